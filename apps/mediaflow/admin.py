@@ -1,3 +1,10 @@
 from django.contrib import admin
+from .models import TranscribeJob
 
-# Register your models here.
+
+@admin.register(TranscribeJob)
+class TranscribeJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "status", "stage", "segments_done", "segments_total", "source", "created_at")
+    list_filter = ("status", "stage")
+    search_fields = ("source",)
+    readonly_fields = ("created_at", "updated_at", "started_at", "finished_at")
@@ -4,3 +4,7 @@ class MediaflowConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = "apps.mediaflow"
     verbose_name = "Media Flow"
+
+    def ready(self):
+        from .utils import metrics
+        metrics.install_audit_hook()
@@ -0,0 +1,95 @@
+import json
+import asyncio
+import threading
+import numpy as np
+from .utils.audio import StreamingVAD, SAMPLE_RATE
+from .utils.transcribe import transcribe_array
+from .utils import workers
+
+# WebSocket /ws/transcribe (ASGI เท่านั้น — ดู asrpro/asgi.py)
+# client → server: binary = PCM s16le 16 kHz mono, text = {"type": "stop"} เพื่อปิด utterance สุดท้าย
+# server → client: {"type": "partial"|"final", "start", "end", "text"} / {"type": "error", "error"}
+
+PARTIAL_EVERY_S = 1.5
+
+# โมเดลตัวเดียวใช้ร่วมกันทุก session → ถอดทีละงาน
+_model_lock = threading.Lock()
+
+
+def _decode(pcm: np.ndarray, greedy: bool) -> str:
+    if workers.enabled():
+        return workers.transcribe_array(pcm, greedy=greedy)
+    with _model_lock:
+        return transcribe_array(pcm, greedy=greedy)
+
+
+async def live_transcribe(scope, receive, send):
+    msg = await receive()
+    if msg["type"] != "websocket.connect":
+        return
+    await send({"type": "websocket.accept"})
+
+    vad = StreamingVAD()
+    finals: asyncio.Queue = asyncio.Queue()
+    state = {"partial_at": 0.0, "partial_task": None}
+
+    async def emit(payload: dict):
+        await send({"type": "websocket.send", "text": json.dumps(payload, ensure_ascii=False)})
+
+    async def final_worker():
+        # ถอด utterance ที่จบแล้วตามลำดับ แล้วส่ง final กลับ
+        while True:
+            item = await finals.get()
+            if item is None:
+                return
+            start, pcm = item
+            try:
+                text = await asyncio.to_thread(_decode, pcm, False)
+                await emit({"type": "final", "start": round(start, 3),
+                            "end": round(start + len(pcm) / SAMPLE_RATE, 3), "text": text})
+            except Exception as e:
+                await emit({"type": "error", "error": str(e)})
+
+    async def partial(start: float, pcm: np.ndarray):
+        try:
+            text = await asyncio.to_thread(_decode, pcm, True)
+            if vad.in_speech:
+                await emit({"type": "partial", "start": round(start, 3),
+                            "end": round(start + len(pcm) / SAMPLE_RATE, 3), "text": text})
+        except Exception:
+            pass
+
+    worker = asyncio.create_task(final_worker())
+    try:
+        while True:
+            msg = await receive()
+            if msg["type"] == "websocket.disconnect":
+                break
+            if msg["type"] != "websocket.receive":
+                continue
+            if msg.get("bytes"):
+                for utt in vad.feed(np.frombuffer(msg["bytes"], dtype="<i2")):
+                    await finals.put(utt)
+                    state["partial_at"] = 0.0
+                start, cur = vad.current()
+                dur = len(cur) / SAMPLE_RATE
+                busy = state["partial_task"] is not None and not state["partial_task"].done()
+                if dur - state["partial_at"] >= PARTIAL_EVERY_S and not busy:
+                    state["partial_at"] = dur
+                    state["partial_task"] = asyncio.create_task(partial(start, cur))
+            elif msg.get("text"):
+                try:
+                    cmd = json.loads(msg["text"])
+                except ValueError:
+                    cmd = {}
+                if cmd.get("type") == "stop":
+                    for utt in vad.flush():
+                        await finals.put(utt)
+                    await finals.put(None)
+                    await worker
+                    await emit({"type": "done"})
+                    await send({"type": "websocket.close", "code": 1000})
+                    return
+    finally:
+        if not worker.done():
+            worker.cancel()
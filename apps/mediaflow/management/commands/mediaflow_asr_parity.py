@@ -0,0 +1,44 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.mediaflow.utils import bench, transcribe
+
+
+class Command(BaseCommand):
+    help = (
+        "เทียบผลถอดเสียงของ ASR backend (PATHUMMA_BACKEND) กับ backend อ้างอิงบนคลิปชุดเดียวกัน "
+        "— CER ระหว่างสองตัว + ความเร็ว; CER เกิน --max-cer → exit code ไม่เป็น 0"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("files", nargs="*", help="ไฟล์เสียงจริงที่ใช้เทียบ (ไม่ระบุ = เสียงสังเคราะห์, ใช้ทดสอบขั้นตอนเท่านั้น)")
+        parser.add_argument("--backend", choices=transcribe.ASR_BACKENDS, default=None,
+                            help="backend ที่จะตรวจ (default PATHUMMA_BACKEND หรือ int8)")
+        parser.add_argument("--reference", choices=transcribe.ASR_BACKENDS, default="transformers")
+        parser.add_argument("--clips", type=int, default=20, help="จำนวนคลิป, default 20")
+        parser.add_argument("--clip-s", type=float, default=15.0, help="ความยาวคลิป (วินาที), default 15")
+        parser.add_argument("--decode", choices=list(transcribe.DECODE_PROFILES), default="fast")
+        parser.add_argument("--models", choices=["stub", "real"], default="real")
+        parser.add_argument("--max-cer", type=float, default=0.02, help="CER สูงสุดที่ยอมรับ, default 0.02")
+        parser.add_argument("--output", "-o", default=None, help="เขียนรายงาน JSON (รวมข้อความทุกคลิป) ลงไฟล์นี้")
+
+    def handle(self, *args, **opts):
+        backend = opts["backend"] or (
+            transcribe.asr_backend() if os.getenv("PATHUMMA_BACKEND") not in (None, "", "transformers") else "int8"
+        )
+        try:
+            report = bench.asr_parity(
+                opts["files"], candidate=backend, reference=opts["reference"], clips=opts["clips"],
+                clip_s=opts["clip_s"], decode=opts["decode"], models=opts["models"],
+                log=lambda msg: self.stderr.write(msg),
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        if opts["output"]:
+            bench.dump(report, opts["output"])
+        summary = {k: v for k, v in report.items() if k != "rows"}
+        self.stdout.write(json.dumps(summary, ensure_ascii=False, indent=2))
+        if report["cer"] > opts["max_cer"]:
+            raise CommandError(f"parity failed: CER {report['cer']:.4f} > {opts['max_cer']}")
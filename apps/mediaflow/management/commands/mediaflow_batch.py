@@ -0,0 +1,102 @@
+import json
+import signal
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.mediaflow.utils import batch
+from apps.mediaflow.utils.io import export_formats
+
+
+class Command(BaseCommand):
+    help = (
+        "ถอดเสียงทุกไฟล์จากโฟลเดอร์ / manifest → คลังผล (GET /tools/results?batch=<name>) "
+        "(แปลง ffmpeg พร้อมกันหลายไฟล์, ใช้โมเดลชุดเดียวทุกไฟล์, รันซ้ำจะข้ามไฟล์ที่มีผลแล้ว)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("inputs", nargs="+",
+                            help="โฟลเดอร์ (ค้นแบบ recursive), manifest (.txt/.lst/.json/.jsonl) หรือไฟล์เสียง")
+        parser.add_argument("--name", default="default",
+                            help="ชื่อ batch (catalog + โฟลเดอร์สถานะ); ใช้ชื่อเดิมเพื่อทำต่อจากรอบก่อน (default: default)")
+        parser.add_argument("--language", default="th", help="ภาษา ('' = auto ของโมเดล), default th")
+        parser.add_argument("--decode", choices=["fast", "mid", "max"], default=None,
+                            help="decode profile ของ ASR (default ตาม PATHUMMA_DECODE_PROFILE)")
+        parser.add_argument("--timestamps", choices=["none", "word"], default="none",
+                            help="word = เวลาต่อคำในผล (จากการถอดรอบเดียวกัน)")
+        parser.add_argument("--exports", default="",
+                            help="ไฟล์เพิ่มข้างไฟล์ผล คั่นด้วย comma: srt, vtt, compact")
+        parser.add_argument("--profile", choices=["fast", "mid", "max"], default="mid", help="ffmpeg filter profile")
+        parser.add_argument("--convert-jobs", type=int, default=None,
+                            help="จำนวนไฟล์ที่แปลงพร้อมกัน (default MEDIAFLOW_BATCH_CONVERT_JOBS หรือ cores/2; "
+                                 "ffmpeg ทั้ง process ยังไม่เกิน MEDIAFLOW_FFMPEG_JOBS)")
+        parser.add_argument("--parallel", type=int, default=None,
+                            help="จำนวนไฟล์ที่ถอดพร้อมกัน (default = MEDIAFLOW_MODEL_WORKERS หรือ 1)")
+        parser.add_argument("--force", action="store_true", help="ทำใหม่ทุกไฟล์ แม้มีผลอยู่แล้ว")
+        parser.add_argument("--dry-run", action="store_true", help="แสดงรายการไฟล์ที่จะทำ แล้วจบ")
+
+    def handle(self, *args, **opts):
+        try:
+            out_dir = batch.batch_dir(opts["name"])
+        except ValueError as e:
+            raise CommandError(str(e))
+        try:
+            exports = export_formats(opts["exports"])
+        except ValueError as e:
+            raise CommandError(str(e))
+        sources = batch.collect_sources(opts["inputs"])
+        if not sources:
+            raise CommandError("no audio files found")
+        missing = [str(p) for p, _ in sources if not p.exists()]
+        if missing:
+            raise CommandError(f"not found: {', '.join(missing[:5])}")
+
+        if opts["dry_run"]:
+            prior = batch.done_results(out_dir.name)
+            for src, rel in sources:
+                done = not opts["force"] and rel in prior
+                self.stdout.write(f"{'skip' if done else 'todo'}\t{rel}\t{src}")
+            return
+
+        # Ctrl-C ครั้งแรก → ถอดไฟล์ที่ค้างอยู่ให้เสร็จแล้วหยุด (ครั้งที่สอง → ออกทันที)
+        stop = threading.Event()
+
+        def on_sigint(signum, frame):
+            if stop.is_set():
+                raise KeyboardInterrupt
+            stop.set()
+            self.stderr.write("stopping after files in progress… (Ctrl-C again to abort)")
+
+        prev = signal.signal(signal.SIGINT, on_sigint)
+        try:
+            status = batch.run_batch(
+                opts["inputs"],
+                opts["name"],
+                language=opts["language"].strip() or None,
+                decode=opts["decode"],
+                timestamps=None if opts["timestamps"] == "none" else opts["timestamps"],
+                exports=exports,
+                profile=opts["profile"],
+                convert_jobs=opts["convert_jobs"],
+                parallel=opts["parallel"],
+                force=opts["force"],
+                log=self._log,
+                stop=stop,
+            )
+        finally:
+            signal.signal(signal.SIGINT, prev)
+        self.stdout.write(json.dumps(
+            {k: v for k, v in status.items() if k != "failed"} | {"failed": sorted(status["failed"])},
+            ensure_ascii=False, indent=2,
+        ))
+        if status["failed"]:
+            raise CommandError(f"{len(status['failed'])} file(s) failed — see {out_dir / batch.STATUS_FILE}")
+
+    def _log(self, event, info):
+        if event == "start":
+            self.stdout.write(f"batch → {info['output_dir']}: {info['pending']} to do, {info['skipped']} already done")
+        elif event == "done":
+            self.stdout.write(self.style.SUCCESS(
+                f"done\t{info['rel']}\t{info['result_id']}\t{info['segments']} segments, {info['audio_s']:.0f}s audio"))
+        elif event == "failed":
+            self.stdout.write(self.style.ERROR(f"failed\t{info['rel']}\t{info['error'][:200]}"))
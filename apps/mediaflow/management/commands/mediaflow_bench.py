@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.mediaflow.utils import bench
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark convert → diarize → transcribe บนเสียงประชุมสังเคราะห์ "
+        "แล้วพิมพ์ผลเป็น JSON (RTF, segments/s, peak RSS, จำนวน subprocess)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--duration", type=float, default=120.0, help="ความยาวเสียง (วินาที), default 120")
+        parser.add_argument("--speakers", type=int, default=3, help="จำนวนผู้พูด (1-8), default 3")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--models", choices=["stub", "real"], default="stub",
+                            help="stub = โมเดลจิ๋ว offline บน CPU (default), real = โมเดลตาม .env")
+        parser.add_argument("--decode", choices=["fast", "mid", "max"], default=None,
+                            help="decode profile ของ ASR (default ตาม PATHUMMA_DECODE_PROFILE)")
+        parser.add_argument("--stages", default=",".join(bench.STAGES),
+                            help=f"คั่นด้วย comma จาก: {', '.join(bench.STAGES)}")
+        parser.add_argument("--output", "-o", default=None, help="เขียน JSON ลงไฟล์นี้ด้วย")
+
+    def handle(self, *args, **opts):
+        stages = [s.strip() for s in opts["stages"].split(",") if s.strip()]
+        unknown = [s for s in stages if s not in bench.STAGES]
+        if unknown:
+            raise CommandError(f"unknown stage(s): {', '.join(unknown)}")
+        if opts["duration"] <= 1:
+            raise CommandError("--duration must be > 1 second")
+
+        report = bench.run_benchmark(
+            duration_s=opts["duration"],
+            speakers=opts["speakers"],
+            seed=opts["seed"],
+            models=opts["models"],
+            decode=opts["decode"],
+            stages=stages,
+        )
+        self.stdout.write(bench.dump(report, opts["output"]))
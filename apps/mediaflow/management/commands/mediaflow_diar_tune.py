@@ -0,0 +1,34 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from apps.mediaflow.utils import bench, diarize
+
+
+class Command(BaseCommand):
+    help = (
+        "หา batch size / threads (/ int8) ของ pyannote ที่เร็วที่สุดบนเครื่องนี้ "
+        "แล้วเขียน data/diar_runtime.json — ใช้ด้วย PYANNOTE_RUNTIME_PROFILE=auto"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--duration", type=float, default=120.0, help="ความยาวเสียงทดสอบ (วินาที), default 120")
+        parser.add_argument("--speakers", type=int, default=3)
+        parser.add_argument("--models", choices=["stub", "real"], default="real",
+                            help="real = pyannote ตาม .env (default); stub = ทดสอบขั้นตอน ไม่เขียนไฟล์")
+        parser.add_argument("--int8", action="store_true", help="ลอง dynamic int8 ด้วย (ผลต่างจาก fp32 เล็กน้อย)")
+        parser.add_argument("--repeats", type=int, default=1, help="รันต่อค่าที่ลองกี่รอบ (ใช้เวลาที่ดีที่สุด)")
+        parser.add_argument("--dry-run", action="store_true", help="แสดงผล ไม่เขียน data/diar_runtime.json")
+
+    def handle(self, *args, **opts):
+        report = bench.tune_diarization(
+            duration_s=opts["duration"], speakers=opts["speakers"], models=opts["models"],
+            int8=opts["int8"], repeats=opts["repeats"], log=lambda msg: self.stderr.write(msg),
+        )
+        text = json.dumps(report, ensure_ascii=False, indent=2)
+        if opts["models"] == "real" and not opts["dry_run"]:
+            path = diarize.tuned_runtime_path()
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(text, encoding="utf-8")
+            self.stderr.write(f"wrote {path}")
+        self.stdout.write(json.dumps(report["config"]))
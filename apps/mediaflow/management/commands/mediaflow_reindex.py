@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from apps.mediaflow.utils import search
+
+
+class Command(BaseCommand):
+    help = (
+        "สร้าง/อัปเดต index ค้นหาข้อความจากผลถอดเสียงที่เซฟไว้ (results/transcribe, results/batch) "
+        "— ทำเฉพาะไฟล์ใหม่หรือที่แก้ไข, ลบรายการที่ไฟล์หายไปแล้ว"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="*", help="ไฟล์ JSON เฉพาะที่ต้องการ (default: ทุกไฟล์ใน results)")
+        parser.add_argument("--force", action="store_true", help="index ใหม่ทุกไฟล์ แม้ไม่เปลี่ยน")
+
+    def handle(self, *args, **opts):
+        stats = search.reindex(
+            opts["paths"] or None, force=opts["force"],
+            log=lambda msg: self.stderr.write(msg),
+        )
+        self.stdout.write(
+            f"indexed={stats['indexed']} skipped={stats['skipped']} failed={stats['failed']} pruned={stats['pruned']}"
+        )
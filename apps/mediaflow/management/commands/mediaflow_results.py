@@ -0,0 +1,33 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.mediaflow.utils import results, search
+
+
+class Command(BaseCommand):
+    help = (
+        "ดูแลคลังผล (results/transcribe, results/diar): sync catalog กับไฟล์ที่มีอยู่ "
+        "และย้ายผล JSON รุ่นเก่าเข้าคลัง (--import-json)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--import-json", action="store_true",
+                            help="ย้าย results/transcribe/*.json, results/diar/*.json เข้าคลัง (ลบ JSON เดิมเมื่อแปลงสำเร็จ)")
+
+    def handle(self, *args, **opts):
+        log = lambda msg: self.stderr.write(msg)
+        if opts["import_json"]:
+            root = Path(settings.RESULTS_ROOT)
+            before = after = 0
+            for kind, sub in results.KIND_DIRS.items():
+                files = [p for p in sorted((root / sub).glob("*.json")) if not p.name.endswith(".min.json")]
+                stats = results.import_json(files, kind, remove=True, log=log)
+                before, after = before + stats["bytes_before"], after + stats["bytes_after"]
+                self.stdout.write(f"{kind}: imported={stats['imported']} failed={stats['failed']}")
+            if before:
+                self.stdout.write(f"size {before / 1024:.0f} KB → {after / 1024:.0f} KB ({after / before:.0%})")
+            search.reindex(log=log)            # index ค้นหาชี้ไปไฟล์ใหม่ แทน JSON ที่ลบไปแล้ว
+        stats = results.rebuild_catalog(log=log)
+        self.stdout.write(f"catalog added={stats['added']} pruned={stats['pruned']} failed={stats['failed']}")
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# FTS5 (trigram) ใช้ได้เฉพาะ SQLite — ฐานข้อมูลอื่น utils/search.py จะค้นด้วย icontains แทน
+FTS_SQL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS mediaflow_segment_fts USING fts5(text, tokenize='trigram')",
+    """CREATE TRIGGER IF NOT EXISTS mediaflow_segment_fts_delete
+       AFTER DELETE ON mediaflow_transcriptsegment
+       BEGIN DELETE FROM mediaflow_segment_fts WHERE rowid = old.id; END""",
+]
+UNDO_SQL = [
+    "DROP TRIGGER IF EXISTS mediaflow_segment_fts_delete",
+    "DROP TABLE IF EXISTS mediaflow_segment_fts",
+]
+
+
+def _run(statements):
+    def op(apps, schema_editor):
+        if schema_editor.connection.vendor != "sqlite":
+            return
+        with schema_editor.connection.cursor() as cur:
+            for sql in statements:
+                cur.execute(sql)
+    return op
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediaflow', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Transcript',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('json_path', models.CharField(max_length=500, unique=True)),
+                ('source', models.CharField(blank=True, max_length=500)),
+                ('title', models.CharField(blank=True, db_index=True, max_length=255)),
+                ('speakers', models.JSONField(blank=True, default=list)),
+                ('duration_s', models.FloatField(default=0.0)),
+                ('file_mtime', models.FloatField(default=0.0)),
+                ('created_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='TranscriptSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('idx', models.PositiveIntegerField()),
+                ('start', models.FloatField()),
+                ('end', models.FloatField()),
+                ('speaker', models.CharField(blank=True, db_index=True, max_length=120)),
+                ('speaker_id', models.CharField(blank=True, max_length=32)),
+                ('text', models.TextField(blank=True)),
+                ('transcript', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='segments', to='mediaflow.transcript')),
+            ],
+            options={
+                'ordering': ['transcript_id', 'idx'],
+            },
+        ),
+        migrations.RunPython(_run(FTS_SQL), _run(UNDO_SQL)),
+    ]
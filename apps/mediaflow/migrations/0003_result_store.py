@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediaflow', '0002_transcript_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredResult',
+            fields=[
+                ('id', models.CharField(max_length=40, primary_key=True, serialize=False)),
+                ('kind', models.CharField(db_index=True, max_length=8)),
+                ('source', models.CharField(blank=True, db_index=True, max_length=500)),
+                ('title', models.CharField(blank=True, max_length=255)),
+                ('speakers_count', models.PositiveIntegerField(db_index=True, default=0)),
+                ('segments_count', models.PositiveIntegerField(default=0)),
+                ('duration_s', models.FloatField(default=0.0)),
+                ('size_bytes', models.PositiveIntegerField(default=0)),
+                ('path', models.CharField(max_length=500)),
+                ('created_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediaflow', '0003_result_store'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedresult',
+            name='batch',
+            field=models.CharField(blank=True, db_index=True, max_length=80),
+        ),
+        migrations.AddField(
+            model_name='storedresult',
+            name='rel',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+    ]
@@ -1,3 +1,137 @@
+import uuid
 from django.db import models
 
-# Create your models here.
+
+class TranscribeJob(models.Model):
+    """งาน transcribe_auto ที่รันใน worker pool (ดู utils/jobs.py) — อยู่รอดข้ามการรีสตาร์ต"""
+
+    QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    source = models.CharField(max_length=500)
+    params = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    stage = models.CharField(max_length=32, blank=True)          # convert | diarize | transcribe
+    segments_done = models.PositiveIntegerField(default=0)
+    segments_total = models.PositiveIntegerField(default=0)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"{self.id} [{self.status}] {self.source}"
+
+    def as_dict(self, with_result: bool = True) -> dict:
+        data = {
+            "job_id": str(self.id),
+            "status": self.status,
+            "stage": self.stage,
+            "progress": {
+                "segments_done": self.segments_done,
+                "segments_total": self.segments_total,
+            },
+            "source": self.source,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+        if self.error:
+            data["error"] = self.error
+        if with_result and self.status == self.DONE:
+            data["result"] = self.result
+        return data
+
+
+class Transcript(models.Model):
+    """ผลถอดเสียงที่เซฟแล้ว (results/transcribe, results/batch) — ดัชนีค้นหาข้อความ (ดู utils/search.py)"""
+
+    json_path = models.CharField(max_length=500, unique=True)    # ไฟล์ผล: .mfr ในคลัง หรือ JSON ของ batch
+    source = models.CharField(max_length=500, blank=True)
+    title = models.CharField(max_length=255, blank=True, db_index=True)
+    speakers = models.JSONField(default=list, blank=True)
+    duration_s = models.FloatField(default=0.0)
+    file_mtime = models.FloatField(default=0.0)                  # reindex ข้ามไฟล์ที่ไม่เปลี่ยน
+    created_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"{self.title} ({self.json_path})"
+
+    def as_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "title": self.title,
+            "source": self.source,
+            "json_path": self.json_path,
+            "speakers": self.speakers,
+            "duration_s": self.duration_s,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+        }
+
+
+class TranscriptSegment(models.Model):
+    """หนึ่งช่วงของ Transcript — id ตรงกับ rowid ของตาราง FTS5 mediaflow_segment_fts"""
+
+    transcript = models.ForeignKey(Transcript, on_delete=models.CASCADE, related_name="segments")
+    idx = models.PositiveIntegerField()
+    start = models.FloatField()
+    end = models.FloatField()
+    speaker = models.CharField(max_length=120, blank=True, db_index=True)
+    speaker_id = models.CharField(max_length=32, blank=True)
+    text = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ["transcript_id", "idx"]
+
+
+class StoredResult(models.Model):
+    """catalog ของผลในคลัง results/<transcribe|diar>/<id>.mfr (ดู utils/results.py) — list/กรองไม่ต้องเปิดไฟล์"""
+
+    id = models.CharField(primary_key=True, max_length=40)        # trans-YYYYmmdd-HHMMSS-<12 hex>
+    kind = models.CharField(max_length=8, db_index=True)           # trans | diar
+    source = models.CharField(max_length=500, blank=True, db_index=True)
+    title = models.CharField(max_length=255, blank=True)
+    speakers_count = models.PositiveIntegerField(default=0, db_index=True)
+    segments_count = models.PositiveIntegerField(default=0)
+    duration_s = models.FloatField(default=0.0)
+    size_bytes = models.PositiveIntegerField(default=0)
+    path = models.CharField(max_length=500)
+    created_at = models.DateTimeField(db_index=True)
+    batch = models.CharField(max_length=80, blank=True, db_index=True)   # ชื่อ batch (ว่าง = ไม่ได้มาจาก batch)
+    rel = models.CharField(max_length=500, blank=True)                   # path ของไฟล์เสียงภายใน batch
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"{self.id} {self.title}"
+
+    def as_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "title": self.title,
+            "source": self.source,
+            "speakers_count": self.speakers_count,
+            "segments_count": self.segments_count,
+            "duration_s": self.duration_s,
+            "size_bytes": self.size_bytes,
+            "path": self.path,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "batch": self.batch,
+            "rel": self.rel,
+        }
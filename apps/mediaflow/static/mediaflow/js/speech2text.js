@@ -202,16 +202,24 @@ document.addEventListener("DOMContentLoaded", () => {
         );
 
         try {
-            setTimeout(() => { setStepState("upload", "done"); setStepState("convert", "active"); statusEl.textContent = "Convert (denoise: mid)…"; progress.style.width = "30%"; }, 400);
-            setTimeout(() => { setStepState("convert", "done"); setStepState("diarize", "active"); statusEl.textContent = "Diarize (pyannote)…"; progress.style.width = "55%"; }, 900);
-            setTimeout(() => { setStepState("diarize", "done"); setStepState("transcribe", "active"); statusEl.textContent = "Transcribe (Pathumma)…"; progress.style.width = "80%"; }, 1600);
-
-            const res = await fetch("/tools/transcribe_auto", { method: "POST", body: data });
-            const txt = await res.text();
-            let json; try { json = JSON.parse(txt); } catch (e) { throw new Error("API ตอบกลับไม่ใช่ JSON: " + txt.slice(0, 300)); }
+            // ส่งงานเข้าคิว → ได้ job_id กลับมาทันที แล้ว poll สถานะจริงจาก server
+            // ไฟล์ใหญ่ → อัปโหลดเป็นชิ้น (ต่อจากที่ค้างได้ถ้าเน็ตหลุด/รีเฟรชหน้า)
+            let job;
+            if (fileInput.files[0].size >= CHUNKED_MIN_BYTES) {
+                job = await uploadChunked(fileInput.files[0], (done, total) => {
+                    statusEl.textContent = `กำลังอัปโหลด... ${Math.floor(100 * done / total)}%`;
+                    progress.style.width = `${10 + Math.round(20 * done / total)}%`;
+                });
+            } else {
+                const res = await fetch("/tools/jobs/transcribe_auto", { method: "POST", body: data });
+                const txt = await res.text();
+                try { job = JSON.parse(txt); } catch (e) { throw new Error("API ตอบกลับไม่ใช่ JSON: " + txt.slice(0, 300)); }
+            }
+            if (!job.ok) throw new Error(job.error || "ส่งงานไม่สำเร็จ");
+            setStepState("upload", "done");
 
-            console.log("API /tools/transcribe_auto =>", json);
-            if (!json.ok) throw new Error(json.error || "ถอดเสียงไม่สำเร็จ");
+            const json = await pollJob(job.job_id);
+            console.log("API /tools/jobs/" + job.job_id + " =>", json);
 
             const segs = getSegmentsFromResponse(json, audio.duration || 0);
             if (!segs.length) {
@@ -240,6 +248,186 @@ document.addEventListener("DOMContentLoaded", () => {
     }
 
 
+    // ===== chunked upload (/tools/uploads: init → PUT chunks → finalize)
+    const CHUNKED_MIN_BYTES = 32 * 1024 * 1024;
+    const CHUNK_PARALLEL = 3, CHUNK_RETRIES = 5;
+    async function sha256Hex(buf) {
+        // crypto.subtle มีเฉพาะ https / localhost → ไม่มีก็ส่งโดยไม่ใส่ checksum
+        if (!window.crypto?.subtle) return null;
+        const d = await crypto.subtle.digest('SHA-256', buf);
+        return [...new Uint8Array(d)].map(b => b.toString(16).padStart(2, '0')).join('');
+    }
+    async function jsonOrThrow(res) {
+        const txt = await res.text();
+        let j; try { j = JSON.parse(txt); } catch (e) { throw new Error("API ตอบกลับไม่ใช่ JSON: " + txt.slice(0, 300)); }
+        if (!res.ok && !j.error) j.error = `HTTP ${res.status}`;
+        return j;
+    }
+    async function uploadChunked(file, onProgress) {
+        // upload_id เก็บใน localStorage → เลือกไฟล์เดิมอีกครั้งจะอัปโหลดต่อเฉพาะชิ้นที่ขาด
+        const key = `mediaflow-upload:${file.name}:${file.size}:${file.lastModified}`;
+        let st = null;
+        const saved = localStorage.getItem(key);
+        if (saved) {
+            const res = await fetch(`/tools/uploads/${saved}`);
+            if (res.ok) st = await res.json();
+        }
+        if (!st) {
+            const res = await fetch("/tools/uploads", {
+                method: "POST", headers: { "Content-Type": "application/json" },
+                body: JSON.stringify({ name: file.name, size: file.size }),
+            });
+            st = await jsonOrThrow(res);
+            if (!st.ok) throw new Error(st.error || "เริ่มอัปโหลดไม่สำเร็จ");
+            localStorage.setItem(key, st.upload_id);
+        }
+        const { upload_id: id, chunk_size: cs, total_chunks: n } = st;
+        const have = new Set(st.received || []);
+        const todo = [...Array(n).keys()].filter(i => !have.has(i));
+        let sent = st.received_bytes || 0;
+        onProgress(sent, file.size);
+
+        async function putChunk(i) {
+            const blob = file.slice(i * cs, Math.min(file.size, (i + 1) * cs));
+            const buf = await blob.arrayBuffer();
+            const sum = await sha256Hex(buf);
+            for (let attempt = 0; ; attempt++) {
+                try {
+                    const res = await fetch(`/tools/uploads/${id}/chunks/${i}`, {
+                        method: "PUT", body: buf,
+                        headers: { "Content-Type": "application/octet-stream", ...(sum ? { "X-Chunk-SHA256": sum } : {}) },
+                    });
+                    if (res.ok) { sent += buf.byteLength; onProgress(sent, file.size); return; }
+                    if (res.status === 404) throw Object.assign(new Error("upload หมดอายุ — กรุณาส่งใหม่"), { fatal: true });
+                } catch (e) {
+                    if (e.fatal || attempt >= CHUNK_RETRIES) throw e;
+                }
+                if (attempt >= CHUNK_RETRIES) throw new Error(`อัปโหลดชิ้นที่ ${i} ไม่สำเร็จ`);
+                await new Promise(r => setTimeout(r, 1000 * 2 ** attempt));
+            }
+        }
+        const queue = [...todo];
+        const workers = Array.from({ length: Math.min(CHUNK_PARALLEL, queue.length) }, async () => {
+            while (queue.length) await putChunk(queue.shift());
+        });
+        try {
+            await Promise.all(workers);
+        } catch (e) {
+            if (e.fatal) localStorage.removeItem(key);
+            throw e;
+        }
+
+        const res = await fetch(`/tools/uploads/${id}/finalize`, { method: "POST", body: new FormData() });
+        const job = await jsonOrThrow(res);
+        if (job.ok || res.status !== 409) localStorage.removeItem(key);
+        return job;
+    }
+
+
+    // ===== job polling (สถานะจริงจาก /tools/jobs/<id>)
+    const stageLabel = {
+        convert: "Convert (denoise: mid)…",
+        diarize: "Diarize (pyannote)…",
+        transcribe: "Transcribe (Pathumma)…",
+    };
+    function showJobProgress(job) {
+        const stage = job.stage;
+        if (!stage || !stageLabel[stage]) return;
+        const order = ["convert", "diarize", "transcribe"];
+        const at = order.indexOf(stage);
+        order.forEach((s, i) => setStepState(s, i < at ? "done" : (i === at ? "active" : "idle")));
+        let pct = [30, 55, 80][at];
+        let label = stageLabel[stage];
+        const { segments_done: done = 0, segments_total: total = 0 } = job.progress || {};
+        if (stage === "transcribe" && total > 0) {
+            pct = 80 + Math.round(18 * done / total);
+            label = `Transcribe (Pathumma)… ${done}/${total} ช่วง`;
+        }
+        statusEl.textContent = label;
+        progress.style.width = `${pct}%`;
+    }
+    async function pollJob(jobId, intervalMs = 2000) {
+        while (true) {
+            await new Promise(r => setTimeout(r, intervalMs));
+            const res = await fetch(`/tools/jobs/${jobId}`);
+            const job = await res.json();
+            if (job.status === "done") return { ok: true, ...(job.result || {}) };
+            if (job.status === "failed") throw new Error((job.error || "ถอดเสียงไม่สำเร็จ").split("\n")[0]);
+            showJobProgress(job);
+        }
+    }
+
+
+    // ===== live captions (WebSocket /ws/transcribe, PCM 16 kHz)
+    const btnLive = $('#btnLive');
+    let live = null;
+    function floatTo16k(buf, inRate) {
+        // ลด sample rate แบบเฉลี่ยช่วง (ถ้า AudioContext ไม่ได้ 16 kHz มาให้)
+        const ratio = inRate / 16000, n = Math.floor(buf.length / ratio);
+        const out = new Int16Array(n);
+        for (let i = 0; i < n; i++) {
+            const a = Math.floor(i * ratio), b = Math.min(buf.length, Math.floor((i + 1) * ratio));
+            let sum = 0; for (let j = a; j < b; j++) sum += buf[j];
+            const v = Math.max(-1, Math.min(1, sum / Math.max(1, b - a)));
+            out[i] = v < 0 ? v * 0x8000 : v * 0x7fff;
+        }
+        return out;
+    }
+    function liveBubble(msg) {
+        let el = chatBox.querySelector('[data-live-partial]');
+        if (!el) {
+            el = document.createElement('div');
+            el.className = 'flex justify-start mt-3';
+            el.innerHTML = `<div class="rounded-2xl px-4 py-3 shadow-sm border border-rose-200 bg-rose-50">
+                <div class="text-xs font-semibold text-rose-700 mb-1"></div>
+                <div class="text-[15px] leading-7 text-slate-800"></div></div>`;
+            el.setAttribute('data-live-partial', '');
+            chatBox.appendChild(el);
+        }
+        el.querySelector('.text-xs').textContent = `LIVE • ${tlabel(msg.start || 0)}–${tlabel(msg.end || 0)}`;
+        el.querySelector('.leading-7').textContent = msg.text || '…';
+        if (msg.type === 'final') el.removeAttribute('data-live-partial');
+        chatBox.scrollTop = chatBox.scrollHeight;
+    }
+    async function startLive() {
+        const stream = await navigator.mediaDevices.getUserMedia({ audio: { channelCount: 1, echoCancellation: true, noiseSuppression: true } });
+        const ctx = new (window.AudioContext || window.webkitAudioContext)({ sampleRate: 16000 });
+        const srcNode = ctx.createMediaStreamSource(stream);
+        const proc = ctx.createScriptProcessor(4096, 1, 1);
+        const ws = new WebSocket(`${location.protocol === 'https:' ? 'wss' : 'ws'}://${location.host}/ws/transcribe`);
+        ws.binaryType = 'arraybuffer';
+        ws.onmessage = ev => {
+            const msg = JSON.parse(ev.data);
+            if (msg.type === 'partial' || msg.type === 'final') liveBubble(msg);
+            else if (msg.type === 'error') showToast('err', msg.error);
+        };
+        ws.onclose = () => stopLive(false);
+        ws.onerror = () => showToast('err', 'เชื่อมต่อ live ไม่ได้ (ต้องรันด้วย uvicorn asrpro.asgi:application)');
+        proc.onaudioprocess = e => {
+            if (ws.readyState === WebSocket.OPEN) ws.send(floatTo16k(e.inputBuffer.getChannelData(0), ctx.sampleRate).buffer);
+        };
+        srcNode.connect(proc); proc.connect(ctx.destination);
+        live = { stream, ctx, proc, ws };
+        chatBox.innerHTML = '';
+        btnLive.textContent = '⏹ Stop';
+        statusEl.textContent = 'กำลังถอดเสียงสด…';
+    }
+    function stopLive(sendStop = true) {
+        if (!live) return;
+        const { stream, ctx, proc, ws } = live; live = null;
+        try { proc.disconnect(); } catch (e) { }
+        stream.getTracks().forEach(t => t.stop());
+        ctx.close();
+        if (sendStop && ws.readyState === WebSocket.OPEN) ws.send(JSON.stringify({ type: 'stop' }));
+        btnLive.textContent = '🎤 Live';
+        statusEl.textContent = 'หยุดถอดเสียงสดแล้ว';
+    }
+    btnLive?.addEventListener('click', async () => {
+        if (live) { stopLive(); return; }
+        try { await startLive(); } catch (e) { showToast('err', e.message); }
+    });
+
+
     // ===== transcript renderer (ชิดซ้ายทั้งหมด + click-to-seek)
     function renderTranscript(segments) {
         // 1) กรองช่วงที่ไม่ใช้: ไม่มีข้อความ หรือเป็น ERROR
@@ -1,3 +1,1194 @@
-from django.test import TestCase
+import os
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+
+from .utils.segments import clean_diar_segments, prepare_asr_segments
+
+
+def _seg(start, end, speaker="A"):
+    return {"start": start, "end": end, "speaker": speaker}
+
+
+# ---- segments: ค่าที่คาดไว้ตรงกับ implementation เดิม (ก่อนเปลี่ยนเป็น array) ----------
+class CleanDiarSegmentsTests(SimpleTestCase):
+    def test_empty(self):
+        self.assertEqual(clean_diar_segments([]), [])
+
+    def test_overlap_absorbs_short_turn_between_same_speaker(self):
+        segs = [_seg(0.0, 2.0, "A"), _seg(1.5, 3.0, "B"), _seg(2.8, 5.0, "A")]
+        self.assertEqual(clean_diar_segments(segs), [_seg(0.0, 5.05, "A")])
+
+    def test_unsorted_input(self):
+        segs = [_seg(4.0, 6.0, "B"), _seg(0.0, 1.0, "A"), _seg(1.1, 3.0, "A")]
+        self.assertEqual(clean_diar_segments(segs), [_seg(0.0, 3.05, "A"), _seg(3.95, 6.05, "B")])
+
+    def test_same_speaker_merged_across_gaps(self):
+        segs = [_seg(0.0, 1.0), _seg(1.15, 2.0), _seg(2.5, 3.0)]
+        self.assertEqual(clean_diar_segments(segs), [_seg(0.0, 3.05)])
+        self.assertEqual(clean_diar_segments([_seg(0.0, 1.0), _seg(3.0, 4.0)]), [_seg(0.0, 4.05)])
+
+    def test_sandwiched_short_turn(self):
+        segs = [_seg(0.0, 2.0, "A"), _seg(2.0, 2.3, "B"), _seg(2.3, 4.0, "A"), _seg(4.5, 6.0, "B")]
+        self.assertEqual(clean_diar_segments(segs), [_seg(0.0, 4.05, "A"), _seg(4.45, 6.05, "B")])
+
+
+class PrepareAsrSegmentsTests(SimpleTestCase):
+    def test_empty(self):
+        self.assertEqual(prepare_asr_segments([]), [])
+
+    def test_overlap_keeps_both_speakers_padded(self):
+        segs = [_seg(0.0, 2.0, "A"), _seg(1.5, 4.0, "B")]
+        self.assertEqual(prepare_asr_segments(segs), [_seg(0.0, 2.35, "A"), _seg(1.25, 4.35, "B")])
+
+    def test_unsorted_input(self):
+        segs = [_seg(5.0, 7.0, "B"), _seg(0.0, 2.0, "A"), _seg(2.1, 4.0, "A")]
+        self.assertEqual(prepare_asr_segments(segs), [_seg(0.0, 4.35, "A"), _seg(4.75, 7.35, "B")])
+
+    def test_short_same_speaker_merged(self):
+        segs = [_seg(0.0, 0.5, "A"), _seg(0.7, 1.0, "A"), _seg(3.0, 5.0, "B")]
+        self.assertEqual(prepare_asr_segments(segs), [_seg(0.0, 1.35, "A"), _seg(2.75, 5.35, "B")])
+
+    def test_gap_beyond_merge_gap_kept_apart(self):
+        segs = [_seg(0.0, 2.0), _seg(3.0, 5.0)]
+        self.assertEqual(prepare_asr_segments(segs), [_seg(0.0, 2.35), _seg(2.75, 5.35)])
+
+    def test_long_segment_split_at_max_len(self):
+        self.assertEqual(prepare_asr_segments([_seg(0.0, 40.0)]), [
+            _seg(0.0, 18.0), _seg(17.7, 35.7), _seg(35.4, 40.35),
+        ])
+
+    def test_merge_stops_at_max_len(self):
+        segs = [_seg(0.0, 10.0), _seg(10.1, 20.0), _seg(20.2, 30.0)]
+        self.assertEqual(prepare_asr_segments(segs, max_len=12.0), [
+            _seg(0.0, 12.0), _seg(11.7, 23.7), _seg(23.4, 30.35),
+        ])
+
+
+# ---- search: FTS5 trigram (substring ภาษาไทย) + LIKE สำหรับคำสั้น -----------------------
+class SearchTests(TestCase):
+    def setUp(self):
+        from .utils import search
+        self.search = search
+        search.index_transcript({"source": "/audio/meeting-a.wav", "segments": [
+            {"start": 0.0, "end": 2.0, "speaker": "SPEAKER_00", "text": "วันนี้เราประชุมเรื่องงบประมาณ"},
+            {"start": 2.0, "end": 4.0, "speaker": "SPEAKER_01", "text": "ใช้ AI ช่วยสรุปรายงานการประชุม"},
+            {"start": 4.0, "end": 6.0, "speaker": "SPEAKER_00", "text": "ทํางานต่อพรุ่งนี้"},   # นิคหิต + สระอา
+        ]}, "/results/a.json")
+
+    def texts(self, q, **kw):
+        return [h["text"] for h in self.search.search(q, **kw)["hits"]]
+
+    def test_thai_substring(self):
+        # order=recent → segment ที่ index ทีหลังก่อน
+        self.assertEqual(self.texts("ประชุม"), [
+            "ใช้ AI ช่วยสรุปรายงานการประชุม", "วันนี้เราประชุมเรื่องงบประมาณ",
+        ])
+        self.assertEqual(self.texts("งบประ"), ["วันนี้เราประชุมเรื่องงบประมาณ"])
+        hit = self.search.search("งบประ")["hits"][0]
+        self.assertIn("[งบประ]", hit["snippet"])
+        self.assertEqual(hit["transcript"]["title"], "meeting-a.wav")
+
+    def test_normalized_spelling(self):
+        self.assertEqual(self.texts("ทำงาน"), ["ทํางานต่อพรุ่งนี้"])
+
+    def test_all_terms_and_speaker_filter(self):
+        self.assertEqual(self.texts("ประชุม สรุป"), ["ใช้ AI ช่วยสรุปรายงานการประชุม"])
+        self.assertEqual(self.texts("ประชุม", speaker="SPEAKER_00"), ["วันนี้เราประชุมเรื่องงบประมาณ"])
+
+    def test_short_term_like_fallback(self):
+        self.assertEqual(self.texts("AI"), ["ใช้ AI ช่วยสรุปรายงานการประชุม"])
+        self.assertEqual(self.texts("ai ประชุม"), ["ใช้ AI ช่วยสรุปรายงานการประชุม"])
+        self.assertEqual(self.texts("งบ"), ["วันนี้เราประชุมเรื่องงบประมาณ"])
+        self.assertEqual(self.texts("zz"), [])
+
+    def test_reindex_replaces_rows(self):
+        from .models import Transcript, TranscriptSegment
+        self.search.index_transcript({"source": "/audio/meeting-a.wav", "segments": [
+            {"start": 0.0, "end": 3.0, "speaker": "SPEAKER_00", "text": "สรุปผลการทดลอง"},
+        ]}, "/results/a.json")
+        self.assertEqual(Transcript.objects.count(), 1)
+        self.assertEqual(TranscriptSegment.objects.count(), 1)
+        self.assertEqual(self.texts("ประชุม"), [])
+        self.assertEqual(self.texts("งบ"), [])
+        self.assertEqual(self.texts("ทดลอง"), ["สรุปผลการทดลอง"])
+
+    def test_empty_query(self):
+        with self.assertRaises(ValueError):
+            self.search.search("  ")
+
+
+# ---- io: SRT / WebVTT ----------------------------------------------------------------
+class SubtitleExportTests(SimpleTestCase):
+    def test_clock(self):
+        from .utils.io import _clock
+        self.assertEqual(_clock(0.0, ","), "00:00:00,000")
+        self.assertEqual(_clock(-1.0, ","), "00:00:00,000")
+        self.assertEqual(_clock(61.5, ","), "00:01:01,500")
+        self.assertEqual(_clock(3725.0004, "."), "01:02:05.000")
+        self.assertEqual(_clock(59.9996, "."), "00:01:00.000")
+
+    def test_srt(self):
+        from .utils.io import to_srt
+        segs = [
+            {"start": 0.0, "end": 1.25, "speaker": "SPEAKER_00", "text": " สวัสดีครับ "},
+            {"start": 1.5, "end": 2.0, "speaker": "SPEAKER_01", "text": "[ERROR] decode failed"},
+            {"start": 2.0, "end": 3.0, "speaker": "", "text": "ok"},
+        ]
+        self.assertEqual(to_srt(segs), (
+            "1\n00:00:00,000 --> 00:00:01,250\n[SPEAKER_00] สวัสดีครับ\n"
+            "\n"
+            "2\n00:00:02,000 --> 00:00:03,000\nok\n"
+        ))
+        self.assertEqual(to_srt(segs[:1], speakers=False), "1\n00:00:00,000 --> 00:00:01,250\nสวัสดีครับ\n")
+
+    def test_vtt_escapes_and_voice(self):
+        from .utils.io import to_vtt
+        segs = [{"start": 0.5, "end": 1.0, "speaker": "A", "text": "x < y & z"}]
+        self.assertEqual(to_vtt(segs), "WEBVTT\n\n00:00:00.500 --> 00:00:01.000\n<v A>x &lt; y &amp; z\n")
+
+    def test_long_segment_split_on_words(self):
+        from .utils.io import _cues, to_vtt
+        words = [{"start": float(i), "end": i + 0.9, "text": f"w{i} "} for i in range(10)]
+        seg = {"start": 0.0, "end": 9.9, "speaker": "A", "text": "".join(w["text"] for w in words), "words": words}
+        self.assertEqual(list(_cues([seg])), [
+            (0.0, 5.9, "A", "w0 w1 w2 w3 w4 w5"),
+            (6.0, 9.9, "A", "w6 w7 w8 w9"),
+        ])
+        self.assertEqual(list(_cues([seg], max_s=100, max_chars=6)), [
+            (0.0, 1.9, "A", "w0 w1"), (2.0, 3.9, "A", "w2 w3"), (4.0, 5.9, "A", "w4 w5"),
+            (6.0, 7.9, "A", "w6 w7"), (8.0, 9.9, "A", "w8 w9"),
+        ])
+        self.assertTrue(to_vtt([seg]).endswith("00:00:06.000 --> 00:00:09.900\n<v A>w6 w7 w8 w9\n"))
+
+    def test_long_segment_without_words_is_one_cue(self):
+        from .utils.io import _cues
+        seg = {"start": 0.0, "end": 20.0, "speaker": "A", "text": "ก" * 200}
+        self.assertEqual(list(_cues([seg])), [(0.0, 20.0, "A", "ก" * 200)])
+
+
+# ---- results: คลังผลแบบ columnar + catalog -------------------------------------------
+class ResultCodecTests(SimpleTestCase):
+    def roundtrip(self, result):
+        from datetime import datetime, timezone
+        from .utils import results
+        blob = results.dumps(result, "trans-20260101-000000-000000000000", "trans",
+                             datetime(2026, 1, 1, tzinfo=timezone.utc))
+        return results.loads(blob), results._split(blob)[0]
+
+    def test_all_encodings(self):
+        notes = [f"note {i}" for i in range(20)]
+        segments = [
+            {"start": i * 1.5, "end": i * 1.5 + 1.234, "speaker": f"SPEAKER_0{i % 2}", "text": f"ข้อความ {i}",
+             "note": notes[i]}
+            for i in range(20)
+        ]
+        segments[0]["words"] = [{"start": 0.0, "end": 0.5, "text": "ข้อ"}, {"start": 0.5, "end": 1.234, "text": "ความ 0"}]
+        segments[2]["words"] = []
+        segments[3]["score"] = {"avg_logprob": -0.25, "beam": 5}
+        segments[4]["score"] = [1, 2]
+        del segments[5]["speaker"]
+        del segments[6]["text"]
+        del segments[7]["note"]
+        result = {"source": "/audio/a.wav", "language": "th", "metrics": {"audio_s": 31.0}, "segments": segments}
+
+        out, header = self.roundtrip(result)
+        self.assertEqual(out, result)
+        self.assertEqual(dict(header["fields"]), {
+            "start": "ms", "end": "ms", "speaker": "dict", "text": "text", "note": "text",
+            "words": "words", "score": "extra",
+        })
+        self.assertEqual(header["tables"], {"speaker": ["SPEAKER_00", "SPEAKER_01"]})
+        columns = {name for name, _, _ in header["columns"]}
+        self.assertTrue({"text:has", "note:has", "words:has", "words:n", "extra"} <= columns)
+        self.assertNotIn("speaker:has", columns)        # dict ใช้ 0xFFFF แทน
+        self.assertEqual((header["segments_count"], header["speakers_count"], header["duration_s"]), (20, 2, 31.0))
+
+    def test_times_rounded_to_ms(self):
+        out, _ = self.roundtrip({"segments": [{"start": 0.0004, "end": 1.2346}, {"start": 2.5, "end": 3}]})
+        self.assertEqual(out["segments"], [{"start": 0.0, "end": 1.235}, {"start": 2.5, "end": 3.0}])
+
+    def test_missing_or_non_numeric_time_goes_to_extra(self):
+        segments = [{"start": 0.0, "end": 1.0}, {"end": 2.0}, {"start": "x", "end": 3.0}]
+        out, header = self.roundtrip({"segments": segments})
+        self.assertEqual(out["segments"], segments)
+        self.assertEqual(dict(header["fields"])["start"], "extra")
+
+    def test_unknown_segments_kept_as_json(self):
+        for segments in (None, ["a", "b"], []):
+            out, _ = self.roundtrip({"source": "x", "segments": segments})
+            self.assertEqual(out, {"source": "x", "segments": segments})
+
+    def test_bad_magic(self):
+        from .utils import results
+        with self.assertRaises(ValueError):
+            results.loads(b"JSON{}")
+
+
+class ResultCatalogTests(TestCase):
+    def setUp(self):
+        import tempfile
+        from datetime import datetime, timezone
+        from django.test import override_settings
+        from .utils import results
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        override = override_settings(RESULTS_ROOT=tmp.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        def seg(spk):
+            return {"start": 0.0, "end": 1.0, "speaker": spk, "text": "x"}
+
+        self.ids = {}
+        for name, kind, day, spks in (
+            ("meeting-a.wav", "trans", 1, ["A", "B"]),
+            ("meeting-b.wav", "trans", 2, ["A", "B", "C"]),
+            ("call-c.wav", "diar", 3, ["A"]),
+        ):
+            header, _, _ = results._write({"source": f"/audio/{name}", "segments": [seg(s) for s in spks]},
+                                          kind, datetime(2026, 3, day, 12, tzinfo=timezone.utc))
+            self.ids[name] = header["id"]
+
+    def names(self, **kw):
+        from .utils import results
+        inv = {v: k for k, v in self.ids.items()}
+        return [inv[r["id"]] for r in results.catalog(**kw)["results"]]
+
+    def test_filters(self):
+        self.assertEqual(self.names(), ["call-c.wav", "meeting-b.wav", "meeting-a.wav"])
+        self.assertEqual(self.names(kind="trans"), ["meeting-b.wav", "meeting-a.wav"])
+        self.assertEqual(self.names(source="MEETING-A"), ["meeting-a.wav"])
+        self.assertEqual(self.names(speakers=3), ["meeting-b.wav"])
+        self.assertEqual(self.names(min_speakers="2", max_speakers="2"), ["meeting-a.wav"])
+        self.assertEqual(self.names(since="2026-03-02T00:00:00+00:00"), ["call-c.wav", "meeting-b.wav"])
+        self.assertEqual(self.names(until="2026-03-02T23:00:00+00:00"), ["meeting-b.wav", "meeting-a.wav"])
+
+    def test_paging_and_load(self):
+        from .utils import results
+        page = results.catalog(limit=2)
+        self.assertEqual(page["next_offset"], 2)
+        self.assertIsNone(results.catalog(limit=2, offset=2)["next_offset"])
+        loaded = results.load(self.ids["meeting-b.wav"])
+        self.assertEqual([s["speaker"] for s in loaded["segments"]], ["A", "B", "C"])
+
+    def test_invalid_arguments(self):
+        from .utils import results
+        for kw in ({"kind": "nope"}, {"speakers": "x"}, {"since": "yesterday"}):
+            with self.assertRaises(ValueError):
+                results.catalog(**kw)
+
+
+# ---- retranscribe: ใช้ข้อความเดิมของช่วงที่ไม่ได้แก้ --------------------------------------
+class FakeAsrMixin:
+    """แทน transcribe_segments_with_pathumma: ทำตามสัญญาของของจริง (prepare → ช่วงที่ตรง reuse ใช้ผลเดิม)
+    และจดช่วงที่ถอดจริงไว้ใน self.decoded"""
+
+    def fake_transcribe(self, wav, segments, language=None, reuse=None, **kw):
+        from .utils.segments import prepare_asr_segments
+        from .utils.transcribe import PREPARE_PARAMS, span_key
+        out = []
+        for seg in prepare_asr_segments(segments, **PREPARE_PARAMS):
+            hit = (reuse or {}).get(span_key(seg))
+            if hit is None:
+                self.decoded.append((seg["start"], seg["end"]))
+                hit = {"text": f"decoded {seg['start']:.2f}-{seg['end']:.2f}"}
+            out.append({**hit, "start": seg["start"], "end": seg["end"], "speaker": seg["speaker"]})
+        return out
+
+    def use_temp_store(self):
+        import tempfile
+        from pathlib import Path
+        from django.test import override_settings
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        override = override_settings(RESULTS_ROOT=tmp.name, CACHE_ROOT=Path(tmp.name) / "cache")
+        override.enable()
+        self.addCleanup(override.disable)
+        return Path(tmp.name)
+
+    def patch(self, *patches):
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+
+class RetranscribeTests(FakeAsrMixin, TestCase):
+    DIAR = [
+        {"start": 0.0, "end": 2.0, "speaker": "SPEAKER_00"},
+        {"start": 3.0, "end": 5.0, "speaker": "SPEAKER_01"},
+        {"start": 6.0, "end": 8.0, "speaker": "SPEAKER_00"},
+    ]
+
+    def setUp(self):
+        from unittest import mock
+        import numpy as np
+        from .utils import pipeline, results
+        from .utils.audio import SAMPLE_RATE, write_wav_pcm16k
+
+        wav = write_wav_pcm16k(self.use_temp_store() / "a.wav", np.zeros(10 * SAMPLE_RATE, dtype=np.int16))
+        self.decoded = []
+        self.patch(
+            mock.patch.object(pipeline, "transcribe_segments_with_pathumma", self.fake_transcribe),
+            mock.patch.object(pipeline.workers, "enabled", lambda: False),
+        )
+
+        self.pipeline, self.results = pipeline, results
+        self.asr_key = pipeline._asr_key("th", None)
+        segments = self.fake_transcribe(wav, self.DIAR, language="th")
+        self.decoded.clear()
+        self.prior = {
+            "source": str(wav), "wav": str(wav), "audio_key": "audio-a", "asr_key": self.asr_key,
+            "segments": segments,
+        }
+
+    def run_edit(self, segments, prior=None):
+        saved = self.results.save(prior or self.prior, "trans")
+        return self.pipeline.retranscribe(saved["id"], segments, language="th", save=False)
+
+    def test_unchanged_segments_reused(self):
+        edited = [dict(s) for s in self.DIAR]
+        edited[0]["speaker"] = "SPEAKER_02"        # เปลี่ยนแค่ผู้พูด ช่วงเวลาเดิม → ใช้ข้อความเดิม
+        out = self.run_edit(edited)
+        self.assertEqual(self.decoded, [])
+        self.assertEqual(out["incremental"], {"segments": 3, "reused": 3, "decoded": 0})
+        self.assertEqual([s["text"] for s in out["segments"]], [s["text"] for s in self.prior["segments"]])
+        self.assertEqual(out["segments"][0]["speaker"], "SPEAKER_02")
+        self.assertEqual(out["asr_key"], self.asr_key)
+
+    def test_edited_segment_redecoded(self):
+        edited = [dict(s) for s in self.DIAR]
+        edited[1]["end"] = 5.5
+        out = self.run_edit(edited)
+        self.assertEqual(len(self.decoded), 1)
+        self.assertEqual(out["incremental"], {"segments": 3, "reused": 2, "decoded": 1})
+        texts = [s["text"] for s in out["segments"]]
+        self.assertEqual([texts[0], texts[2]], [self.prior["segments"][0]["text"], self.prior["segments"][2]["text"]])
+        self.assertEqual(texts[1], "decoded {:.2f}-{:.2f}".format(*self.decoded[0]))
+
+    def test_new_segment_redecoded(self):
+        out = self.run_edit(self.DIAR + [{"start": 9.0, "end": 9.8, "speaker": "SPEAKER_01"}])
+        self.assertEqual(out["incremental"]["decoded"], 1)
+        self.assertEqual(out["incremental"]["reused"], 3)
+
+    def test_reuse_gated_on_asr_key(self):
+        out = self.run_edit([dict(s) for s in self.DIAR], prior={**self.prior, "asr_key": "other-settings"})
+        self.assertEqual(len(self.decoded), 3)
+        self.assertEqual(out["incremental"], {"segments": 3, "reused": 0, "decoded": 3})
+
+    def test_error_text_not_reused(self):
+        segments = [dict(s) for s in self.prior["segments"]]
+        segments[2]["text"] = "[ERROR] decode failed"
+        out = self.run_edit([dict(s) for s in self.DIAR], prior={**self.prior, "segments": segments})
+        self.assertEqual(out["incremental"], {"segments": 3, "reused": 2, "decoded": 1})
+
+    def test_invalid_input(self):
+        with self.assertRaises(ValueError):
+            self.pipeline.retranscribe("diar-20260101-000000-000000000000", self.DIAR)
+        with self.assertRaises(ValueError):
+            self.run_edit([{"start": 2.0, "end": 1.0}])
+        with self.assertRaises(LookupError):
+            self.pipeline.retranscribe("trans-20260101-000000-000000000000", self.DIAR)
+
+    def test_audio_gone(self):
+        # upload แบบ streaming: source เป็นแค่ชื่อไฟล์ — ถ้า .wav หายด้วยก็ถอดใหม่ไม่ได้
+        prior = {**self.prior, "source": "meeting.m4a", "wav": "/nonexistent/meeting.wav"}
+        with self.assertRaisesRegex(LookupError, "no longer available"):
+            self.run_edit([dict(s) for s in self.DIAR], prior=prior)
+
+
+# ---- streaming: ผลที่ถอดทีละก้อนต้องตรงกับ diarization สุดท้าย ------------------------------
+class StreamingTranscribeTests(FakeAsrMixin, TestCase):
+    # ผู้พูด A พูดคร่อมรอยต่อก้อน: ตอน stream ถูกถอดเป็นสองช่วง แต่ clean รอบสุดท้ายรวมเป็นช่วงเดียว
+    WINDOWS = [
+        (10.0, [{"start": 0.0, "end": 3.0, "speaker": "SPEAKER_00"},
+                {"start": 3.2, "end": 8.5, "speaker": "SPEAKER_00"}]),
+        (20.0, [{"start": 8.7, "end": 12.0, "speaker": "SPEAKER_00"},
+                {"start": 13.0, "end": 16.0, "speaker": "SPEAKER_01"}]),
+    ]
+
+    def setUp(self):
+        from unittest import mock
+        import numpy as np
+        from .utils import diarize, pipeline
+        from .utils.audio import SAMPLE_RATE, write_wav_pcm16k
+
+        self.pcm = np.zeros(20 * SAMPLE_RATE, dtype=np.int16)
+        wav = write_wav_pcm16k(self.use_temp_store() / "s.wav", self.pcm)
+        self.conv = {"ok": True, "output": str(wav), "cache_key": "audio-s", "profile": "mid"}
+        self.decoded = []
+        self.patch(
+            mock.patch.object(pipeline, "transcribe_segments_with_pathumma", self.fake_transcribe),
+            mock.patch.object(pipeline.workers, "enabled", lambda: False),
+            mock.patch.object(pipeline.vad, "active_map", lambda *a: None),
+            mock.patch.object(diarize, "WINDOW_S", 10.0),
+            mock.patch.object(diarize, "diarize_windows", lambda *a, **kw: iter(self.WINDOWS)),
+            mock.patch.object(diarize.speakers, "identify", lambda segs, *a, **kw: (segs, {})),
+        )
+        self.pipeline = pipeline
+
+    def run_auto(self):
+        return self.pipeline.transcribe_auto(
+            self.conv["output"], conv=self.conv, pcm=self.pcm, streaming=True, save=False,
+        )
+
+    def test_cached_transcript_matches_final_diarization(self):
+        from .utils import cache, diarize, speakers
+        from .utils.segments import prepare_asr_segments
+        from .utils.transcribe import PREPARE_PARAMS, asr_settings, span_key
+
+        out = self.run_auto()
+        final = cache.get_json("diar", diarize.diar_cache_key(self.conv))
+        self.assertEqual([s["speaker"] for s in final], ["SPEAKER_00", "SPEAKER_01"])
+        want = [(span_key(s), s["speaker"]) for s in prepare_asr_segments(final, **PREPARE_PARAMS)]
+        self.assertEqual([(span_key(s), s["speaker"]) for s in out["segments"]], want)
+
+        key = cache.cache_key("trans", "audio-s", speakers.raw_segments(final), asr_settings("th", None, None))
+        self.assertEqual(cache.get_json("trans", key), out["segments"])
+        # ก้อนแรก 1 + ก้อนสอง 2 + ถอดช่วงที่รวมข้ามรอยต่อใหม่ 1 (ช่วงของ B ใช้ข้อความเดิม)
+        self.assertEqual(len(self.decoded), 4)
+        self.assertEqual(self.decoded[-1][0], out["segments"][0]["start"])
+
+        # รอบถัดไปเจอ diarization ในแคช → ทางปกติ ได้ผลเดียวกันจากแคช ไม่ถอดเพิ่ม
+        self.decoded.clear()
+        again = self.run_auto()
+        self.assertEqual(self.decoded, [])
+        self.assertEqual(again["segments"], out["segments"])
+
+
+# ---- ingest: upload ที่ถอดระหว่างรับข้อมูล ----------------------------------------------
+class TakeUploadTests(SimpleTestCase):
+    def decoded(self, profile="fast"):
+        import numpy as np
+        from .utils.audio import SAMPLE_RATE
+        from .utils.ingest import DecodedUpload
+        return DecodedUpload("meeting.m4a", 1234, "audio/mp4", None, pcm=np.zeros(SAMPLE_RATE, dtype=np.int16),
+                             digest="ab" * 32, profile=profile, ok=True, stderr="")
+
+    def setUp(self):
+        import tempfile
+        from pathlib import Path
+        from unittest import mock
+        from django.test import override_settings
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        override = override_settings(CONVERTED_ROOT=self.root / "converted", CACHE_ROOT=self.root / "cache")
+        override.enable()
+        self.addCleanup(override.disable)
+        env = mock.patch.dict(os.environ, {"MEDIAFLOW_MODEL_WORKERS": "0"})
+        env.start()
+        self.addCleanup(env.stop)
+
+    def test_cache_off_writes_wav(self):
+        from unittest import mock
+        from .utils import ingest
+        from .utils.audio import load_pcm16k
+        with mock.patch.dict(os.environ, {"MEDIAFLOW_CACHE_MAX_MB": "0"}):
+            src, conv, pcm = ingest.take_upload(self.decoded(), profile="fast")
+        self.assertEqual(str(src), "meeting.m4a")
+        self.assertFalse(src.exists())
+        self.assertEqual(conv["output"], str(self.root / "converted" / "meeting.wav"))
+        self.assertEqual(len(load_pcm16k(conv["output"])), len(pcm))
+
+    def test_cache_on_links_cached_wav(self):
+        from .utils import ingest
+        _, conv, _ = ingest.take_upload(self.decoded())
+        self.assertTrue(os.path.samefile(conv["output"], next((self.root / "cache").rglob("*.wav"))))
+
+    def test_profile_mismatch(self):
+        from .utils import ingest
+        with self.assertRaisesRegex(ValueError, r"\?profile=max"):
+            ingest.take_upload(self.decoded("fast"), profile="max")
+        _, conv, _ = ingest.take_upload(self.decoded("mid"), profile="unknown")     # ไม่รู้จัก → mid เหมือน handler
+        self.assertEqual(conv["profile"], "mid")
+
+
+# ---- ffmpeg: แปลงไฟล์ยาวแบบแบ่งช่วงขนาน --------------------------------------------------
+class SplitConvertTests(SimpleTestCase):
+    def ranges(self, duration, jobs=4, split_s="600"):
+        from types import SimpleNamespace
+        from unittest import mock
+        from .utils import ffmpeg_convert
+        with mock.patch.object(ffmpeg_convert, "scheduler", lambda: SimpleNamespace(jobs=jobs)), \
+                mock.patch.dict(os.environ, {"MEDIAFLOW_FFMPEG_SPLIT_S": split_s}):
+            return ffmpeg_convert.split_ranges(duration)
+
+    def test_split_ranges(self):
+        self.assertEqual(self.ranges(None), [(0.0, None)])
+        self.assertEqual(self.ranges(600.0), [(0.0, None)])
+        self.assertEqual(self.ranges(1000.0), [(0.0, 250.0), (250.0, 500.0), (500.0, 750.0), (750.0, None)])
+        # จำนวนช่วง ≤ ceil(duration / SPLIT_MIN_PART_S) แม้ jobs มากกว่า; ขอบเป็นวินาทีเต็ม
+        self.assertEqual(self.ranges(601.0, jobs=16), [(0.0, 101.0), (101.0, 202.0), (202.0, 303.0),
+                                                       (303.0, 404.0), (404.0, 505.0), (505.0, None)])
+        self.assertEqual(self.ranges(1000.0, jobs=1), [(0.0, None)])
+        self.assertEqual(self.ranges(1000.0, split_s="0"), [(0.0, None)])
+
+    def test_concat_parts_trims_pads_sample_exact(self):
+        import tempfile
+        import wave
+        from pathlib import Path
+        import numpy as np
+        from .utils.audio import SAMPLE_RATE
+        from .utils.ffmpeg_convert import SPLIT_PAD_S, _concat_parts
+
+        sr = SAMPLE_RATE
+        signal = (np.arange(32 * sr) % 30011).astype("<i2")
+        ranges = [(0.0, 10.0), (10.0, 21.0), (21.0, None)]
+        with tempfile.TemporaryDirectory() as d:
+            d = Path(d)
+            parts = d / "parts"
+            parts.mkdir()
+            # เหมือน ffmpeg -ss (t0 - pre) -t (t1 - t0 + pre + pad): pre-roll ≤ SPLIT_PAD_S, post-roll = SPLIT_PAD_S
+            for i, (t0, t1) in enumerate(ranges):
+                a = round((t0 - min(SPLIT_PAD_S, t0)) * sr)
+                b = None if t1 is None else round((t1 + SPLIT_PAD_S) * sr)
+                signal[a:b].tofile(parts / f"{i:03d}.raw")
+            out = d / "x.wav"
+            _concat_parts(parts, out, ranges)
+            with wave.open(str(out), "rb") as w:
+                self.assertEqual((w.getnchannels(), w.getsampwidth(), w.getframerate()), (1, 2, sr))
+                got = np.frombuffer(w.readframes(w.getnframes()), dtype="<i2")
+            np.testing.assert_array_equal(got, signal)
+            self.assertEqual(sorted(p.name for p in d.iterdir()), ["parts", "x.wav"])    # ไม่เหลือไฟล์ชั่วคราว
+
+    def test_cache_key_depends_on_layout(self):
+        from .utils.ffmpeg_convert import wav_cache_key
+        single = wav_cache_key("d" * 64, "mid")
+        self.assertEqual(wav_cache_key("d" * 64, "mid", [(0.0, None)]), single)
+        split = wav_cache_key("d" * 64, "mid", [(0.0, 250.0), (250.0, None)])
+        self.assertNotEqual(split, single)
+        self.assertNotEqual(wav_cache_key("d" * 64, "mid", [(0.0, 300.0), (300.0, None)]), split)
+        self.assertEqual(wav_cache_key("d" * 64, "bogus"), single)
+
+
+# ---- packing: ช่วงสั้นหลายช่วงในหน้าต่าง encoder เดียว ---------------------------
+class PackTests(SimpleTestCase):
+    def test_groups_respect_window_and_piece_limits(self):
+        from .utils.transcribe import PACK_PARAMS, _pack_groups
+        self.assertEqual(PACK_PARAMS, {"max_window_s": 28.0, "max_piece_s": 8.0, "gap_s": 0.6})
+        durs = {0: 5.0, 1: 5.0, 2: 9.0, 3: 5.0, 4: 5.0, 5: 5.0, 6: 5.0}
+        # 5 ชิ้น + เงียบ 4 ช่วง = 27.4 s ≤ 28; ชิ้นที่ 6 ล้น → กลุ่มเดี่ยว ถูกทิ้ง; ชิ้น 9 s ยาวเกิน max_piece_s
+        self.assertEqual(_pack_groups([6, 5, 4, 3, 2, 1, 0], durs.__getitem__), [[0, 1, 3, 4, 5]])
+        self.assertEqual(_pack_groups([0], durs.__getitem__), [])
+        self.assertEqual(_pack_groups([2, 0], durs.__getitem__), [])
+
+    def test_groups_split_at_window(self):
+        from .utils.transcribe import _pack_groups
+        durs = [7.0] * 8    # 7 + 0.6 + 7 + 0.6 + 7 = 22.2; ชิ้นที่ 4 → 29.8 > 28
+        self.assertEqual(_pack_groups(list(range(8)), durs.__getitem__), [[0, 1, 2], [3, 4, 5], [6, 7]])
+
+    def test_audio_offsets_match_gap(self):
+        import numpy as np
+        from .utils.audio import SAMPLE_RATE
+        from .utils.transcribe import _pack_audio
+
+        sr = SAMPLE_RATE
+        arrs = [np.ones(sr, np.float32), np.full(2 * sr, 2, np.float32), np.full(sr // 2, 3, np.float32)]
+        packed, offsets = _pack_audio(arrs)
+        self.assertEqual(offsets, [0.0, 1.6, 4.2])
+        self.assertEqual(len(packed), round(4.7 * sr))
+        for a, o in zip(arrs, offsets):
+            i = round(o * sr)
+            np.testing.assert_array_equal(packed[i:i + len(a)], a)
+        self.assertFalse(packed[sr:round(1.6 * sr)].any())     # เงียบคั่น
+
+    def test_unpack_splits_at_gap_middle(self):
+        from .utils.transcribe import _unpack_words
+        offsets, durs = [0.0, 1.6], [1.0, 2.0]      # ขอบ = 1.3 (กลางช่องเงียบ 1.0–1.6)
+        words = [
+            {"start": 0.2, "end": 0.6, "text": " หนึ่ง"},
+            {"start": 0.9, "end": 1.5, "text": "สอง"},     # กลางคำ 1.2 → ชิ้นแรก, ท้ายคำถูกตัดที่ความยาวชิ้น
+            {"start": 1.2, "end": 2.0, "text": " สาม"},    # กลางคำ 1.6 → ชิ้นที่สอง, ต้นคำติดลบ → 0
+            {"start": 3.0, "end": 3.9, "text": "สี่"},      # เลยท้ายชิ้น → ตัดที่ 2.0
+        ]
+        self.assertEqual(_unpack_words(words, offsets, durs), [
+            [{"start": 0.2, "end": 0.6, "text": "หนึ่ง"}, {"start": 0.9, "end": 1.0, "text": "สอง"}],
+            [{"start": 0.0, "end": 0.4, "text": "สาม"}, {"start": 1.4, "end": 2.0, "text": "สี่"}],
+        ])
+
+
+# ---- VAD: ช่วงเสียงพูด / แปลงเวลา compact ↔ เดิม -----------------------------------
+class VadTests(FakeAsrMixin, SimpleTestCase):
+    # เสียง 0–2 s, เงียบ 4 s (ถูกตัด), เสียง 6–8 s, เงียบ 0.5 s (สั้นกว่า min_silence → คงไว้), เสียง 8.5–10 s, เงียบ 2 s
+    # pad 0.25 s → ช่วงเสียง [0, 2.25) และ [5.75, 10.25)
+    REGIONS = [(0, 36000), (92000, 164000)]
+    TOTAL = 192000
+
+    def setUp(self):
+        from unittest import mock
+        self.patch(mock.patch.dict(os.environ, {"MEDIAFLOW_VAD": "1"}))
+        os.environ.pop("MEDIAFLOW_VAD_THRESHOLD_DB", None)
+
+    def signal(self):
+        import numpy as np
+        from .utils.audio import SAMPLE_RATE
+        sr = SAMPLE_RATE
+        rng = np.random.default_rng(0)
+        x = rng.normal(0.0, 30.0, 12 * sr)
+        t = np.arange(len(x)) / sr
+        tone = 8000.0 * np.sin(2 * np.pi * 440.0 * t)
+        for a, b in ((0.0, 2.0), (6.0, 8.0), (8.5, 10.0)):
+            x[int(a * sr):int(b * sr)] += tone[int(a * sr):int(b * sr)]
+        return x.astype("<i2")
+
+    def tmap(self):
+        from .utils.vad import TimeMap
+        return TimeMap(self.REGIONS, self.TOTAL)
+
+    def test_speech_regions(self):
+        import numpy as np
+        from .utils.vad import speech_regions
+        self.assertEqual(speech_regions(self.signal(), {"threshold_db": None}), self.REGIONS)
+        self.assertEqual(speech_regions(np.zeros(16000, dtype="<i2"), {"threshold_db": None}), [])
+        self.assertEqual(speech_regions(np.zeros(0, dtype="<i2")), [])
+
+    def test_round_trip(self):
+        tm = self.tmap()
+        self.assertEqual((tm.speech_s, tm.total_s), (6.75, 12.0))
+        self.assertAlmostEqual(tm.saving(), 0.4375)
+        for orig, comp in ((0.0, 0.0), (1.0, 1.0), (5.75, 2.25 + 1e-4), (6.5, 3.0), (10.25, 6.75)):
+            self.assertAlmostEqual(tm.to_original(comp), orig, places=3)
+        # จุดบนรอยต่อ = ท้ายช่วงก่อนหน้า; เลยท้ายไฟล์ compact → ท้ายช่วงสุดท้าย
+        self.assertEqual(tm.to_original(2.25), 2.25)
+        self.assertEqual(tm.to_original(99.0), 10.25)
+
+    def test_segment_across_removed_silence_is_split(self):
+        tm = self.tmap()
+        segs = [{"start": 1.0, "end": 4.0, "speaker": "A", "text": "x"}, {"start": 2.22, "end": 3.0, "speaker": "B"}]
+        self.assertEqual(tm.segments_to_original(segs), [
+            {"start": 1.0, "end": 2.25, "speaker": "A", "text": "x"},
+            {"start": 5.75, "end": 7.5, "speaker": "A", "text": "x"},
+            {"start": 5.75, "end": 6.5, "speaker": "B"},        # ชิ้น 0.03 s ก่อนรอยต่อสั้นกว่า MIN_PIECE_S → ทิ้ง
+        ])
+
+    def test_clip_at_region_edges(self):
+        tm = self.tmap()
+        segs = [
+            {"start": 1.0, "end": 7.0, "speaker": "A"},
+            {"start": 3.0, "end": 5.0, "speaker": "B"},         # อยู่ในช่วงเงียบทั้งหมด
+            {"start": 5.75, "end": 6.0, "speaker": "C"},        # ตรงขอบพอดี
+            {"start": 10.0, "end": 11.0, "speaker": "D"},
+            {"start": 10.24, "end": 11.0, "speaker": "E"},      # เหลือ 0.01 s
+        ]
+        self.assertEqual(tm.clip(segs), [
+            {"start": 1.0, "end": 2.25, "speaker": "A"},
+            {"start": 5.75, "end": 7.0, "speaker": "A"},
+            {"start": 5.75, "end": 6.0, "speaker": "C"},
+            {"start": 10.0, "end": 10.25, "speaker": "D"},
+        ])
+
+    def compact(self, key):
+        import tempfile
+        import wave
+        from pathlib import Path
+        import numpy as np
+        from .utils.audio import SAMPLE_RATE, load_pcm16k
+        from .utils.vad import compacted
+
+        x = self.signal()
+        with tempfile.TemporaryDirectory() as d:
+            src = Path(d) / "src.wav"
+            with wave.open(str(src), "wb") as w:
+                w.setnchannels(1)
+                w.setsampwidth(2)
+                w.setframerate(SAMPLE_RATE)
+                w.writeframes(x.tobytes())
+            with compacted(src, load_pcm16k(src), key) as (path, pcm, tm):
+                self.assertNotEqual(path, src)
+                self.assertEqual(tm.regions(), [list(r) for r in self.REGIONS])
+                np.testing.assert_array_equal(pcm, np.concatenate([x[a:b] for a, b in self.REGIONS]))
+            return path
+
+    def test_compacted_temp_file_removed(self):
+        self.assertFalse(self.compact(None).exists())
+
+    def test_compacted_cached_by_key(self):
+        root = self.use_temp_store()
+        path = self.compact("k" * 64)
+        self.assertTrue(path.exists())
+        self.assertTrue(path.is_relative_to(root / "cache"))
+        self.assertEqual(self.compact("k" * 64), path)
+
+    def test_compacted_passthrough_when_nothing_to_cut(self):
+        from .utils.vad import compacted
+        pcm = self.signal()[:32000]     # เสียงพูดล้วน
+        with compacted(None, pcm) as (path, got, tm):
+            self.assertIsNone(path)
+            self.assertIs(got, pcm)
+            self.assertIsNone(tm)
+
+
+# ---- windowed diarization: วางหน้าต่าง + เชื่อม label ข้ามหน้าต่าง -----------------------
+def _unit(*v):
+    import numpy as np
+    v = np.asarray(v, dtype=np.float32)
+    return (v / np.linalg.norm(v)).tolist()
+
+
+class WindowedDiarizeTests(SimpleTestCase):
+    A, B, C = _unit(1, 0, 0), _unit(0, 1, 0), _unit(0, 0, 1)
+
+    def test_window_ranges_overlap(self):
+        from .utils.diarize import window_ranges
+        self.assertEqual(window_ranges(700.0, 300.0, 30.0), [(0.0, 300.0), (270.0, 570.0), (540.0, 700.0)])
+        self.assertEqual(window_ranges(570.0, 300.0, 30.0), [(0.0, 300.0), (270.0, 570.0)])
+        self.assertEqual(window_ranges(300.0, 300.0, 30.0), [(0.0, 300.0)])
+        self.assertEqual(window_ranges(10.0, 300.0, 30.0), [(0.0, 10.0)])
+        self.assertEqual(window_ranges(3.0, 2.0, 5.0), [(0.0, 2.0), (1.0, 3.0)])    # overlap ≥ window → ขยับทีละ 1 s
+
+    def test_same_speaker_keeps_global_label(self):
+        from .utils.diarize import _Stitcher
+        st = _Stitcher()
+        w1 = [_seg(0.0, 100.0, "SPEAKER_00"), _seg(100.0, 300.0, "SPEAKER_01")]
+        self.assertEqual(st.assign([], w1, {"SPEAKER_00": self.A, "SPEAKER_01": self.B}, 0.0, 0.0),
+                         {"SPEAKER_00": "SPEAKER_00", "SPEAKER_01": "SPEAKER_01"})    # label ทั้งไฟล์ = w1
+
+        # หน้าต่างที่สอง: pyannote ตั้ง label ใหม่ (B กลายเป็น SPEAKER_00) + คนใหม่ C
+        w2 = [_seg(270.0, 400.0, "SPEAKER_00"), _seg(400.0, 570.0, "SPEAKER_01")]
+        self.assertEqual(st.assign(w1, w2, {"SPEAKER_00": _unit(0.1, 1, 0), "SPEAKER_01": self.C}, 270.0, 300.0),
+                         {"SPEAKER_00": "SPEAKER_01", "SPEAKER_01": "SPEAKER_02"})
+
+        # A กลับมาหลังหายไปหนึ่งหน้าต่าง (ไม่มี overlap ให้อ้างอิง) → ยังเป็น label เดิม
+        w3 = [_seg(540.0, 600.0, "SPEAKER_00"), _seg(600.0, 700.0, "SPEAKER_01")]
+        self.assertEqual(st.assign([], w3, {"SPEAKER_00": self.C, "SPEAKER_01": _unit(1, 0.2, 0)}, 540.0, 570.0),
+                         {"SPEAKER_00": "SPEAKER_02", "SPEAKER_01": "SPEAKER_00"})
+        self.assertEqual(st.known, ["SPEAKER_00", "SPEAKER_01", "SPEAKER_02"])
+
+    def test_overlap_only_without_embeddings(self):
+        from .utils.diarize import _Stitcher
+        st = _Stitcher()
+        st.assign([], [_seg(0.0, 300.0, "SPEAKER_00")], {}, 0.0, 0.0)
+        prev = [_seg(0.0, 300.0, "SPEAKER_00")]
+        # พูดทับในช่วง overlap ≥ 1 s → คนเดิม; ทับไม่ถึง 1 s → คนใหม่
+        self.assertEqual(st.assign(prev, [_seg(270.0, 290.0, "SPEAKER_01")], {}, 270.0, 300.0),
+                         {"SPEAKER_01": "SPEAKER_00"})
+        self.assertEqual(st.assign(prev, [_seg(299.5, 320.0, "SPEAKER_00")], {}, 270.0, 300.0),
+                         {"SPEAKER_00": "SPEAKER_01"})
+
+    def test_dissimilar_embedding_overrides_overlap(self):
+        from .utils.diarize import _Stitcher
+        st = _Stitcher()
+        st.assign([], [_seg(0.0, 300.0, "SPEAKER_00")], {"SPEAKER_00": self.A}, 0.0, 0.0)
+        got = st.assign([_seg(0.0, 300.0, "SPEAKER_00")], [_seg(270.0, 300.0, "SPEAKER_00")],
+                        {"SPEAKER_00": self.B}, 270.0, 300.0)
+        self.assertEqual(got, {"SPEAKER_00": "SPEAKER_01"})
+
+    def test_windows_commit_owned_spans(self):
+        from unittest import mock
+        import numpy as np
+        from .utils import diarize
+        from .utils.audio import SAMPLE_RATE
+
+        results = [
+            ([_seg(0.0, 20.0, "SPEAKER_00"), _seg(20.0, 30.0, "SPEAKER_01")], {"SPEAKER_00": self.A, "SPEAKER_01": self.B}),
+            ([_seg(24.0, 40.0, "SPEAKER_00"), _seg(40.0, 54.0, "SPEAKER_01")], {"SPEAKER_00": self.B, "SPEAKER_01": self.C}),
+            ([_seg(48.0, 60.0, "SPEAKER_00"), _seg(60.0, 70.0, "SPEAKER_01")], {"SPEAKER_00": self.C, "SPEAKER_01": self.A}),
+        ]
+        pcm = np.zeros(70 * SAMPLE_RATE, dtype="<i2")
+        with mock.patch.object(diarize, "_window_results", return_value=iter(results)):
+            got = list(diarize._diarize_windows(None, pcm, 30.0, 6.0))
+        self.assertEqual(got, [
+            (27.0, [_seg(0.0, 20.0, "SPEAKER_00"), _seg(20.0, 27.0, "SPEAKER_01")]),
+            (51.0, [_seg(27.0, 40.0, "SPEAKER_01"), _seg(40.0, 51.0, "SPEAKER_02")]),
+            (70.0, [_seg(51.0, 60.0, "SPEAKER_02"), _seg(60.0, 70.0, "SPEAKER_00")]),
+        ])
+
+
+# ---- batch: ผลเข้าคลัง + ทำต่อจาก catalog ------------------------------------------------
+class BatchTests(FakeAsrMixin, TransactionTestCase):
+    # consumer ของ run_batch เป็น thread แยก → ต้องเห็นแถวที่ commit แล้ว (TestCase ครอบ transaction ไว้)
+
+    def setUp(self):
+        from unittest import mock
+        from django.test import override_settings
+        from .utils import batch, pipeline
+
+        root = self.use_temp_store()
+        override = override_settings(CONVERTED_ROOT=root / "converted")
+        override.enable()
+        self.addCleanup(override.disable)
+        self.src = root / "in"
+        (self.src / "sub").mkdir(parents=True)
+        for rel in ("a.wav", "sub/b.mp3"):
+            (self.src / rel).write_bytes(b"")
+        self.calls, self.fail = [], set()
+
+        async def fake_convert(src, out_dir=None, profile="mid"):
+            return {"ok": True, "output": str(src), "cached": False}
+
+        def fake_transcribe_auto(src, **kw):
+            self.calls.append(src.name)
+            if src.name in self.fail:
+                raise RuntimeError("boom")
+            return {"source": str(src), "segments": [{"start": 0.0, "end": 1.0, "speaker": "SPEAKER_00",
+                                                      "text": f"text of {src.name}"}],
+                    "metrics": {"audio_s": 1.0}}
+
+        self.patch(
+            mock.patch.object(batch, "convert_to_wav_cached", fake_convert),
+            mock.patch.object(pipeline, "transcribe_auto", fake_transcribe_auto),
+        )
+        self.batch = batch
+
+    def run_batch(self, **kw):
+        return self.batch.run_batch([self.src], "nightly", parallel=1, convert_jobs=1, **kw)
+
+    def test_results_go_to_store_and_resume_from_catalog(self):
+        from .utils import results
+
+        self.fail = {"b.mp3"}
+        status = self.run_batch()
+        self.assertEqual((status["status"], status["done"], sorted(status["failed"])), ("done_with_errors", 1, ["sub/b.mp3"]))
+        done = self.batch.done_results("nightly")
+        self.assertEqual(list(done), ["a.wav"])
+        self.assertEqual(results.load(done["a.wav"])["segments"][0]["text"], "text of a.wav")
+        row = results.catalog(batch="nightly")["results"]
+        self.assertEqual([(r["rel"], r["kind"], r["title"]) for r in row], [("a.wav", "trans", "a.wav")])
+        # โฟลเดอร์ batch เหลือแค่สถานะ — ไม่มี JSON ต่อไฟล์
+        self.assertEqual([p.name for p in self.batch.batch_dir("nightly").iterdir()], [self.batch.STATUS_FILE])
+        self.assertEqual(self.batch.read_status("nightly")["status"], "done_with_errors")
+
+        # รอบสอง: ข้ามไฟล์ที่มีผลใน catalog แล้ว ลองเฉพาะไฟล์ที่ล้มเหลว
+        self.fail, self.calls = set(), []
+        status = self.run_batch()
+        self.assertEqual((status["status"], status["skipped"], status["done"]), ("done", 1, 1))
+        self.assertEqual(self.calls, ["b.mp3"])
+        self.assertEqual(sorted(self.batch.done_results("nightly")), ["a.wav", "sub/b.mp3"])
+
+    def test_force_replaces_previous_results(self):
+        from .utils import results
+
+        self.run_batch()
+        before = self.batch.done_results("nightly")
+        self.calls = []
+        status = self.run_batch(force=True)
+        self.assertEqual((status["skipped"], status["done"]), (0, 2))
+        self.assertEqual(sorted(self.calls), ["a.wav", "b.mp3"])
+        after = self.batch.done_results("nightly")
+        self.assertEqual(sorted(after), sorted(before))
+        self.assertTrue(set(after.values()).isdisjoint(before.values()))
+        self.assertEqual(len(results.catalog(batch="nightly")["results"]), 2)
+        for rid in before.values():
+            self.assertFalse(results.path_for(rid).exists())
+
+    def test_catalog_rebuild_keeps_batch(self):
+        from .models import StoredResult
+        from .utils import results
+
+        self.run_batch()
+        StoredResult.objects.all().delete()
+        self.assertEqual(self.batch.done_results("nightly"), {})
+        results.rebuild_catalog(log=lambda *a: None)
+        self.assertEqual(sorted(self.batch.done_results("nightly")), ["a.wav", "sub/b.mp3"])
+
+
+# ---- chunked upload: ส่งทีละชิ้น สลับลำดับ/ซ้ำได้ --------------------------------------
+class ChunkedUploadTests(SimpleTestCase):
+    CHUNK = 256 * 1024      # MIN_CHUNK
+
+    def setUp(self):
+        import tempfile
+        from unittest import mock
+        from django.test import override_settings
+        from . import views
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        override = override_settings(MEDIA_ROOT=tmp.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.submitted = []
+        job = mock.Mock(as_dict=lambda with_result=True: {"job_id": "j1", "status": "queued"})
+        for p in (
+            mock.patch.dict(os.environ, {"MEDIAFLOW_UPLOAD_PRECONVERT": "0"}),
+            mock.patch.object(views, "submit_transcribe_job", lambda src, **kw: self.submitted.append(src) or job),
+        ):
+            p.start()
+            self.addCleanup(p.stop)
+        self.data = bytes(range(256)) * ((2 * self.CHUNK + 1000) // 256) + b"tail"
+        self.parts = [self.data[i:i + self.CHUNK] for i in range(0, len(self.data), self.CHUNK)]
+
+    def init(self, **extra):
+        import json
+        r = self.client.post("/tools/uploads", json.dumps({"name": "meeting.wav", "size": len(self.data),
+                                                           "chunk_size": self.CHUNK, **extra}),
+                             content_type="application/json")
+        self.assertEqual(r.status_code, 201)
+        return r.json()
+
+    def put(self, uid, index, body=None, checksum=None):
+        import hashlib
+        body = self.parts[index] if body is None else body
+        return self.client.put(f"/tools/uploads/{uid}/chunks/{index}", body, content_type="application/octet-stream",
+                               headers={"X-Chunk-SHA256": checksum or hashlib.sha256(body).hexdigest()})
+
+    def finalize(self, uid):
+        return self.client.post(f"/tools/uploads/{uid}/finalize", "{}", content_type="application/json")
+
+    def test_out_of_order_then_missing_reported(self):
+        st = self.init()
+        uid = st["upload_id"]
+        self.assertEqual((st["total_chunks"], st["received"], st["complete"]), (3, [], False))
+        self.assertEqual(self.put(uid, 2).status_code, 200)
+        self.assertEqual(self.put(uid, 0).json()["received_count"], 2)
+
+        st = self.client.get(f"/tools/uploads/{uid}").json()
+        self.assertEqual((st["received"], st["received_bytes"], st["complete"]), ([0, 2], self.CHUNK + len(self.parts[2]), False))
+        r = self.finalize(uid)
+        self.assertEqual(r.status_code, 409)
+        self.assertIn("[1]", r.json()["error"])
+        self.assertEqual(self.submitted, [])
+
+        self.put(uid, 1)
+        r = self.finalize(uid)
+        self.assertEqual(r.status_code, 202)
+        self.assertEqual((r.json()["job_id"], r.json()["preconverted"]), ("j1", False))
+        (src,) = self.submitted
+        self.assertTrue(src.name.endswith("_meeting.wav"))
+        self.assertEqual(src.read_bytes(), self.data)
+        self.assertEqual(self.client.get(f"/tools/uploads/{uid}").status_code, 404)    # session ถูกเก็บกวาดแล้ว
+
+    def test_checksum_mismatch_is_not_recorded(self):
+        uid = self.init()["upload_id"]
+        r = self.put(uid, 1, checksum="0" * 64)
+        self.assertEqual(r.status_code, 422)
+        self.assertEqual(self.client.get(f"/tools/uploads/{uid}").json()["received"], [])
+        self.assertEqual(self.put(uid, 1).status_code, 200)      # ส่งใหม่ได้
+        self.assertEqual(self.client.get(f"/tools/uploads/{uid}").json()["received"], [1])
+
+    def test_repeated_chunk_is_idempotent(self):
+        import hashlib
+        uid = self.init()["upload_id"]
+        first = self.put(uid, 0).json()
+        again = self.put(uid, 0).json()
+        self.assertEqual(first, again)
+        self.assertEqual((again["received_count"], again["sha256"]), (1, hashlib.sha256(self.parts[0]).hexdigest()))
+        for i in (1, 2, 1):
+            self.put(uid, i)
+        self.assertEqual(self.finalize(uid).status_code, 202)
+        self.assertEqual(self.submitted[0].read_bytes(), self.data)
+
+    def test_bad_requests(self):
+        uid = self.init()["upload_id"]
+        self.assertEqual(self.put(uid, 3, b"x").status_code, 400)               # index เกิน
+        self.assertEqual(self.put(uid, 0, b"short").status_code, 400)           # ขนาดไม่ตรงชิ้น
+        self.assertEqual(self.put("f" * 32, 0).status_code, 404)
+        self.assertEqual(self.put("not-an-id", 0).status_code, 404)
+        self.assertEqual(self.client.post("/tools/uploads", "{}", content_type="application/json").status_code, 400)
+
+    def test_whole_file_checksum_checked_at_finalize(self):
+        import hashlib
+        uid = self.init(sha256=hashlib.sha256(b"other").hexdigest())["upload_id"]
+        for i in range(3):
+            self.put(uid, i)
+        self.assertEqual(self.finalize(uid).status_code, 422)
+        self.assertEqual(self.submitted, [])
+        self.assertEqual(self.client.get(f"/tools/uploads/{uid}").status_code, 404)
+
+        uid = self.init(sha256=hashlib.sha256(self.data).hexdigest())["upload_id"]
+        for i in (2, 1, 0):
+            self.put(uid, i)
+        self.assertEqual(self.finalize(uid).status_code, 202)
+
+    def test_feeder_waits_for_contiguous_prefix(self):
+        from pathlib import Path
+        from .utils import chunked
+
+        st = self.init()
+        d = Path(chunked._root()) / st["upload_id"]
+        feeder = chunked._Feeder(d, chunked._load_meta(d))      # ไม่ start thread — ดูแค่ช่วงที่ป้อนได้
+        self.assertEqual(feeder._contiguous_end(), 0)
+        self.put(st["upload_id"], 1)
+        self.assertEqual(feeder._contiguous_end(), 0)              # ชิ้น 0 ยังไม่มา → ยังป้อนไม่ได้
+        self.put(st["upload_id"], 0)
+        self.assertEqual(feeder._contiguous_end(), 2 * self.CHUNK)
+        feeder.fed = 2 * self.CHUNK
+        self.put(st["upload_id"], 2)
+        self.assertEqual(feeder._contiguous_end(), len(self.data))
+
+
+# ---- jobs: claim แบบ atomic + sweep งานค้าง ---------------------------------------------
+class JobQueueTests(FakeAsrMixin, TransactionTestCase):
+    # _run_job เรียก close_old_connections → ต้องอยู่นอก transaction ของ TestCase
+
+    def setUp(self):
+        from unittest import mock
+        from .utils import jobs, pipeline
+
+        self.src = self.use_temp_store() / "a.wav"
+        self.src.write_bytes(b"")
+        self.ran, self.enqueued = [], []
+        self.patch(
+            mock.patch.object(pipeline, "transcribe_auto", lambda src, **kw: self.ran.append(src) or {"segments": []}),
+            mock.patch.object(jobs, "_inflight", set()),
+        )
+        self.jobs = jobs
+
+    def job(self, status="queued", age_s=0.0):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import TranscribeJob
+        job = TranscribeJob.objects.create(source=str(self.src), params={"language": "th"})
+        TranscribeJob.objects.filter(pk=job.pk).update(status=status, updated_at=timezone.now() - timedelta(seconds=age_s))
+        return job.pk
+
+    def status(self, pk):
+        from .models import TranscribeJob
+        return TranscribeJob.objects.get(pk=pk).status
+
+    def test_second_claim_is_noop(self):
+        pk = self.job()
+        self.jobs._run_job(pk)
+        self.jobs._run_job(pk)
+        self.assertEqual((self.status(pk), len(self.ran)), ("done", 1))
+
+        other = self.job(status="running")      # process อื่น claim ไปแล้ว
+        self.jobs._run_job(other)
+        self.assertEqual((self.status(other), len(self.ran)), ("running", 1))
+
+    def test_enqueue_once_per_process(self):
+        from unittest import mock
+        submitted = []
+        executor = mock.Mock(submit=lambda fn, pk: submitted.append(pk))
+        with mock.patch.object(self.jobs, "_get_executor", lambda: executor):
+            pk = self.job()
+            self.jobs._enqueue(pk)
+            self.jobs._enqueue(pk)
+            self.assertEqual(submitted, [pk])
+            self.jobs._run_job(pk)              # จบแล้ว → ออกจาก _inflight ส่งใหม่ได้ (แต่ claim ไม่ได้แล้ว)
+            self.assertEqual(self.jobs._inflight, set())
+
+    def test_sweep_requeues_only_stale_jobs_of_other_processes(self):
+        from unittest import mock
+        from .models import TranscribeJob
+
+        stale = self.job(status="running", age_s=3600)
+        mine = self.job(status="running", age_s=3600)
+        fresh = self.job(status="running", age_s=5)
+        queued = self.job()
+        done = self.job(status="done", age_s=3600)
+        self.jobs._inflight.add(mine)
+        before = TranscribeJob.objects.get(pk=mine).updated_at
+        with mock.patch.object(self.jobs, "_enqueue", self.enqueued.append):
+            self.jobs.sweep()
+
+        self.assertEqual([self.status(pk) for pk in (stale, mine, fresh, queued, done)],
+                         ["queued", "running", "running", "queued", "done"])
+        self.assertGreater(TranscribeJob.objects.get(pk=mine).updated_at, before)     # heartbeat
+        self.assertEqual(sorted(self.enqueued, key=str), sorted([stale, queued], key=str))
+
+
+# ---- cache: LRU + ยอดรวมที่จำไว้ ------------------------------------------------------
+class CacheEvictTests(FakeAsrMixin, SimpleTestCase):
+    SIZE = 3000
+
+    def setUp(self):
+        from unittest import mock
+        from .utils import cache
+
+        self.use_temp_store()
+        self.scans = 0
+        evict = cache._evict
+
+        def counted():
+            self.scans += 1
+            return evict()
+
+        self.patch(
+            mock.patch.dict(os.environ, {"MEDIAFLOW_CACHE_MAX_MB": str(10 * self.SIZE / (1024 * 1024))}),
+            mock.patch.object(cache, "_evict", counted),
+            mock.patch.object(cache, "_totals", {}),
+            mock.patch.object(cache, "_puts", 0),
+        )
+        self.cache = cache
+
+    def put(self, key, age_s=None):
+        import time
+        p = self.cache.put_with("wav", key, ".wav", lambda tmp: tmp.write_bytes(b"x" * self.SIZE))
+        if age_s is not None:
+            os.utime(p, (time.time() - age_s,) * 2)
+        return p
+
+    def keys(self):
+        return sorted(p.stem for p in (self.cache._root() / "wav").iterdir())
+
+    def test_least_recently_used_evicted_first(self):
+        for i in range(9):
+            self.put(f"k{i}", age_s=1000 - i)
+        self.assertEqual(self.scans, 1)             # สแกนแค่ครั้งแรก (ยังไม่รู้ยอด) — ที่เหลือบวกยอดเอา
+        self.assertIsNotNone(self.cache.get_file("wav", "k0", ".wav"))     # hit → กลายเป็นใหม่สุด
+        self.put("k9", age_s=1)
+        self.assertEqual(self.scans, 1)             # 30000 พอดีเพดาน
+        self.put("k10")
+        self.assertEqual(self.scans, 2)
+        # 33000 > 30000 → ลบจากเก่าสุด (k1, k2) จนเหลือ ≤ 90% ของเพดาน; k0 ถูกใช้ล่าสุดจึงอยู่รอด
+        self.assertEqual(self.keys(), ["k0", "k10", "k3", "k4", "k5", "k6", "k7", "k8", "k9"])
+        self.assertEqual(self.cache._totals[str(self.cache._root())], 9 * self.SIZE)
+
+    def test_overwrite_counts_difference(self):
+        for _ in range(20):
+            self.put("same")
+        self.assertEqual(self.scans, 1)
+        self.assertEqual(self.cache._totals[str(self.cache._root())], self.SIZE)
+
+    def test_periodic_rescan_sees_other_writers(self):
+        from unittest import mock
+        self.put("a")
+        # process อื่นเขียนไฟล์ใหญ่เข้าแคชเดียวกัน — ยอดของ process นี้ไม่รู้
+        (self.cache._root() / "wav" / "other.wav").write_bytes(b"x" * 40 * self.SIZE)
+        with mock.patch.object(self.cache, "RESCAN_EVERY", 3):
+            self.put("b")
+            self.assertEqual(self.keys(), ["a", "b", "other"])
+            self.put("c")                                   # put ที่ 3 → สแกน → เกินเพดาน ลบ
+        self.assertEqual(self.scans, 2)
+        self.assertLessEqual(self.cache._totals[str(self.cache._root())], 9 * self.SIZE)
+        self.assertNotIn("other", self.keys())
+
+
+# ---- ASR confidence: เกณฑ์ถอดซ้ำแบบ Whisper -------------------------------------------
+class ConfidenceTests(SimpleTestCase):
+    THAI = ("วันนี้ที่ประชุมได้หารือเรื่องงบประมาณของโครงการใหม่และกำหนดการส่งมอบงานในไตรมาสหน้า "
+            "ฝ่ายบัญชีขอให้ทุกแผนกส่งรายงานค่าใช้จ่ายภายในวันศุกร์ "
+            "ส่วนฝ่ายบุคคลจะสรุปแผนการรับสมัครพนักงานเพิ่มเติมอีกครั้งในการประชุมครั้งถัดไป และทุกคนเห็นด้วยกับแนวทางนี้")
+
+    def test_thresholds(self):
+        from .utils.transcribe import CONFIDENCE
+        self.assertEqual(CONFIDENCE, {"min_avg_logprob": -1.0, "max_compression_ratio": 2.4, "min_chars": 3})
+
+    def test_compression_ratio(self):
+        import zlib
+        from .utils.transcribe import CONFIDENCE, _compression_ratio
+        limit = CONFIDENCE["max_compression_ratio"]
+        self.assertEqual(_compression_ratio(""), 0.0)
+        self.assertGreater(_compression_ratio("สวัสดีครับ" * 20), limit)      # วนคำ
+        self.assertGreater(_compression_ratio("ok ok ok ok " * 15), limit)
+        self.assertLess(_compression_ratio("the budget for next quarter was approved by the board"), limit)
+        # ประโยคไทยปกติ: วัดบน UTF-8 จะเกินเกณฑ์ (ไบต์นำ 0xE0 ซ้ำทุกตัวอักษร) — TIS-620 ไม่เกิน
+        utf8 = self.THAI.encode("utf-8")
+        self.assertGreater(len(utf8) / len(zlib.compress(utf8)), limit)
+        self.assertLess(_compression_ratio(self.THAI), limit)
+
+    def test_low_confidence(self):
+        from .utils.transcribe import _low_confidence
+        self.assertFalse(_low_confidence(self.THAI, -0.3))
+        self.assertFalse(_low_confidence(self.THAI, None))              # ไม่มี log-prob → ดูแค่ข้อความ
+        self.assertFalse(_low_confidence(self.THAI, -1.0))              # เท่าเกณฑ์พอดียังผ่าน
+        self.assertTrue(_low_confidence(self.THAI, -1.2))
+        self.assertTrue(_low_confidence("สวัสดีครับ" * 20, -0.1))
+        self.assertTrue(_low_confidence("อ๋", -0.1))                    # สั้นกว่า min_chars
+        self.assertFalse(_low_confidence("ค่ะ", -0.1))
+        self.assertTrue(_low_confidence("", None))
+        self.assertTrue(_low_confidence("[ERROR] RuntimeError: boom", -0.1))
+
+    def test_decode_profiles(self):
+        from unittest import mock
+        from .utils.transcribe import DECODE_PROFILES, decode_profile
+        self.assertEqual({k: v["escalate_beams"] for k, v in DECODE_PROFILES.items()}, {"fast": 0, "mid": 5, "max": 0})
+        self.assertEqual({k: v["num_beams"] for k, v in DECODE_PROFILES.items()}, {"fast": 1, "mid": 1, "max": 5})
+        self.assertFalse(DECODE_PROFILES["fast"]["retry_untrimmed"])
+        with mock.patch.dict(os.environ, {"PATHUMMA_DECODE_PROFILE": "fast"}):
+            self.assertEqual(decode_profile(), "fast")
+            self.assertEqual(decode_profile(" MAX "), "max")
+            self.assertEqual(decode_profile("bogus"), "mid")
+        with mock.patch.dict(os.environ, {"PATHUMMA_DECODE_PROFILE": ""}):
+            self.assertEqual(decode_profile(), "mid")
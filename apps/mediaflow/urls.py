@@ -6,6 +6,23 @@ from .views import (
     diarize_auto_page,
     transcribe_auto_page,
     transcribe_auto_api,
+    retranscribe_api,
+    transcribe_job_submit_api,
+    job_status_api,
+    upload_init_api,
+    upload_detail_api,
+    upload_chunk_api,
+    upload_finalize_api,
+    batch_submit_api,
+    batch_status_api,
+    batch_stop_api,
+    export_api,
+    results_api,
+    result_detail_api,
+    search_api,
+    speakers_api,
+    speaker_detail_api,
+    metrics_api,
 )
 
 urlpatterns = [
@@ -15,4 +32,21 @@ urlpatterns = [
     path("diarize_auto_ui", diarize_auto_page, name="diarize_auto_page"),
     path("transcribe_auto", transcribe_auto_api, name="transcribe_auto_api"),
     path("transcribe_auto_ui", transcribe_auto_page, name="transcribe_auto_page"),
+    path("transcribe_incremental", retranscribe_api, name="retranscribe_api"),
+    path("jobs/transcribe_auto", transcribe_job_submit_api, name="transcribe_job_submit_api"),
+    path("jobs/<uuid:job_id>", job_status_api, name="job_status_api"),
+    path("uploads", upload_init_api, name="upload_init_api"),
+    path("uploads/<str:upload_id>", upload_detail_api, name="upload_detail_api"),
+    path("uploads/<str:upload_id>/chunks/<int:index>", upload_chunk_api, name="upload_chunk_api"),
+    path("uploads/<str:upload_id>/finalize", upload_finalize_api, name="upload_finalize_api"),
+    path("batch", batch_submit_api, name="batch_submit_api"),
+    path("batch/<str:name>", batch_status_api, name="batch_status_api"),
+    path("batch/<str:name>/stop", batch_stop_api, name="batch_stop_api"),
+    path("export", export_api, name="export_api"),
+    path("results", results_api, name="results_api"),
+    path("results/<str:result_id>", result_detail_api, name="result_detail_api"),
+    path("search", search_api, name="search_api"),
+    path("speakers", speakers_api, name="speakers_api"),
+    path("speakers/<str:speaker_id>", speaker_detail_api, name="speaker_detail_api"),
+    path("metrics", metrics_api, name="metrics_api"),
 ]
\ No newline at end of file
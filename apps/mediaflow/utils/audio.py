@@ -0,0 +1,229 @@
+import wave
+import subprocess
+import numpy as np
+from pathlib import Path
+
+SAMPLE_RATE = 16000
+FRAME_S = 0.01            # 10 ms ต่อเฟรมสำหรับคำนวณพลังงาน
+
+
+# ---- Load PCM ครั้งเดียว ------------------------------------------------------
+def _ffmpeg_decode_pcm(path: Path) -> np.ndarray:
+    """ถอดไฟล์ใดๆ เป็น PCM s16le 16 kHz mono ด้วย ffmpeg หนึ่ง process (ทั้งไฟล์)"""
+    cmd = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-i", str(path), "-ac", "1", "-ar", str(SAMPLE_RATE),
+        "-f", "s16le", "pipe:1",
+    ]
+    from .ffmpeg_convert import ffmpeg_slot
+    with ffmpeg_slot():
+        p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if p.returncode != 0:
+        raise RuntimeError(f"ffmpeg decode failed: {p.stderr.decode('utf-8', 'ignore')[:500]}")
+    return np.frombuffer(p.stdout, dtype="<i2")
+
+
+def _wav_pcm16k_layout(path: Path):
+    """
+    อ่าน header RIFF เอง → (offset, n_samples) ถ้าเป็น PCM s16le 16 kHz mono, ไม่งั้นคืน None
+    """
+    with path.open("rb") as fh:
+        head = fh.read(12)
+        if len(head) < 12 or head[:4] != b"RIFF" or head[8:12] != b"WAVE":
+            return None
+        fmt_ok = False
+        while True:
+            hdr = fh.read(8)
+            if len(hdr) < 8:
+                return None
+            cid, size = hdr[:4], int.from_bytes(hdr[4:], "little")
+            if cid == b"fmt ":
+                fmt = fh.read(size + (size & 1))
+                tag, ch, sr = int.from_bytes(fmt[0:2], "little"), int.from_bytes(fmt[2:4], "little"), int.from_bytes(fmt[4:8], "little")
+                bits = int.from_bytes(fmt[14:16], "little")
+                fmt_ok = (tag in (1, 0xFFFE) and ch == 1 and sr == SAMPLE_RATE and bits == 16)
+            elif cid == b"data":
+                if not fmt_ok:
+                    return None
+                offset = fh.tell()
+                avail = path.stat().st_size - offset
+                # ffmpeg ที่เขียนผ่าน pipe อาจใส่ size = 0xFFFFFFFF → ใช้ขนาดไฟล์จริงแทน
+                n = min(size, avail) // 2
+                return offset, n
+            else:
+                fh.seek(size + (size & 1), 1)
+
+
+def load_pcm16k(wav_path: str | Path) -> np.ndarray:
+    """
+    คืน PCM int16 16 kHz mono ของทั้งไฟล์
+    - WAV ที่ได้จาก convert_to_wav (pcm_s16le/16k/mono) → memory-map data chunk ตรงๆ ไม่ copy
+    - รูปแบบอื่น → ให้ ffmpeg ถอดครั้งเดียวทั้งไฟล์
+    """
+    wav_path = Path(wav_path)
+    layout = _wav_pcm16k_layout(wav_path)
+    if layout is None:
+        return _ffmpeg_decode_pcm(wav_path)
+    offset, n = layout
+    if n == 0:
+        return np.zeros(0, dtype=np.int16)
+    return np.memmap(wav_path, dtype="<i2", mode="r", offset=offset, shape=(n,))
+
+
+def write_wav_pcm16k(path: str | Path, pcm: np.ndarray) -> Path:
+    """เขียน PCM int16 16 kHz mono เป็น .wav (header มาตรฐาน 44 ไบต์ → load_pcm16k memory-map ได้)"""
+    path = Path(path)
+    with wave.open(str(path), "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        w.writeframes(np.ascontiguousarray(pcm, dtype="<i2"))
+    return path
+
+
+def slice_pcm(pcm: np.ndarray, start: float, dur: float, sr: int = SAMPLE_RATE) -> np.ndarray:
+    """ตัดช่วง [start, start+dur) เป็น view (zero-copy)"""
+    a = max(0, int(round(start * sr)))
+    b = min(len(pcm), a + max(0, int(round(dur * sr))))
+    return pcm[a:b]
+
+
+def to_float32(pcm: np.ndarray) -> np.ndarray:
+    return np.asarray(pcm, dtype=np.float32) / 32768.0
+
+
+# ---- Energy gate (แทน silenceremove) ---------------------------------------
+def frame_db(x: np.ndarray, sr: int = SAMPLE_RATE, frame_s: float = FRAME_S) -> np.ndarray:
+    """RMS ต่อเฟรม (dBFS) ของสัญญาณ float32 [-1, 1]"""
+    hop = max(1, int(sr * frame_s))
+    n = len(x) // hop
+    if n == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = x[: n * hop].reshape(n, hop)
+    rms = np.sqrt(np.mean(np.square(frames, dtype=np.float32), axis=1))
+    return 20.0 * np.log10(np.maximum(rms, 1e-10))
+
+
+def trim_bounds(
+    x: np.ndarray,
+    sr: int = SAMPLE_RATE,
+    threshold_db: float = -35.0,
+    min_dur: float = 0.2,
+) -> tuple[int, int]:
+    """
+    ขอบเขต (a, b) หลังตัดเงียบหัว/ท้ายแบบเดียวกับ silenceremove (start/stop_threshold, *_duration)
+    - หาเฟรมเสียงพูดช่วงแรก/สุดท้ายที่ต่อเนื่องอย่างน้อย min_dur
+    - ไม่มีเสียงพูดเลย → (0, 0)
+    """
+    hop = max(1, int(sr * FRAME_S))
+    voiced = frame_db(x, sr) > threshold_db
+    if not voiced.any():
+        return 0, 0
+    need = max(1, int(round(min_dur / FRAME_S)))
+    # หน้าต่างละ need เฟรมที่ voiced ครบทุกเฟรม (box convolution)
+    runs = np.convolve(voiced.astype(np.int32), np.ones(need, dtype=np.int32), mode="valid")
+    hits = np.flatnonzero(runs >= need)
+    if len(hits) == 0:
+        first, last = np.flatnonzero(voiced)[[0, -1]]
+        last += 1
+    else:
+        first, last = hits[0], hits[-1] + need
+    return int(first * hop), int(min(len(x), last * hop))
+
+
+def trim_silence(
+    x: np.ndarray,
+    sr: int = SAMPLE_RATE,
+    threshold_db: float = -35.0,
+    min_dur: float = 0.2,
+) -> np.ndarray:
+    """คืน view ของ x ที่ตัดเงียบหัว/ท้ายแล้ว (ไม่ copy); ถ้าไม่มีเสียงพูดเลยคืน array ว่าง"""
+    a, b = trim_bounds(x, sr, threshold_db, min_dur)
+    return x[a:b]
+
+
+# ---- Incremental VAD (สำหรับ live captions) --------------------------------
+class StreamingVAD:
+    """
+    ตัดเสียงที่ไหลเข้ามาเป็น utterance ด้วย energy gate ทีละเฟรม 10 ms
+    - เริ่ม utterance เมื่อเจอเฟรมเสียงพูด (เก็บ pre-roll ไว้ด้วย)
+    - จบ utterance เมื่อเงียบต่อเนื่อง end_silence วินาที หรือยาวเกิน max_utt
+    feed() คืนรายการ (start_s, pcm_int16) ของ utterance ที่จบแล้ว
+    """
+
+    def __init__(
+        self,
+        threshold_db: float = -40.0,
+        end_silence: float = 0.6,
+        pre_roll: float = 0.3,
+        min_utt: float = 0.4,
+        max_utt: float = 15.0,
+        sr: int = SAMPLE_RATE,
+    ):
+        self.sr = sr
+        self.hop = int(sr * FRAME_S)
+        self.threshold_db = threshold_db
+        self.end_frames = max(1, int(round(end_silence / FRAME_S)))
+        self.pre_frames = int(round(pre_roll / FRAME_S))
+        self.min_frames = int(round(min_utt / FRAME_S))
+        self.max_frames = int(round(max_utt / FRAME_S))
+        self._carry = np.zeros(0, dtype=np.int16)   # เศษที่ยังไม่ครบเฟรม
+        self._pre: list = []                          # เฟรมก่อนเริ่มพูด (pre-roll)
+        self._utt: list = []                          # เฟรมของ utterance ปัจจุบัน
+        self._utt_start = 0                           # index เฟรมที่ utterance เริ่ม
+        self._silent = 0
+        self._frame_idx = 0                           # เฟรมทั้งหมดที่รับมาแล้ว
+
+    @property
+    def in_speech(self) -> bool:
+        return bool(self._utt)
+
+    def current(self) -> tuple[float, np.ndarray]:
+        """utterance ที่ยังพูดไม่จบ (ใช้ทำ partial)"""
+        if not self._utt:
+            return 0.0, np.zeros(0, dtype=np.int16)
+        return self._utt_start * FRAME_S, np.concatenate(self._utt)
+
+    def feed(self, pcm: np.ndarray) -> list:
+        pcm = np.concatenate([self._carry, np.asarray(pcm, dtype=np.int16)])
+        n = len(pcm) // self.hop
+        self._carry = pcm[n * self.hop:]
+        if n == 0:
+            return []
+        frames = pcm[: n * self.hop].reshape(n, self.hop)
+        voiced = frame_db(frames.reshape(-1).astype(np.float32) / 32768.0, self.sr) > self.threshold_db
+
+        done = []
+        for f, v in zip(frames, voiced):
+            idx = self._frame_idx
+            self._frame_idx += 1
+            if not self._utt:
+                if v:
+                    self._utt = self._pre + [f]
+                    self._utt_start = idx - len(self._pre)
+                    self._pre, self._silent = [], 0
+                else:
+                    self._pre.append(f)
+                    if len(self._pre) > self.pre_frames:
+                        self._pre.pop(0)
+                continue
+            self._utt.append(f)
+            self._silent = 0 if v else self._silent + 1
+            if self._silent >= self.end_frames or len(self._utt) >= self.max_frames:
+                out = self._close()
+                if out is not None:
+                    done.append(out)
+        return done
+
+    def flush(self) -> list:
+        out = self._close()
+        return [out] if out is not None else []
+
+    def _close(self):
+        utt, start = self._utt, self._utt_start
+        # ตัดเงียบท้าย utterance ออก (เหลือไว้นิดหน่อย)
+        keep = len(utt) - max(0, self._silent - self.pre_frames)
+        self._utt, self._silent, self._pre = [], 0, []
+        if keep - self.pre_frames < self.min_frames:
+            return None
+        return start * FRAME_S, np.concatenate(utt[:keep])
@@ -0,0 +1,355 @@
+import os
+import json
+import time
+import queue
+import asyncio
+import hashlib
+import threading
+import traceback
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .ffmpeg_convert import convert_to_wav_cached
+from .io import SAFE, save_exports
+from . import results, search, workers
+
+# Batch: ถอดเสียงทั้งโฟลเดอร์ / manifest ในรอบเดียว (manage.py mediaflow_batch, POST /tools/batch)
+# - แปลง ffmpeg หลายไฟล์พร้อมกัน (asyncio ใน thread แยก) ล้ำหน้าไปก่อนขณะที่โมเดลถอดไฟล์ก่อนหน้า
+# - โมเดล pyannote/Pathumma โหลดครั้งเดียวใช้ทุกไฟล์ (lru_cache ใน process หรือ model workers)
+# - ผลต่อไฟล์เข้าคลังเดียวกับ /tools/transcribe_auto (results.save, .mfr) พร้อม batch/rel ใน catalog
+#   รันซ้ำด้วยชื่อเดิม → ข้ามไฟล์ที่มีผลใน catalog แล้ว (ต่อจากที่ค้างได้หลังถูกขัดจังหวะ)
+# - สถานะรวมอยู่ที่ RESULTS_ROOT/batch/<name>/_batch.json (JSON ธรรมดา อ่านด้วย GET /tools/batch/<name>)
+
+AUDIO_EXTS = {".mp3", ".m4a", ".wav", ".flac", ".ogg", ".aac", ".mp4", ".webm", ".opus", ".wma", ".mov", ".mkv"}
+MANIFEST_EXTS = {".txt", ".lst", ".json", ".jsonl"}
+STATUS_FILE = "_batch.json"
+
+# log(event, info) — event: start | converted | done | failed | finish
+LogFn = Callable[[str, Dict], None]
+
+
+def convert_concurrency() -> int:
+    try:
+        n = int(os.getenv("MEDIAFLOW_BATCH_CONVERT_JOBS", "0"))
+    except ValueError:
+        n = 0
+    return n if n > 0 else max(1, (os.cpu_count() or 2) // 2)
+
+
+def default_parallel() -> int:
+    # model workers แยก process → ถอดหลายไฟล์พร้อมกันได้เท่าจำนวน worker
+    # ในตัว process มีโมเดลชุดเดียว → ทีละไฟล์ (ASR ใช้ทุกคอร์อยู่แล้ว)
+    return max(1, workers.num_workers())
+
+
+def safe_name(name: str) -> str:
+    name = SAFE.sub("_", (name or "").strip())[:80].strip("._")
+    if not name:
+        raise ValueError("invalid batch name")
+    return name
+
+
+def batch_dir(name: str) -> Path:
+    return Path(settings.RESULTS_ROOT) / "batch" / safe_name(name)
+
+
+# ---- Sources ---------------------------------------------------------------------
+def _read_manifest(path: Path) -> List[Path]:
+    """manifest = .txt/.lst (บรรทัดละ path, # = comment), .json (list) หรือ .jsonl ({"path": ...} / string)"""
+    text = path.read_text(encoding="utf-8")
+    if path.suffix == ".json":
+        items = json.loads(text)
+    elif path.suffix == ".jsonl":
+        items = [json.loads(line) for line in text.splitlines() if line.strip()]
+    else:
+        items = [line.strip() for line in text.splitlines() if line.strip() and not line.lstrip().startswith("#")]
+    out = []
+    for it in items:
+        p = Path(it["path"] if isinstance(it, dict) else it).expanduser()
+        out.append(p if p.is_absolute() else path.parent / p)
+    return out
+
+
+def collect_sources(inputs: Iterable[str | Path]) -> List[Tuple[Path, str]]:
+    """
+    inputs: โฟลเดอร์ (หาไฟล์เสียงแบบ recursive), ไฟล์ manifest หรือไฟล์เสียงตรงๆ
+    คืน [(path, rel)] — rel ใช้ตั้งชื่อไฟล์ผล (โฟลเดอร์ → path ภายในโฟลเดอร์, อื่นๆ → ชื่อไฟล์)
+    rel ซ้ำกัน → ต่อท้ายด้วย hash ของ path เต็ม ให้ชื่อคงที่ทุกรอบ
+    """
+    found: List[Tuple[Path, str]] = []
+    for inp in inputs:
+        inp = Path(inp).expanduser()
+        if inp.is_dir():
+            for p in sorted(inp.rglob("*")):
+                if p.is_file() and p.suffix.lower() in AUDIO_EXTS:
+                    found.append((p.resolve(), p.relative_to(inp).as_posix()))
+        elif inp.suffix.lower() in MANIFEST_EXTS:
+            found += [(p.resolve(), p.name) for p in _read_manifest(inp)]
+        else:
+            found.append((inp.resolve(), inp.name))
+
+    seen = set()
+    uniq = [(p, rel) for p, rel in found if not (p in seen or seen.add(p))]
+    counts: Dict[str, int] = {}
+    for _, rel in uniq:
+        counts[rel] = counts.get(rel, 0) + 1
+    return [
+        (p, rel if counts[rel] == 1 else f"{rel}-{hashlib.sha1(str(p).encode()).hexdigest()[:8]}")
+        for p, rel in uniq
+    ]
+
+
+def done_results(name: str) -> Dict[str, str]:
+    """ผลที่ batch นี้เซฟไว้แล้ว {rel: result_id} (ล่าสุดต่อ rel) — ดูจาก catalog ไม่ต้องเปิดไฟล์"""
+    from ..models import StoredResult
+
+    out: Dict[str, str] = {}
+    rows = StoredResult.objects.filter(kind="trans", batch=safe_name(name)).order_by("-created_at")
+    for rel, rid in rows.values_list("rel", "id"):
+        out.setdefault(rel, rid)
+    return out
+
+
+def _write_json_atomic(path: Path, payload: Dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def read_status(name: str) -> Optional[Dict]:
+    p = batch_dir(name) / STATUS_FILE
+    try:
+        return json.loads(p.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+# ---- Convert (producer) ----------------------------------------------------------------
+def _convert_all(
+    pending: List[Tuple[Path, str]], conv_dir: Path, profile: str, jobs: int, q: "queue.Queue", stop: threading.Event,
+):
+    """
+    แปลงพร้อมกัน `jobs` ไฟล์ ส่ง (path, rel, conv | Exception) เข้า q ตามลำดับที่เสร็จ; จบด้วย None
+    .wav ของแต่ละไฟล์อยู่ใน conv_dir/<rel>/ — ไฟล์ชื่อซ้ำจากคนละโฟลเดอร์แปลงพร้อมกันได้ไม่ทับกัน
+    """
+
+    async def worker(it):
+        for src, rel in it:
+            if stop.is_set():
+                return
+            try:
+                conv = await convert_to_wav_cached(src, out_dir=conv_dir / rel, profile=profile)
+                item = (src, rel, conv if conv.get("ok") else RuntimeError(f"ffmpeg failed: {conv.get('stderr', '')[-2000:]}"))
+            except Exception as e:
+                item = (src, rel, e)
+            # q มีขนาดจำกัด → แปลงล้ำหน้าไม่เกิน jobs + maxsize ไฟล์
+            await asyncio.to_thread(q.put, item)
+
+    async def main():
+        it = iter(pending)
+        await asyncio.gather(*(worker(it) for _ in range(max(1, jobs))))
+
+    try:
+        asyncio.run(main())
+    finally:
+        q.put(None)
+
+
+# ---- Run -----------------------------------------------------------------------------
+def run_batch(
+    inputs: Iterable[str | Path],
+    name: str,
+    *,
+    language: Optional[str] = "th",
+    decode: Optional[str] = None,
+    timestamps: Optional[str] = None,
+    exports=(),
+    profile: str = "mid",
+    convert_jobs: Optional[int] = None,
+    parallel: Optional[int] = None,
+    force: bool = False,
+    log: Optional[LogFn] = None,
+    stop: Optional[threading.Event] = None,
+) -> Dict:
+    """
+    ถอดเสียงทุกไฟล์ใน inputs → คลังผล (catalog batch=<name>) แล้วคืนสถานะรวม (เหมือน _batch.json)
+    ไฟล์ที่มีผลแล้วถูกข้าม (force=True → ทำใหม่ทั้งหมด แทนที่ผลเดิม); ไฟล์ที่ล้มเหลวไม่มีผล → รันรอบหน้าจะลองใหม่
+    stop.set() → หยุดรับไฟล์ใหม่ ไฟล์ที่กำลังถอดทำต่อจนเสร็จ
+    timestamps / exports: เหมือน pipeline.transcribe_auto (srt/vtt/compact เขียนข้างไฟล์ผลของแต่ละไฟล์)
+    """
+    from .pipeline import transcribe_auto
+
+    out_dir = batch_dir(name)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    stop = stop or threading.Event()
+    sources = collect_sources(inputs)
+    prior = done_results(out_dir.name)
+    pending, skipped = [], 0
+    for src, rel in sources:
+        if not force and rel in prior:
+            skipped += 1
+        else:
+            pending.append((src, rel))
+
+    status = {
+        "name": out_dir.name,
+        "output_dir": str(out_dir),
+        "status": "running",
+        "total": len(sources),
+        "skipped": skipped,
+        "done": 0,
+        "failed": {},
+        "params": {"language": language, "decode": decode, "profile": profile,
+                   "timestamps": timestamps, "exports": list(exports)},
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "updated_at": None,
+        "audio_s": 0.0,
+        "wall_s": 0.0,
+    }
+    lock = threading.Lock()
+    t0 = time.perf_counter()
+
+    def emit(event: str, **info):
+        if log:
+            log(event, info)
+
+    def save_status(final: Optional[str] = None):
+        with lock:
+            if final:
+                status["status"] = final
+            status["updated_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+            status["wall_s"] = round(time.perf_counter() - t0, 3)
+            _write_json_atomic(out_dir / STATUS_FILE, status)
+
+    save_status()
+    emit("start", total=len(sources), pending=len(pending), skipped=skipped, output_dir=str(out_dir))
+
+    q: "queue.Queue" = queue.Queue(maxsize=max(2, parallel or default_parallel()))
+    producer = threading.Thread(
+        target=_convert_all,
+        args=(pending, Path(settings.CONVERTED_ROOT) / "batch" / out_dir.name, profile,
+              convert_jobs or convert_concurrency(), q, stop),
+        name="mediaflow-batch-convert", daemon=True,
+    )
+    producer.start()
+
+    def transcribe_one(src: Path, rel: str, conv):
+        if isinstance(conv, Exception):
+            raise conv
+        emit("converted", rel=rel, cached=conv.get("cached"))
+        result = transcribe_auto(src, language=language, conv=conv, decode=decode, timestamps=timestamps, save=False)
+        saved = results.save(result, "trans", extra={"batch": out_dir.name, "rel": rel})
+        search.index_saved(result, saved["path"])
+        if exports:
+            save_exports(result, saved["path"], exports)
+        if rel in prior:
+            results.delete(prior[rel])      # force → ผลใหม่แทนผลเดิม (rel ละหนึ่งผล)
+        return saved["id"], result
+
+    def consume():
+        while True:
+            item = q.get()
+            if item is None:
+                q.put(None)   # ให้ consumer ตัวอื่นเห็นจุดจบด้วย
+                close_old_connections()
+                return
+            if stop.is_set():
+                continue      # แปลงไว้แล้วแต่ยังไม่ถอด → ปล่อยให้รอบหน้าทำ (ต้องดึงออกจาก q ให้ producer จบได้)
+            src, rel, conv = item
+            try:
+                rid, result = transcribe_one(src, rel, conv)
+                audio_s = (result.get("metrics") or {}).get("audio_s") or 0.0
+                with lock:
+                    status["done"] += 1
+                    status["audio_s"] = round(status["audio_s"] + audio_s, 3)
+                    status["failed"].pop(rel, None)
+                emit("done", rel=rel, result_id=rid, segments=len(result["segments"]), audio_s=audio_s)
+            except Exception as e:
+                with lock:
+                    status["failed"][rel] = f"{e}\n{traceback.format_exc()[-1500:]}"
+                emit("failed", rel=rel, error=str(e))
+            save_status()
+
+    consumers = [
+        threading.Thread(target=consume, name=f"mediaflow-batch-{i}", daemon=True)
+        for i in range(max(1, parallel or default_parallel()))
+    ]
+    for t in consumers:
+        t.start()
+    for t in consumers:
+        t.join()
+    producer.join()
+
+    final = "stopped" if stop.is_set() else ("done_with_errors" if status["failed"] else "done")
+    save_status(final)
+    emit("finish", **{k: status[k] for k in ("status", "total", "skipped", "done", "wall_s", "audio_s")},
+         failed=len(status["failed"]))
+    return dict(status)
+
+
+# ---- Background (สำหรับ POST /tools/batch) ------------------------------------------------
+_running: Dict[str, Tuple[threading.Thread, threading.Event]] = {}
+_running_lock = threading.Lock()
+
+
+def batch_roots() -> List[Path]:
+    """โฟลเดอร์ที่ API อนุญาตให้อ่านไฟล์ (MEDIAFLOW_BATCH_ROOTS คั่นด้วย comma, default = MEDIA_ROOT)"""
+    raw = os.getenv("MEDIAFLOW_BATCH_ROOTS", "")
+    roots = [Path(r.strip()).expanduser() for r in raw.split(",") if r.strip()] or [Path(settings.MEDIA_ROOT)]
+    return [r.resolve() for r in roots]
+
+
+def check_allowed(inputs: Iterable[str | Path]) -> List[Path]:
+    """path ทั้งหมด (รวมที่อยู่ใน manifest) ต้องอยู่ใต้ batch_roots() ไม่เช่นนั้น ValueError"""
+    roots = batch_roots()
+    paths = [Path(p).expanduser().resolve() for p in inputs]
+    for p in paths:
+        if not any(p.is_relative_to(r) for r in roots):
+            raise ValueError(f"path not under MEDIAFLOW_BATCH_ROOTS: {p}")
+        if not p.exists():
+            raise ValueError(f"not found: {p}")
+    for src, _ in collect_sources(paths):
+        if not any(src.is_relative_to(r) for r in roots):
+            raise ValueError(f"manifest entry not under MEDIAFLOW_BATCH_ROOTS: {src}")
+    return paths
+
+
+def start_background(inputs: List[Path], name: str, **kwargs) -> bool:
+    """รัน run_batch ใน thread พื้นหลัง — คืน False ถ้า batch ชื่อนี้กำลังรันอยู่"""
+    name = safe_name(name)
+    with _running_lock:
+        cur = _running.get(name)
+        if cur is not None and cur[0].is_alive():
+            return False
+        stop = threading.Event()
+
+        def run():
+            try:
+                run_batch(inputs, name, stop=stop, **kwargs)
+            except Exception as e:
+                _write_json_atomic(batch_dir(name) / STATUS_FILE, {
+                    **(read_status(name) or {"name": name}),
+                    "status": "error", "error": f"{e}\n{traceback.format_exc()[-1500:]}",
+                })
+
+        t = threading.Thread(target=run, name=f"mediaflow-batch-{name}", daemon=True)
+        _running[name] = (t, stop)
+        t.start()
+    return True
+
+
+def is_running(name: str) -> bool:
+    cur = _running.get(safe_name(name))
+    return cur is not None and cur[0].is_alive()
+
+
+def stop_background(name: str) -> bool:
+    cur = _running.get(safe_name(name))
+    if cur is None or not cur[0].is_alive():
+        return False
+    cur[1].set()
+    return True
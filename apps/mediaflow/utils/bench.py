@@ -0,0 +1,606 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import threading
+import contextlib
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .audio import SAMPLE_RATE, load_pcm16k, write_wav_pcm16k
+
+# Benchmark: convert → diarize → transcribe บนเสียงสังเคราะห์ (deterministic ตาม seed)
+# - models="stub": pyannote แทนด้วยตัวแยกผู้พูดจาก pitch (numpy), Pathumma แทนด้วย Whisper ขนาดจิ๋ว
+#   น้ำหนักสุ่มที่สร้างจาก config → รันได้ offline บน CPU แต่ยังผ่านโค้ด batch/generate จริงทั้งหมด
+# - models="real": ใช้โมเดลตาม .env
+# - วัด wall time, real-time factor, segments/s, peak RSS และจำนวน subprocess (audit hook) ต่อขั้น
+
+STAGES = ("convert", "load_pcm", "diarize", "clean", "prepare", "transcribe", "end_to_end")
+
+# pitch พื้นฐานของผู้พูดสังเคราะห์ (Hz) — ตัวแยกผู้พูดแบบ stub ใช้ตารางเดียวกัน
+SPEAKER_F0 = (110.0, 165.0, 220.0, 285.0, 350.0, 140.0, 195.0, 255.0)
+
+
+# ---- เสียงสังเคราะห์ ----------------------------------------------------------
+def synth_meeting(duration_s: float, speakers: int = 3, seed: int = 0) -> Tuple[np.ndarray, List[Dict]]:
+    """
+    เสียงประชุมสังเคราะห์: ผู้พูดผลัดกันพูด (tone + harmonics + envelope แบบพยางค์ ~4 Hz)
+    มีช่วงเงียบ/เสียงรบกวนเบาๆ และ backchannel สั้นๆ แทรก → คืน (PCM int16, turns จริง)
+    """
+    speakers = max(1, min(speakers, len(SPEAKER_F0)))
+    rng = np.random.default_rng(seed)
+    n = int(duration_s * SAMPLE_RATE)
+    x = (rng.standard_normal(n) * 0.003).astype(np.float32)
+    turns: List[Dict] = []
+    t, cur = 0.2, 0
+    while t < duration_s - 0.5:
+        short = speakers > 1 and rng.random() < 0.15
+        dur = rng.uniform(0.25, 0.45) if short else rng.uniform(1.5, 8.0)
+        end = min(duration_s - 0.1, t + dur)
+        a, b = int(t * SAMPLE_RATE), int(end * SAMPLE_RATE)
+        tt = np.arange(b - a, dtype=np.float32) / SAMPLE_RATE
+        f0 = SPEAKER_F0[cur] * (1.0 + 0.02 * np.sin(2 * np.pi * 0.7 * tt + rng.uniform(0, 6.28)))
+        phase = 2 * np.pi * np.cumsum(f0) / SAMPLE_RATE
+        voice = np.sin(phase) + 0.5 * np.sin(2 * phase) + 0.25 * np.sin(3 * phase)
+        env = 0.55 + 0.45 * np.sin(2 * np.pi * rng.uniform(3.0, 5.0) * tt + rng.uniform(0, 6.28))
+        x[a:b] += (0.18 * voice * env).astype(np.float32)
+        turns.append({"start": round(t, 3), "end": round(end, 3), "speaker": f"SPEAKER_{cur:02d}"})
+        t = end + rng.uniform(0.1, 0.8)
+        if speakers > 1:
+            cur = (cur + int(rng.integers(1, speakers))) % speakers
+    pcm = (np.clip(x, -1.0, 1.0) * 32767).astype("<i2")
+    return pcm, turns
+
+
+def fragment_turns(turns: List[Dict], seed: int = 0) -> List[Dict]:
+    """
+    ซอย turn จริงเป็นชิ้น 0.2–2 s มีช่องว่าง/label ผิดบ้าง ให้หน้าตาเหมือนผลดิบของ pyannote
+    — อินพุตของขั้น clean ที่ไม่ขึ้นกับโมเดล
+    """
+    rng = np.random.default_rng(seed + 1)
+    labels = sorted({t["speaker"] for t in turns})
+    out: List[Dict] = []
+    for t in turns:
+        a = t["start"]
+        while a < t["end"]:
+            b = min(t["end"], a + rng.uniform(0.2, 2.0))
+            spk = t["speaker"]
+            if len(labels) > 1 and rng.random() < 0.05:
+                spk = labels[int(rng.integers(len(labels)))]
+            out.append({"start": round(a, 3), "end": round(b, 3), "speaker": spk})
+            a = b + rng.uniform(0.0, 0.2)
+    return out
+
+
+# ---- Stub models ---------------------------------------------------------------
+class _Turn:
+    __slots__ = ("start", "end")
+
+    def __init__(self, start: float, end: float):
+        self.start, self.end = start, end
+
+
+class _Annotation:
+    def __init__(self, tracks: List[Tuple[float, float, str]]):
+        self.tracks = tracks
+
+    def itertracks(self, yield_label: bool = False):
+        for i, (a, b, spk) in enumerate(self.tracks):
+            yield (_Turn(a, b), i, spk) if yield_label else (_Turn(a, b), i)
+
+
+def _stub_frame_speakers(x: np.ndarray, frame_s: float) -> np.ndarray:
+    """ต่อเฟรม: index ใน SPEAKER_F0 ที่ pitch เด่นใกล้สุด (-1 = เงียบ)"""
+    hop = int(frame_s * SAMPLE_RATE)
+    nf = len(x) // hop
+    if nf == 0:
+        return np.zeros(0, dtype=np.int64)
+    frames = np.asarray(x[: nf * hop], dtype=np.float32).reshape(nf, hop) * np.hanning(hop).astype(np.float32)
+    spec = np.abs(np.fft.rfft(frames, axis=1))
+    freqs = np.fft.rfftfreq(hop, 1.0 / SAMPLE_RATE)
+    band = (freqs >= 80) & (freqs <= 420)
+    peak = freqs[band][np.argmax(spec[:, band], axis=1)]
+    energy = np.sqrt(np.mean(frames ** 2, axis=1))
+    voiced = energy > 0.02
+    f0 = np.asarray(SPEAKER_F0)
+    label = np.argmin(np.abs(peak[:, None] - f0[None, :]), axis=1)
+    return np.where(voiced, label, -1)
+
+
+class StubEmbedding:
+    """แทน speaker embedding ของ pyannote: histogram ของผู้พูด (ตาม pitch) ในคลิป — (batch, 1, n) → (batch, dim)"""
+
+    frame_s = 0.1
+    dim = 16
+
+    def __call__(self, waveforms):
+        out = np.zeros((waveforms.shape[0], self.dim), dtype=np.float32)
+        for i, w in enumerate(waveforms):
+            lab = _stub_frame_speakers(w.numpy()[0], self.frame_s)
+            lab = lab[lab >= 0]
+            if len(lab) == 0:
+                out[i] = np.nan       # เหมือน pyannote: คลิปที่ไม่มีเสียงพูด → NaN
+            else:
+                out[i, : len(SPEAKER_F0)] = np.bincount(lab, minlength=len(SPEAKER_F0))
+        return out
+
+
+class StubDiarizer:
+    """
+    แทน pyannote Pipeline: เฟรม 100 ms → FFT หา pitch เด่น → ผู้พูดที่ pitch ใกล้สุด
+    ได้ turn ที่แตกเป็นชิ้นๆ ตามขอบเฟรม (ใกล้เคียงผลดิบของ pyannote ให้ clean_diar_segments ได้ทำงาน)
+    label เรียงตามลำดับที่เริ่มพูดในแต่ละครั้งที่เรียก เหมือน pyannote (หน้าต่างต่างกัน label ไม่ตรงกัน)
+    """
+
+    frame_s = 0.1
+    embedding = "stub-embedding"
+
+    def __init__(self):
+        self._embedding = StubEmbedding()
+
+    def __call__(self, inp, batch_size: int = 1):
+        if isinstance(inp, dict):
+            x = inp["waveform"][0].numpy()
+        else:
+            x = load_pcm16k(inp).astype(np.float32) / 32768.0
+        label = _stub_frame_speakers(x, self.frame_s)
+        nf = len(label)
+        if nf == 0:
+            return _Annotation([])
+
+        tracks: List[Tuple[float, float, str]] = []
+        order: Dict[int, int] = {}
+        change = np.flatnonzero(np.diff(label)) + 1
+        for a, b in zip(np.concatenate([[0], change]), np.concatenate([change, [nf]])):
+            if label[a] >= 0:
+                k = order.setdefault(int(label[a]), len(order))
+                tracks.append((a * self.frame_s, b * self.frame_s, f"SPEAKER_{k:02d}"))
+        return _Annotation(tracks)
+
+
+def build_stub_asr():
+    """
+    Whisper ขนาดจิ๋ว (2 layer, d_model=64) น้ำหนักสุ่ม seed คงที่ + tokenizer ตัวอักษรไทย
+    ผ่าน transformers.pipeline ตัวจริง → batch/chunk/generate เหมือนของจริงแต่เล็กพอสำหรับ CPU
+    """
+    import torch
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from transformers import (
+        WhisperConfig, WhisperFeatureExtractor, WhisperForConditionalGeneration, WhisperTokenizerFast, pipeline,
+    )
+
+    # <|notimestamps|> ต้องเป็น id สุดท้าย: Whisper ถือว่า id ที่มากกว่านี้คือ timestamp
+    special = ["<|endoftext|>", "<|startoftranscript|>", "<|th|>", "<|transcribe|>"]
+    vocab: Dict[str, int] = {}
+    for tok in special + [chr(0x0E01 + i) for i in range(46)] + [f"w{i}" for i in range(64)] + ["<|notimestamps|>"]:
+        vocab.setdefault(tok, len(vocab))
+    backend = Tokenizer(models.WordLevel(vocab, unk_token="<|endoftext|>"))
+    backend.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    tokenizer = WhisperTokenizerFast(
+        tokenizer_object=backend, unk_token="<|endoftext|>", bos_token="<|endoftext|>",
+        eos_token="<|endoftext|>", pad_token="<|endoftext|>",
+        additional_special_tokens=special[1:] + ["<|notimestamps|>"],
+    )
+
+    cfg = WhisperConfig(
+        vocab_size=len(vocab), d_model=64, encoder_layers=2, decoder_layers=2,
+        encoder_attention_heads=4, decoder_attention_heads=4, encoder_ffn_dim=128, decoder_ffn_dim=128,
+        max_source_positions=1500, max_target_positions=64, num_mel_bins=80,
+        decoder_start_token_id=1, eos_token_id=0, pad_token_id=0, bos_token_id=0,
+        begin_suppress_tokens=None, suppress_tokens=None,
+    )
+    torch.manual_seed(0)
+    model = WhisperForConditionalGeneration(cfg).eval()
+    with torch.no_grad():
+        # EOS ไม่ชนะตั้งแต่ token แรก → ทุก segment generate จริงจนถึง max_length
+        model.model.decoder.embed_tokens.weight[0].zero_()
+    gc = model.generation_config
+    gc.decoder_start_token_id, gc.eos_token_id, gc.pad_token_id = 1, 0, 0
+    gc.no_timestamps_token_id = vocab["<|notimestamps|>"]
+    gc.begin_suppress_tokens = gc.suppress_tokens = None
+    gc.max_length = 32
+    # cross-attention ของ decoder ชั้นสุดท้าย → timestamps=word ใช้ DTW แบบเดียวกับโมเดลจริง
+    gc.alignment_heads = [[1, h] for h in range(4)]
+    return pipeline(
+        "automatic-speech-recognition", model=model, tokenizer=tokenizer,
+        feature_extractor=WhisperFeatureExtractor(), device=-1,
+    )
+
+
+@contextlib.contextmanager
+def use_models(kind: str):
+    """สลับ pipeline ของ diarize/transcribe เป็น stub ชั่วคราว (kind="real" = ไม่แตะอะไร)"""
+    from . import diarize, speakers, transcribe
+    if kind != "stub":
+        yield
+        return
+    stub_diar = StubDiarizer()
+    old_get, old_asr = diarize._get_pipeline, transcribe._asr_pipeline
+    diarize._get_pipeline = lambda: stub_diar
+    transcribe._asr_pipeline = build_stub_asr()
+    speakers._get_embedding.cache_clear()      # embedding มาจาก pipeline ที่สลับอยู่
+    try:
+        yield
+    finally:
+        diarize._get_pipeline, transcribe._asr_pipeline = old_get, old_asr
+        speakers._get_embedding.cache_clear()
+
+
+# ---- การวัดผล -----------------------------------------------------------------
+_spawned = {"on": False, "count": 0}
+_hook_installed = False
+
+
+def _audit(event: str, args):
+    if _spawned["on"] and event in ("subprocess.Popen", "os.posix_spawn", "os.exec", "os.fork"):
+        _spawned["count"] += 1
+
+
+def _install_hook():
+    # audit hook ถอดออกไม่ได้ → ติดตั้งครั้งเดียว แล้วเปิด/ปิดการนับด้วย flag
+    global _hook_installed
+    if not _hook_installed:
+        sys.addaudithook(_audit)
+        _hook_installed = True
+
+
+def _rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _PeakRss:
+    """สุ่มอ่าน RSS ทุก 20 ms ระหว่างขั้น (Linux); ที่อื่นใช้ ru_maxrss ของทั้ง process แทน"""
+
+    def __enter__(self):
+        self.peak = _rss_bytes()
+        self._stop = threading.Event()
+        if self.peak is not None:
+            self._t = threading.Thread(target=self._run, daemon=True)
+            self._t.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(0.02):
+            cur = _rss_bytes()
+            if cur is not None and cur > self.peak:
+                self.peak = cur
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self.peak is not None:
+            self._t.join()
+            cur = _rss_bytes()
+            if cur is not None:
+                self.peak = max(self.peak, cur)
+        else:
+            import resource
+            kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            self.peak = kb * (1 if sys.platform == "darwin" else 1024)
+        return False
+
+
+def measure(fn: Callable[[], object], audio_s: float, count: Callable[[object], int] = len) -> Tuple[Dict, object]:
+    _install_hook()
+    _spawned["count"] = 0
+    _spawned["on"] = True
+    try:
+        with _PeakRss() as rss:
+            t0 = time.perf_counter()
+            out = fn()
+            wall = time.perf_counter() - t0
+    finally:
+        _spawned["on"] = False
+    n = count(out) if out is not None else 0
+    return {
+        "wall_s": round(wall, 4),
+        "rtf": round(wall / audio_s, 5) if audio_s else None,
+        "segments": n,
+        "segments_per_s": round(n / wall, 2) if wall > 0 else None,
+        "peak_rss_mb": round(rss.peak / 2**20, 1),
+        "subprocesses": _spawned["count"],
+    }, out
+
+
+# ---- Runner ----------------------------------------------------------------------
+def run_benchmark(
+    duration_s: float = 120.0,
+    speakers: int = 3,
+    seed: int = 0,
+    models: str = "stub",
+    decode: Optional[str] = None,
+    stages: Optional[List[str]] = None,
+) -> Dict:
+    """
+    สร้างเสียงสังเคราะห์ → วัดทีละขั้น + end-to-end (transcribe_auto) → dict พร้อม dump เป็น JSON
+    ไฟล์ทั้งหมด (upload/wav/results) อยู่ใน temp dir และปิดแคช เพื่อให้ทุกขั้นทำงานจริงทุกรอบ
+    """
+    from django.test import override_settings
+    from . import diarize, transcribe, pipeline
+    from .ffmpeg_convert import convert_to_wav, run_sync
+    from .segments import clean_diar_segments, prepare_asr_segments
+
+    stages = [s for s in (stages or STAGES) if s in STAGES]
+    pcm, truth = synth_meeting(duration_s, speakers=speakers, seed=seed)
+    audio_s = len(pcm) / SAMPLE_RATE
+    report: Dict = {
+        "meta": {
+            "duration_s": audio_s, "speakers": speakers, "seed": seed, "models": models,
+            "decode": transcribe.decode_profile(decode),
+            "ground_truth_turns": len(truth),
+            "python": platform.python_version(), "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "torch_threads": _torch_threads(),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "stages": {},
+    }
+    has_ffmpeg = shutil.which("ffmpeg") is not None
+
+    tmp = Path(tempfile.mkdtemp(prefix="mediaflow-bench-"))
+    env_keep = {k: os.environ.get(k) for k in ("MEDIAFLOW_CACHE_MAX_MB", "MEDIAFLOW_MODEL_WORKERS")}
+    os.environ["MEDIAFLOW_CACHE_MAX_MB"] = "0"
+    os.environ["MEDIAFLOW_MODEL_WORKERS"] = "0"
+    try:
+        with override_settings(
+            MEDIA_ROOT=tmp / "uploads", CONVERTED_ROOT=tmp / "converted",
+            RESULTS_ROOT=tmp / "results", CACHE_ROOT=tmp / "cache",
+        ), use_models(models):
+            for d in ("uploads", "converted", "results"):
+                (tmp / d).mkdir(parents=True, exist_ok=True)
+            src = write_wav_pcm16k(tmp / "uploads" / f"synthetic_{speakers}spk_{int(audio_s)}s.wav", pcm)
+            wav = src
+            res = report["stages"]
+
+            if "convert" in stages:
+                if has_ffmpeg:
+                    res["convert"], conv = measure(
+                        lambda: run_sync(convert_to_wav(src, out_dir=tmp / "converted")), audio_s, lambda r: 0,
+                    )
+                    if conv["ok"]:
+                        wav = Path(conv["output"])
+                    else:
+                        res["convert"]["error"] = conv["stderr"][-500:]
+                else:
+                    res["convert"] = {"skipped": "ffmpeg not found"}
+
+            if "load_pcm" in stages:
+                res["load_pcm"], _ = measure(lambda: np.asarray(load_pcm16k(wav)).sum(), audio_s, lambda r: 0)
+
+            raw_segs = fragment_turns(truth, seed=seed)
+            report["meta"]["raw_diar_segments"] = len(raw_segs)
+
+            segments = None
+            if "diarize" in stages:
+                res["diarize"], segments = measure(lambda: diarize._run_pipeline_local(wav), audio_s)
+            if "clean" in stages and raw_segs:
+                res["clean"], cleaned = measure(lambda: clean_diar_segments(raw_segs, **diarize.CLEAN_PARAMS), audio_s)
+                segments = segments or cleaned
+            if segments is None:
+                segments = truth
+            if "prepare" in stages:
+                res["prepare"], _ = measure(lambda: prepare_asr_segments(segments, **transcribe.PREPARE_PARAMS), audio_s)
+            if "transcribe" in stages:
+                res["transcribe"], _ = measure(
+                    lambda: transcribe.transcribe_segments_with_pathumma(wav, segments, decode=decode), audio_s,
+                )
+
+            if "end_to_end" in stages:
+                conv_arg = None
+                if not has_ffmpeg:
+                    # ไม่มี ffmpeg → ข้ามขั้น convert ใช้ .wav สังเคราะห์ตรงๆ
+                    conv_arg = {"ok": True, "input": str(src), "output": str(src), "stderr": "",
+                                "profile": "mid", "cache_key": f"bench-{seed}", "cached": False}
+                res["end_to_end"], _ = measure(
+                    lambda: pipeline.transcribe_auto(src, decode=decode, conv=conv_arg), audio_s,
+                    lambda r: len(r["segments"]),
+                )
+                if conv_arg is not None:
+                    res["end_to_end"]["note"] = "convert skipped (ffmpeg not found)"
+    finally:
+        for k, v in env_keep.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    report["meta"]["finished_at"] = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+    return report
+
+
+# ---- ASR backend parity ------------------------------------------------------------------
+def _edit_distance(a: str, b: str) -> int:
+    """Levenshtein ระดับตัวอักษร (DP ทีละแถว)"""
+    if len(a) < len(b):
+        a, b = b, a
+    prev = np.arange(len(b) + 1)
+    for i, ca in enumerate(a, 1):
+        cur = np.empty_like(prev)
+        cur[0] = i
+        sub = prev[:-1] + (np.frombuffer(b.encode("utf-32-le"), dtype="<u4") != ord(ca))
+        for j in range(1, len(b) + 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, sub[j - 1])
+        prev = cur
+    return int(prev[-1])
+
+
+def _cer_parts(ref: str, hyp: str) -> Tuple[int, int]:
+    """(edits, ตัวอักษรของ ref) — ไม่นับช่องว่าง (ภาษาไทยเว้นวรรคไม่คงที่)"""
+    ref, hyp = "".join(ref.split()), "".join(hyp.split())
+    return _edit_distance(ref, hyp), len(ref)
+
+
+def _parity_clips(files: List[str | Path], clips: int, clip_s: float, seed: int) -> List[np.ndarray]:
+    """ตัดคลิปละ clip_s วินาทีที่มีเสียง (ข้ามช่วงเงียบ) จากไฟล์ที่ให้มา หรือเสียงสังเคราะห์ถ้าไม่มีไฟล์"""
+    n = int(clip_s * SAMPLE_RATE)
+    sources = [load_pcm16k(f) for f in files] if files else [synth_meeting(clips * clip_s, seed=seed)[0]]
+    out: List[np.ndarray] = []
+    per_source = max(1, -(-clips // len(sources)))
+    for pcm in sources:
+        taken = 0
+        for a in range(0, max(1, len(pcm) - n + 1), n):
+            x = np.asarray(pcm[a:a + n], dtype=np.float32) / 32768.0
+            if len(x) < SAMPLE_RATE or np.sqrt(np.mean(x ** 2)) < 0.005:
+                continue
+            out.append(x)
+            taken += 1
+            if taken >= per_source or len(out) >= clips:
+                break
+    return out[:clips]
+
+
+def asr_parity(
+    files: Optional[List[str | Path]] = None,
+    candidate: str = "int8",
+    reference: str = "transformers",
+    clips: int = 20,
+    clip_s: float = 15.0,
+    decode: str = "fast",
+    models: str = "real",
+    seed: int = 0,
+    log: Callable[[str], None] = print,
+) -> Dict:
+    """
+    ถอดคลิปชุดเดียวกันด้วย backend อ้างอิงและ backend ที่จะใช้ แล้วเทียบ CER (ระหว่างสอง backend) + ความเร็ว
+    models="stub": Whisper จิ๋วของ bench (ทดสอบขั้นตอน; รองรับเฉพาะ candidate=int8)
+    """
+    from . import transcribe
+
+    arrs = _parity_clips(list(files or []), clips, clip_s, seed)
+    if not arrs:
+        raise ValueError("no usable (non-silent) audio for parity check")
+    if models == "stub":
+        if candidate != "int8":
+            raise ValueError("stub models only support candidate=int8")
+        pipes = {"reference": build_stub_asr(), "candidate": transcribe.quantize_int8(build_stub_asr())}
+    else:
+        pipes = {"reference": transcribe._load_pipeline(reference), "candidate": transcribe._load_pipeline(candidate)}
+
+    prof = transcribe.DECODE_PROFILES[transcribe.decode_profile(decode)]
+    gen = transcribe._generate_kwargs(prof["num_beams"])
+    bs = transcribe._default_batch_size()
+    texts: Dict[str, List[str]] = {}
+    wall: Dict[str, float] = {}
+    for name, pipe in pipes.items():
+        transcribe._direct_decode(pipe, arrs[:1], gen)      # warm-up
+        t0 = time.perf_counter()
+        out: List[str] = []
+        for b in range(0, len(arrs), bs):
+            out += [transcribe._extract_text(o) for o in transcribe._direct_decode(pipe, arrs[b:b + bs], gen)]
+        wall[name] = time.perf_counter() - t0
+        texts[name] = out
+        log(f"{name}: {wall[name]:.2f}s for {len(arrs)} clips")
+
+    rows, edits, chars = [], 0, 0
+    for i, (r, h) in enumerate(zip(texts["reference"], texts["candidate"])):
+        e, n = _cer_parts(r, h)
+        edits, chars = edits + e, chars + n
+        rows.append({"clip": i, "cer": round(e / max(1, n), 4), "reference": r, "candidate": h})
+    audio_s = sum(len(a) for a in arrs) / SAMPLE_RATE
+    return {
+        "reference": reference,
+        "candidate": candidate if models == "real" else "int8 (stub)",
+        "decode": decode,
+        "clips": len(arrs),
+        "audio_s": round(audio_s, 2),
+        "cer": round(edits / max(1, chars), 4),
+        "exact_match": round(sum(r["reference"] == r["candidate"] for r in rows) / len(rows), 4),
+        "wall_s": {k: round(v, 3) for k, v in wall.items()},
+        "rtf": {k: round(v / audio_s, 4) for k, v in wall.items()},
+        "speedup": round(wall["reference"] / max(wall["candidate"], 1e-9), 3),
+        "rows": rows,
+    }
+
+
+# ---- Auto-tune diarization runtime ------------------------------------------------------
+TUNE_BATCHES = ((1, 1), (8, 8), (16, 16), (32, 32), (32, 64))
+
+
+def tune_diarization(
+    duration_s: float = 120.0,
+    speakers: int = 3,
+    seed: int = 0,
+    models: str = "real",
+    int8: bool = False,
+    repeats: int = 1,
+    log: Callable[[str], None] = print,
+) -> Dict:
+    """
+    หาค่า runtime ของ diarization ที่เร็วที่สุดบนเครื่องนี้ (ดู diarize.RUNTIME_PROFILES) ด้วยเสียงสังเคราะห์
+    ปรับทีละมิติ: threads → batch size (segmentation, embedding) → int8 (เฉพาะ int8=True เพราะผลต่างจาก fp32)
+    คืน {"config": ค่าที่ดีที่สุด, "trials": [...], ...} — ผลถูกตั้งให้ pipeline ของ process นี้ด้วย
+    """
+    from . import diarize
+
+    tmp = Path(tempfile.mkdtemp(prefix="mediaflow-tune-"))
+    try:
+        pcm, _ = synth_meeting(duration_s, speakers=speakers, seed=seed)
+        wav = write_wav_pcm16k(tmp / "tune.wav", pcm)
+        with use_models(models):
+            pipe = diarize._get_pipeline()
+            trials: List[Dict] = []
+
+            def run(cfg: Dict) -> float:
+                diarize.apply_runtime(pipe, cfg)
+                best = float("inf")
+                for _ in range(max(1, repeats)):
+                    t0 = time.perf_counter()
+                    diarize._run_pipeline_local(wav)
+                    best = min(best, time.perf_counter() - t0)
+                trials.append({**{k: cfg[k] for k in ("threads", "segmentation_batch", "embedding_batch", "quantize")},
+                               "wall_s": round(best, 3), "rtf": round(best / duration_s, 4)})
+                log(f"  {trials[-1]}")
+                return best
+
+            cores = os.cpu_count() or 1
+            cfg = {**diarize.runtime_config("mid"), "threads": diarize._auto_threads() or cores, "interop_threads": 0}
+            diarize._run_pipeline_local(wav)      # warm-up (โหลด kernel / แคช)
+
+            log("threads:")
+            options = sorted({cores, max(1, cores // 2), cfg["threads"]})
+            cfg["threads"] = min(options, key=lambda n: run({**cfg, "threads": n}))
+            log("batch sizes:")
+            seg, emb = min(TUNE_BATCHES, key=lambda b: run({**cfg, "segmentation_batch": b[0], "embedding_batch": b[1]}))
+            cfg.update(segmentation_batch=seg, embedding_batch=emb)
+            if int8:
+                log("int8:")
+                cfg["quantize"] = min(QUANTIZE_TRIALS, key=lambda q: run({**cfg, "quantize": q}))
+            diarize.apply_runtime(pipe, cfg)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    return {
+        "config": {k: cfg[k] for k in ("segmentation_batch", "embedding_batch", "quantize", "threads", "interop_threads")},
+        "trials": trials,
+        "audio_s": duration_s,
+        "models": models,
+        "host": {"platform": platform.platform(), "cpu_count": os.cpu_count(), "python": sys.version.split()[0]},
+        "tuned_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+QUANTIZE_TRIALS = ("none", "embedding", "all")
+
+
+def _torch_threads() -> Optional[int]:
+    try:
+        import torch
+        return torch.get_num_threads()
+    except Exception:
+        return None
+
+
+def dump(report: Dict, path: Optional[str | Path] = None) -> str:
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if path:
+        Path(path).write_text(text, encoding="utf-8")
+    return text
@@ -0,0 +1,179 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+from django.conf import settings
+
+# แคชแบบ content-addressed ใต้ data/cache/<stage>/<key>.<ext>
+# - key = sha256 ของ (hash ไฟล์ต้นฉบับ + พารามิเตอร์ของแต่ละขั้น)
+# - LRU ตาม mtime (แตะ mtime ทุกครั้งที่ hit) จำกัดขนาดรวมด้วย MEDIAFLOW_CACHE_MAX_MB (0 = ปิดแคช)
+# - put ไม่สแกนทั้งแคช: บวกขนาดไฟล์ใหม่เข้ายอดรวมที่จำไว้ สแกน/ลบจริงเมื่อยอดเกินเพดาน หรือครบ RESCAN_EVERY ครั้ง
+#   (ยอดของ process นี้ไม่เห็นไฟล์ที่ process อื่นเขียน → สแกนเป็นระยะให้ตรงกับดิสก์)
+#   เกินเพดาน → ลบจนเหลือ EVICT_TARGET ของเพดาน กัน put ถัดๆ ไปต้องสแกนซ้ำทันที
+
+RESCAN_EVERY = 256
+EVICT_TARGET = 0.9
+
+_lock = threading.Lock()
+_totals: Dict[str, int] = {}    # root → ขนาดรวมโดยประมาณ (bytes)
+_puts = 0
+
+
+def _max_bytes() -> int:
+    try:
+        return int(float(os.getenv("MEDIAFLOW_CACHE_MAX_MB", "2048")) * 1024 * 1024)
+    except ValueError:
+        return 2048 * 1024 * 1024
+
+
+def enabled() -> bool:
+    return _max_bytes() > 0
+
+
+def _root() -> Path:
+    return Path(getattr(settings, "CACHE_ROOT", settings.BASE_DIR / "data" / "cache"))
+
+
+def file_digest(path: str | Path, bufsize: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with Path(path).open("rb") as fh:
+        while True:
+            b = fh.read(bufsize)
+            if not b:
+                break
+            h.update(b)
+    return h.hexdigest()
+
+
+def cache_key(*parts: Any) -> str:
+    """รวม hash/พารามิเตอร์เป็น key เดียว (ลำดับมีผล, dict ถูก sort key)"""
+    blob = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def _path(stage: str, key: str, suffix: str) -> Path:
+    return _root() / stage / f"{key}{suffix}"
+
+
+def _touch(p: Path):
+    try:
+        os.utime(p, None)
+    except OSError:
+        pass
+
+
+def get_file(stage: str, key: str, suffix: str) -> Optional[Path]:
+    if not enabled():
+        return None
+    p = _path(stage, key, suffix)
+    if p.exists():
+        _touch(p)
+        return p
+    return None
+
+
+def put_with(stage: str, key: str, suffix: str, write: Callable[[Path], Any]) -> Optional[Path]:
+    """
+    ให้ write(tmp_path) เขียนไฟล์ชั่วคราว แล้ว rename เข้าแคช (atomic)
+    — ใช้เมื่อมีข้อมูลอยู่ในหน่วยความจำแล้ว ไม่ต้องเขียนไฟล์อื่นก่อนค่อย copy
+    """
+    if not enabled():
+        return None
+    dst = _path(stage, key, suffix)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(f".{dst.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    write(tmp)
+    replaced = _size(dst)
+    os.replace(tmp, dst)
+    _account(_size(dst) - replaced)
+    return dst
+
+
+def put_file(stage: str, key: str, src: str | Path, suffix: str) -> Optional[Path]:
+    """คัดลอกไฟล์เข้าแคช (เขียนไฟล์ชั่วคราวแล้ว rename เพื่อให้ atomic)"""
+    return put_with(stage, key, suffix, lambda tmp: shutil.copyfile(src, tmp))
+
+
+def get_json(stage: str, key: str) -> Optional[Any]:
+    p = get_file(stage, key, ".json")
+    if p is None:
+        return None
+    try:
+        return json.loads(p.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def put_json(stage: str, key: str, payload: Any):
+    blob = json.dumps(payload, ensure_ascii=False)
+    put_with(stage, key, ".json", lambda tmp: tmp.write_text(blob, encoding="utf-8"))
+
+
+def link_or_copy(src: str | Path, dst: str | Path) -> Path:
+    """
+    วางไฟล์จากแคชไว้ที่ปลายทาง — hardlink ถ้าได้ (ไม่เปลือง I/O), ไม่งั้น copy
+    ปลายทางใช้ inode เดียวกับแคช: ผู้เขียนไฟล์ที่ path นั้นภายหลังต้องเขียนไฟล์ชั่วคราวแล้ว os.replace ห้ามเขียนทับตรงๆ
+    """
+    src, dst = Path(src), Path(dst)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    if dst.exists():
+        dst.unlink()
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+    return dst
+
+
+def _size(p: Path) -> int:
+    try:
+        return p.stat().st_size
+    except OSError:
+        return 0
+
+
+def _account(added: int):
+    """บวกขนาดที่เพิ่มเข้ายอดรวม → สแกน/ลบเฉพาะเมื่อเกินเพดาน (หรือยังไม่รู้ยอด / ครบ RESCAN_EVERY ครั้ง)"""
+    global _puts
+    root = str(_root())
+    with _lock:
+        _puts += 1
+        total = _totals.get(root)
+        if total is not None and _puts % RESCAN_EVERY:
+            total += added
+            _totals[root] = total
+            if total <= _max_bytes():
+                return
+        _totals[root] = _evict()
+
+
+def _evict() -> int:
+    """สแกนแคชแล้วลบไฟล์ที่ถูกใช้ล่าสุดนานที่สุด ถ้าขนาดรวมเกินเพดาน จนเหลือ EVICT_TARGET → คืนขนาดรวม (เรียกภายใต้ _lock)"""
+    limit = _max_bytes()
+    files = []
+    total = 0
+    for p in _root().glob("*/*"):
+        if p.name.startswith("."):
+            continue
+        try:
+            st = p.stat()
+        except OSError:
+            continue
+        files.append((st.st_mtime, st.st_size, p))
+        total += st.st_size
+    if total <= limit:
+        return total
+    target = int(limit * EVICT_TARGET)
+    files.sort()
+    for _, size, p in files:
+        try:
+            p.unlink()
+        except OSError:
+            continue
+        total -= size
+        if total <= target:
+            break
+    return total
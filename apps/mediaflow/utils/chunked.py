@@ -0,0 +1,322 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from .audio import SAMPLE_RATE
+from .ffmpeg_convert import AUDIO_FILTERS, FFMPEG, _safe_stem, acquire_slot, wav_cache_key
+from .ingest import _pipe_unfriendly
+from . import cache
+
+# Chunked upload: init → PUT chunk ทีละชิ้น (ส่งซ้ำ/สลับลำดับได้) → finalize → job
+# - ชิ้นเขียนลง data.part ที่ offset ของมันตรงๆ (จองขนาดไฟล์ไว้ตอน init) + ไฟล์ <n>.sha256 เป็นตัวบอกว่าได้รับแล้ว
+#   สถานะอยู่บนดิสก์ทั้งหมด → เน็ตหลุด/server รีสตาร์ต ก็ GET สถานะแล้วส่งเฉพาะชิ้นที่ขาดต่อได้
+# - PUT ส่ง X-Chunk-SHA256 มาด้วย → ตรวจก่อนบันทึก (ไม่ตรง = 422 ให้ส่งใหม่), init ใส่ sha256 ทั้งไฟล์ได้ → ตรวจตอน finalize
+# - ระหว่างอัปโหลด: ป้อน prefix ที่ต่อเนื่องแล้วเข้า ffmpeg ทันที (MEDIAFLOW_UPLOAD_PRECONVERT=0 = ปิด)
+#   ได้ sha256 ทั้งไฟล์ระหว่างทาง → finalize ใช้ .wav นี้เลยไม่ต้องแปลงซ้ำ; feeder อยู่ใน process ที่รับชิ้นเท่านั้น
+#   ถ้าไม่มี/ล้มเหลว job จะแปลงจากไฟล์เต็มตามปกติ
+# - session ที่ค้างเกิน MEDIAFLOW_UPLOAD_TTL_H ชั่วโมงถูกลบตอน init ครั้งถัดไป
+
+DEFAULT_CHUNK = 8 * 1024 * 1024
+MIN_CHUNK, MAX_CHUNK = 256 * 1024, 64 * 1024 * 1024
+PRECONVERT_PROFILE = "mid"     # ตรงกับ default ของ transcribe_auto
+_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadError(ValueError):
+    status = 400
+
+
+class UploadNotFound(UploadError):
+    status = 404
+
+
+class UploadIncomplete(UploadError):
+    status = 409
+
+
+class ChecksumMismatch(UploadError):
+    status = 422
+
+
+def _root() -> Path:
+    return Path(settings.MEDIA_ROOT) / ".chunked"
+
+
+def _dir(upload_id: str) -> Path:
+    if not _ID.match(upload_id or ""):
+        raise UploadNotFound("upload not found")
+    d = _root() / upload_id
+    if not (d / "meta.json").exists():
+        raise UploadNotFound("upload not found")
+    return d
+
+
+def _preconvert_enabled() -> bool:
+    return os.getenv("MEDIAFLOW_UPLOAD_PRECONVERT", "1") not in ("0", "false", "False", "")
+
+
+def _ttl_s() -> float:
+    try:
+        return float(os.getenv("MEDIAFLOW_UPLOAD_TTL_H", "24")) * 3600
+    except ValueError:
+        return 24 * 3600
+
+
+def _load_meta(d: Path) -> Dict:
+    return json.loads((d / "meta.json").read_text(encoding="utf-8"))
+
+
+def _chunk_len(meta: Dict, index: int) -> int:
+    return min(meta["chunk_size"], meta["size"] - index * meta["chunk_size"])
+
+
+def _received(d: Path, meta: Dict) -> List[int]:
+    return sorted(int(p.stem) for p in d.glob("*.sha256") if p.stem.isdigit() and int(p.stem) < meta["total_chunks"])
+
+
+def _cleanup_stale():
+    root = _root()
+    if not root.exists():
+        return
+    cutoff = time.time() - _ttl_s()
+    for d in root.iterdir():
+        try:
+            if d.stat().st_mtime < cutoff and d.name not in _feeders:
+                shutil.rmtree(d, ignore_errors=True)
+        except OSError:
+            pass
+
+
+# ---- Protocol -----------------------------------------------------------------------
+def init_upload(name: str, size: int, chunk_size: Optional[int] = None, sha256: Optional[str] = None) -> Dict:
+    if not name or size is None or int(size) <= 0:
+        raise UploadError("name and size (> 0) are required")
+    _cleanup_stale()
+    chunk_size = min(MAX_CHUNK, max(MIN_CHUNK, int(chunk_size or DEFAULT_CHUNK)))
+    size = int(size)
+    meta = {
+        "upload_id": uuid.uuid4().hex,
+        "name": Path(name).name,
+        "size": size,
+        "chunk_size": chunk_size,
+        "total_chunks": -(-size // chunk_size),
+        "sha256": (sha256 or "").lower() or None,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    d = _root() / meta["upload_id"]
+    d.mkdir(parents=True)
+    with (d / "data.part").open("wb") as fh:
+        fh.truncate(size)    # sparse บนระบบไฟล์ส่วนใหญ่
+    (d / "meta.json").write_text(json.dumps(meta), encoding="utf-8")
+    return status(meta["upload_id"])
+
+
+def status(upload_id: str) -> Dict:
+    d = _dir(upload_id)
+    meta = _load_meta(d)
+    got = _received(d, meta)
+    feeder = _feeders.get(upload_id)
+    return {
+        **meta,
+        "received": got,
+        "received_bytes": sum(_chunk_len(meta, i) for i in got),
+        "complete": len(got) == meta["total_chunks"],
+        "preconvert": None if feeder is None else {"fed_bytes": feeder.fed, "failed": feeder.failed},
+    }
+
+
+def put_chunk(upload_id: str, index: int, stream, length: Optional[int], checksum: Optional[str] = None) -> Dict:
+    """อ่าน body จาก stream (ทีละ 1 MB) เขียนลง offset ของชิ้น แล้วตรวจ checksum ก่อนบันทึกว่าได้รับ"""
+    d = _dir(upload_id)
+    meta = _load_meta(d)
+    if not 0 <= index < meta["total_chunks"]:
+        raise UploadError(f"chunk index out of range (0..{meta['total_chunks'] - 1})")
+    expected = _chunk_len(meta, index)
+    if length is not None and length != expected:
+        raise UploadError(f"chunk {index} must be {expected} bytes, got {length}")
+
+    h = hashlib.sha256()
+    n = 0
+    with (d / "data.part").open("r+b") as fh:
+        fh.seek(index * meta["chunk_size"])
+        while n < expected:
+            b = stream.read(min(1 << 20, expected - n))
+            if not b:
+                break
+            fh.write(b)
+            h.update(b)
+            n += len(b)
+    if n != expected:
+        raise UploadError(f"chunk {index} incomplete: {n}/{expected} bytes")
+    digest = h.hexdigest()
+    if checksum and checksum.strip().lower() != digest:
+        raise ChecksumMismatch(f"chunk {index} checksum mismatch")
+
+    marker = d / f"{index}.sha256"
+    tmp = d / f".{index}.{threading.get_ident()}.tmp"
+    tmp.write_text(digest)
+    os.replace(tmp, marker)
+    os.utime(d, None)
+
+    if _preconvert_enabled():
+        _ensure_feeder(upload_id, d, meta)
+    return {"upload_id": upload_id, "index": index, "sha256": digest, "received_count": len(_received(d, meta))}
+
+
+def abort(upload_id: str):
+    d = _dir(upload_id)
+    feeder = _feeders.pop(upload_id, None)
+    if feeder is not None:
+        feeder.cancel()
+        feeder.done.wait()
+    _no_feed.discard(upload_id)
+    shutil.rmtree(d, ignore_errors=True)
+
+
+def finalize(upload_id: str, prefix: str = "") -> Tuple[Path, Optional[Dict]]:
+    """
+    ครบทุกชิ้น → ย้ายเป็นไฟล์ต้นฉบับใน MEDIA_ROOT แล้วคืน (src, conv)
+    conv = ผลแปลงจาก feeder (ใช้กับ submit_transcribe_job ได้เลย) หรือ None ถ้าต้องแปลงใหม่
+    """
+    d = _dir(upload_id)
+    meta = _load_meta(d)
+    got = _received(d, meta)
+    if len(got) != meta["total_chunks"]:
+        missing = sorted(set(range(meta["total_chunks"])) - set(got))
+        raise UploadIncomplete(f"missing {len(missing)} chunk(s): {missing[:20]}")
+
+    feeder = _feeders.pop(upload_id, None)
+    _no_feed.discard(upload_id)
+    digest = None
+    if feeder is not None:
+        feeder.wake.set()
+        feeder.done.wait()
+        if feeder.ok():
+            digest = feeder.sha.hexdigest()
+        else:
+            feeder = None
+    if meta["sha256"]:
+        digest = digest or cache.file_digest(d / "data.part")
+        if digest != meta["sha256"]:
+            shutil.rmtree(d, ignore_errors=True)
+            raise ChecksumMismatch("file checksum mismatch — upload again")
+
+    up = Path(settings.MEDIA_ROOT)
+    up.mkdir(parents=True, exist_ok=True)
+    src = up / f"{prefix}{meta['name']}"
+    os.replace(d / "data.part", src)
+
+    conv = None
+    if feeder is not None:
+        key = wav_cache_key(digest, PRECONVERT_PROFILE)
+        out = Path(settings.CONVERTED_ROOT) / f"{prefix}{_safe_stem(Path(meta['name']))}.wav"
+        out.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(feeder.out_wav, out)
+        cache.put_file("wav", key, out, ".wav")
+        conv = {
+            "ok": True, "input": str(src), "output": str(out), "stderr": "",
+            "profile": PRECONVERT_PROFILE, "cache_key": key, "cached": False,
+        }
+    shutil.rmtree(d, ignore_errors=True)
+    return src, conv
+
+
+# ---- Pre-conversion of the received prefix -------------------------------------------------
+class _Feeder:
+    """thread ที่ป้อน data.part ช่วงที่ต่อเนื่องแล้วเข้า stdin ของ ffmpeg (+ sha256 ทั้งไฟล์ระหว่างทาง)"""
+
+    def __init__(self, d: Path, meta: Dict):
+        self.dir = d
+        self.meta = meta
+        self.out_wav = d / "preconv.wav"
+        self.sha = hashlib.sha256()
+        self.fed = 0
+        self.failed: Optional[str] = None
+        self.rc: Optional[int] = None
+        self.wake = threading.Event()
+        self.done = threading.Event()
+        self._cancel = False
+        self.thread = threading.Thread(target=self._run, name=f"mediaflow-preconv-{meta['upload_id'][:8]}", daemon=True)
+
+    def ok(self) -> bool:
+        return self.rc == 0 and not self.failed and self.fed == self.meta["size"]
+
+    def cancel(self):
+        self._cancel = True
+        self.wake.set()
+
+    def _contiguous_end(self) -> int:
+        cs, k = self.meta["chunk_size"], self.fed // self.meta["chunk_size"]
+        while k < self.meta["total_chunks"] and (self.dir / f"{k}.sha256").exists():
+            k += 1
+        return min(k * cs, self.meta["size"])
+
+    def _run(self):
+        release = acquire_slot()
+        err = bytearray()
+        proc = None
+        try:
+            proc = subprocess.Popen(
+                [FFMPEG, "-hide_banner", "-y", "-i", "pipe:0", "-ac", "1", "-ar", str(SAMPLE_RATE),
+                 "-vn", "-sn", "-dn", "-af", AUDIO_FILTERS[PRECONVERT_PROFILE], "-c:a", "pcm_s16le", str(self.out_wav)],
+                stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            )
+            drain = threading.Thread(target=lambda: err.extend(proc.stderr.read()), daemon=True)
+            drain.start()
+            with (self.dir / "data.part").open("rb") as fh:
+                while self.fed < self.meta["size"] and not self._cancel:
+                    end = self._contiguous_end()
+                    if self.fed >= end:
+                        # รอชิ้นถัดไป (timeout เผื่อชิ้นถูกรับโดย process อื่น)
+                        self.wake.wait(1.0)
+                        self.wake.clear()
+                        continue
+                    fh.seek(self.fed)
+                    b = fh.read(min(1 << 20, end - self.fed))
+                    self.sha.update(b)
+                    proc.stdin.write(b)
+                    self.fed += len(b)
+            if self._cancel:
+                proc.kill()
+            proc.stdin.close()
+            self.rc = proc.wait()
+            drain.join()
+            if self.rc != 0:
+                self.failed = err.decode("utf-8", "ignore")[-2000:] or f"ffmpeg exited {self.rc}"
+        except (OSError, ValueError) as e:   # BrokenPipe = ffmpeg ล้มกลางทาง
+            self.failed = str(e)
+            if proc is not None:
+                proc.kill()
+        finally:
+            release()
+            self.done.set()
+
+
+_feeders: Dict[str, _Feeder] = {}
+_no_feed = set()        # MP4/MOV ที่ moov อยู่ท้ายไฟล์ → ป้อนผ่าน pipe ไม่ได้
+_feeders_lock = threading.Lock()
+
+
+def _ensure_feeder(upload_id: str, d: Path, meta: Dict):
+    with _feeders_lock:
+        feeder = _feeders.get(upload_id)
+        if feeder is None:
+            if upload_id in _no_feed or not (d / "0.sha256").exists():
+                return
+            with (d / "data.part").open("rb") as fh:
+                if _pipe_unfriendly(fh.read(min(meta["size"], 1 << 16))):
+                    _no_feed.add(upload_id)
+                    return
+            feeder = _feeders[upload_id] = _Feeder(d, meta)
+            feeder.thread.start()
+    feeder.wake.set()
@@ -1,18 +1,20 @@
 import os
+import json
+from collections import deque
 from functools import lru_cache
+from itertools import islice
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Callable, Optional, Iterator, Tuple
+import numpy as np
 from django.conf import settings
 from .hf_auth import hf_login_from_env
-from .ffmpeg_convert import convert_to_wav
-from .io import save_json
+from .ffmpeg_convert import convert_to_wav_cached, run_sync
+from .audio import SAMPLE_RATE, load_pcm16k, slice_pcm, to_float32
+from .segments import clean_diar_segments
+from . import cache, metrics, results, speakers, vad, workers
 
 MODEL_ID = os.getenv("PYANNOTE_MODEL_ID", "pyannote/speaker-diarization-3.1")
 
-def _run_async(coro):
-    import asyncio
-    return asyncio.run(coro)
-
 def _to_cuda_if_available(pipe):
     try:
         import torch
@@ -29,75 +31,433 @@ def _get_pipeline():
     if not token and not ok:
         raise RuntimeError("Missing HUGGINGFACE_HUB_TOKEN in .env (required for pyannote).")
     from pyannote.audio import Pipeline
-    pipe = Pipeline.from_pretrained(MODEL_ID, use_auth_token=token)
+    with metrics.span("diarize.load_model"):
+        pipe = Pipeline.from_pretrained(MODEL_ID, use_auth_token=token)
     if pipe is None: raise RuntimeError(f"Pipeline.load returned None for '{MODEL_ID}'.")
-    return _to_cuda_if_available(pipe)
+    pipe = _to_cuda_if_available(pipe)
+    apply_runtime(pipe, runtime_config())
+    return pipe
+
+# ---- Runtime (batch size / threads / int8) ------------------------------------------
+# segmentation_batch: จำนวนหน้าต่าง 10 s ที่ส่งเข้าโมเดล segmentation ต่อครั้ง
+# embedding_batch   : จำนวน (หน้าต่าง × ผู้พูด) ที่คำนวณ embedding ต่อครั้ง — ขั้นที่กินเวลามากสุดบน CPU
+# quantize          : none | embedding | all — dynamic int8 (Linear/LSTM) เฉพาะบน CPU; ผลต่างจาก fp32 เล็กน้อย
+# threads / interop_threads: torch threads ของ process (0 = อัตโนมัติ: model worker ใช้ค่าของ worker,
+#                   process ของ Django = cores // MEDIAFLOW_JOB_WORKERS กันงานพร้อมกันแย่งคอร์)
+RUNTIME_PROFILES = {
+    # batch ใหญ่ + int8 embedding — เร็วสุดบน CPU
+    "fast":   {"segmentation_batch": 32, "embedding_batch": 32, "quantize": "embedding"},
+    # batch ใหญ่ fp32
+    "mid":    {"segmentation_batch": 32, "embedding_batch": 32, "quantize": "none"},
+    # batch 1 (พฤติกรรมเดิม) — หน่วยความจำน้อยสุด
+    "lowmem": {"segmentation_batch": 1, "embedding_batch": 1, "quantize": "none"},
+}
+QUANTIZE_MODES = ("none", "embedding", "all")
+
+def tuned_runtime_path() -> Path:
+    """ผลของ manage.py mediaflow_diar_tune (ใช้เมื่อ PYANNOTE_RUNTIME_PROFILE=auto)"""
+    return Path(settings.BASE_DIR) / "data" / "diar_runtime.json"
+
+def _env_int(name: str) -> Optional[int]:
+    try:
+        return int(os.environ[name])
+    except (KeyError, ValueError):
+        return None
+
+def runtime_config(profile: Optional[str] = None) -> Dict:
+    """
+    ค่าที่ใช้จริง: profile (ที่ส่งมา → PYANNOTE_RUNTIME_PROFILE → mid; auto = ผล auto-tune ถ้ามี)
+    แล้วทับด้วย PYANNOTE_SEGMENTATION_BATCH / PYANNOTE_EMBEDDING_BATCH / PYANNOTE_QUANTIZE /
+    PYANNOTE_THREADS / PYANNOTE_INTEROP_THREADS ที่ตั้งไว้
+    """
+    name = (profile or os.getenv("PYANNOTE_RUNTIME_PROFILE") or "mid").lower().strip()
+    cfg = {**RUNTIME_PROFILES["mid"], "threads": 0, "interop_threads": 0}
+    if name == "auto":
+        try:
+            tuned = json.loads(tuned_runtime_path().read_text(encoding="utf-8"))["config"]
+            cfg.update({k: v for k, v in tuned.items() if k in cfg})
+        except (OSError, ValueError, KeyError):
+            name = "mid"
+    elif name in RUNTIME_PROFILES:
+        cfg.update(RUNTIME_PROFILES[name])
+    else:
+        name = "mid"
+    for key, env in (("segmentation_batch", "PYANNOTE_SEGMENTATION_BATCH"), ("embedding_batch", "PYANNOTE_EMBEDDING_BATCH"),
+                     ("threads", "PYANNOTE_THREADS"), ("interop_threads", "PYANNOTE_INTEROP_THREADS")):
+        v = _env_int(env)
+        if v is not None:
+            cfg[key] = max(0, v)
+    q = (os.getenv("PYANNOTE_QUANTIZE") or "").lower().strip()
+    if q in QUANTIZE_MODES:
+        cfg["quantize"] = q
+    cfg["segmentation_batch"] = max(1, int(cfg["segmentation_batch"]))
+    cfg["embedding_batch"] = max(1, int(cfg["embedding_batch"]))
+    return {"profile": name, **cfg}
+
+def _auto_threads() -> Optional[int]:
+    import multiprocessing as mp
+    if mp.parent_process() is not None:
+        return None           # model worker: threads ถูกตั้งตอนเริ่ม worker แล้ว (MEDIAFLOW_WORKER_THREADS)
+    try:
+        jobs = max(1, int(os.getenv("MEDIAFLOW_JOB_WORKERS", "1")))
+    except ValueError:
+        jobs = 1
+    return max(1, (os.cpu_count() or 1) // jobs)
+
+def _quantize(pipe, mode: str):
+    """dynamic int8 ของ Linear/LSTM — เก็บโมเดล fp32 เดิมไว้ที่ pipe._fp32_models ให้สลับกลับได้ (auto-tune)"""
+    import torch
+    orig = getattr(pipe, "_fp32_models", None)
+    if orig is None:
+        emb = getattr(pipe, "_embedding", None)
+        seg = getattr(pipe, "_segmentation", None)
+        orig = pipe._fp32_models = {
+            "embedding": (emb, "model_", getattr(emb, "model_", None)),
+            "segmentation": (seg, "model", getattr(seg, "model", None)),
+        }
+    targets = {"none": (), "embedding": ("embedding",), "all": ("embedding", "segmentation")}[mode]
+    for part, (owner, attr, model) in orig.items():
+        if owner is None or not isinstance(model, torch.nn.Module):
+            continue
+        if part in targets and next(model.parameters()).device.type == "cpu":
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear, torch.nn.LSTM}, dtype=torch.qint8)
+        setattr(owner, attr, model)
+
+def apply_runtime(pipe, cfg: Dict):
+    """ตั้ง batch size / int8 ของ pipeline และ torch threads ของ process"""
+    for attr, key in (("segmentation_batch_size", "segmentation_batch"), ("embedding_batch_size", "embedding_batch")):
+        try:
+            setattr(pipe, attr, cfg[key])
+        except Exception as e:
+            print(f"[WARN] cannot set {attr}: {e}")
+    try:
+        _quantize(pipe, cfg["quantize"])
+    except Exception as e:
+        print(f"[WARN] int8 quantization ({cfg['quantize']}) failed: {e}")
+    try:
+        import torch
+        threads = cfg.get("threads") or _auto_threads()
+        if threads:
+            torch.set_num_threads(threads)
+        if cfg.get("interop_threads"):
+            try:
+                torch.set_num_interop_threads(cfg["interop_threads"])
+            except RuntimeError:
+                pass          # ตั้งได้ครั้งเดียวก่อนเริ่มงานขนาน — worker/process ที่เริ่มแล้วใช้ค่าเดิม
+    except ImportError:
+        pass
+
+CLEAN_PARAMS = {"min_turn": 0.60, "merge_gap": 0.25, "collar": 0.05}
 
-def diarize_auto(audio_path: str | Path, *, save: bool = True) -> Dict:
-    audio_path = Path(audio_path).resolve()
+# หน้าต่างสำหรับ diarize แบบทยอยส่งผล (streaming) / ไฟล์ยาว — วินาที
+WINDOW_S = float(os.getenv("PYANNOTE_WINDOW_S", "300"))
+WINDOW_OVERLAP_S = float(os.getenv("PYANNOTE_WINDOW_OVERLAP_S", "30"))
+# ไฟล์ที่ยาวกว่านี้ diarize ทีละหน้าต่างเสมอ (ส่งทั้งไฟล์เข้า pipeline ทีเดียว หน่วยความจำโตตามความยาว) — 0 = ปิด
+WINDOWED_MIN_S = float(os.getenv("PYANNOTE_WINDOWED_MIN_S", "1800"))
+# cosine ขั้นต่ำที่ถือว่า label ของสองหน้าต่างเป็นคนเดียวกัน (ผ่อนลง SLACK ถ้าพูดทับกันในช่วง overlap ด้วย)
+STITCH_THRESHOLD = float(os.getenv("PYANNOTE_STITCH_THRESHOLD", "0.5"))
+STITCH_OVERLAP_SLACK = 0.15
 
-    conv = _run_async(convert_to_wav(audio_path, profile="mid"))
+def use_windowed(duration_s: float) -> bool:
+    return WINDOWED_MIN_S > 0 and duration_s > WINDOWED_MIN_S and duration_s > WINDOW_S
+
+def convert_for_diarization(
+    audio_path: str | Path, profile: str = "mid", progress: Optional[Callable[[str, int, int], None]] = None,
+) -> Dict:
+    conv = run_sync(convert_to_wav_cached(Path(audio_path).resolve(), profile=profile, progress=progress))
     if not conv.get("ok"):
         raise RuntimeError(f"ffmpeg failed: {conv.get('stderr','')}")
-    wav_path = Path(conv["output"]).resolve()
+    return conv
 
-    pipe = _get_pipeline()
-    try:
-        diar = pipe(str(wav_path), batch_size=1)
-    except TypeError:
-        diar = pipe(str(wav_path))
 
-    segments, speakers = [], set()
-    for turn, _, spk in diar.itertracks(yield_label=True):
-        s = str(spk); speakers.add(s)
-        segments.append({"start": round(float(turn.start), 3),
-                         "end": round(float(turn.end), 3),
-                         "speaker": s})
-    segments.sort(key=lambda x: (x["start"], x["end"]))
+def diar_cache_key(conv: Dict) -> str:
+    # แคช diarization แยกจาก .wav → เปลี่ยนแค่ค่า ASR ก็ยังใช้ผลเดิมได้
+    windows = {"window_s": WINDOW_S, "overlap_s": WINDOW_OVERLAP_S, "windowed_min_s": WINDOWED_MIN_S,
+               "stitch": STITCH_THRESHOLD}
+    # batch size/threads ไม่เปลี่ยนผล แต่ int8 / VAD เปลี่ยน
+    return cache.cache_key("diar", conv["cache_key"], MODEL_ID, CLEAN_PARAMS, windows, runtime_config()["quantize"],
+                           vad.settings())
+
+
+def diarize_auto(
+    audio_path: str | Path,
+    *,
+    save: bool = True,
+    profile: str = "mid",
+    progress: Optional[Callable[[str, int, int], None]] = None,
+    conv: Optional[Dict] = None,
+    pcm=None,
+) -> Dict:
+    """
+    conv/pcm มาจาก ingest แบบ streaming ได้ (conv["output"] อาจเป็น None = มีแต่ PCM ในหน่วยความจำ)
+    """
+    audio_path = Path(audio_path)
+    if audio_path.exists():
+        audio_path = audio_path.resolve()
 
-    segments = clean_diar_segments(segments, min_turn=0.60, merge_gap=0.25, collar=0.05)
+    if conv is None:
+        if progress: progress("convert", 0, 0)
+        conv = convert_for_diarization(audio_path, profile=profile, progress=progress)
+    wav_path = Path(conv["output"]).resolve() if conv["output"] else None
 
+    if progress: progress("diarize", 0, 0)
+    diar_key = diar_cache_key(conv)
+    segments = cache.get_json("diar", diar_key)
+    metrics.inc("cache", stage="diar", result="hit" if segments is not None else "miss")
+    if segments is None:
+        if pcm is None:
+            pcm = load_pcm16k(wav_path)
+        with metrics.span("diarize", audio_s=len(pcm) / SAMPLE_RATE):
+            segments = _run_pipeline(wav_path, pcm=pcm, audio_key=conv["cache_key"])
+        cache.put_json("diar", diar_key, segments)
+
+    return diar_result(audio_path, conv, segments, save=save, pcm=pcm)
+
+def diar_result(audio_path: Path, conv: Dict, segments: List[Dict], *, save: bool = True, pcm=None) -> Dict:
+    """
+    segments ในแคชเป็น label ของไฟล์ (SPEAKER_xx) เสมอ — ชื่อคนที่ลงทะเบียนไว้เติมตรงนี้ทุกครั้ง
+    (ลงทะเบียนเพิ่มภายหลังก็ได้ผลทันทีโดยไม่ต้อง diarize ใหม่)
+    """
+    wav = conv["output"]
+    segments, matched = speakers.identify(segments, conv["cache_key"], wav_path=wav, pcm=pcm)
     result = {
-        "wav": str(wav_path),
+        "wav": str(Path(conv["output"]).resolve()) if conv["output"] else None,
         "segments": segments,
         "speakers_count": len({s["speaker"] for s in segments}),
-        "profile": "mid",
+        "profile": conv["profile"],
         "model": MODEL_ID,
         "source": str(audio_path),
+        "audio_key": conv["cache_key"],
+        "speakers": matched,
     }
+    tr = metrics.current()
+    if tr is not None:
+        result["metrics"] = tr.summary()
     if save:
-        result["json_path"] = save_json(result, base_name=audio_path.name, tag="diar", subdir="diar")
+        saved = results.save(result, "diar")
+        result["result_id"], result["result_path"] = saved["id"], saved["path"]
     return result
 
-def clean_diar_segments(segs: List[Dict], min_turn=0.50, merge_gap=0.20, collar=0.05) -> List[Dict]:
-    if not segs: return []
-    segs = sorted(segs, key=lambda x: (x["start"], x["end"]))
-    merged = []
-    for s in segs:
-        if not merged: merged.append(dict(s)); continue
-        last = merged[-1]
-        if s["speaker"] == last["speaker"] and s["start"] - last["end"] <= merge_gap:
-            last["end"] = max(last["end"], s["end"])
-        else:
-            merged.append(dict(s))
-    for i, s in enumerate(merged):
-        s["start"] = max(0.0, s["start"] - collar)
-        s["end"]   = s["end"] + collar
-        if i > 0: s["start"] = max(s["start"], merged[i-1]["end"])
-    i = 1
-    while 0 < i < len(merged)-1:
-        prev, cur, nxt = merged[i-1], merged[i], merged[i+1]
-        if (cur["end"] - cur["start"]) < min_turn and prev["speaker"] == nxt["speaker"] != cur["speaker"]:
-            prev["end"] = nxt["end"]; merged.pop(i+1); merged.pop(i); i -= 1
-        else: i += 1
-    cleaned = []
-    for s in merged:
-        if not cleaned: cleaned.append(s); continue
-        last = cleaned[-1]; gap = s["start"] - last["end"]
-        if s["speaker"] == last["speaker"] or gap <= merge_gap:
-            last["end"] = max(last["end"], s["end"])
-        else: cleaned.append(s)
-    for s in cleaned:
-        s["start"] = round(float(s["start"]), 3)
-        s["end"]   = round(float(s["end"]), 3)
-    return cleaned
+def _run_pipeline(wav_path: Optional[Path], pcm=None, audio_key: Optional[str] = None) -> List[Dict]:
+    """
+    diarize เฉพาะช่วงที่มีเสียงพูด (vad.compacted) แล้วแปลงเวลากลับเป็นเวลาของไฟล์เดิม
+    segment ที่คร่อมช่วงเงียบที่ถูกตัดจะถูกแยกเป็นชิ้น → ASR ไม่ต้องถอดช่วงเงียบนั้น
+    """
+    if pcm is None and wav_path is not None:
+        pcm = load_pcm16k(wav_path)
+    with vad.compacted(wav_path, pcm, audio_key) as (wav_c, pcm_c, tmap):
+        if tmap is None:
+            return _run_pipeline_audio(wav_path, pcm)
+        if len(pcm_c) == 0:
+            return []
+        return tmap.segments_to_original(_run_pipeline_audio(wav_c, pcm_c))
+
+def _run_pipeline_audio(wav_path: Optional[Path], pcm) -> List[Dict]:
+    if use_windowed(len(pcm) / SAMPLE_RATE):
+        return _run_pipeline_windowed(wav_path, pcm)
+    if wav_path is None:
+        # ingest แบบ streaming ที่ไม่ได้เขียน .wav → diarize จาก PCM ในหน่วยความจำ (worker process อ่านได้แค่ไฟล์)
+        segments = _diarize_array(_get_pipeline(), to_float32(pcm), 0.0)
+        return clean_diar_segments(segments, **CLEAN_PARAMS)
+    if workers.enabled():
+        return workers.diarize(wav_path)
+    return _run_pipeline_local(wav_path)
+
+def _run_pipeline_local(wav_path: Path) -> List[Dict]:
+    pipe = _get_pipeline()
+    diar = pipe(str(wav_path))
+
+    segments, speakers = [], set()
+    for turn, _, spk in diar.itertracks(yield_label=True):
+        s = str(spk); speakers.add(s)
+        segments.append({"start": round(float(turn.start), 3),
+                         "end": round(float(turn.end), 3),
+                         "speaker": s})
+    segments.sort(key=lambda x: (x["start"], x["end"]))
+
+    return clean_diar_segments(segments, **CLEAN_PARAMS)
+
+# ---- Windowed diarization (ทยอยส่งผลทีละหน้าต่าง) ------------------------------
+def _diarize_array(pipe, x, offset: float) -> List[Dict]:
+    """diarize waveform ในหน่วยความจำ แล้วเลื่อนเวลาตาม offset ของหน้าต่าง"""
+    import torch
+    inp = {"waveform": torch.from_numpy(x[None, :]), "sample_rate": SAMPLE_RATE}
+    diar = pipe(inp)
+    segs = [{"start": round(offset + float(turn.start), 3),
+             "end": round(offset + float(turn.end), 3),
+             "speaker": str(spk)}
+            for turn, _, spk in diar.itertracks(yield_label=True)]
+    segs.sort(key=lambda x: (x["start"], x["end"]))
+    return segs
+
+_embed_warned: List[bool] = []
+
+def _diarize_window(pipe, pcm, w0: float, w1: float) -> Tuple[List[Dict], Dict[str, List[float]]]:
+    """diarize หนึ่งหน้าต่าง + embedding ต่อ label (ใช้เชื่อม label ข้ามหน้าต่าง; คำนวณไม่ได้ → {})"""
+    local = _diarize_array(pipe, to_float32(slice_pcm(pcm, w0, w1 - w0)), w0)
+    try:
+        embs = speakers.embed_speakers_local(pcm, local)
+    except Exception as e:
+        if not _embed_warned:
+            _embed_warned.append(True)
+            print(f"[WARN] window embeddings unavailable, stitching by overlap only: {e}")
+        embs = {}
+    return local, embs
+
+def _overlap_scores(prev: List[Dict], cur: List[Dict], lo: float, hi: float) -> Dict[tuple, float]:
+    """เวลาที่ label ของหน้าต่างใหม่ (loc) พูดทับกับ label เดิม (glob) ในช่วง overlap [lo, hi)"""
+    score: Dict[tuple, float] = {}
+    for a in cur:
+        a0, a1 = max(a["start"], lo), min(a["end"], hi)
+        if a1 <= a0:
+            continue
+        for b in prev:
+            ov = min(a1, b["end"]) - max(a0, b["start"])
+            if ov > 0:
+                k = (a["speaker"], b["speaker"])
+                score[k] = score.get(k, 0.0) + ov
+    return score
+
+class _Stitcher:
+    """
+    เชื่อม label ของแต่ละหน้าต่างเป็น label เดียวกันทั้งไฟล์ (online clustering)
+    - แต่ละ label ทั้งไฟล์เก็บ centroid ของ embedding (ถ่วงตามเวลาพูด) — label ในหน้าต่างใหม่ไปอยู่กับ
+      centroid ที่ cosine ≥ STITCH_THRESHOLD (หนึ่งต่อหนึ่ง, คู่ที่คล้ายสุดก่อน) → คนที่หายไปหลายหน้าต่างแล้วกลับมาก็ยังเป็นคนเดิม
+    - เวลาที่พูดทับกันในช่วง overlap เป็นหลักฐานเสริม และใช้แทนเมื่อ label นั้นไม่มี embedding (พูดสั้นเกิน)
+    - ที่เหลือ → label ใหม่
+    เก็บแค่ centroid ต่อคน → หน่วยความจำไม่โตตามความยาวไฟล์
+    """
+
+    def __init__(self, threshold: float = None):
+        self.threshold = STITCH_THRESHOLD if threshold is None else threshold
+        self.centroids: Dict[str, np.ndarray] = {}
+        self.known: List[str] = []
+
+    def _new_label(self) -> str:
+        n = len(self.known)
+        while f"SPEAKER_{n:02d}" in self.known:
+            n += 1
+        return f"SPEAKER_{n:02d}"
+
+    def assign(self, prev: List[Dict], cur: List[Dict], embs: Dict[str, List[float]], lo: float, hi: float) -> Dict[str, str]:
+        overlap = _overlap_scores(prev, cur, lo, hi)
+        locs = sorted({a["speaker"] for a in cur})
+        cands = []
+        for loc in locs:
+            e = np.asarray(embs[loc], dtype=np.float32) if loc in embs else None
+            for glob in self.known:
+                ov = overlap.get((loc, glob), 0.0)
+                c = self.centroids.get(glob)
+                sim = float(e @ c / (np.linalg.norm(c) or 1.0)) if e is not None and c is not None else None
+                ok = (sim is not None and sim >= self.threshold) or \
+                     (ov >= 1.0 and (sim is None or sim >= self.threshold - STITCH_OVERLAP_SLACK))
+                if ok:
+                    cands.append(((sim or 0.0) + min(ov, 5.0) / 10.0, loc, glob))
+
+        mapping: Dict[str, str] = {}
+        used = set()
+        for _, loc, glob in sorted(cands, reverse=True):
+            if loc not in mapping and glob not in used:
+                mapping[loc] = glob; used.add(glob)
+        for loc in locs:
+            if loc not in mapping:
+                mapping[loc] = self._new_label()
+                self.known.append(mapping[loc])
+
+        # อัปเดต centroid (ผลรวม embedding × เวลาพูดในหน้าต่างนี้)
+        dur: Dict[str, float] = {}
+        for a in cur:
+            dur[a["speaker"]] = dur.get(a["speaker"], 0.0) + (a["end"] - a["start"])
+        for loc, glob in mapping.items():
+            if loc in embs:
+                v = np.asarray(embs[loc], dtype=np.float32) * dur.get(loc, 1.0)
+                self.centroids[glob] = v if glob not in self.centroids else self.centroids[glob] + v
+        return mapping
+
+def window_ranges(total: float, window_s: float = WINDOW_S, overlap_s: float = WINDOW_OVERLAP_S) -> List[Tuple[float, float]]:
+    step = max(1.0, window_s - overlap_s)
+    out, w0 = [], 0.0
+    while True:
+        w1 = min(total, w0 + window_s)
+        out.append((w0, w1))
+        if w1 >= total:
+            return out
+        w0 += step
+
+def _window_results(wav_path, pcm, ranges) -> Iterator[Tuple[List[Dict], Dict[str, List[float]]]]:
+    """ผลทีละหน้าต่างตามลำดับ — มี model workers → ส่งล่วงหน้าไว้เท่าจำนวน worker ให้รันขนานกัน"""
+    if workers.enabled() and wav_path is not None:
+        ahead = max(1, workers.num_workers())
+        futs = deque()
+        it = iter(ranges)
+        for w0, w1 in islice(it, ahead):
+            futs.append(workers.submit_diarize_window(wav_path, w0, w1))
+        while futs:
+            res = futs.popleft().result()
+            nxt = next(it, None)
+            if nxt is not None:
+                futs.append(workers.submit_diarize_window(wav_path, *nxt))
+            yield res
+        return
+    pipe = _get_pipeline()
+    for w0, w1 in ranges:
+        yield _diarize_window(pipe, pcm, w0, w1)
+
+def diarize_windows(
+    wav_path: str | Path,
+    window_s: float = WINDOW_S,
+    overlap_s: float = WINDOW_OVERLAP_S,
+    pcm=None,
+    audio_key: Optional[str] = None,
+) -> Iterator[Tuple[float, List[Dict]]]:
+    """
+    diarize ทีละหน้าต่าง (ซ้อนกัน overlap_s) แล้ว yield (commit_until, segments)
+    - segments ครอบคลุมเฉพาะช่วงที่หน้าต่างนี้ "เป็นเจ้าของ" (ถึงกลาง overlap กับหน้าต่างถัดไป)
+      และจะไม่ถูกแก้อีก → ส่งต่อให้ ASR ได้ทันที
+    - label ผู้พูดต่อเนื่องข้ามหน้าต่างด้วย _Stitcher (embedding + เวลาที่ทับกันในช่วง overlap)
+    - ใช้หน่วยความจำเท่ากับหน้าต่างเดียว ไม่ว่าไฟล์จะยาวแค่ไหน (PCM เป็น memmap, ตัดเฉพาะหน้าต่างที่ใช้)
+    - หน้าต่างนับบนเสียงที่ตัดช่วงเงียบแล้ว (vad); commit_until / segments เป็นเวลาของไฟล์เดิม
+    """
+    if pcm is None:
+        pcm = load_pcm16k(wav_path)
+    with vad.compacted(Path(wav_path) if wav_path else None, pcm, audio_key) as (wav_c, pcm_c, tmap):
+        if tmap is None:
+            yield from _diarize_windows(wav_path, pcm, window_s, overlap_s)
+            return
+        if len(pcm_c) == 0:
+            yield len(pcm) / SAMPLE_RATE, []
+            return
+        end_c = len(pcm_c) / SAMPLE_RATE
+        for commit, own in _diarize_windows(wav_c, pcm_c, window_s, overlap_s):
+            # หน้าต่างสุดท้าย → ถึงท้ายไฟล์เดิม (ช่วงเงียบท้ายไฟล์ไม่อยู่ใน compact)
+            yield (tmap.total_s if commit >= end_c else tmap.to_original(commit)), tmap.segments_to_original(own)
+
+def _diarize_windows(wav_path, pcm, window_s: float, overlap_s: float) -> Iterator[Tuple[float, List[Dict]]]:
+    total = len(pcm) / SAMPLE_RATE
+    ranges = window_ranges(total, window_s, overlap_s)
+    stitcher = _Stitcher()
+
+    prev: List[Dict] = []
+    prev_end = 0.0
+    committed = 0.0
+    results = _window_results(wav_path, pcm, ranges)
+    for k, (w0, w1) in enumerate(ranges):
+        with metrics.span("diarize.window", audio_s=w1 - w0):
+            local, embs = next(results)
+        mapping = stitcher.assign(prev, local, embs, w0, prev_end)
+        cur = [{**s, "speaker": mapping[s["speaker"]]} for s in local]
+
+        last = k == len(ranges) - 1
+        commit = total if last else w1 - overlap_s / 2
+        own = []
+        for s in cur:
+            a, b = max(s["start"], committed), (s["end"] if last else min(s["end"], commit))
+            if b > a:
+                own.append({**s, "start": round(a, 3), "end": round(b, 3)})
+        yield commit, own
+        prev, prev_end, committed = cur, w1, commit
+
+def _run_pipeline_windowed(wav_path: Optional[Path], pcm) -> List[Dict]:
+    """ไฟล์ยาว: diarize ทีละหน้าต่างแล้วรวม (หน่วยความจำคงที่) แทนการส่งทั้งไฟล์เข้า pipeline ครั้งเดียว"""
+    segments = [s for _, own in _diarize_windows(wav_path, pcm, WINDOW_S, WINDOW_OVERLAP_S) for s in own]
+    return clean_diar_segments(segments, **CLEAN_PARAMS)
@@ -1,41 +1,327 @@
-import asyncio, shlex, uuid
+import asyncio, contextlib, math, os, shutil, threading, uuid, wave
+from concurrent.futures import Future
 from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
 from django.conf import settings
 
+from .audio import SAMPLE_RATE
+
 FFMPEG = "ffmpeg"
+FFPROBE = "ffprobe"
 
 AUDIO_FILTERS = {
     "fast": 'highpass=f=60,lowpass=f=7900,afftdn=nr=12:nt=w:om=o,dynaudnorm=f=180:g=15,loudnorm=I=-17:TP=-1.5:LRA=11,apad=pad_dur=0.2',
     "mid":  'highpass=f=70,lowpass=f=7800,afftdn=nr=16:nt=w:om=o,dynaudnorm=f=180:g=12,loudnorm=I=-17:TP=-1.5:LRA=10,apad=pad_dur=0.2',
     "max":  'highpass=f=70,lowpass=f=7600,afftdn=nr=22:nt=w:om=o,dynaudnorm=f=200:g=12,loudnorm=I=-18:TP=-2.0:LRA=9,apad=pad_dur=0.2',
 }
+APAD = ",apad=pad_dur=0.2"
+
+# ---- Scheduler ------------------------------------------------------------------
+# ffmpeg ทุกตัวใน process นี้วิ่งบน event loop เดียว (thread พื้นหลัง) ภายใต้ semaphore
+# - MEDIAFLOW_FFMPEG_JOBS = จำนวน ffmpeg พร้อมกันสูงสุด (default = จำนวนคอร์) — งานที่เกินรอคิว
+# - convert_to_wav await ได้จาก loop ไหนก็ได้ (ส่งไปรันบน loop ของ scheduler ให้เอง)
+# - โค้ด sync ใช้ run_sync(...) แทน asyncio.run, ส่วนที่เปิด ffmpeg เอง (ingest/load_pcm) ใช้ ffmpeg_slot()
+# - ไฟล์ยาวกว่า MEDIAFLOW_FFMPEG_SPLIT_S → แบ่งเป็นช่วงเวลา แปลงขนานกันแล้วต่อ PCM (0 = ไม่แบ่ง)
+#   แต่ละช่วงแปลงเกินขอบไป SPLIT_PAD_S ทั้งสองข้างให้ filter (afftdn/dynaudnorm/loudnorm) ตั้งตัวได้ แล้วตัดทิ้งตอนต่อ
+
+SPLIT_PAD_S = 5.0
+SPLIT_MIN_PART_S = 120.0
+
+# progress(stage, done, total) — ขั้น convert: done/total = วินาทีของเสียง
+ProgressFn = Callable[[str, int, int], None]
+
+
+def _env_num(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def max_jobs() -> int:
+    n = int(_env_num("MEDIAFLOW_FFMPEG_JOBS", 0))
+    return n if n > 0 else (os.cpu_count() or 1)
+
+
+class _Scheduler:
+    def __init__(self, jobs: int):
+        self.jobs = jobs
+        self.loop = asyncio.new_event_loop()
+        self.sem: Optional[asyncio.Semaphore] = None
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.sem = asyncio.Semaphore(jobs)
+            ready.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run, name="mediaflow-ffmpeg", daemon=True)
+        self.thread.start()
+        ready.wait()
+
+    def submit(self, coro) -> Future:
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+
+_sched: Optional[_Scheduler] = None
+_sched_lock = threading.Lock()
+
+
+def scheduler() -> _Scheduler:
+    global _sched
+    with _sched_lock:
+        if _sched is None:
+            _sched = _Scheduler(max_jobs())
+    return _sched
+
+
+def _reset_after_fork():
+    # thread ของ loop ไม่ตามไปใน process ลูก → สร้างใหม่เมื่อเรียกใช้ครั้งแรก
+    global _sched, _sched_lock
+    _sched, _sched_lock = None, threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def run_sync(coro):
+    """รัน coroutine บน loop ของ scheduler แล้วรอผล (แทน asyncio.run ในโค้ด sync)"""
+    s = scheduler()
+    if threading.current_thread() is s.thread:
+        raise RuntimeError("run_sync() called from the ffmpeg scheduler loop")
+    return s.submit(coro).result()
+
+
+async def _on_scheduler(coro):
+    s = scheduler()
+    if asyncio.get_running_loop() is s.loop:
+        return await coro
+    return await asyncio.wrap_future(s.submit(coro))
+
+
+@contextlib.contextmanager
+def ffmpeg_slot():
+    """จองที่ของ ffmpeg หนึ่งตัว (โค้ด sync ที่เปิด ffmpeg เอง) — รอคิวเดียวกับ convert_to_wav"""
+    release = acquire_slot()
+    try:
+        yield
+    finally:
+        release()
+
+
+def acquire_slot() -> Callable[[], None]:
+    """เหมือน ffmpeg_slot แต่คืนฟังก์ชันปล่อย (ใช้ข้าม callback เช่น upload handler)"""
+    s = scheduler()
+    s.submit(s.sem.acquire()).result()
+    return lambda: s.loop.call_soon_threadsafe(s.sem.release)
+
+
+async def _ffmpeg(args: List[str], on_time: Optional[Callable[[float], None]] = None) -> Tuple[int, str]:
+    """ffmpeg หนึ่ง process ภายใต้ semaphore (ต้องรันบน loop ของ scheduler); -progress → on_time(วินาที)"""
+    async with scheduler().sem:
+        proc = await asyncio.create_subprocess_exec(
+            FFMPEG, "-hide_banner", "-nostats", "-progress", "pipe:1", *args,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+
+        async def read_progress():
+            # key=value ทีละบรรทัด; out_time_ms ของ ffmpeg รุ่นเก่าเป็นไมโครวินาทีเหมือน out_time_us
+            # on_time รันนอก loop (to_thread) — callback อาจเขียน DB (jobs) ซึ่ง Django ห้ามทำใน async context
+            async for line in proc.stdout:
+                k, _, v = line.decode("ascii", "ignore").strip().partition("=")
+                if on_time and k in ("out_time_us", "out_time_ms") and v.isdigit():
+                    await asyncio.to_thread(on_time, int(v) / 1e6)
+
+        err, _ = await asyncio.gather(proc.stderr.read(), read_progress())
+        await proc.wait()
+    return proc.returncode, err.decode("utf-8", "ignore")
+
+
+async def probe_duration(inp: Path) -> Optional[float]:
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            FFPROBE, "-v", "error", "-show_entries", "format=duration", "-of", "default=nw=1:nk=1", str(inp),
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+        )
+        out, _ = await proc.communicate()
+        return float(out.decode().strip()) if proc.returncode == 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def split_ranges(duration: Optional[float]) -> List[Tuple[float, Optional[float]]]:
+    """[(t0, t1)] ที่จะแปลงขนานกัน — ช่วงสุดท้าย t1 = None (ถึงท้ายไฟล์)"""
+    split_s = _env_num("MEDIAFLOW_FFMPEG_SPLIT_S", 600)
+    if not duration or split_s <= 0 or duration <= split_s:
+        return [(0.0, None)]
+    n = min(scheduler().jobs, math.ceil(duration / SPLIT_MIN_PART_S))
+    if n < 2:
+        return [(0.0, None)]
+    # ขอบช่วงเป็นวินาทีเต็ม → -ss/-t ตรงกับจำนวน sample ที่ตัดตอนต่อพอดี
+    step = float(math.ceil(duration / n))
+    return [(i * step, (i + 1) * step if i < n - 1 else None) for i in range(n)]
+
 
 def _safe_stem(p: Path) -> str:
     s = p.stem.strip().replace(" ", "_")
     return s[:80] or uuid.uuid4().hex[:8]
 
-async def convert_to_wav(input_path, out_dir=None, profile="mid"):
+
+def _filter(profile: str, last: bool = True) -> str:
+    af = AUDIO_FILTERS.get(profile, AUDIO_FILTERS["mid"])
+    return af if last else af.replace(APAD, "")
+
+
+async def _convert_split(inp: Path, out_wav: Path, profile: str, ranges, on_time) -> Tuple[bool, str]:
+    tmp = out_wav.with_name(f".{out_wav.stem}.{uuid.uuid4().hex[:8]}.parts")
+    tmp.mkdir(parents=True, exist_ok=True)
+    done = [0.0] * len(ranges)
+
+    def part_time(i):
+        def f(t):
+            done[i] = t
+            if on_time:
+                on_time(sum(done))
+        return f
+
+    async def part(i, t0, t1):
+        pre = min(SPLIT_PAD_S, t0)
+        args = ["-y", "-ss", f"{t0 - pre:.3f}"]
+        if t1 is not None:
+            args += ["-t", f"{t1 - t0 + pre + SPLIT_PAD_S:.3f}"]
+        args += [
+            "-i", str(inp), "-ac", "1", "-ar", str(SAMPLE_RATE), "-vn", "-sn", "-dn",
+            "-af", _filter(profile, last=t1 is None), "-f", "s16le", "-c:a", "pcm_s16le", str(tmp / f"{i:03d}.raw"),
+        ]
+        return await _ffmpeg(args, part_time(i))
+
+    try:
+        results = await asyncio.gather(*(part(i, t0, t1) for i, (t0, t1) in enumerate(ranges)))
+        errors = [err for rc, err in results if rc != 0]
+        if errors:
+            return False, "\n".join(errors)
+        await asyncio.to_thread(_concat_parts, tmp, out_wav, ranges)
+        return True, ""
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _concat_parts(tmp: Path, out_wav: Path, ranges):
+    """ตัดส่วนเกินขอบ (pre-roll/post-roll) ของแต่ละช่วงทิ้งแล้วต่อเป็น .wav ไฟล์เดียว"""
+    # ชื่อชั่วคราวไม่ซ้ำ — สองงานที่แปลงไฟล์ชื่อ (stem) เดียวกันพร้อมกันจะไม่เขียนทับไฟล์ของกันและกัน
+    part_wav = out_wav.with_name(f".{out_wav.name}.{uuid.uuid4().hex[:8]}.tmp")
+    with wave.open(str(part_wav), "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        for i, (t0, t1) in enumerate(ranges):
+            pcm = np.fromfile(tmp / f"{i:03d}.raw", dtype="<i2")
+            skip = round(min(SPLIT_PAD_S, t0) * SAMPLE_RATE)
+            keep = round((t1 - t0) * SAMPLE_RATE) if t1 is not None else None
+            w.writeframes(pcm[skip:None if keep is None else skip + keep].tobytes())
+    os.replace(part_wav, out_wav)
+
+
+async def _convert(
+    inp: Path, out_wav: Path, profile: str, progress: Optional[ProgressFn], duration: Optional[float] = None,
+) -> Tuple[bool, str]:
+    if duration is None:
+        duration = await probe_duration(inp)
+    total = int(duration or 0)
+
+    def on_time(t: float):
+        if progress:
+            progress("convert", min(int(t), total) if total else int(t), total)
+
+    ranges = split_ranges(duration)
+    if len(ranges) > 1:
+        return await _convert_split(inp, out_wav, profile, ranges, on_time)
+    # เขียนไฟล์ชั่วคราวแล้ว rename — out_wav อาจเป็น hardlink ของไฟล์ในแคช (convert_to_wav_cached)
+    # ถ้า ffmpeg เขียนทับตรงๆ จะ truncate inode เดียวกัน แล้วแคชของไฟล์อื่นกลายเป็นเสียงนี้
+    part_wav = out_wav.with_name(f".{out_wav.name}.{os.getpid()}.part.wav")
+    rc, err = await _ffmpeg([
+        "-y", "-i", str(inp), "-ac", "1", "-ar", str(SAMPLE_RATE), "-vn", "-sn", "-dn",
+        "-af", _filter(profile), "-c:a", "pcm_s16le", str(part_wav),
+    ], on_time)
+    if rc == 0:
+        os.replace(part_wav, out_wav)
+    else:
+        part_wav.unlink(missing_ok=True)
+    return rc == 0, err
+
+
+async def convert_to_wav(
+    input_path, out_dir=None, profile="mid", progress: Optional[ProgressFn] = None, duration: Optional[float] = None,
+):
+    """
+    แปลงเป็น .wav pcm_s16le 16 kHz mono ผ่าน scheduler (จำกัดจำนวน ffmpeg พร้อมกัน, แบ่งไฟล์ยาว)
+    progress("convert", วินาทีที่แปลงแล้ว, ความยาวทั้งหมด) ถูกเรียกจาก worker thread (ไม่ใช่ loop ของ scheduler)
+    duration: ความยาวที่ probe ไว้แล้ว (ไม่ส่ง = probe เอง) — กำหนดการแบ่งช่วง (split_ranges)
+    """
     inp = Path(input_path).resolve()
     out_base = Path(out_dir) if out_dir else settings.CONVERTED_ROOT
     out_base.mkdir(parents=True, exist_ok=True)
     out_wav = out_base / f"{_safe_stem(inp)}.wav"
+    prof = profile if profile in AUDIO_FILTERS else "mid"
 
-    af = AUDIO_FILTERS.get(profile, AUDIO_FILTERS["mid"])
-
-    cmd = (
-        f'ffmpeg -hide_banner -y -i "{inp}" -ac 1 -ar 16000 -vn -sn -dn '
-        f'-af "{af}" -c:a pcm_s16le "{out_wav}"'
-    )
-    proc = await asyncio.create_subprocess_exec(
-        *shlex.split(cmd),
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-    )
-    _, err = await proc.communicate()
+    ok, err = await _on_scheduler(_convert(inp, out_wav, prof, progress, duration))
     return {
-        "ok": proc.returncode == 0,
+        "ok": ok,
         "input": str(inp),
         "output": str(out_wav),
-        "stderr": err.decode("utf-8", "ignore"),
-        "profile": profile if profile in AUDIO_FILTERS else "mid",
+        "stderr": err,
+        "profile": prof,
     }
+
+
+def wav_cache_key(digest: str, profile: str, ranges=None) -> str:
+    """
+    key แคชของ .wav = hash ไฟล์ต้นฉบับ + filter chain (+ การแบ่งช่วง ถ้าแปลงแบบแบ่ง)
+    afftdn/dynaudnorm/loudnorm ทำงานแยกต่อช่วง → ไบต์ต่างจากแปลงรวดเดียว จึงแยก key ตาม split_ranges
+    แปลงรวดเดียว (ranges ช่วงเดียว / None) ใช้ key ร่วมกับ ingest แบบ streaming และ pre-conversion ของ chunked
+    """
+    prof = profile if profile in AUDIO_FILTERS else "mid"
+    from . import cache
+    parts = ["wav", digest, AUDIO_FILTERS[prof], "pcm_s16le/16000/mono"]
+    if ranges and len(ranges) > 1:
+        parts.append({"split": [list(r) for r in ranges], "pad_s": SPLIT_PAD_S})
+    return cache.cache_key(*parts)
+
+
+async def convert_to_wav_cached(input_path, out_dir=None, profile="mid", digest=None, progress: Optional[ProgressFn] = None):
+    """
+    convert_to_wav + แคชตาม hash ไฟล์ต้นฉบับ, filter chain ของ profile และการแบ่งช่วง (wav_cache_key)
+    - hit → วาง .wav จากแคชไว้ที่ out_dir เลย ไม่ต้องรัน ffmpeg
+    - คืน dict เดียวกับ convert_to_wav + "cache_key", "cached"
+    """
+    from . import cache, metrics
+
+    inp = Path(input_path).resolve()
+    prof = profile if profile in AUDIO_FILTERS else "mid"
+    digest = digest or await asyncio.to_thread(cache.file_digest, inp)
+    # ผลแปลงรวดเดียว (จาก ingest / ไฟล์สั้น) ใช้ได้เสมอ → ลองก่อนโดยไม่ต้อง probe
+    # ไม่มี → probe ความยาว แล้วใช้ key ตามการแบ่งช่วงจริง (แต่ละ key มีไบต์แบบเดียวเสมอ)
+    key = wav_cache_key(digest, prof)
+    hit = cache.get_file("wav", key, ".wav")
+    duration = None
+    if hit is None:
+        duration = await _on_scheduler(probe_duration(inp))
+        key = wav_cache_key(digest, prof, split_ranges(duration))
+        hit = cache.get_file("wav", key, ".wav")
+    metrics.inc("cache", stage="wav", result="hit" if hit is not None else "miss")
+    if hit is not None:
+        out_base = Path(out_dir) if out_dir else settings.CONVERTED_ROOT
+        out_wav = cache.link_or_copy(hit, out_base / f"{_safe_stem(inp)}.wav")
+        return {"ok": True, "input": str(inp), "output": str(out_wav), "stderr": "",
+                "profile": prof, "cache_key": key, "cached": True}
+
+    with metrics.span("convert", profile=prof):
+        res = await convert_to_wav(inp, out_dir=out_dir, profile=prof, progress=progress, duration=duration)
+    if res["ok"]:
+        cache.put_file("wav", key, res["output"], ".wav")
+    return {**res, "cache_key": key, "cached": False}
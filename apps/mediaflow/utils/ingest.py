@@ -0,0 +1,225 @@
+import os
+import hashlib
+import subprocess
+import threading
+import weakref
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+
+from .audio import SAMPLE_RATE, write_wav_pcm16k
+from .ffmpeg_convert import AUDIO_FILTERS, FFMPEG, _safe_stem, acquire_slot, wav_cache_key
+from .io import save_upload
+from . import metrics
+
+# Streaming ingest: ส่ง chunk ที่อัปโหลดเข้า stdin ของ ffmpeg ทันทีที่มาถึง แล้วอ่าน PCM จาก stdout
+# - ไม่ต้องรอให้อัปโหลดครบก่อนเริ่มแปลง และไม่เขียนไฟล์ต้นฉบับลง MEDIA_ROOT
+# - hash ไฟล์ต้นฉบับระหว่างทาง → ใช้ key แคช .wav เดียวกับ convert_to_wav_cached
+# - เขียน .wav ลงดิสก์เฉพาะตอนเก็บเข้าแคช (หรือเมื่อ job/model worker ต้องอ่านจากไฟล์)
+# - MP4/MOV ที่ moov อยู่ท้ายไฟล์อ่านผ่าน pipe ไม่ได้ → ตกไปใช้ handler ปกติ (เขียนลงดิสก์) ให้เอง
+# - MEDIAFLOW_STREAM_UPLOADS=0 → ปิด ใช้ save_upload แบบเดิมทั้งหมด
+# - ffmpeg ของ upload นับรวมใน MEDIAFLOW_FFMPEG_JOBS (รอคิวก่อนเริ่มถ้าเต็ม)
+
+FIELD_NAME = "file"
+
+
+def enabled() -> bool:
+    return os.getenv("MEDIAFLOW_STREAM_UPLOADS", "1") not in ("0", "false", "False", "")
+
+
+def _pipe_unfriendly(head: bytes) -> bool:
+    """ISO-BMFF (mp4/m4a/mov) ที่ยังไม่เจอ moov ใน chunk แรก = moov อยู่ท้ายไฟล์ ต้อง seek"""
+    return head[4:8] == b"ftyp" and b"moov" not in head
+
+
+class DecodedUpload(UploadedFile):
+    """ผลของ FFmpegIngestHandler: ไม่มีเนื้อไฟล์ต้นฉบับ มีแต่ PCM 16 kHz ที่ถอดแล้ว"""
+
+    def __init__(self, name, size, content_type, charset, *, pcm, digest, profile, ok, stderr):
+        super().__init__(file=None, name=name, content_type=content_type, size=size, charset=charset)
+        self.pcm = pcm
+        self.digest = digest
+        self.profile = profile
+        self.ok = ok
+        self.stderr = stderr
+
+    def open(self, mode=None):
+        raise ValueError("DecodedUpload has no source bytes (streamed straight into ffmpeg)")
+
+    def chunks(self, chunk_size=None):
+        raise ValueError("DecodedUpload has no source bytes (streamed straight into ffmpeg)")
+
+
+class FFmpegIngestHandler(FileUploadHandler):
+    """
+    upload handler ที่ต่อ ffmpeg ตรงกับ request body
+    ต้องติดตั้งก่อนแตะ request.POST / request.FILES (ดู install) — view ต้องเป็น csrf_exempt
+    """
+
+    def __init__(self, request=None, profile: str = "mid"):
+        super().__init__(request)
+        self.profile = profile if profile in AUDIO_FILTERS else "mid"
+        self.proc: Optional[subprocess.Popen] = None
+        self.active = False
+        self.decided = False
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self.active = field_name == FIELD_NAME
+        self.decided = False
+
+    def _start(self) -> bool:
+        release = acquire_slot()
+        cmd = [
+            FFMPEG, "-hide_banner", "-y", "-i", "pipe:0",
+            "-ac", "1", "-ar", str(SAMPLE_RATE), "-vn", "-sn", "-dn",
+            "-af", AUDIO_FILTERS[self.profile], "-f", "s16le", "-c:a", "pcm_s16le", "pipe:1",
+        ]
+        try:
+            self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError:
+            release()
+            return False
+        # Django ไม่เรียก handler เลยถ้า request ล้มกลางทาง (เช่น client หลุด) → ปล่อยที่/ฆ่า ffmpeg ตอน GC
+        self._cleanup = weakref.finalize(self, _cleanup, self.proc, release)
+        self.pcm = bytearray()
+        self.err = bytearray()
+        self.sha = hashlib.sha256()
+        self.readers = [
+            threading.Thread(target=self._drain, args=(self.proc.stdout, self.pcm), daemon=True),
+            threading.Thread(target=self._drain, args=(self.proc.stderr, self.err), daemon=True),
+        ]
+        for t in self.readers:
+            t.start()
+        return True
+
+    @staticmethod
+    def _drain(stream, buf: bytearray):
+        for block in iter(lambda: stream.read(1 << 16), b""):
+            buf += block
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+        if not self.decided:
+            self.decided = True
+            self.active = not _pipe_unfriendly(raw_data[:1 << 16]) and self._start()
+            if not self.active:
+                return raw_data
+        self.sha.update(raw_data)
+        try:
+            self.proc.stdin.write(raw_data)
+        except (BrokenPipeError, OSError):
+            pass  # ffmpeg ล้มกลางทาง → รายงานจาก stderr ตอน file_complete
+        return None
+
+    def _finish_proc(self) -> int:
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+        rc = self.proc.wait()
+        for t in self.readers:
+            t.join()
+        self._cleanup()
+        return rc
+
+    def file_complete(self, file_size):
+        if not self.active:
+            return None
+        self.active = False
+        rc = self._finish_proc()
+        n = len(self.pcm) // 2
+        pcm = np.frombuffer(self.pcm, dtype="<i2", count=n)
+        return DecodedUpload(
+            self.file_name, file_size, self.content_type, self.charset,
+            pcm=pcm, digest=self.sha.hexdigest(), profile=self.profile,
+            ok=rc == 0, stderr=self.err.decode("utf-8", "ignore"),
+        )
+
+    def upload_interrupted(self):
+        if self.active and self.proc is not None:
+            self.proc.kill()
+            self._finish_proc()
+            self.active = False
+
+
+def _cleanup(proc: subprocess.Popen, release):
+    if proc.poll() is None:
+        proc.kill()
+    release()
+
+
+def install(request, profile: str = "mid") -> bool:
+    """ใส่ FFmpegIngestHandler ไว้หน้าสุด (เรียกก่อนอ่าน request.POST/FILES)"""
+    if not enabled():
+        return False
+    request.upload_handlers.insert(0, FFmpegIngestHandler(request, profile=profile))
+    return True
+
+
+def materialize(f: DecodedUpload, persist: bool = False, prefix: str = "") -> Dict:
+    """
+    DecodedUpload → dict แบบเดียวกับ convert_to_wav_cached (ok/input/output/profile/cache_key/cached)
+    - แคชเปิด → เขียน .wav ตรงเข้าแคชครั้งเดียว แล้ววางที่ CONVERTED_ROOT ด้วย cache.link_or_copy
+      (hardlink ถ้าได้ — ไฟล์ที่ path นั้นจึงเขียนแบบไฟล์ชั่วคราว + os.replace เสมอ ไม่เขียนทับ inode ของแคช)
+    - แคชปิด → output = None (อยู่ในหน่วยความจำเท่านั้น) เว้นแต่ persist=True (job / model worker / take_upload)
+    """
+    from . import cache
+
+    if not f.ok:
+        raise RuntimeError(f"ffmpeg failed: {f.stderr[-2000:]}")
+    key = wav_cache_key(f.digest, f.profile)
+    out_wav = Path(settings.CONVERTED_ROOT) / f"{prefix}{_safe_stem(Path(f.name))}.wav"
+
+    stored = cache.get_file("wav", key, ".wav")
+    cached = stored is not None
+    metrics.inc("cache", stage="wav", result="hit" if cached else "miss")
+    if stored is None:
+        stored = cache.put_with("wav", key, ".wav", lambda tmp: write_wav_pcm16k(tmp, f.pcm))
+
+    output = None
+    if stored is not None:
+        output = cache.link_or_copy(stored, out_wav)
+    elif persist:
+        out_wav.parent.mkdir(parents=True, exist_ok=True)
+        part = out_wav.with_name(f".{out_wav.name}.{os.getpid()}.part.wav")
+        write_wav_pcm16k(part, f.pcm)
+        os.replace(part, out_wav)
+        output = out_wav
+
+    return {
+        "ok": True,
+        "input": f.name,
+        "output": str(output) if output else None,
+        "stderr": "",
+        "profile": f.profile,
+        "cache_key": key,
+        "cached": cached,
+    }
+
+
+def take_upload(
+    f, persist: bool = False, prefix: str = "", profile: Optional[str] = None,
+) -> Tuple[Path, Optional[Dict], Optional[np.ndarray]]:
+    """
+    คืน (src, conv, pcm) ให้ transcribe_auto / diarize_auto
+    - DecodedUpload → src เป็นแค่ชื่อไฟล์ (ไม่มีบนดิสก์), conv/pcm พร้อมใช้
+      ต้นฉบับไม่ถูกเก็บ → งานที่ต้องแปลงใหม่ทีหลังอาศัย .wav เท่านั้น: แคชปิดจึงเขียน .wav ลงดิสก์เสมอ
+    - UploadedFile ปกติ → เขียนลง MEDIA_ROOT แบบเดิม, conv/pcm = None
+    - profile: ที่ view ต้องการ — ffmpeg เริ่มก่อนอ่าน field อื่นของ form ได้ จึงต้องตรงกับที่ install
+      (ส่งเป็น ?profile= ใน URL); ไม่ตรง → ValueError
+    """
+    if isinstance(f, DecodedUpload):
+        from . import cache, workers
+        if profile is not None and (profile if profile in AUDIO_FILTERS else "mid") != f.profile:
+            raise ValueError(
+                f"profile={profile} must be given in the query string (?profile={profile}) for streamed uploads"
+            )
+        conv = materialize(f, persist=persist or workers.enabled() or not cache.enabled(), prefix=prefix)
+        return Path(f"{prefix}{Path(f.name).name}"), conv, f.pcm
+    return save_upload(f, prefix=prefix), None, None
@@ -1,4 +1,4 @@
-import json, re, time
+import json, re
 from pathlib import Path
 from django.conf import settings
 
@@ -8,11 +8,113 @@ def safe_stem(name: str) -> str:
     stem = Path(name).stem
     return SAFE.sub("_", stem)[:120] or "audio"
 
-def save_json(payload: dict, base_name: str, tag: str, subdir: str) -> str:
-    stem = Path(base_name).stem
-    ts = time.strftime("%Y%m%d-%H%M%S")
-    outdir = (settings.RESULTS_ROOT / subdir)
-    outdir.mkdir(parents=True, exist_ok=True)
-    outpath = outdir / f"{stem}_{tag}_{ts}.json"
-    outpath.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
-    return str(outpath)
+def save_upload(f, dest_dir: Path | None = None, prefix: str = "") -> Path:
+    """เขียนไฟล์ที่อัปโหลด (UploadedFile) ลง MEDIA_ROOT ทีละ chunk แล้วคืน path"""
+    up = Path(dest_dir or settings.MEDIA_ROOT); up.mkdir(parents=True, exist_ok=True)
+    src = up / f"{prefix}{Path(f.name).name}"
+    with src.open("wb") as dst:
+        for ch in f.chunks():
+            dst.write(ch)
+    return src
+
+# ---- Subtitle / compact export (ไฟล์คู่กับไฟล์ผล) ----
+EXPORT_FORMATS = ("srt", "vtt", "compact")
+CUE_MAX_S = 6.0        # cue ยาวกว่านี้แบ่งตามเวลาต่อคำ (ถ้ามี words)
+CUE_MAX_CHARS = 84     # ~2 บรรทัด
+
+def export_formats(value) -> list:
+    """ "srt,vtt" / ["srt", "vtt"] → ["srt", "vtt"] (ไม่รู้จัก → ValueError)"""
+    if isinstance(value, str):
+        value = value.split(",")
+    out = []
+    for f in value or []:
+        f = str(f).lower().strip()
+        if not f:
+            continue
+        if f not in EXPORT_FORMATS:
+            raise ValueError(f"unknown export format: {f} (use {', '.join(EXPORT_FORMATS)})")
+        if f not in out:
+            out.append(f)
+    return out
+
+def _cues(segments: list, max_s: float = CUE_MAX_S, max_chars: int = CUE_MAX_CHARS):
+    """segment → (start, end, speaker, text); segment ยาวที่มี words แบ่งเป็นหลาย cue ตรงขอบคำ"""
+    for seg in segments:
+        text = str(seg.get("text", "")).strip()
+        if not text or text.startswith("[ERROR"):
+            continue
+        speaker = str(seg.get("speaker", "") or "")
+        words = seg.get("words") or []
+        if not words or (seg["end"] - seg["start"] <= max_s and len(text) <= max_chars):
+            yield seg["start"], seg["end"], speaker, text
+            continue
+        cur = []
+        for w in words:
+            if cur and (w["end"] - cur[0]["start"] > max_s or len("".join(x["text"] for x in cur + [w]).strip()) > max_chars):
+                yield cur[0]["start"], cur[-1]["end"], speaker, "".join(x["text"] for x in cur).strip()
+                cur = []
+            cur.append(w)
+        if cur:
+            yield cur[0]["start"], cur[-1]["end"], speaker, "".join(x["text"] for x in cur).strip()
+
+def _clock(t: float, sep: str) -> str:
+    ms = int(round(max(0.0, t) * 1000))
+    h, ms = divmod(ms, 3_600_000)
+    m, ms = divmod(ms, 60_000)
+    s, ms = divmod(ms, 1000)
+    return f"{h:02d}:{m:02d}:{s:02d}{sep}{ms:03d}"
+
+def to_srt(segments: list, speakers: bool = True) -> str:
+    blocks = []
+    for n, (a, b, spk, text) in enumerate(_cues(segments), 1):
+        line = f"[{spk}] {text}" if speakers and spk else text
+        blocks.append(f"{n}\n{_clock(a, ',')} --> {_clock(b, ',')}\n{line}\n")
+    return "\n".join(blocks)
+
+def to_vtt(segments: list, speakers: bool = True) -> str:
+    blocks = ["WEBVTT\n"]
+    for a, b, spk, text in _cues(segments):
+        text = text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+        line = f"<v {spk}>{text}" if speakers and spk else text
+        blocks.append(f"{_clock(a, '.')} --> {_clock(b, '.')}\n{line}\n")
+    return "\n".join(blocks)
+
+def to_compact_json(result: dict) -> str:
+    """
+    JSON บรรทัดเดียวสำหรับส่งต่อ/เก็บ: speakers = รายชื่อ, segments = [start, end, speaker index, text(, words)]
+    words = [[start, end, text], ...] (มีเมื่อถอดด้วย timestamps=word)
+    """
+    names, segs = [], []
+    for s in result.get("segments") or []:
+        spk = str(s.get("speaker", ""))
+        if spk not in names:
+            names.append(spk)
+        row = [round(float(s["start"]), 3), round(float(s["end"]), 3), names.index(spk), s.get("text", "")]
+        if s.get("words"):
+            row.append([[w["start"], w["end"], w["text"]] for w in s["words"]])
+        segs.append(row)
+    payload = {"v": 1, "source": result.get("source"), "speakers": names, "segments": segs}
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+_EXPORTERS = {
+    "srt": (lambda r: to_srt(r.get("segments") or []), ".srt"),
+    "vtt": (lambda r: to_vtt(r.get("segments") or []), ".vtt"),
+    "compact": (to_compact_json, ".min.json"),
+}
+
+def render_export(result: dict, fmt: str) -> tuple:
+    """→ (ข้อความ, นามสกุลไฟล์)"""
+    render, ext = _EXPORTERS[fmt]
+    return render(result), ext
+
+def save_exports(result: dict, result_path: str | Path, formats) -> dict:
+    """เขียน srt / vtt / compact ข้างไฟล์ผล (ชื่อเดียวกัน ต่างนามสกุล) → {format: path}"""
+    base = Path(result_path).with_suffix("")
+    base.parent.mkdir(parents=True, exist_ok=True)
+    out = {}
+    for fmt in export_formats(formats):
+        text, ext = render_export(result, fmt)
+        p = base.with_name(base.name + ext)
+        p.write_text(text, encoding="utf-8")
+        out[fmt] = str(p)
+    return out
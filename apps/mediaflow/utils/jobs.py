@@ -0,0 +1,174 @@
+import os
+import time
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+from typing import Optional
+from django.db import close_old_connections
+from django.utils import timezone
+
+# งานค้าง (queued / running ที่ process เดิมตายไป) ถูกดึงกลับเข้าคิวโดย thread sweeper ของทุก process
+# - start_job_queue() เรียกตอน start server (wsgi/asgi) → sweep ทันทีแล้วทุก SWEEP_INTERVAL_S
+# - หลาย process อาจส่ง job เดียวกันเข้า pool ของตัวเอง แต่ _run_job claim แบบ atomic (queued → running)
+#   จึงมีแค่ process เดียวที่ได้รัน
+# - job ที่ process นี้กำลังรันถูก heartbeat (updated_at) ทุกรอบ sweep; running ที่ไม่ขยับเกิน
+#   MEDIAFLOW_JOB_STALE_S = process นั้นตายแล้ว → กลับเป็น queued
+
+_executor: Optional[ThreadPoolExecutor] = None
+_sweeper: Optional[threading.Thread] = None
+_inflight: set = set()         # job ที่ process นี้ส่งเข้า pool แล้ว (รอคิวหรือกำลังรัน)
+_lock = threading.Lock()
+
+PROGRESS_MIN_INTERVAL = 0.5   # วินาที — กันเขียน DB ถี่เกินไปตอนถอดทีละ batch
+SWEEP_INTERVAL_S = 30
+
+
+def _max_workers() -> int:
+    # ต่อ process — server หลาย process (gunicorn/uvicorn --workers) รันพร้อมกันได้ ค่านี้ × จำนวน process
+    try:
+        return max(1, int(os.getenv("MEDIAFLOW_JOB_WORKERS", "1")))
+    except ValueError:
+        return 1
+
+
+def _stale_s() -> float:
+    try:
+        return max(3 * SWEEP_INTERVAL_S, float(os.getenv("MEDIAFLOW_JOB_STALE_S", "180")))
+    except ValueError:
+        return 180.0
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_max_workers(), thread_name_prefix="mediaflow-job")
+    return _executor
+
+
+def _enqueue(job_id):
+    executor = _get_executor()
+    with _lock:
+        if job_id in _inflight:
+            return
+        _inflight.add(job_id)
+    executor.submit(_run_job, job_id)
+
+
+def start_job_queue():
+    """เรียกตอน start server (ซ้ำได้): เริ่ม thread ที่ดึงงานค้างกลับเข้าคิว + heartbeat งานที่รันอยู่"""
+    global _sweeper
+    with _lock:
+        if _sweeper is not None:
+            return
+        _sweeper = threading.Thread(target=_sweep_loop, name="mediaflow-job-sweeper", daemon=True)
+    _sweeper.start()
+
+
+def _sweep_loop():
+    while True:
+        try:
+            sweep()
+        except Exception as e:
+            print(f"[WARN] job sweep failed: {e}")
+        finally:
+            close_old_connections()
+        time.sleep(SWEEP_INTERVAL_S)
+
+
+def sweep():
+    """heartbeat งานของ process นี้ → running ที่ค้างเกิน MEDIAFLOW_JOB_STALE_S กลับเป็น queued → ส่ง queued เข้าคิว"""
+    from ..models import TranscribeJob
+    now = timezone.now()
+    with _lock:
+        mine = list(_inflight)
+    if mine:
+        TranscribeJob.objects.filter(pk__in=mine, status=TranscribeJob.RUNNING).update(updated_at=now)
+    TranscribeJob.objects.filter(
+        status=TranscribeJob.RUNNING, updated_at__lt=now - timedelta(seconds=_stale_s()),
+    ).exclude(pk__in=mine).update(status=TranscribeJob.QUEUED, stage="", updated_at=now)
+    pending = TranscribeJob.objects.filter(status=TranscribeJob.QUEUED).order_by("created_at")
+    for pk in pending.values_list("pk", flat=True):
+        _enqueue(pk)
+
+
+def submit_transcribe_job(
+    src: str | Path,
+    language: Optional[str] = "th",
+    conv: Optional[dict] = None,
+    decode: Optional[str] = None,
+    timestamps: Optional[str] = None,
+    exports=(),
+):
+    """
+    สร้าง job ในตาราง แล้วส่งเข้า worker pool — คืน TranscribeJob ทันที
+    - conv: ผลแปลงจาก ingest แบบ streaming (ต้องมี .wav บนดิสก์) → job ไม่ต้องมีไฟล์ต้นฉบับ
+    - timestamps / exports: เหมือน pipeline.transcribe_auto
+    """
+    from ..models import TranscribeJob
+    start_job_queue()
+    params = {"language": language, "decode": decode}
+    if timestamps:
+        params["timestamps"] = timestamps
+    if exports:
+        params["exports"] = list(exports)
+    if conv is not None:
+        params["conv"] = conv
+    job = TranscribeJob.objects.create(source=str(src), params=params)
+    _enqueue(job.pk)
+    return job
+
+
+def _run_job(job_id):
+    from ..models import TranscribeJob
+    from .pipeline import transcribe_auto
+
+    close_old_connections()
+    try:
+        # claim แบบ atomic — process/thread อื่นได้ไปแล้ว (หรือ job จบแล้ว) → ไม่ต้องทำอะไร
+        now = timezone.now()
+        claimed = TranscribeJob.objects.filter(pk=job_id, status=TranscribeJob.QUEUED).update(
+            status=TranscribeJob.RUNNING, started_at=now, updated_at=now,
+        )
+        if claimed != 1:
+            return
+        job = TranscribeJob.objects.get(pk=job_id)
+        conv = job.params.get("conv")
+        needed = conv["output"] if conv else job.source
+        if not needed or not Path(needed).exists():
+            _finish(job_id, TranscribeJob.FAILED, error=f"source not found: {needed or job.source}")
+            return
+
+        last = {"stage": None, "t": 0.0}
+
+        def progress(stage: str, done: int = 0, total: int = 0):
+            now = time.monotonic()
+            if stage == last["stage"] and done < total and now - last["t"] < PROGRESS_MIN_INTERVAL:
+                return
+            last["stage"], last["t"] = stage, now
+            TranscribeJob.objects.filter(pk=job_id).update(
+                stage=stage, segments_done=done, segments_total=total, updated_at=timezone.now(),
+            )
+
+        result = transcribe_auto(
+            job.source, language=job.params.get("language"), progress=progress, conv=conv,
+            decode=job.params.get("decode"), timestamps=job.params.get("timestamps"),
+            exports=job.params.get("exports") or (),
+        )
+        _finish(job_id, TranscribeJob.DONE, result=result)
+    except Exception as e:
+        _finish(job_id, TranscribeJob.FAILED, error=f"{e}\n{traceback.format_exc()[:2000]}")
+    finally:
+        with _lock:
+            _inflight.discard(job_id)
+        close_old_connections()
+
+
+def _finish(job_id, status: str, result: Optional[dict] = None, error: str = ""):
+    from ..models import TranscribeJob
+    TranscribeJob.objects.filter(pk=job_id).update(
+        status=status, result=result, error=error,
+        finished_at=timezone.now(), updated_at=timezone.now(),
+    )
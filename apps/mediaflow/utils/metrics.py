@@ -0,0 +1,217 @@
+import os
+import sys
+import time
+import threading
+import contextlib
+import contextvars
+from typing import Dict, List, Optional, Tuple
+
+# Instrumentation ในตัว (ไม่พึ่ง prometheus_client)
+# - span(name, **labels): จับเวลาแต่ละขั้น → histogram mediaflow_stage_seconds + บันทึกลง trace ปัจจุบัน
+# - inc(name, n, **labels): counter (เช่น ถอดซ้ำ, subprocess)
+# - trace(): เก็บ span/counter ของงานหนึ่งชิ้น (contextvar) → summary() แนบใน result JSON
+# - render_prometheus(): text format สำหรับ GET /tools/metrics
+# ค่าใน registry เป็นของ process นี้เท่านั้น (model worker แยก process → วัดจากฝั่งที่เรียกแทน)
+
+SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800)
+SPEED_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+HELP = {
+    "mediaflow_stage_seconds": ("histogram", "Wall time per pipeline stage / span"),
+    "mediaflow_audio_speed_ratio": ("histogram", "Audio seconds processed per wall second"),
+    "mediaflow_subprocess_spawn_total": ("counter", "Subprocesses spawned (ffmpeg etc.)"),
+    "mediaflow_asr_segments_total": ("counter", "Segments sent to the ASR model, by decode phase"),
+    "mediaflow_asr_redecode_total": ("counter", "Segments decoded again, by reason"),
+    "mediaflow_cache_total": ("counter", "Cache lookups by stage and result"),
+}
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, Tuple], float] = {}
+_hists: Dict[Tuple[str, Tuple], List[float]] = {}      # [count, sum, bucket_0, ..., bucket_n]
+_buckets: Dict[str, Tuple[float, ...]] = {
+    "mediaflow_stage_seconds": SECONDS_BUCKETS,
+    "mediaflow_audio_speed_ratio": SPEED_BUCKETS,
+}
+_current: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("mediaflow_trace", default=None)
+
+
+def _key(name: str, labels: Dict) -> Tuple[str, Tuple]:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+# ---- Registry ------------------------------------------------------------------
+def inc(name: str, n: float = 1, **labels):
+    """counter ของ process + ของ trace ปัจจุบัน (key ใน trace = ชื่อย่อ.label)"""
+    k = _key(f"mediaflow_{name}_total", labels)
+    with _lock:
+        _counters[k] = _counters.get(k, 0) + n
+    tr = _current.get()
+    if tr is not None:
+        tr.count(".".join([name, *[str(v) for _, v in k[1]]]), n)
+
+
+def observe(name: str, value: float, **labels):
+    buckets = _buckets[name]
+    k = _key(name, labels)
+    with _lock:
+        h = _hists.get(k)
+        if h is None:
+            h = _hists[k] = [0, 0.0] + [0] * len(buckets)
+        h[0] += 1
+        h[1] += value
+        for i, b in enumerate(buckets):
+            if value <= b:
+                h[2 + i] += 1
+
+
+def speed(stage: str, audio_s: float, wall_s: float):
+    if audio_s > 0 and wall_s > 0:
+        observe("mediaflow_audio_speed_ratio", audio_s / wall_s, stage=stage)
+
+
+# ---- Trace / span ----------------------------------------------------------------
+class Trace:
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.spans: List[Dict] = []
+        self.counters: Dict[str, float] = {}
+        self.audio_s: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def add(self, name: str, start: float, dur: float, labels: Dict):
+        with self._lock:
+            self.spans.append({"name": name, "start_s": round(start - self.t0, 4), "dur_s": round(dur, 4), **labels})
+
+    def count(self, key: str, n: float):
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def summary(self) -> Dict:
+        with self._lock:
+            spans = list(self.spans)
+            counters = dict(self.counters)
+        wall = time.perf_counter() - self.t0
+        stages: Dict[str, float] = {}
+        for s in spans:
+            stages[s["name"]] = round(stages.get(s["name"], 0.0) + s["dur_s"], 4)
+        out = {"wall_s": round(wall, 4), "stages": stages, "counters": counters, "spans": spans}
+        if self.audio_s:
+            out["audio_s"] = round(self.audio_s, 3)
+            out["audio_per_wall_s"] = round(self.audio_s / wall, 3) if wall > 0 else None
+        return out
+
+
+@contextlib.contextmanager
+def trace():
+    """เริ่ม trace ใหม่ หรือใช้ของเดิมถ้ามีอยู่แล้ว (view → transcribe_auto ใช้ trace เดียวกัน)"""
+    tr = _current.get()
+    if tr is not None:
+        yield tr
+        return
+    tr = Trace()
+    token = _current.set(tr)
+    try:
+        yield tr
+    finally:
+        _current.reset(token)
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+@contextlib.contextmanager
+def span(name: str, audio_s: Optional[float] = None, **labels):
+    """
+    จับเวลาช่วงโค้ด → histogram mediaflow_stage_seconds{stage=name} (+ speed ratio ถ้าให้ audio_s)
+    labels เพิ่มเติม (เช่น cached, beams) เก็บใน trace เท่านั้น ไม่เพิ่ม cardinality ของ Prometheus
+    """
+    t0 = time.perf_counter()
+    try:
+        yield labels
+    finally:
+        dur = time.perf_counter() - t0
+        observe("mediaflow_stage_seconds", dur, stage=name)
+        if audio_s:
+            speed(name, audio_s, dur)
+            labels = {**labels, "audio_s": round(audio_s, 3)}
+        tr = _current.get()
+        if tr is not None:
+            tr.add(name, t0, dur, labels)
+
+
+def traced(view):
+    """decorator ของ view: ทั้ง request (รวม upload) อยู่ใน trace เดียวกับ transcribe_auto"""
+    import functools
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with trace():
+            return view(*args, **kwargs)
+    return wrapper
+
+
+def run_in_context(target, *args):
+    """ให้ thread ใหม่เห็น trace เดียวกับ thread ที่สร้าง: threading.Thread(target=run_in_context(fn))"""
+    ctx = contextvars.copy_context()
+    return lambda: ctx.run(target, *args)
+
+
+# ---- Subprocess counter (audit hook) ------------------------------------------------
+_hook_installed = False
+
+
+def _audit(event: str, args):
+    if event != "subprocess.Popen":
+        return
+    try:
+        inc("subprocess_spawn", exe=os.path.basename(str(args[0])) if args and args[0] else "?")
+    except Exception:
+        pass  # exception ใน audit hook จะทำให้ Popen ล้ม → กลืนไว้
+
+
+def install_audit_hook():
+    # audit hook ถอดออกไม่ได้ → ติดตั้งครั้งเดียวต่อ process
+    global _hook_installed
+    with _lock:
+        if _hook_installed:
+            return
+        _hook_installed = True
+    sys.addaudithook(_audit)
+
+
+# ---- Prometheus text format -----------------------------------------------------------
+def _fmt_labels(labels: Tuple, extra: Tuple = ()) -> str:
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+
+def _fmt_num(v: float) -> str:
+    return repr(float(v)) if isinstance(v, float) and not float(v).is_integer() else str(int(v))
+
+
+def render_prometheus() -> str:
+    with _lock:
+        counters = dict(_counters)
+        hists = {k: list(v) for k, v in _hists.items()}
+    names = sorted({k[0] for k in counters} | {k[0] for k in hists})
+    lines: List[str] = []
+    for name in names:
+        kind, help_text = HELP.get(name, ("counter" if name in {k[0] for k in counters} else "histogram", name))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (n, labels), v in sorted(counters.items()):
+            if n == name:
+                lines.append(f"{name}{_fmt_labels(labels)} {_fmt_num(v)}")
+        for (n, labels), h in sorted(hists.items()):
+            if n != name:
+                continue
+            for b, c in zip(_buckets[name], h[2:]):   # observe() นับแบบสะสมอยู่แล้ว (value <= b)
+                lines.append(f"{name}_bucket{_fmt_labels(labels, (('le', _fmt_num(b)),))} {c}")
+            lines.append(f"{name}_bucket{_fmt_labels(labels, (('le', '+Inf'),))} {h[0]}")
+            lines.append(f"{name}_sum{_fmt_labels(labels)} {_fmt_num(round(h[1], 6))}")
+            lines.append(f"{name}_count{_fmt_labels(labels)} {h[0]}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,366 @@
+import os
+import queue
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+from . import diarize
+from .diarize import diarize_auto, clean_diar_segments, CLEAN_PARAMS
+from .transcribe import transcribe_segments_with_pathumma, asr_settings, span_key, timestamps_mode, PREPARE_PARAMS
+from .segments import prepare_asr_segments
+from .audio import SAMPLE_RATE, load_pcm16k
+from .io import save_exports
+from . import cache, metrics, results, search, speakers, vad, workers
+
+# progress(stage, done, total) — stage: convert | diarize | transcribe (convert: done/total = วินาทีของเสียง)
+ProgressFn = Callable[[str, int, int], None]
+
+# segment ที่จบก่อนจุด commit ของหน้าต่างอย่างน้อยเท่านี้ (วินาที) ถึงจะส่งเข้า ASR
+# กันกรณีผู้พูดคนเดิมพูดต่อในหน้าต่างถัดไปแล้ว prepare_asr_segments ควรรวมเป็นช่วงเดียว
+STREAM_HOLD_S = 1.0
+
+
+def _use_streaming(streaming: Optional[bool], pcm) -> bool:
+    if streaming is None:
+        streaming = os.getenv("MEDIAFLOW_STREAMING", "1") not in ("0", "false", "False", "")
+    if not streaming:
+        return False
+    # ไฟล์สั้นกว่าหนึ่งหน้าต่าง ไม่มีอะไรให้ทับซ้อน
+    return len(pcm) / SAMPLE_RATE > diarize.WINDOW_S
+
+
+def _speech_seconds(segments: List[Dict]) -> float:
+    return sum(max(0.0, s["end"] - s["start"]) for s in segments)
+
+
+def _diarize_and_transcribe_streaming(
+    src: Path,
+    conv: Dict,
+    pcm,
+    language: Optional[str],
+    progress: Optional[ProgressFn],
+    decode: Optional[str] = None,
+    save: bool = True,
+    timestamps: Optional[str] = None,
+) -> Tuple[Dict, List[Dict]]:
+    """
+    producer (thread): diarize ทีละหน้าต่าง → queue
+    consumer (thread นี้): ช่วงที่ commit แล้ว → clean → prepare/ถอดเสียงทันที
+    เวลารวมจึงเข้าใกล้ max(diarize, transcribe) แทนที่จะเป็นผลบวก
+    """
+    wav_path = Path(conv["output"]).resolve() if conv["output"] else None
+    # ช่วงเสียงพูดเดียวกับที่ diarize_windows ใช้ (แคชไว้แล้ว) — clean ต่อ segment ข้ามช่วงเงียบได้ จึงตัดซ้ำหลัง clean
+    tmap = vad.active_map(pcm, conv["cache_key"])
+    q: "queue.Queue" = queue.Queue(maxsize=4)
+    # consumer เลิกกลางทาง (ถอดเสียงพัง) → stop; producer ไม่ค้างที่ q.put แล้วหยุด diarize หน้าต่างถัดไป
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in diarize.diarize_windows(wav_path, pcm=pcm, audio_key=conv["cache_key"]):
+                if not put(item):
+                    return
+            put(None)
+        except BaseException as e:
+            put(e)
+
+    t = threading.Thread(target=metrics.run_in_context(produce), name="mediaflow-diarize", daemon=True)
+    t.start()
+
+    raw: List[Dict] = []
+    pending: List[Dict] = []
+    enriched: List[Dict] = []
+
+    def part_progress(stage: str, done: int, total: int):
+        if progress:
+            progress("transcribe", len(enriched) + done, len(enriched) + total)
+
+    if progress: progress("diarize", 0, 0)
+    try:
+        while True:
+            item = q.get()
+            if isinstance(item, BaseException):
+                raise item
+            if item is None:
+                ready, pending = pending, []
+            else:
+                commit, segs = item
+                raw += segs
+                pending += segs
+                ready = [s for s in pending if s["end"] <= commit - STREAM_HOLD_S]
+                pending = [s for s in pending if s["end"] > commit - STREAM_HOLD_S]
+            if ready:
+                ready = clean_diar_segments(ready, **CLEAN_PARAMS)
+                if tmap is not None:
+                    ready = tmap.clip(ready)
+                with metrics.span("transcribe", audio_s=_speech_seconds(ready)):
+                    if workers.enabled():
+                        enriched += workers.transcribe_segments(
+                            wav_path, ready, language=language, progress=part_progress, decode=decode,
+                            timestamps=timestamps,
+                        )
+                    else:
+                        enriched += transcribe_segments_with_pathumma(
+                            wav_path, ready, language=language, pcm=pcm, progress=part_progress, decode=decode,
+                            timestamps=timestamps,
+                        )
+            if item is None:
+                break
+    finally:
+        stop.set()
+        # ระบาย queue — producer ที่รอ put อยู่จะเห็น stop ภายใน timeout
+        while True:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                break
+    t.join()
+
+    segments = clean_diar_segments(raw, **CLEAN_PARAMS)
+    if tmap is not None:
+        segments = tmap.clip(segments)
+    cache.put_json("diar", diarize.diar_cache_key(conv), segments)
+    dia = diarize.diar_result(src.resolve() if src.exists() else src, conv, segments, save=save, pcm=pcm)
+    enriched = sorted(enriched, key=lambda x: (x["start"], x["end"]))
+    return dia, _reconcile(wav_path, segments, enriched, pcm, language, decode, timestamps)
+
+
+def _reconcile(wav_path, segments, enriched, pcm, language, decode, timestamps) -> List[Dict]:
+    """
+    ผลที่ถอดทีละก้อนตอน streaming → ให้ตรงกับช่วงของ diarization สุดท้าย (segments)
+    turn ของผู้พูดเดียวกันที่คร่อมรอยต่อก้อนถูก clean รวมกันตอนท้าย → ช่วงที่ prepare ได้ต่างจากที่ถอดไป
+    ถอดใหม่เฉพาะช่วงนั้น (ที่เหลือใช้ข้อความเดิมผ่าน reuse) — แคช trans / retranscribe จึงเทียบช่วงกับ diarization ได้ตรง
+    """
+    want = [(span_key(s), str(s.get("speaker", "-"))) for s in prepare_asr_segments(segments, **PREPARE_PARAMS)]
+    if want == [(span_key(s), s["speaker"]) for s in enriched]:
+        return enriched
+    reuse = _reuse_map(enriched, timestamps_mode(timestamps) == "word")
+    metrics.inc("stream_seam_fixups", sum(k not in reuse for k, _ in want))
+    with metrics.span("transcribe"):
+        if workers.enabled():
+            return workers.transcribe_segments(
+                wav_path, segments, language=language, decode=decode, timestamps=timestamps, reuse=reuse,
+            )
+        return transcribe_segments_with_pathumma(
+            wav_path, segments, language=language, pcm=pcm, decode=decode, timestamps=timestamps, reuse=reuse,
+        )
+
+
+def transcribe_auto(
+    src: str | Path,
+    language: Optional[str] = "th",
+    progress: Optional[ProgressFn] = None,
+    streaming: Optional[bool] = None,
+    conv: Optional[Dict] = None,
+    pcm=None,
+    decode: Optional[str] = None,
+    save: bool = True,
+    timestamps: Optional[str] = None,
+    exports=(),
+) -> Dict:
+    """
+    Convert → Diarize → Transcribe ของไฟล์เดียว (ใช้ร่วมกันทั้ง view แบบ sync และ job queue)
+    - ไฟล์ยาวกว่า PYANNOTE_WINDOW_S และยังไม่มี diarization ในแคช → diarize/ASR ซ้อนกันแบบ streaming
+      (ปิดได้ด้วย MEDIAFLOW_STREAMING=0 หรือ streaming=False)
+    - conv/pcm จาก ingest.take_upload → ข้ามขั้น convert (ถอดระหว่างอัปโหลดไปแล้ว)
+    - decode: fast | mid | max (ความเร็ว vs ความแม่นของ ASR, ดู transcribe.DECODE_PROFILES)
+    - save=False → ไม่เขียน results/diar, results/transcribe (ผู้เรียกเก็บผลเอง เช่น batch)
+    - timestamps="word" → ทุก segment มี words (เวลาต่อคำ) จากการถอดรอบเดียวกัน
+    - exports: srt / vtt / compact → เขียนไฟล์ข้างไฟล์ผล (ต้อง save) แล้วคืน path ใน "exports"
+    คืน dict เดียวกับที่ /tools/transcribe_auto ตอบกลับ (รวม result_id / result_path ถ้า save)
+    """
+    src = Path(src)
+
+    with metrics.trace() as tr:
+        if conv is None:
+            if progress: progress("convert", 0, 0)
+            conv = diarize.convert_for_diarization(src, progress=progress)
+        if pcm is None:
+            pcm = load_pcm16k(conv["output"])
+        tr.audio_s = len(pcm) / SAMPLE_RATE
+
+        if cache.get_json("diar", diarize.diar_cache_key(conv)) is None and _use_streaming(streaming, pcm):
+            # 1+2) diarize และ transcribe ซ้อนกัน — ผลถูกปรับให้ตรงกับช่วงของ diarization สุดท้ายแล้ว (_reconcile)
+            #      จึงแคชด้วย key เดียวกับทางปกติได้
+            dia, enriched = _diarize_and_transcribe_streaming(
+                src, conv, pcm, language, progress, decode=decode, save=save, timestamps=timestamps,
+            )
+            trans_key = cache.cache_key(
+                "trans", dia["audio_key"], speakers.raw_segments(dia["segments"]),
+                asr_settings(language, decode, timestamps),
+            )
+            cache.put_json("trans", trans_key, enriched)
+        else:
+            # 1) diarize (เซฟผลลงคลัง results/diar ให้อัตโนมัติ)
+            dia = diarize_auto(src, save=save, progress=progress, conv=conv, pcm=pcm)
+
+            # 2) transcribe ตามช่วง (แคชตามเสียง + segments + ค่า ASR) — ใช้ label เดิมของไฟล์ ไม่ใช่ชื่อที่จับคู่ได้
+            diar_segments = speakers.raw_segments(dia["segments"])
+            trans_key = cache.cache_key(
+                "trans", dia["audio_key"], diar_segments, asr_settings(language, decode, timestamps),
+            )
+            enriched = cache.get_json("trans", trans_key)
+            metrics.inc("cache", stage="trans", result="miss" if enriched is None else "hit")
+            if enriched is None:
+                with metrics.span("transcribe", audio_s=_speech_seconds(diar_segments)):
+                    if workers.enabled():
+                        enriched = workers.transcribe_segments(
+                            dia["wav"], diar_segments, language=language, progress=progress, decode=decode,
+                            timestamps=timestamps,
+                        )
+                    else:
+                        enriched = transcribe_segments_with_pathumma(
+                            dia["wav"], diar_segments, language=language, pcm=pcm, progress=progress, decode=decode,
+                            timestamps=timestamps,
+                        )
+                cache.put_json("trans", trans_key, enriched)
+            elif progress:
+                progress("transcribe", len(enriched), len(enriched))
+
+        # 3) รวมผล + เซฟลงคลังผล (results/transcribe/<id>.mfr, ดู utils/results.py)
+        result = {
+            "source": str(src),
+            "wav": dia["wav"],
+            "speakers_count": dia.get("speakers_count"),
+            "speakers": dia.get("speakers", {}),
+            "segments": speakers.apply(enriched, dia.get("speakers", {})),
+            "diar_result": dia.get("result_id"),  # id ของผล diarize ในคลัง (GET /tools/results/<id>)
+            "audio_key": dia["audio_key"],
+            "asr_key": _asr_key(language, decode),
+        }
+        result["metrics"] = tr.summary()
+    if not save:
+        return result
+    return _save_transcript(result, exports)
+
+
+def _asr_key(language: Optional[str], decode: Optional[str]) -> str:
+    """hash ของค่า ASR ที่กำหนดข้อความ (ไม่รวม timestamps) — retranscribe ใช้ข้อความเดิมได้เมื่อ key ตรงกัน"""
+    return cache.cache_key(asr_settings(language, decode))
+
+
+def _save_transcript(result: Dict, exports=()) -> Dict:
+    saved = results.save(result, "trans")
+    search.index_saved(result, saved["path"])
+    if exports:
+        result["exports"] = save_exports(result, saved["path"], exports)
+    return {"result_id": saved["id"], "result_path": saved["path"], **result}
+
+
+# ---- Re-transcribe หลังแก้ช่วงผู้พูด ----------------------------------------------------
+def _reuse_map(segments: List[Dict], want_words: bool) -> Dict[Tuple[int, int], Dict]:
+    """ผลถอดเดิม → {span_key: ข้อความ (+ words)} สำหรับ reuse (ตัด speaker ออก — ช่วงเดียวกันอาจถูกแก้ผู้พูด)"""
+    reuse = {}
+    for s in segments:
+        text = str(s.get("text", ""))
+        if text.startswith("[ERROR") or (want_words and "words" not in s):
+            continue
+        keep = ("text", "words", "words_approx") if want_words else ("text",)
+        reuse[span_key(s)] = {k: s[k] for k in keep if k in s}
+    return reuse
+
+
+def _edited_segments(segments) -> List[Dict]:
+    """segments ที่ผู้ใช้แก้ → [{start, end, speaker}] เรียงตามเวลา (ใช้ label เดิมถ้ามี speaker_label); ผิด → ValueError"""
+    if not isinstance(segments, list) or not segments:
+        raise ValueError("segments must be a non-empty list")
+    out = []
+    for n, s in enumerate(segments):
+        try:
+            start, end = float(s["start"]), float(s["end"])
+        except (TypeError, KeyError, ValueError):
+            raise ValueError(f"segments[{n}]: start and end (seconds) are required")
+        if not 0.0 <= start < end:
+            raise ValueError(f"segments[{n}]: need 0 <= start < end")
+        spk = str(s.get("speaker_label") or s.get("speaker") or "SPEAKER_00")
+        out.append({"start": round(start, 3), "end": round(end, 3), "speaker": spk})
+    return sorted(out, key=lambda x: (x["start"], x["end"]))
+
+
+def retranscribe(
+    result_id: str,
+    segments: List[Dict],
+    language: Optional[str] = "th",
+    decode: Optional[str] = None,
+    timestamps: Optional[str] = None,
+    exports=(),
+    save: bool = True,
+    progress: Optional[ProgressFn] = None,
+) -> Dict:
+    """
+    ถอดเสียงใหม่หลังผู้ใช้แก้ช่วงผู้พูดของผลถอดเสียงเดิม (result_id ในคลัง)
+    - segments ที่แก้แล้วผ่าน prepare_asr_segments เหมือนเดิม แล้วเทียบกับช่วงในผลเดิม (start/end ระดับ ms):
+      ช่วงที่ตรงกันใช้ข้อความ (+ words) เดิม, ถอดจริงเฉพาะช่วงใหม่/ที่ขอบเปลี่ยน
+    - ค่า ASR (language / decode) ต่างจากตอนถอดผลเดิม → ไม่มีช่วงไหนใช้ซ้ำได้ (ถอดใหม่ทั้งหมด)
+    - ผลใหม่เซฟเป็น id ใหม่ (based_on = id เดิม) — ผลเดิมไม่ถูกแก้
+    ผลเดิมไม่มี หรือไม่มีเสียงเหลือให้ถอด (.wav และต้นฉบับหายไปแล้ว) → LookupError, segments ผิดรูปแบบ → ValueError
+    """
+    if not result_id.startswith("trans-"):
+        raise ValueError("result_id must be a transcript result (trans-...)")
+    prior = results.load(result_id)
+    edited = _edited_segments(segments)
+    want_words = timestamps_mode(timestamps) == "word"
+    asr_key = _asr_key(language, decode)
+    src = Path(prior.get("source") or "")
+
+    with metrics.trace() as tr:
+        wav, audio_key = prior.get("wav"), prior.get("audio_key")
+        if not (wav and audio_key and Path(wav).is_file()):
+            # upload แบบ streaming ไม่เก็บต้นฉบับ (src เป็นแค่ชื่อ) — .wav หายแล้วก็แปลงใหม่ไม่ได้
+            if not src.is_file():
+                raise LookupError(f"audio for {result_id} is no longer available (neither .wav nor source file on disk); "
+                                  "transcribe the file again")
+            if progress: progress("convert", 0, 0)
+            conv = diarize.convert_for_diarization(src, progress=progress)
+            wav, audio_key = conv["output"], conv["cache_key"]
+        pcm = load_pcm16k(wav)
+        tr.audio_s = len(pcm) / SAMPLE_RATE
+
+        # ผลเดิมต่อช่วง — ค่า ASR ต่างจากตอนถอดผลเดิม → ใช้ซ้ำไม่ได้
+        reuse = _reuse_map(prior.get("segments") or [], want_words) if prior.get("asr_key", asr_key) == asr_key else {}
+
+        trans_key = cache.cache_key("trans", audio_key, edited, asr_settings(language, decode, timestamps))
+        enriched = cache.get_json("trans", trans_key)
+        metrics.inc("cache", stage="trans", result="miss" if enriched is None else "hit")
+        if enriched is None:
+            with metrics.span("transcribe", audio_s=_speech_seconds(edited)):
+                if workers.enabled():
+                    enriched = workers.transcribe_segments(
+                        wav, edited, language=language, progress=progress, decode=decode,
+                        timestamps=timestamps, reuse=reuse,
+                    )
+                else:
+                    enriched = transcribe_segments_with_pathumma(
+                        wav, edited, language=language, pcm=pcm, progress=progress, decode=decode,
+                        timestamps=timestamps, reuse=reuse,
+                    )
+            cache.put_json("trans", trans_key, enriched)
+        elif progress:
+            progress("transcribe", len(enriched), len(enriched))
+
+        mapping = prior.get("speakers") or {}
+        reused = sum(span_key(s) in reuse for s in enriched)
+        result = {
+            "source": str(src),
+            "wav": str(wav),
+            "speakers_count": len({s["speaker"] for s in edited}),
+            "speakers": {k: v for k, v in mapping.items() if any(s["speaker"] == k for s in edited)},
+            "segments": speakers.apply(enriched, mapping),
+            "diar_result": prior.get("diar_result"),
+            "audio_key": audio_key,
+            "asr_key": asr_key,
+            "based_on": result_id,
+            "incremental": {"segments": len(enriched), "reused": reused, "decoded": len(enriched) - reused},
+        }
+        result["metrics"] = tr.summary()
+    if not save:
+        return result
+    return _save_transcript(result, exports)
@@ -0,0 +1,438 @@
+import os
+import re
+import json
+import uuid
+import zlib
+import struct
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from . import metrics
+
+# คลังผล diarize / ถอดเสียงที่เซฟไว้ (แทน JSON แบบ indent=2 ที่ตั้งชื่อด้วยเวลาระดับวินาที)
+# - id ไม่ซ้ำ: <kind>-<YYYYmmdd-HHMMSS>-<uuid 12 hex> เรียงตามเวลาได้ → สองคำขอในวินาทีเดียวกันไม่ทับกัน
+# - ไฟล์ results/<transcribe|diar>/<id>.mfr = MAGIC + header JSON (ไม่บีบอัด: source, เวลา, จำนวนผู้พูด,
+#   ตารางคอลัมน์) + body zlib ของคอลัมน์ต่อ segment:
+#     start/end/words → int32 มิลลิวินาทีแบบ delta, text → utf-8 ต่อกัน + offsets,
+#     string ที่ซ้ำกันมาก (speaker, speaker_id) → index ลงตารางใน header, ค่าอื่น → JSON ก้อนเดียว (extra)
+#   ส่วนที่ไม่ใช่ segments (wav, speakers, metrics ...) เก็บเป็น JSON ก้อนเดียว (meta)
+# - เขียนไฟล์ชั่วคราวแล้ว os.replace (atomic); catalog = ตาราง StoredResult — list/กรองไม่ต้องเปิดไฟล์,
+#   โหลดผลเดียวอ่านไฟล์เดียว
+# - extra (batch / rel ของผลจาก batch) อยู่ใน header ด้วย → rebuild_catalog สร้างคืนได้จากไฟล์
+# - เวลาเก็บละเอียดระดับมิลลิวินาที (ผลเดิมปัดทศนิยม 3 ตำแหน่งอยู่แล้ว)
+
+MAGIC = b"MFR1"
+SUFFIX = ".mfr"
+KIND_DIRS = {"trans": "transcribe", "diar": "diar"}
+ZLIB_LEVEL = 6
+MAX_LIMIT = 500
+
+_ID = re.compile(r"^(trans|diar)-\d{8}-\d{6}-[0-9a-f]{12}$")
+_TIME_KEYS = ("start", "end")
+_NO_CODE = 0xFFFF           # dict column: segment ไม่มี key นี้
+_MISSING = object()
+
+
+def _root() -> Path:
+    return Path(settings.RESULTS_ROOT)
+
+
+def title(source: str) -> str:
+    name = Path(source or "").name
+    # ไฟล์อัปโหลดถูกเติม prefix สุ่ม "<8 hex>_" กันชื่อชน
+    return re.sub(r"^[0-9a-f]{8}_", "", name)
+
+
+def new_id(kind: str, now: Optional[datetime] = None) -> str:
+    if kind not in KIND_DIRS:
+        raise ValueError(f"unknown result kind: {kind}")
+    now = now or datetime.now()
+    return f"{kind}-{now.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:12]}"
+
+
+def path_for(result_id: str) -> Path:
+    """id → path ของไฟล์ (ไม่ต้องถาม catalog); id ผิดรูปแบบ → ValueError"""
+    if not _ID.match(result_id or ""):
+        raise ValueError(f"invalid result id: {result_id!r}")
+    return _root() / KIND_DIRS[result_id.split("-", 1)[0]] / f"{result_id}{SUFFIX}"
+
+
+# ---- Encode / decode --------------------------------------------------------------
+def _is_num(v) -> bool:
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+
+def _ms(values) -> np.ndarray:
+    """เวลา (วินาที) → int32 ms แบบ delta (ค่าที่ติดกันต่างกันน้อย → zlib บีบได้ดี)"""
+    ms = np.rint(np.asarray(values, dtype=np.float64) * 1000.0).astype(np.int64)
+    return np.diff(ms, prepend=0).astype("<i4")
+
+
+def _unms(arr: np.ndarray) -> List[float]:
+    return [round(v / 1000.0, 3) for v in np.cumsum(arr.astype(np.int64)).tolist()]
+
+
+def _texts(values: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """list ของ str → (offsets uint32 [n+1], utf-8 ต่อกัน)"""
+    raw = [v.encode("utf-8") for v in values]
+    offsets = np.zeros(len(raw) + 1, dtype="<u4")
+    np.cumsum([len(b) for b in raw], out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(raw), dtype=np.uint8)
+
+
+def _untexts(offsets: np.ndarray, blob: bytes) -> List[str]:
+    o = offsets.tolist()
+    return [blob[o[i]:o[i + 1]].decode("utf-8") for i in range(len(o) - 1)]
+
+
+def _plain_words(v) -> bool:
+    return isinstance(v, list) and all(
+        isinstance(w, dict) and w.keys() == {"start", "end", "text"}
+        and _is_num(w["start"]) and _is_num(w["end"]) and isinstance(w["text"], str)
+        for w in v
+    )
+
+
+def _encode_segments(segments: List[Dict]) -> Tuple[List[List], Dict[str, List[str]], List[Tuple[str, np.ndarray]]]:
+    """→ (fields [[key, encoding]], tables, columns [(ชื่อ, array)])"""
+    keys: List[str] = []
+    for s in segments:
+        for k in s:
+            if k not in keys:
+                keys.append(k)
+    n = len(segments)
+    fields, tables, cols = [], {}, []
+    extra: List[Dict] = [{} for _ in segments]
+
+    for k in keys:
+        vals = [s.get(k, _MISSING) for s in segments]
+        present = [v is not _MISSING for v in vals]
+        if k in _TIME_KEYS and all(present) and all(_is_num(v) for v in vals):
+            fields.append([k, "ms"])
+            cols.append((f"{k}:ms", _ms(vals)))
+        elif all(isinstance(v, str) for v, p in zip(vals, present) if p):
+            distinct = list(dict.fromkeys(v for v, p in zip(vals, present) if p))
+            if k != "text" and len(distinct) < _NO_CODE and len(distinct) <= max(16, n // 4):
+                index = {v: i for i, v in enumerate(distinct)}
+                fields.append([k, "dict"])
+                tables[k] = distinct
+                cols.append((f"{k}:dict", np.array(
+                    [index[v] if p else _NO_CODE for v, p in zip(vals, present)], dtype="<u2")))
+            else:
+                fields.append([k, "text"])
+                offsets, blob = _texts([v if p else "" for v, p in zip(vals, present)])
+                cols += [(f"{k}:off", offsets), (f"{k}:txt", blob)]
+                if not all(present):
+                    cols.append((f"{k}:has", np.array(present, dtype=np.uint8)))
+        elif all(_plain_words(v) for v, p in zip(vals, present) if p):
+            fields.append([k, "words"])
+            flat = [w for v, p in zip(vals, present) if p for w in v]
+            offsets, blob = _texts([w["text"] for w in flat])
+            cols += [
+                (f"{k}:n", np.array([len(v) if p else 0 for v, p in zip(vals, present)], dtype="<u4")),
+                (f"{k}:start", _ms([w["start"] for w in flat])),
+                (f"{k}:end", _ms([w["end"] for w in flat])),
+                (f"{k}:off", offsets), (f"{k}:txt", blob),
+            ]
+            if not all(present):
+                cols.append((f"{k}:has", np.array(present, dtype=np.uint8)))
+        else:
+            fields.append([k, "extra"])
+            for i, (v, p) in enumerate(zip(vals, present)):
+                if p:
+                    extra[i][k] = v
+    if any(extra):
+        cols.append(("extra", np.frombuffer(_json(extra), dtype=np.uint8)))
+    return fields, tables, cols
+
+
+def _decode_segments(n: int, fields: List[List], tables: Dict, cols: Dict[str, np.ndarray]) -> List[Dict]:
+    segments: List[Dict] = [{} for _ in range(n)]
+    extra = json.loads(cols["extra"].tobytes()) if "extra" in cols else None
+    for k, enc in fields:
+        has = cols[f"{k}:has"].astype(bool).tolist() if f"{k}:has" in cols else [True] * n
+        if enc == "ms":
+            for s, v in zip(segments, _unms(cols[f"{k}:ms"])):
+                s[k] = v
+        elif enc == "dict":
+            table = tables[k]
+            for s, c in zip(segments, cols[f"{k}:dict"].tolist()):
+                if c != _NO_CODE:
+                    s[k] = table[c]
+        elif enc == "text":
+            for s, v, h in zip(segments, _untexts(cols[f"{k}:off"], cols[f"{k}:txt"].tobytes()), has):
+                if h:
+                    s[k] = v
+        elif enc == "words":
+            starts, ends = _unms(cols[f"{k}:start"]), _unms(cols[f"{k}:end"])
+            texts = _untexts(cols[f"{k}:off"], cols[f"{k}:txt"].tobytes())
+            i = 0
+            for s, m, h in zip(segments, cols[f"{k}:n"].tolist(), has):
+                if h:
+                    s[k] = [{"start": starts[j], "end": ends[j], "text": texts[j]} for j in range(i, i + m)]
+                i += m
+        elif enc == "extra" and extra is not None:
+            for s, e in zip(segments, extra):
+                if k in e:
+                    s[k] = e[k]
+    return segments
+
+
+def _json(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def _summary(result: Dict) -> Dict:
+    segments = [s for s in result.get("segments") or [] if isinstance(s, dict)]
+    duration = (result.get("metrics") or {}).get("audio_s") or max((s.get("end", 0.0) for s in segments), default=0.0)
+    count = result.get("speakers_count")
+    if not isinstance(count, int):
+        count = len({str(s.get("speaker", "")) for s in segments if s.get("speaker")})
+    return {
+        "source": str(result.get("source") or ""),
+        "speakers_count": count,
+        "segments_count": len(segments),
+        "duration_s": round(float(duration or 0.0), 3),
+    }
+
+
+def dumps(result: Dict, result_id: str, kind: str, created_at: datetime, extra: Optional[Dict] = None) -> bytes:
+    segments = result.get("segments")
+    meta = {k: v for k, v in result.items() if k != "segments"}
+    if isinstance(segments, list) and all(isinstance(s, dict) for s in segments):
+        fields, tables, cols = _encode_segments(segments)
+    else:
+        meta["segments"] = segments                 # รูปแบบที่ไม่รู้จัก → เก็บเป็น JSON ตามเดิม
+        fields, tables, cols = [], {}, []
+    cols.insert(0, ("meta", np.frombuffer(_json(meta), dtype=np.uint8)))
+    header = {
+        "v": 1, "id": result_id, "kind": kind,
+        "created_at": created_at.astimezone(timezone.utc).isoformat(),
+        **_summary(result), **(extra or {}),
+        "codec": "zlib", "fields": fields, "tables": tables,
+        "columns": [[name, arr.dtype.str, int(arr.size)] for name, arr in cols],
+    }
+    head = _json(header)
+    body = zlib.compress(b"".join(arr.tobytes() for _, arr in cols), ZLIB_LEVEL)
+    return MAGIC + struct.pack("<I", len(head)) + head + body
+
+
+def _split(blob: bytes) -> Tuple[Dict, bytes]:
+    if blob[:4] != MAGIC:
+        raise ValueError("not a mediaflow result file")
+    (size,) = struct.unpack_from("<I", blob, 4)
+    return json.loads(blob[8:8 + size]), blob[8 + size:]
+
+
+def loads(blob: bytes) -> Dict:
+    header, body = _split(blob)
+    if header.get("codec") != "zlib":
+        raise ValueError(f"unsupported codec: {header.get('codec')}")
+    raw = zlib.decompress(body)
+    cols, pos = {}, 0
+    for name, dtype, count in header["columns"]:
+        dt = np.dtype(dtype)
+        cols[name] = np.frombuffer(raw, dtype=dt, count=count, offset=pos)
+        pos += dt.itemsize * count
+    result = json.loads(cols["meta"].tobytes())
+    if "segments" not in result:
+        result["segments"] = _decode_segments(header["segments_count"], header["fields"], header["tables"], cols)
+    return result
+
+
+def read_header(path: str | Path) -> Dict:
+    """อ่านเฉพาะ header (source / เวลา / จำนวนผู้พูด) ไม่ต้องคลาย body"""
+    with Path(path).open("rb") as fh:
+        head = fh.read(8)
+        if head[:4] != MAGIC:
+            raise ValueError(f"not a mediaflow result file: {path}")
+        (size,) = struct.unpack_from("<I", head, 4)
+        return json.loads(fh.read(size))
+
+
+def read_file(path: str | Path) -> Dict:
+    """โหลดผลจากไฟล์ .mfr หรือ JSON เดิม (results/batch, ผลก่อนมีคลังนี้)"""
+    path = Path(path)
+    if path.suffix == SUFFIX:
+        with metrics.span("results.load"):
+            return loads(path.read_bytes())
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+# ---- Store / catalog ---------------------------------------------------------------
+def _write(result: Dict, kind: str, created: datetime, extra: Optional[Dict] = None) -> Tuple[Dict, Path, int]:
+    rid = new_id(kind, created)
+    dst = path_for(rid)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    with metrics.span("results.save"):
+        blob = dumps(result, rid, kind, created, extra)
+        tmp = dst.with_name(f".{dst.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(blob)
+        os.replace(tmp, dst)
+    header = _split(blob)[0]
+    _catalog_add(header, dst, len(blob))
+    return header, dst, len(blob)
+
+
+def save(result: Dict, kind: str, extra: Optional[Dict] = None) -> Dict:
+    """เขียนผลลงคลัง (atomic) + เพิ่มใน catalog → {"id", "path", "size"}; extra = {"batch", "rel"} ของผลจาก batch"""
+    header, path, size = _write(result, kind, datetime.now().astimezone(), extra)
+    return {"id": header["id"], "path": str(path), "size": size}
+
+
+def _catalog_add(header: Dict, path: Path, size: int):
+    """catalog พังไม่ทำให้งานล้ม — ไฟล์อยู่ครบแล้ว (rebuild_catalog ทีหลังได้)"""
+    from ..models import StoredResult
+
+    try:
+        StoredResult.objects.update_or_create(
+            id=header["id"],
+            defaults=dict(
+                kind=header["kind"], source=header["source"][:500], title=title(header["source"])[:255],
+                speakers_count=header["speakers_count"], segments_count=header["segments_count"],
+                duration_s=header["duration_s"], size_bytes=size, path=str(path),
+                created_at=datetime.fromisoformat(header["created_at"]),
+                batch=str(header.get("batch") or "")[:80], rel=str(header.get("rel") or "")[:500],
+            ),
+        )
+    except Exception as e:
+        print(f"[WARN] result catalog failed for {header.get('id')}: {e}")
+
+
+def load(result_id: str) -> Dict:
+    """id → ผล (อ่านไฟล์เดียว); ไม่มี → LookupError"""
+    p = path_for(result_id)
+    if not p.is_file():
+        raise LookupError(f"result not found: {result_id}")
+    return read_file(p)
+
+
+def delete(result_id: str) -> bool:
+    """ลบไฟล์ผล + export ข้างไฟล์ (.srt/.vtt/.min.json) + แถว catalog และ index ค้นหา"""
+    from ..models import StoredResult, Transcript
+
+    p = path_for(result_id)
+    found = p.exists()
+    for q in p.parent.glob(f"{result_id}.*"):
+        q.unlink(missing_ok=True)
+    Transcript.objects.filter(json_path=str(p.resolve())).delete()
+    rows = StoredResult.objects.filter(id=result_id).delete()[0]
+    return found or rows > 0
+
+
+def _date(value, end: bool = False) -> Optional[datetime]:
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value
+    try:
+        d = datetime.fromisoformat(str(value))
+    except ValueError:
+        raise ValueError(f"invalid date: {value!r} (use YYYY-MM-DD or ISO datetime)")
+    if len(str(value)) == 10 and end:
+        d = d.replace(hour=23, minute=59, second=59, microsecond=999999)
+    return d if d.tzinfo else d.astimezone()
+
+
+def _int(value, name: str) -> Optional[int]:
+    if value in (None, ""):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an integer")
+
+
+def catalog(kind: Optional[str] = None, source: Optional[str] = None, since=None, until=None,
+            speakers=None, min_speakers=None, max_speakers=None, batch: Optional[str] = None,
+            limit=50, offset=0) -> Dict:
+    """
+    list ผลที่เซฟไว้จาก catalog (ล่าสุดก่อน) — ไม่เปิดไฟล์ผลเลย
+    source = ส่วนหนึ่งของชื่อไฟล์/path, since/until = วันที่ (YYYY-MM-DD) หรือ ISO datetime,
+    speakers = จำนวนผู้พูดพอดี, min_/max_speakers = ช่วง, batch = ชื่อ batch
+    """
+    from ..models import StoredResult
+
+    if kind and kind not in KIND_DIRS:
+        raise ValueError(f"kind must be one of: {', '.join(KIND_DIRS)}")
+    limit = max(1, min(_int(limit, "limit") or 50, MAX_LIMIT))
+    offset = max(0, _int(offset, "offset") or 0)
+    qs = StoredResult.objects.all()
+    if kind:
+        qs = qs.filter(kind=kind)
+    if source:
+        qs = qs.filter(source__icontains=source)
+    if batch:
+        qs = qs.filter(batch=batch)
+    if (d := _date(since)) is not None:
+        qs = qs.filter(created_at__gte=d)
+    if (d := _date(until, end=True)) is not None:
+        qs = qs.filter(created_at__lte=d)
+    if (n := _int(speakers, "speakers")) is not None:
+        qs = qs.filter(speakers_count=n)
+    if (n := _int(min_speakers, "min_speakers")) is not None:
+        qs = qs.filter(speakers_count__gte=n)
+    if (n := _int(max_speakers, "max_speakers")) is not None:
+        qs = qs.filter(speakers_count__lte=n)
+    rows = list(qs[offset:offset + limit + 1])
+    return {
+        "results": [r.as_dict() for r in rows[:limit]],
+        "next_offset": offset + limit if len(rows) > limit else None,
+    }
+
+
+def store_files() -> Iterable[Path]:
+    for sub in KIND_DIRS.values():
+        yield from sorted((_root() / sub).glob(f"*{SUFFIX}"))
+
+
+def rebuild_catalog(log=print) -> Dict:
+    """sync catalog กับไฟล์ในคลัง (อ่านแค่ header): เพิ่มไฟล์ที่ยังไม่มี, ลบแถวที่ไฟล์หายไปแล้ว"""
+    from ..models import StoredResult
+
+    known = set(StoredResult.objects.values_list("id", flat=True))
+    stats = {"added": 0, "pruned": 0, "failed": 0}
+    seen = set()
+    for p in store_files():
+        seen.add(p.stem)
+        if p.stem in known:
+            continue
+        try:
+            _catalog_add(read_header(p), p, p.stat().st_size)
+            stats["added"] += 1
+        except (OSError, ValueError, KeyError) as e:
+            stats["failed"] += 1
+            log(f"[WARN] {p}: {e}")
+    gone = list(known - seen)
+    for i in range(0, len(gone), 500):
+        stats["pruned"] += StoredResult.objects.filter(id__in=gone[i:i + 500]).delete()[0]
+    return stats
+
+
+def import_json(paths: Iterable[Path], kind: str, remove: bool = False, log=print) -> Dict:
+    """ย้ายผล JSON เดิม (results/transcribe/*.json, results/diar/*.json) เข้าคลัง — created_at = mtime ของไฟล์เดิม"""
+    stats = {"imported": 0, "failed": 0, "bytes_before": 0, "bytes_after": 0}
+    for p in paths:
+        p = Path(p)
+        try:
+            payload = json.loads(p.read_text(encoding="utf-8"))
+            if not isinstance(payload, dict):
+                raise ValueError("not a result object")
+            payload.pop("json_path", None)
+            before = p.stat()
+            header, _, size = _write(payload, kind, datetime.fromtimestamp(before.st_mtime).astimezone())
+            stats["imported"] += 1
+            stats["bytes_before"] += before.st_size
+            stats["bytes_after"] += size
+            if remove:
+                p.unlink()
+            log(f"{p.name} → {header['id']}")
+        except (OSError, ValueError) as e:
+            stats["failed"] += 1
+            log(f"[WARN] {p}: {e}")
+    return stats
@@ -0,0 +1,242 @@
+import os
+import re
+import unicodedata
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from . import metrics, results
+
+# ค้นหาข้อความในผลถอดเสียงที่เซฟแล้ว
+# - Transcript / TranscriptSegment (models.py) + ตาราง FTS5 mediaflow_segment_fts (rowid = id ของ segment)
+# - tokenizer แบบ trigram: ภาษาไทยไม่มีเว้นวรรคระหว่างคำ ตัดคำผิดก็ค้นไม่เจอ → ค้นแบบ substring แทน
+#   ไม่ต้องพึ่งตัวตัดคำ และใช้ได้กับไทย/อังกฤษปนกัน; คำค้นที่สั้นกว่า 3 ตัวอักษรกรองด้วย LIKE ต่อจากผล FTS
+# - ข้อความที่ index ผ่าน normalize() (แก้รูปแบบพิมพ์ไทยที่ต่างกันแต่อ่านเหมือนกัน) — คำค้นก็ normalize แบบเดียวกัน
+# - index ตอนเซฟผล (pipeline / batch) ทีละไฟล์; ไฟล์เก่าใช้ manage.py mediaflow_reindex
+
+FTS_TABLE = "mediaflow_segment_fts"
+MIN_FTS_TERM = 3            # trigram: คำค้นต้องยาว ≥ 3 ตัวอักษรถึงจะใช้ index ได้
+MAX_LIMIT = 200
+
+_INVISIBLE = re.compile("[\u200b\u200c\u200d\u2060\ufeff\u00ad]")   # zero-width / soft hyphen
+_THAI_FIXES = (
+    ("\u0e4d\u0e32", "\u0e33"),   # นิคหิต + สระอา → สระอำ
+    ("\u0e40\u0e40", "\u0e41"),   # เ + เ → แ
+)
+_SPACES = re.compile(r"\s+")
+
+
+def enabled() -> bool:
+    return os.getenv("MEDIAFLOW_SEARCH_INDEX", "1") != "0"
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFC", text or "")
+    text = _INVISIBLE.sub("", text)
+    for a, b in _THAI_FIXES:
+        text = text.replace(a, b)
+    return _SPACES.sub(" ", text).strip()
+
+
+def _fts_available() -> bool:
+    return connection.vendor == "sqlite"
+
+
+# ---- Indexing --------------------------------------------------------------------
+def index_transcript(result: Dict, json_path: str | Path) -> Optional[int]:
+    """
+    index ผลถอดเสียงหนึ่งไฟล์ (แทนที่ของเดิมถ้า json_path เคย index แล้ว) → id ของ Transcript
+    """
+    from ..models import Transcript, TranscriptSegment
+
+    json_path = str(Path(json_path).resolve())
+    try:
+        mtime = os.path.getmtime(json_path)
+    except OSError:
+        mtime = 0.0
+    segments = result.get("segments") or []
+    source = result.get("source") or json_path
+    duration = (result.get("metrics") or {}).get("audio_s") or max((s.get("end", 0.0) for s in segments), default=0.0)
+
+    with metrics.span("search.index"), transaction.atomic():
+        Transcript.objects.filter(json_path=json_path).delete()   # trigger ลบแถว FTS ให้ด้วย
+        tr = Transcript.objects.create(
+            json_path=json_path,
+            source=source,
+            title=results.title(source),
+            speakers=sorted({str(s.get("speaker", "")) for s in segments if s.get("speaker")}),
+            duration_s=round(float(duration), 3),
+            file_mtime=mtime,
+            created_at=datetime.fromtimestamp(mtime or datetime.now().timestamp(), tz=timezone.utc),
+        )
+        rows = TranscriptSegment.objects.bulk_create([
+            TranscriptSegment(
+                transcript=tr, idx=i,
+                start=float(s.get("start", 0.0)), end=float(s.get("end", 0.0)),
+                speaker=str(s.get("speaker", ""))[:120], speaker_id=str(s.get("speaker_id", ""))[:32],
+                text=str(s.get("text", "")),
+            )
+            for i, s in enumerate(segments)
+        ])
+        if _fts_available() and rows:
+            with connection.cursor() as cur:
+                cur.executemany(
+                    f"INSERT INTO {FTS_TABLE}(rowid, text) VALUES (%s, %s)",
+                    [(r.id, normalize(r.text)) for r in rows],
+                )
+    metrics.inc("search_indexed_segments", len(segments))
+    return tr.id
+
+
+def index_saved(result: Dict, json_path: str | Path):
+    """เรียกหลังเซฟผล — index พังไม่ทำให้งานถอดเสียงล้ม (reindex ทีหลังได้)"""
+    if not enabled():
+        return
+    try:
+        index_transcript(result, json_path)
+    except Exception as e:
+        print(f"[WARN] search index failed for {json_path}: {e}")
+
+
+def result_files() -> Iterable[Path]:
+    """ไฟล์ผลถอดเสียงทั้งหมด: คลัง results/transcribe/*.mfr (+ *.json รุ่นเก่า) + results/batch/<name>/**/*.json (batch รุ่นเก่า)"""
+    root = Path(settings.RESULTS_ROOT)
+    yield from sorted((root / "transcribe").glob(f"*{results.SUFFIX}"))
+    for p in sorted((root / "transcribe").glob("*.json")) + sorted((root / "batch").rglob("*.json")):
+        # _batch.json = สถานะ batch, *.min.json = export แบบ compact ของไฟล์ผลเดียวกัน
+        if not p.name.startswith("_") and not p.name.endswith(".min.json"):
+            yield p
+
+
+def reindex(paths: Optional[Iterable[Path]] = None, force: bool = False, prune: bool = True, log=print) -> Dict:
+    """index ไฟล์ที่ยังไม่เคย index หรือแก้ไขหลัง index (force = ทำใหม่ทั้งหมด); prune = ลบรายการที่ไฟล์หายไปแล้ว"""
+    from ..models import Transcript
+
+    known = dict(Transcript.objects.values_list("json_path", "file_mtime"))
+    stats = {"indexed": 0, "skipped": 0, "failed": 0, "pruned": 0}
+    seen = set()
+    for p in (paths if paths is not None else result_files()):
+        p = Path(p).resolve()
+        seen.add(str(p))
+        try:
+            if not force and known.get(str(p)) == p.stat().st_mtime:
+                stats["skipped"] += 1
+                continue
+            payload = results.read_file(p)
+            if not isinstance(payload, dict) or not isinstance(payload.get("segments"), list):
+                stats["skipped"] += 1
+                continue
+            index_transcript(payload, p)
+            stats["indexed"] += 1
+        except Exception as e:
+            stats["failed"] += 1
+            log(f"[WARN] {p}: {e}")
+    if prune and paths is None:
+        gone = [jp for jp in known if jp not in seen and not Path(jp).exists()]
+        for i in range(0, len(gone), 500):
+            stats["pruned"] += Transcript.objects.filter(json_path__in=gone[i:i + 500]).delete()[1].get(
+                "mediaflow.Transcript", 0)
+    return stats
+
+
+# ---- Query ----------------------------------------------------------------------------
+def _terms(q: str) -> List[str]:
+    """แยกคำค้นตามช่องว่าง ("..." = วลีที่มีช่องว่าง); ทุกคำต้องพบ (AND)"""
+    q = normalize(q)
+    out = [a or b for a, b in re.findall(r'"([^"]+)"|(\S+)', q)]
+    return [t.strip() for t in out if t.strip()]
+
+
+def _like(term: str) -> str:
+    return "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def search(
+    q: str,
+    *,
+    speaker: Optional[str] = None,
+    transcript: Optional[int] = None,
+    limit: int = 50,
+    offset: int = 0,
+    order: str = "recent",
+) -> Dict:
+    """
+    ค้นช่วงที่มีทุกคำใน q → {"hits": [...], "next_offset": n | None}
+    hit = transcript (การประชุม) + speaker + start/end + text + snippet ([คำที่เจอ])
+    order: recent = ที่ index ล่าสุดก่อน (FTS หยุดได้ทันทีที่ครบ limit → เร็วแม้คำที่พบทุกไฟล์)
+           rank = ความเกี่ยวข้อง (bm25) — ต้องให้คะแนนทุกช่วงที่พบ ช้ากว่าเมื่อคำค้นพบบ่อย
+    """
+    if order not in ("recent", "rank"):
+        raise ValueError("order must be recent or rank")
+    from ..models import Transcript, TranscriptSegment
+
+    terms = _terms(q)
+    if not terms:
+        raise ValueError("empty query")
+    limit = max(1, min(int(limit), MAX_LIMIT))
+    offset = max(0, int(offset))
+
+    with metrics.span("search.query"):
+        if _fts_available():
+            rows = _search_fts(terms, speaker, transcript, limit + 1, offset, order)
+        else:
+            qs = TranscriptSegment.objects.all()
+            for t in terms:
+                qs = qs.filter(text__icontains=t)
+            if speaker:
+                qs = qs.filter(speaker=speaker)
+            if transcript:
+                qs = qs.filter(transcript_id=transcript)
+            rows = [(s.id, s.transcript_id, s.idx, s.start, s.end, s.speaker, s.speaker_id, s.text, s.text)
+                    for s in qs.order_by("-transcript__created_at", "idx")[offset:offset + limit + 1]]
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    meetings = Transcript.objects.in_bulk({r[1] for r in rows})
+    hits = []
+    for seg_id, tr_id, idx, start, end, spk, spk_id, text, snippet in rows:
+        tr = meetings.get(tr_id)
+        hits.append({
+            "transcript": tr.as_dict() if tr else {"id": tr_id},
+            "segment": idx,
+            "speaker": spk,
+            **({"speaker_id": spk_id} if spk_id else {}),
+            "start": start,
+            "end": end,
+            "text": text,
+            "snippet": snippet,
+        })
+    return {"query": q, "terms": terms, "hits": hits, "next_offset": offset + limit if more else None}
+
+
+def _search_fts(terms: List[str], speaker, transcript, limit: int, offset: int, order: str) -> List[tuple]:
+    fts_terms = [t for t in terms if len(t) >= MIN_FTS_TERM]
+    where, params = [], []
+    if fts_terms:
+        # ใส่ "..." ทุกคำ → อักขระพิเศษของ FTS (AND, OR, *, -, :) เป็นข้อความธรรมดา
+        where.append(f"{FTS_TABLE} MATCH %s")
+        params.append(" ".join('"' + t.replace('"', '""') + '"' for t in fts_terms))
+    for t in terms:
+        if len(t) < MIN_FTS_TERM:
+            where.append(f"{FTS_TABLE}.text LIKE %s ESCAPE '\\'")
+            params.append(_like(t))
+    if speaker:
+        where.append("s.speaker = %s")
+        params.append(speaker)
+    if transcript:
+        where.append("s.transcript_id = %s")
+        params.append(int(transcript))
+    order_by = f"{FTS_TABLE}.rank" if fts_terms and order == "rank" else f"{FTS_TABLE}.rowid DESC"
+    # trigram: 1 token = 1 ตัวอักษร → 64 = ข้อความราวหนึ่งประโยครอบคำที่พบ (สูงสุดที่ snippet() รับ)
+    snippet = f"snippet({FTS_TABLE}, 0, '[', ']', '…', 64)" if fts_terms else f"{FTS_TABLE}.text"
+    sql = (
+        f"SELECT s.id, s.transcript_id, s.idx, s.start, s.\"end\", s.speaker, s.speaker_id, s.text, {snippet} "
+        f"FROM {FTS_TABLE} JOIN mediaflow_transcriptsegment s ON s.id = {FTS_TABLE}.rowid "
+        f"WHERE {' AND '.join(where)} ORDER BY {order_by} LIMIT %s OFFSET %s"
+    )
+    with connection.cursor() as cur:
+        cur.execute(sql, params + [limit, offset])
+        return cur.fetchall()
@@ -0,0 +1,217 @@
+import numpy as np
+from itertools import repeat
+from operator import itemgetter, methodcaller
+from typing import Dict, List, Sequence, Tuple
+
+# Segment post-processing แบบ array (start/end = float64, speaker = รหัส int)
+# - เรียง/merge/collar/padding ทำแบบ vectorized; การดูด turn สั้น (ต้องพึ่งผลก่อนหน้า) เป็น scan เดียวแบบ linear
+# - ไม่มี list.pop กลาง list → O(n) แม้มี turn สั้นๆ เป็นหมื่นช่วง
+# - ผลลัพธ์ต้องตรงกับเวอร์ชัน list-of-dict เดิมทุกตัวอักษร (รวม key อื่นๆ ใน dict และการปัดเศษ)
+
+
+def _max0(x: np.ndarray, floor: float) -> np.ndarray:
+    """เหมือน max(floor, x) ของ Python (คืน floor เมื่อ x ไม่มากกว่า floor)"""
+    return np.where(x > floor, x, floor)
+
+
+def _columns(segs: Sequence[Dict], speaker_key) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """dicts → (start, end, speaker code, ลำดับหลัง sort ตาม (start, end) แบบ stable)"""
+    n = len(segs)
+    start = np.fromiter(map(float, map(itemgetter("start"), segs)), dtype=np.float64, count=n)
+    end = np.fromiter(map(float, map(itemgetter("end"), segs)), dtype=np.float64, count=n)
+    labels = list(map(speaker_key, segs))
+    codes = {v: i for i, v in enumerate(dict.fromkeys(labels))}
+    spk = np.fromiter(map(codes.__getitem__, labels), dtype=np.int64, count=n)
+    order = np.lexsort((end, start))
+    return start, end, spk, order
+
+
+def _segmented_cummax(values: np.ndarray, run_id: np.ndarray) -> np.ndarray:
+    """
+    cumulative max ที่เริ่มนับใหม่ทุก run — ทำบน rank (int) แทนค่า float จึงได้ค่าเดิมเป๊ะ ไม่มีปัญหาปัดเศษ
+    """
+    n = len(values)
+    ordered = np.sort(values)
+    rank = np.searchsorted(ordered, values)
+    offset = run_id * (n + 1)
+    return ordered[np.maximum.accumulate(rank + offset) - offset]
+
+
+def _merge_same_speaker_loop(st: np.ndarray, en: np.ndarray, sp: np.ndarray, gap: float):
+    st_l, en_l, sp_l = st.tolist(), en.tolist(), sp.tolist()
+    heads: List[int] = []
+    for i in range(len(st_l)):
+        if heads:
+            h = heads[-1]
+            if sp_l[i] == sp_l[h] and st_l[i] - en_l[h] <= gap:
+                if en_l[i] > en_l[h]:
+                    en_l[h] = en_l[i]
+                continue
+        heads.append(i)
+    return np.asarray(heads, dtype=np.int64), np.asarray(en_l)[heads]
+
+
+def _merge_same_speaker(st: np.ndarray, en: np.ndarray, sp: np.ndarray, gap: float):
+    """
+    รวม speaker เดียวกันที่ห่างกัน <= gap (ข้อมูลเรียงตาม start แล้ว) → (index หัวกลุ่ม, end ของกลุ่ม)
+    - ถ้าทุกช่วงมี end >= start: ค่า end สะสมของกลุ่ม = cummax ของทั้ง run ผู้พูด → vectorized ได้
+    - ไม่งั้น (ข้อมูลแปลก/NaN) ใช้ loop แบบเดิม
+    """
+    n = len(st)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    if gap < 0 or not np.all(en >= st):
+        return _merge_same_speaker_loop(st, en, sp, gap)
+    run_start = np.ones(n, dtype=bool)
+    run_start[1:] = sp[1:] != sp[:-1]
+    run_id = np.cumsum(run_start) - 1
+    run_max = _segmented_cummax(en, run_id)
+    cont = np.zeros(n, dtype=bool)
+    cont[1:] = ~run_start[1:] & (st[1:] - run_max[:-1] <= gap)
+    heads = np.flatnonzero(~cont)
+    return heads, np.maximum.reduceat(en, heads)
+
+
+def _merge_any_speaker(ks: np.ndarray, ke: np.ndarray, kp: np.ndarray, gap: float):
+    """
+    รวมช่วงที่ผู้พูดเดียวกับหัวกลุ่ม หรือห่างจาก end ของกลุ่มไม่เกิน gap → (index หัวกลุ่ม, end ของกลุ่ม)
+    - ถ้าทุกช่วงมี end >= start: end ของกลุ่ม = cummax ทั้งลำดับ และหัวกลุ่มหลังแต่ละจุดที่ห่างเกิน gap
+      คือผู้พูดของจุดนั้นเสมอ → ตัดสินทุกจุดพร้อมกันได้
+    """
+    m = len(ks)
+    if m == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    if gap >= 0 and np.all(ke >= ks):
+        run_max = np.maximum.accumulate(ke)
+        far = np.flatnonzero(ks[1:] - run_max[:-1] > gap) + 1
+        head_spk = np.concatenate([kp[:1], kp[far[:-1]]])
+        heads = np.concatenate([[0], far[kp[far] != head_spk]]).astype(np.int64)
+        return heads, np.maximum.reduceat(ke, heads)
+    ks_l, ke_l, kp_l = ks.tolist(), ke.tolist(), kp.tolist()
+    out_rows: List[int] = []
+    for r in range(m):
+        if out_rows:
+            last = out_rows[-1]
+            if kp_l[r] == kp_l[last] or ks_l[r] - ke_l[last] <= gap:
+                if ke_l[r] > ke_l[last]:
+                    ke_l[last] = ke_l[r]
+                continue
+        out_rows.append(r)
+    return np.asarray(out_rows, dtype=np.int64), np.asarray(ke_l)[out_rows]
+
+
+def clean_diar_segments(segs: List[Dict], min_turn=0.50, merge_gap=0.20, collar=0.05) -> List[Dict]:
+    if not segs: return []
+    start, end, spk, order = _columns(segs, itemgetter("speaker"))
+    st, en, sp = start[order], end[order], spk[order]
+
+    # 1) รวม speaker เดียวกันที่ติดกัน
+    heads, me = _merge_same_speaker(st, en, sp, merge_gap)
+    src = order[heads]
+    ms = st[heads]
+    msp = sp[heads]
+
+    # 2) collar + ห้ามเริ่มก่อนช่วงก่อนหน้าจบ
+    ms = _max0(ms - collar, 0.0)
+    me = me + collar
+    if len(ms) > 1:
+        prev_end = me[:-1]
+        ms[1:] = np.where(prev_end > ms[1:], prev_end, ms[1:])
+
+    # 3) ดูด turn สั้นที่ถูกประกบด้วยผู้พูดคนเดียวกัน (A B A → A)
+    #    ลำดับการดูดมีผลต่อกัน → scan ด้วย stack (O(n)) เฉพาะเมื่อมีช่วงที่เข้าเงื่อนไข
+    m = len(ms)
+    keep = np.arange(m)
+    dur = me - ms
+    if m > 2 and np.any((dur[1:-1] < min_turn) & (msp[:-2] == msp[2:]) & (msp[1:-1] != msp[2:])):
+        ms_l, me_l, sp_l = ms.tolist(), me.tolist(), msp.tolist()
+        stack = [0]
+        idx = list(range(m))
+        j = 1
+        while stack and j < m - 1:
+            prev, cur, nxt = stack[-1], idx[j], idx[j + 1]
+            if (me_l[cur] - ms_l[cur]) < min_turn and sp_l[prev] == sp_l[nxt] != sp_l[cur]:
+                me_l[prev] = me_l[nxt]
+                stack.pop()
+                idx[j + 1] = prev       # ถอยกลับไปพิจารณา prev อีกรอบ
+            else:
+                stack.append(cur)
+            j += 1
+        keep = np.asarray(stack + idx[j:], dtype=np.int64)
+        me = np.asarray(me_l)
+
+    # 4) รวมช่วงที่เป็นคนเดียวกัน หรือห่างกันไม่เกิน merge_gap
+    ks, ke, kp = ms[keep], me[keep], msp[keep]
+    out, out_end = _merge_any_speaker(ks, ke, kp, merge_gap)
+
+    rows = src[keep][out].tolist()
+    starts = map(round, ks[out].tolist(), repeat(3))
+    ends = map(round, out_end.tolist(), repeat(3))
+    return [{**segs[i], "start": a, "end": b} for i, a, b in zip(rows, starts, ends)]
+
+
+def prepare_asr_segments(
+    raw: List[Dict],
+    pad_head: float = 0.25,
+    pad_tail: float = 0.35,
+    min_len:  float = 1.5,
+    merge_gap: float = 0.30,
+    max_len: float = 18.0,
+) -> List[Dict]:
+    if not raw:
+        return []
+
+    start, end, spk, order = _columns(raw, methodcaller("get", "speaker"))
+    st, en, sp = start[order], end[order], spk[order]
+
+    # รวม speaker เดียวกันที่ติดกัน/ห่างกันน้อย
+    heads, me = _merge_same_speaker(st, en, sp, merge_gap)
+    ms, msp = st[heads], sp[heads]
+    src = order[heads]
+
+    # รวมจนพอขั้นต่ำ — หลังข้อบนช่วงที่ติดกันมักต่างผู้พูดหรือห่างเกิน merge_gap อยู่แล้ว
+    # จึงเข้า loop เฉพาะเมื่อมีคู่ที่เข้าเงื่อนไขจริง
+    limit = max(min_len, max_len)
+    if len(ms) > 1 and np.any(
+        (msp[1:] == msp[:-1]) & ((ms[1:] - me[:-1]) <= merge_gap) & ((me[1:] - ms[:-1]) < limit)
+    ):
+        ms_l, me_l, sp_l, src_l = ms.tolist(), me.tolist(), msp.tolist(), src.tolist()
+        rs, re_, rsrc = [], [], []
+        i, n = 0, len(ms_l)
+        while i < n:
+            c_start, c_end, c_spk, c_src = ms_l[i], me_l[i], sp_l[i], src_l[i]
+            while (
+                i + 1 < n
+                and sp_l[i + 1] == c_spk
+                and (ms_l[i + 1] - c_end) <= merge_gap
+                and (me_l[i + 1] - c_start) < limit
+            ):
+                c_end = me_l[i + 1]
+                i += 1
+            rs.append(c_start); re_.append(c_end); rsrc.append(c_src)
+            i += 1
+        ms, me, src = np.asarray(rs), np.asarray(re_), np.asarray(rsrc, dtype=np.int64)
+
+    # เติม padding (vectorized) แล้วซอยเฉพาะช่วงที่ยาวเกิน max_len
+    a_start = _max0(ms - pad_head, 0.0)
+    a_end = me + pad_tail
+    a_dur = _max0(a_end - a_start, 0.02)
+    fits = (a_dur <= max_len).tolist()
+    ps, pe = a_start.tolist(), a_end.tolist()
+
+    final: List[Dict] = []
+    for k, s_idx in enumerate(src.tolist()):
+        s = raw[s_idx]
+        if fits[k]:
+            final.append({**s, "start": ps[k], "end": pe[k]})
+            continue
+        # ซอยเป็นชิ้นย่อย (มี overlap)
+        cur, end_k = ps[k], pe[k]
+        while cur < end_k:
+            sub_end = min(end_k, cur + max_len)
+            final.append({**s, "start": round(cur, 3), "end": round(sub_end, 3)})
+            if sub_end >= end_k:
+                break
+            cur = sub_end - 0.3
+
+    return final
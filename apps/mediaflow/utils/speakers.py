@@ -0,0 +1,370 @@
+import os
+import json
+import time
+import uuid
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from .audio import SAMPLE_RATE, load_pcm16k, slice_pcm, to_float32
+from . import cache, metrics, workers
+
+# Speaker index: ระบุตัวผู้พูดข้ามไฟล์ (SPEAKER_00 ของแต่ละไฟล์ → คนที่ลงทะเบียนไว้)
+# - embedding ต่อ label = ค่าเฉลี่ย (ถ่วงความยาว) ของ embedding ช่วงที่ยาวที่สุดของ label นั้น รวมไม่เกิน EMBED_MAX_S
+#   ใช้โมเดล embedding ตัวเดียวกับ pipeline ของ pyannote; แคชต่อไฟล์ (stage "spkemb") → จับคู่ซ้ำไม่ต้องคำนวณใหม่
+# - index บนดิสก์ใต้ SPEAKERS_ROOT: vectors.f32 (n × dim, L2-normalized, ต่อท้ายอย่างเดียว) + rows.jsonl (speaker_id ต่อแถว)
+#   + speakers.json (ชื่อ/ข้อมูลของแต่ละคน) — ค้นแบบ exact cosine (matrix-vector บน memmap)
+#   หลายหมื่นเสียง × 256 มิติ ≈ สิบกว่า MB ค้นได้ในระดับมิลลิวินาที ไม่ต้องพึ่ง ANN library
+# - จับคู่แบบหนึ่งต่อหนึ่งภายในไฟล์ (greedy ตาม similarity) เฉพาะคู่ที่ ≥ SPEAKER_MATCH_THRESHOLD
+# - index ว่าง → ไม่คำนวณ embedding เลย (ไม่เสียเวลาถ้าไม่ได้ใช้ฟีเจอร์นี้)
+
+EMBED_MIN_SEG_S = 1.0
+EMBED_MAX_SEG_S = 10.0
+EMBED_MAX_S = 30.0
+
+
+def _threshold() -> float:
+    try:
+        return float(os.getenv("SPEAKER_MATCH_THRESHOLD", "0.55"))
+    except ValueError:
+        return 0.55
+
+
+def _root() -> Path:
+    return Path(getattr(settings, "SPEAKERS_ROOT", settings.BASE_DIR / "data" / "speakers"))
+
+
+# ---- Embeddings ----------------------------------------------------------------------
+@lru_cache(maxsize=1)
+def _get_embedding():
+    """โมเดล embedding ของ pipeline pyannote (โหลดพร้อม pipeline อยู่แล้ว) → (model_id, callable)"""
+    from . import diarize
+    pipe = diarize._get_pipeline()
+    emb = getattr(pipe, "_embedding", None)
+    if emb is None:
+        raise RuntimeError(f"pipeline '{diarize.MODEL_ID}' has no speaker embedding model")
+    model_id = getattr(pipe, "embedding", None) or type(emb).__name__
+    return str(model_id), emb
+
+
+def embedding_model_id() -> str:
+    return _get_embedding()[0]
+
+
+def _embed_crop(emb, x: np.ndarray) -> Optional[np.ndarray]:
+    import torch
+    with torch.inference_mode():
+        v = np.asarray(emb(torch.from_numpy(x[None, None, :])))[0]
+    if not np.all(np.isfinite(v)):
+        return None
+    n = np.linalg.norm(v)
+    return v / n if n > 0 else None
+
+
+def _pick_segments(segments: List[Dict]) -> Dict[str, List[Tuple[float, float]]]:
+    """ต่อ label: ช่วงที่ยาวที่สุดก่อน (ตัดแต่ละช่วงไม่เกิน EMBED_MAX_SEG_S) จนรวมครบ EMBED_MAX_S"""
+    by: Dict[str, List[Dict]] = {}
+    for s in segments:
+        by.setdefault(s["speaker"], []).append(s)
+    picked: Dict[str, List[Tuple[float, float]]] = {}
+    for spk, segs in by.items():
+        segs = sorted(segs, key=lambda s: s["start"] - s["end"])
+        out, total = [], 0.0
+        for s in segs:
+            dur = min(s["end"] - s["start"], EMBED_MAX_SEG_S)
+            if dur < EMBED_MIN_SEG_S or total >= EMBED_MAX_S:
+                break
+            out.append((s["start"], dur))
+            total += dur
+        if not out and segs[0]["end"] - segs[0]["start"] >= EMBED_MIN_SEG_S / 2:
+            s = segs[0]                       # พูดสั้นทุกช่วง → ใช้ช่วงที่ยาวที่สุดเท่าที่มี
+            out = [(s["start"], s["end"] - s["start"])]
+        if out:
+            picked[spk] = out
+    return picked
+
+
+def embed_speakers_local(pcm: np.ndarray, segments: List[Dict]) -> Dict[str, List[float]]:
+    """{label: embedding (L2-normalized)} — label ที่คำนวณไม่ได้ (เสียงสั้นเกิน) จะไม่มีใน dict"""
+    _, emb = _get_embedding()
+    out: Dict[str, List[float]] = {}
+    for spk, crops in _pick_segments(segments).items():
+        acc, wsum = None, 0.0
+        for start, dur in crops:
+            v = _embed_crop(emb, to_float32(slice_pcm(pcm, start, dur)))
+            if v is None:
+                continue
+            acc = v * dur if acc is None else acc + v * dur
+            wsum += dur
+        if acc is not None:
+            n = np.linalg.norm(acc)
+            if n > 0:
+                out[spk] = (acc / n).astype(np.float32).tolist()
+    return out
+
+
+def label_embeddings(audio_key: str, segments: List[Dict], wav_path: Optional[str | Path] = None, pcm=None) -> Dict[str, List[float]]:
+    """embedding ต่อ label ของไฟล์หนึ่ง (แคชตาม audio_key + segments + โมเดล)"""
+    key = cache.cache_key("spkemb", audio_key, segments, embedding_model_id(), EMBED_MAX_S)
+    hit = cache.get_json("spkemb", key)
+    if hit is not None:
+        return hit
+    with metrics.span("speakers.embed"):
+        if workers.enabled() and wav_path:
+            embs = workers.embed_speakers(wav_path, segments)
+        else:
+            if pcm is None:
+                pcm = load_pcm16k(wav_path)
+            embs = embed_speakers_local(pcm, segments)
+    cache.put_json("spkemb", key, embs)
+    return embs
+
+
+# ---- Index ------------------------------------------------------------------------------
+class SpeakerIndex:
+    """
+    index บนดิสก์ (ดูคำอธิบายต้นไฟล์) — อ่านซ้ำอัตโนมัติเมื่อไฟล์เปลี่ยน (เช่น process อื่นลงทะเบียนเพิ่ม)
+    เขียนได้ทีละ thread ใน process เดียว (lock) — ลงทะเบียนเป็นงานนานๆ ครั้ง
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._lock = threading.Lock()
+        self._stamp = None
+        self.meta: Dict = {}
+        self.speakers: Dict[str, Dict] = {}
+        self.rows: List[str] = []
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self._order = np.zeros(0, dtype=np.int64)
+        self._starts = np.zeros(0, dtype=np.int64)
+        self.spk_ids: List[str] = []
+
+    # -- files
+    def _files(self):
+        return self.root / "index.json", self.root / "speakers.json", self.root / "rows.jsonl", self.root / "vectors.f32"
+
+    def _current_stamp(self):
+        return tuple((p.stat().st_mtime_ns, p.stat().st_size) if p.exists() else None for p in self._files())
+
+    def _reload(self):
+        stamp = self._current_stamp()
+        if stamp == self._stamp:
+            return
+        f_meta, f_spk, f_rows, f_vec = self._files()
+        self.meta = json.loads(f_meta.read_text(encoding="utf-8")) if f_meta.exists() else {}
+        self.speakers = json.loads(f_spk.read_text(encoding="utf-8")) if f_spk.exists() else {}
+        self.rows = [json.loads(l)["speaker_id"] for l in f_rows.read_text(encoding="utf-8").splitlines() if l.strip()] \
+            if f_rows.exists() else []
+        dim = self.meta.get("dim", 0)
+        n = min(len(self.rows), (f_vec.stat().st_size // (4 * dim)) if dim and f_vec.exists() else 0)
+        self.rows = self.rows[:n]   # แถวที่เขียนไม่ครบ (ล้มกลางทาง) ไม่นับ
+        self.vectors = np.memmap(f_vec, dtype=np.float32, mode="r", shape=(n, dim)) if n else np.zeros((0, dim), np.float32)
+        self.spk_ids = sorted(set(self.rows) & set(self.speakers))
+        pos = {s: i for i, s in enumerate(self.spk_ids)}
+        row_spk = np.array([pos.get(s, -1) for s in self.rows], dtype=np.int64)
+        # เรียงแถวตามคน → max ต่อคนด้วย reduceat ครั้งเดียว (ทุกคนใน spk_ids มีอย่างน้อยหนึ่งแถว)
+        self._order = np.flatnonzero(row_spk >= 0)[np.argsort(row_spk[row_spk >= 0], kind="stable")]
+        self._starts = np.searchsorted(row_spk[self._order], np.arange(len(self.spk_ids)))
+        self._stamp = stamp
+
+    def __len__(self):
+        with self._lock:
+            self._reload()
+            return len(self.spk_ids)
+
+    # -- query
+    def search(self, queries: np.ndarray, model_id: str) -> Tuple[np.ndarray, List[str], Dict[str, str]]:
+        """
+        similarity (m × จำนวนคนที่ลงทะเบียน) = max cosine ต่อคน, คู่กับ speaker_id ของแต่ละคอลัมน์ และชื่อ
+        index ที่สร้างจากโมเดล embedding อื่น → ไม่มีคอลัมน์ (เทียบกันไม่ได้)
+        """
+        with self._lock:
+            self._reload()
+            if not self.spk_ids or self.meta.get("model") != model_id:
+                return np.zeros((len(queries), 0), dtype=np.float32), [], {}
+            sims = np.asarray(queries, dtype=np.float32) @ self.vectors.T          # m × n
+            best = np.maximum.reduceat(sims[:, self._order], self._starts, axis=1)
+            return best, list(self.spk_ids), {k: v["name"] for k, v in self.speakers.items()}
+
+    def list(self) -> List[Dict]:
+        with self._lock:
+            self._reload()
+            counts: Dict[str, int] = {}
+            for s in self.rows:
+                counts[s] = counts.get(s, 0) + 1
+            return [{"speaker_id": sid, **info, "embeddings": counts.get(sid, 0)} for sid, info in self.speakers.items()]
+
+    # -- write
+    def _write_json(self, path: Path, payload):
+        tmp = path.with_name(f".{path.name}.tmp")
+        tmp.write_text(json.dumps(payload, ensure_ascii=False, indent=1), encoding="utf-8")
+        os.replace(tmp, path)
+
+    def add(self, name: str, vector: List[float], model_id: str, speaker_id: Optional[str] = None,
+            source: Optional[Dict] = None) -> str:
+        """เพิ่ม embedding หนึ่งอัน ให้คนเดิม (speaker_id) หรือสร้างคนใหม่ชื่อ name"""
+        v = np.asarray(vector, dtype=np.float32)
+        v = v / (np.linalg.norm(v) or 1.0)
+        with self._lock:
+            self._reload()
+            self.root.mkdir(parents=True, exist_ok=True)
+            f_meta, f_spk, f_rows, f_vec = self._files()
+            if not self.meta:
+                self.meta = {"dim": int(v.shape[0]), "model": model_id}
+                self._write_json(f_meta, self.meta)
+            if self.meta["dim"] != v.shape[0] or self.meta["model"] != model_id:
+                raise ValueError(f"embedding model mismatch: index uses {self.meta['model']} ({self.meta['dim']}d)")
+            if speaker_id is None:
+                speaker_id = f"spk_{uuid.uuid4().hex[:10]}"
+            if speaker_id not in self.speakers:
+                if not name:
+                    raise ValueError("name is required for a new speaker")
+                self.speakers[speaker_id] = {"name": name, "created_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+                self._write_json(f_spk, self.speakers)
+            elif name and self.speakers[speaker_id].get("name") != name:
+                self.speakers[speaker_id]["name"] = name
+                self._write_json(f_spk, self.speakers)
+            # vectors ก่อน rows: ถ้าล้มกลางทาง แถวที่ไม่มี rows จะถูกตัดทิ้งตอนอ่าน
+            with f_vec.open("ab") as fh:
+                fh.write(v.tobytes())
+            with f_rows.open("a", encoding="utf-8") as fh:
+                fh.write(json.dumps({"speaker_id": speaker_id, **(source or {})}, ensure_ascii=False) + "\n")
+            self._stamp = None
+            return speaker_id
+
+    def remove(self, speaker_id: str) -> bool:
+        """ลบคน + embedding ทั้งหมดของคนนั้น (เขียน vectors/rows ใหม่ทั้งชุด)"""
+        with self._lock:
+            self._reload()
+            if speaker_id not in self.speakers:
+                return False
+            f_meta, f_spk, f_rows, f_vec = self._files()
+            keep = [i for i, s in enumerate(self.rows) if s != speaker_id]
+            lines = [l for l in f_rows.read_text(encoding="utf-8").splitlines() if l.strip()][:len(self.rows)]
+            vec = np.ascontiguousarray(self.vectors[keep]) if keep else np.zeros((0, self.meta.get("dim", 0)), np.float32)
+            tmp_vec, tmp_rows = f_vec.with_name(".vectors.f32.tmp"), f_rows.with_name(".rows.jsonl.tmp")
+            vec.tofile(tmp_vec)
+            tmp_rows.write_text("".join(lines[i] + "\n" for i in keep), encoding="utf-8")
+            self.vectors = np.zeros((0, 0), np.float32)   # ปล่อย memmap ก่อนแทนที่ไฟล์
+            os.replace(tmp_vec, f_vec)
+            os.replace(tmp_rows, f_rows)
+            del self.speakers[speaker_id]
+            self._write_json(f_spk, self.speakers)
+            self._stamp = None
+            return True
+
+
+_index: Optional[SpeakerIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> SpeakerIndex:
+    global _index
+    with _index_lock:
+        if _index is None or _index.root != _root():
+            _index = SpeakerIndex(_root())
+        return _index
+
+
+# ---- Identify / enroll ----------------------------------------------------------------------
+def match(segments: List[Dict], audio_key: str, wav_path=None, pcm=None) -> Dict[str, Dict]:
+    """
+    จับคู่ label ของไฟล์นี้กับคนที่ลงทะเบียนไว้ → {label: {speaker_id, name, score}}
+    label ที่ไม่ตรงกับใคร (หรือ index ว่าง) ไม่อยู่ใน dict
+    """
+    index = get_index()
+    if not segments or len(index) == 0:
+        return {}
+    embs = label_embeddings(audio_key, segments, wav_path=wav_path, pcm=pcm)
+    labels = sorted(embs)
+    if not labels:
+        return {}
+    with metrics.span("speakers.search"):
+        sims, spk_ids, names = index.search(np.array([embs[l] for l in labels], dtype=np.float32), embedding_model_id())
+    if sims.shape[1] == 0:
+        return {}
+
+    # greedy หนึ่งต่อหนึ่ง: คู่ที่ similarity สูงสุดก่อน
+    thr = _threshold()
+    pairs = sorted(((float(sims[i, j]), i, j) for i in range(len(labels)) for j in range(sims.shape[1])
+                    if sims[i, j] >= thr), reverse=True)
+    mapping: Dict[str, Dict] = {}
+    used = set()
+    for score, i, j in pairs:
+        if labels[i] in mapping or j in used:
+            continue
+        sid = spk_ids[j]
+        mapping[labels[i]] = {"speaker_id": sid, "name": names.get(sid, sid), "score": round(score, 4)}
+        used.add(j)
+    metrics.inc("speaker_match", len(mapping), result="matched")
+    metrics.inc("speaker_match", len(labels) - len(mapping), result="unknown")
+    return mapping
+
+
+def apply(segments: List[Dict], mapping: Dict[str, Dict]) -> List[Dict]:
+    """speaker = ชื่อคนที่จับคู่ได้ (+ speaker_id, speaker_label = label เดิมของไฟล์)"""
+    if not mapping:
+        return segments
+    out = []
+    for s in segments:
+        m = mapping.get(s["speaker"])
+        out.append({**s, "speaker": m["name"], "speaker_id": m["speaker_id"], "speaker_label": s["speaker"]} if m else s)
+    return out
+
+
+def raw_segments(segments: List[Dict]) -> List[Dict]:
+    """กลับเป็น label เดิมของไฟล์ (ใช้เป็น key แคช/ถอดเสียง ไม่ให้ผลเปลี่ยนตามการลงทะเบียน)"""
+    out = []
+    for s in segments:
+        if "speaker_label" in s:
+            s = {k: v for k, v in s.items() if k not in ("speaker_id", "speaker_label")} | {"speaker": s["speaker_label"]}
+        out.append(s)
+    return out
+
+
+def identify(segments: List[Dict], audio_key: str, wav_path=None, pcm=None) -> Tuple[List[Dict], Dict[str, Dict]]:
+    """match + apply; embedding ล้มเหลว (เช่นโหลดโมเดลไม่ได้) → คืน segments เดิม ไม่ทำให้ diarize ล้มทั้งงาน"""
+    try:
+        mapping = match(segments, audio_key, wav_path=wav_path, pcm=pcm)
+    except Exception as e:
+        print(f"[WARN] speaker identification failed: {e}")
+        return segments, {}
+    return apply(segments, mapping), mapping
+
+
+def enroll(name: Optional[str], audio_key: str, segments: List[Dict], label: str,
+           wav_path=None, pcm=None, speaker_id: Optional[str] = None) -> str:
+    """ลงทะเบียน label หนึ่งของไฟล์ที่ diarize แล้ว เป็นคนใหม่ (name) หรือเพิ่มเสียงให้คนเดิม (speaker_id)"""
+    embs = label_embeddings(audio_key, raw_segments(segments), wav_path=wav_path, pcm=pcm)
+    if label not in embs:
+        raise ValueError(f"no usable speech for {label}")
+    return get_index().add(name, embs[label], embedding_model_id(), speaker_id=speaker_id,
+                           source={"audio_key": audio_key, "label": label})
+
+
+def enroll_from_result(name: Optional[str], audio_key: str, label: str, speaker_id: Optional[str] = None) -> str:
+    """ลงทะเบียนจากผล diarize ที่มีอยู่ (audio_key + label จาก /tools/diarize_auto) — ใช้ .wav/segments ในแคช"""
+    from . import diarize
+    segments = cache.get_json("diar", diarize.diar_cache_key({"cache_key": audio_key}))
+    wav = cache.get_file("wav", audio_key, ".wav")
+    if segments is None or wav is None:
+        raise LookupError("diarization for this audio_key is not in the cache (run /tools/diarize_auto again)")
+    if label not in {s["speaker"] for s in segments}:
+        raise ValueError(f"unknown label {label}")
+    return enroll(name, audio_key, segments, label, wav_path=wav, speaker_id=speaker_id)
+
+
+def enroll_clip(name: Optional[str], conv: Dict, speaker_id: Optional[str] = None, pcm=None) -> str:
+    """ลงทะเบียนจากคลิปเสียงของคนเดียว (ทั้งคลิปเป็น label เดียว แบ่งช่วงละ EMBED_MAX_SEG_S); pcm จาก ingest ได้"""
+    if pcm is None:
+        pcm = load_pcm16k(conv["output"])
+    total = len(pcm) / SAMPLE_RATE
+    segments, t = [], 0.0
+    while t < total:
+        segments.append({"start": round(t, 3), "end": round(min(total, t + EMBED_MAX_SEG_S), 3), "speaker": "SPEAKER_00"})
+        t += EMBED_MAX_SEG_S
+    return enroll(name, conv["cache_key"], segments, "SPEAKER_00", wav_path=conv["output"], pcm=pcm, speaker_id=speaker_id)
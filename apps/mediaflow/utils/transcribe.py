@@ -1,12 +1,16 @@
 import os
-import io
 import re
+import zlib
+import bisect
+import difflib
 import torch
-import soundfile as sf
+import numpy as np
 from pathlib import Path
-from typing import List, Dict, Optional, Any
-from subprocess import Popen, PIPE
+from typing import List, Dict, Optional, Any, Callable, Tuple
 from transformers import pipeline
+from .audio import SAMPLE_RATE, load_pcm16k, slice_pcm, to_float32, trim_bounds
+from .segments import prepare_asr_segments
+from . import metrics
 
 # ---- Device & dtype ---------------------------------------------------------
 HAS_CUDA = torch.cuda.is_available()
@@ -15,6 +19,27 @@ DTYPE = torch.float16 if HAS_CUDA else torch.float32
 
 
 # ---- Pipeline loader ---------------------------------------------------------
+# Backend (PATHUMMA_BACKEND) — ทุกตัวคืน object หน้าตาเดียวกับ transformers ASR pipeline
+# (feature_extractor / tokenizer / model.generate / __call__) โค้ดถอดเสียงด้านล่างจึงไม่ต้องรู้ว่าเป็นตัวไหน
+# - transformers : float32 (CPU) / float16 (CUDA) ตามเดิม — ตัวอ้างอิง
+# - int8         : transformers + dynamic int8 ของ Linear ทั้ง encoder/decoder (CPU เท่านั้น) ไม่ต้องติดตั้งอะไรเพิ่ม
+# - onnx         : export เป็น ONNX encoder + decoder (with past = KV cache) ผ่าน optimum แล้วรันด้วย onnxruntime
+#                  export ครั้งแรกเก็บไว้ที่ PATHUMMA_ONNX_DIR; PATHUMMA_ONNX_INT8=1 → quantize ONNX เป็น int8 ด้วย
+# ตรวจว่าผลใกล้ตัวอ้างอิงด้วย manage.py mediaflow_asr_parity ก่อนเปลี่ยน backend บน production
+ASR_BACKENDS = ("transformers", "int8", "onnx")
+
+
+def asr_backend(name: Optional[str] = None) -> str:
+    name = (name or os.getenv("PATHUMMA_BACKEND") or "transformers").lower().strip()
+    return name if name in ASR_BACKENDS else "transformers"
+
+
+def backend_id() -> str:
+    """backend + ตัวเลือกที่เปลี่ยนผลถอดเสียง (ใช้ใน cache key)"""
+    b = asr_backend()
+    return "onnx-int8" if b == "onnx" and os.getenv("PATHUMMA_ONNX_INT8", "0") == "1" else b
+
+
 def _require_model_id() -> str:
     mid = os.getenv("PATHUMMA_MODEL_ID")
     if not mid:
@@ -22,9 +47,82 @@ def _require_model_id() -> str:
     return mid
 
 
-def _load_pipeline():
+def _load_transformers(model_id: str, token: Optional[str]):
+    return pipeline(
+        task="automatic-speech-recognition",
+        model=model_id,
+        torch_dtype=DTYPE,
+        device=DEVICE,
+        token=token,  # ถ้า transformers เก่า: ใช้ use_auth_token=token
+    )
+
+
+def quantize_int8(asr):
+    """dynamic int8 ของ nn.Linear (attention/FFN = เกือบทั้งหมดของเวลาบน CPU); บน CUDA ไม่ทำอะไร"""
+    if next(asr.model.parameters()).device.type != "cpu":
+        print("[WARN] PATHUMMA_BACKEND=int8 is CPU-only; using the float model on CUDA")
+        return asr
+    asr.model = torch.ao.quantization.quantize_dynamic(asr.model, {torch.nn.Linear}, dtype=torch.qint8)
+    return asr
+
+
+def _load_int8(model_id: str, token: Optional[str]):
+    return quantize_int8(_load_transformers(model_id, token))
+
+
+def _onnx_dir(model_id: str) -> Path:
+    from django.conf import settings
+    root = Path(os.getenv("PATHUMMA_ONNX_DIR") or Path(settings.BASE_DIR) / "data" / "models" / "onnx")
+    return root / re.sub(r"[^a-zA-Z0-9._-]+", "_", model_id)
+
+
+def _load_onnx(model_id: str, token: Optional[str]):
+    try:
+        from optimum.onnxruntime import ORTModelForSpeechSeq2Seq
+    except ImportError as e:
+        raise RuntimeError("PATHUMMA_BACKEND=onnx requires: pip install 'optimum[onnxruntime]'") from e
+    from transformers import AutoProcessor
+
+    out = _onnx_dir(model_id)
+    int8 = os.getenv("PATHUMMA_ONNX_INT8", "0") == "1"
+    model_dir = out / ("int8" if int8 else "fp32")
+    if not (model_dir / "config.json").exists():
+        print(f"[INFO] Exporting {model_id} to ONNX → {model_dir}")
+        model = ORTModelForSpeechSeq2Seq.from_pretrained(model_id, export=True, use_cache=True, token=token)
+        if int8:
+            from optimum.onnxruntime import ORTQuantizer
+            from optimum.onnxruntime.configuration import AutoQuantizationConfig
+            tmp = out / "fp32"
+            model.save_pretrained(tmp)
+            qconfig = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+            for onnx_file in sorted(tmp.glob("*.onnx")):
+                ORTQuantizer.from_pretrained(tmp, file_name=onnx_file.name).quantize(
+                    save_dir=model_dir, quantization_config=qconfig,
+                )
+            # quantizer เขียนไฟล์ชื่อ *_quantized.onnx → ตั้งชื่อกลับให้ ORTModel หาเจอ
+            for q in model_dir.glob("*_quantized.onnx"):
+                q.replace(q.with_name(q.name.replace("_quantized", "")))
+            for f in ("config.json", "generation_config.json"):
+                if (tmp / f).exists():
+                    (model_dir / f).write_bytes((tmp / f).read_bytes())
+        else:
+            model.save_pretrained(model_dir)
+    model = ORTModelForSpeechSeq2Seq.from_pretrained(model_dir, use_cache=True)
+    processor = AutoProcessor.from_pretrained(model_id, token=token)
+    return pipeline(
+        task="automatic-speech-recognition",
+        model=model,
+        tokenizer=processor.tokenizer,
+        feature_extractor=processor.feature_extractor,
+    )
+
+
+_BACKEND_LOADERS = {"transformers": _load_transformers, "int8": _load_int8, "onnx": _load_onnx}
+
+
+def _load_pipeline(backend: Optional[str] = None):
     """
-    โหลด Pathumma (Whisper-TH) ด้วย transformers.pipeline
+    โหลด Pathumma (Whisper-TH) ตาม backend (default PATHUMMA_BACKEND)
     - บังคับภาษาไทย
     - รองรับ token (กรณี private/จำกัดสิทธิ์)
     """
@@ -33,15 +131,11 @@ def _load_pipeline():
 
     model_id = _require_model_id()
     token = os.getenv("HUGGINGFACE_HUB_TOKEN")
+    backend = asr_backend(backend)
 
-    print(f"[INFO] Loading ASR pipeline: {model_id} (device={'cuda' if HAS_CUDA else 'cpu'}, dtype={DTYPE})")
-    asr = pipeline(
-        task="automatic-speech-recognition",
-        model=model_id,
-        torch_dtype=DTYPE,
-        device=DEVICE,
-        token=token,  # ถ้า transformers เก่า: ใช้ use_auth_token=token
-    )
+    print(f"[INFO] Loading ASR pipeline: {model_id} (backend={backend}, device={'cuda' if HAS_CUDA else 'cpu'}, dtype={DTYPE})")
+    with metrics.span("asr.load_model", backend=backend):
+        asr = _BACKEND_LOADERS[backend](model_id, token)
     # บังคับ decoder ไทย
     asr.model.config.forced_decoder_ids = asr.tokenizer.get_decoder_prompt_ids(
         language="th", task="transcribe"
@@ -57,70 +151,7 @@ def _get_pipe():
     return _asr_pipeline
 
 
-# ---- Segments prep (รวม/เติม padding/ซอย) -----------------------------------
-def prepare_asr_segments(
-    raw: List[Dict],
-    pad_head: float = 0.25,
-    pad_tail: float = 0.35,
-    min_len:  float = 1.5,
-    merge_gap: float = 0.30,
-    max_len: float = 18.0,
-) -> List[Dict]:
-    if not raw:
-        return []
-
-    raw = sorted(raw, key=lambda x: (x["start"], x["end"]))
-
-    # รวม speaker เดียวกันที่ติดกัน/ห่างกันน้อย
-    merged: List[Dict] = []
-    for s in raw:
-        if not merged:
-            merged.append(dict(s))
-            continue
-        last = merged[-1]
-        if s.get("speaker") == last.get("speaker") and (float(s["start"]) - float(last["end"])) <= merge_gap:
-            last["end"] = max(float(last["end"]), float(s["end"]))
-        else:
-            merged.append(dict(s))
-
-    # รวมจนพอขั้นต่ำ แล้วเติม padding และซอยตาม max_len
-    asr_ready: List[Dict] = []
-    i = 0
-    while i < len(merged):
-        cur = dict(merged[i])
-        while (
-            i + 1 < len(merged)
-            and merged[i + 1].get("speaker") == cur.get("speaker")
-            and (float(merged[i + 1]["start"]) - float(cur["end"])) <= merge_gap
-            and (float(merged[i + 1]["end"]) - float(cur["start"])) < max(min_len, max_len)
-        ):
-            cur["end"] = float(merged[i + 1]["end"])
-            i += 1
-        asr_ready.append(cur)
-        i += 1
-
-    final: List[Dict] = []
-    for s in asr_ready:
-        start = max(0.0, float(s["start"]) - pad_head)
-        end = float(s["end"]) + pad_tail
-        dur = max(0.02, end - start)
-        if dur <= max_len:
-            final.append({**s, "start": start, "end": end})
-        else:
-            # ซอยเป็นชิ้นย่อย (มี overlap)
-            stride = max_len - 0.3
-            cur = start
-            while cur < end:
-                sub_end = min(end, cur + max_len)
-                final.append({**s, "start": round(cur, 3), "end": round(sub_end, 3)})
-                if sub_end >= end:
-                    break
-                cur = sub_end - 0.3
-
-    return final
-
-
-# ---- Helper: ดึง text จากผลลัพธ์หลายรูปแบบของ transformers.pipeline ----------
+# ---- Text post-processing ----------------------------------------------------
 def _extract_text(out: Any) -> str:
     """
     รองรับ:
@@ -168,96 +199,611 @@ def _squash_repeats(text: str, max_repeat: int = 2) -> str:
     return rough
 
 
+# ---- Decode settings (ใช้ร่วมกับ cache key ด้วย) -------------------------------
+PREPARE_PARAMS = {"pad_head": 0.30, "pad_tail": 0.40, "min_len": 1.5, "merge_gap": 0.30, "max_len": 18.0}
+CHUNK_PARAMS = {"chunk_length_s": 12, "stride_length_s": (2, 2)}
+GENERATE_KWARGS = {
+    "num_beams": 5,
+    "temperature": 0.0,
+    "no_repeat_ngram_size": 3,
+    "repetition_penalty": 1.1,
+    "length_penalty": 0.1,
+}
+SILENCE_GATE = {"threshold_db": -35.0, "min_dur": 0.2}
+
+# ---- Decode profiles (เลือกต่อ request เหมือน AUDIO_FILTERS) -------------------
+# num_beams      : beam ของรอบแรก
+# escalate_beams : ช่วงที่ความมั่นใจต่ำ (ดู CONFIDENCE) ถอดซ้ำด้วย beam เท่านี้ (0 = ไม่ถอดซ้ำ)
+# retry_untrimmed: ข้อความสั้น/ERROR → ถอดใหม่แบบไม่ตัดเงียบ
+# direct         : ช่วงที่ไม่เกิน DIRECT_MAX_S เรียก model.generate ตรงๆ ไม่ผ่าน chunking ของ pipeline
+DECODE_PROFILES = {
+    # greedy อย่างเดียว ไม่ถอดซ้ำ — ใช้ตอนคิวยาว
+    "fast": {"num_beams": 1, "escalate_beams": 0, "retry_untrimmed": False, "direct": True},
+    # greedy ก่อน → beam เฉพาะช่วงที่ไม่มั่นใจ
+    "mid":  {"num_beams": 1, "escalate_beams": 5, "retry_untrimmed": True, "direct": True},
+    # beam 5 ทุกช่วงผ่าน pipeline (พฤติกรรมเดิม)
+    "max":  {"num_beams": 5, "escalate_beams": 0, "retry_untrimmed": True, "direct": False},
+}
+# เกณฑ์ความมั่นใจแบบ Whisper: avg log-prob ต่ำ หรือข้อความบีบอัดได้มาก (วนคำ)
+CONFIDENCE = {"min_avg_logprob": -1.0, "max_compression_ratio": 2.4, "min_chars": 3}
+DIRECT_MAX_S = 30.0
+TIMESTAMP_MODES = ("word",)
+# PATHUMMA_PACK=1: ช่วงสั้น (≤ max_piece_s) ต่อกันเป็นหน้าต่างเดียว (≤ max_window_s, คั่นด้วยเงียบ gap_s)
+# encoder ของ Whisper คิดเต็ม 30 s ทุกครั้งไม่ว่าเสียงยาวเท่าไร → ถอดรวมแล้วแยกข้อความคืนตามเวลาต่อคำ
+PACK_PARAMS = {"max_window_s": 28.0, "max_piece_s": 8.0, "gap_s": 0.6}
+
+
+def pack_enabled() -> bool:
+    return os.getenv("PATHUMMA_PACK", "0") not in ("0", "false", "False", "")
+
+
+def decode_profile(name: Optional[str] = None) -> str:
+    """ชื่อ profile ที่ใช้จริง: ค่าที่ส่งมา → PATHUMMA_DECODE_PROFILE → "mid" """
+    name = (name or os.getenv("PATHUMMA_DECODE_PROFILE") or "mid").lower().strip()
+    return name if name in DECODE_PROFILES else "mid"
+
+
+def timestamps_mode(name: Optional[str] = None) -> Optional[str]:
+    """None/"" /none = ไม่มีเวลาระดับคำ, word = เวลาต่อคำจากการถอดรอบเดียวกัน"""
+    name = (name or "").lower().strip()
+    if name in ("", "none", "segment"):
+        return None
+    if name not in TIMESTAMP_MODES:
+        raise ValueError(f"timestamps must be one of: none, {', '.join(TIMESTAMP_MODES)}")
+    return name
+
+
+def asr_settings(language: Optional[str] = "th", decode: Optional[str] = None, timestamps: Optional[str] = None) -> Dict:
+    """ทุกอย่างที่มีผลต่อข้อความที่ถอดได้ — ใช้เป็นส่วนหนึ่งของ cache key"""
+    prof = decode_profile(decode)
+    extra = {"timestamps": timestamps} if timestamps_mode(timestamps) else {}
+    if pack_enabled():
+        extra["pack"] = PACK_PARAMS
+    return {
+        "model": os.getenv("PATHUMMA_MODEL_ID"),
+        "backend": backend_id(),
+        "language": language,
+        "prepare": PREPARE_PARAMS,
+        "chunk": CHUNK_PARAMS,
+        "generate": GENERATE_KWARGS,
+        "silence_gate": SILENCE_GATE,
+        "decode": {"profile": prof, **DECODE_PROFILES[prof], "confidence": CONFIDENCE, "direct_max_s": DIRECT_MAX_S},
+        **extra,
+    }
+
+
+def span_key(seg: Dict) -> Tuple[int, int]:
+    """ช่วงที่ prepare แล้ว → (start, end) เป็นมิลลิวินาที — ใช้จับคู่ช่วงกับผลเดิมตอนถอดซ้ำบางส่วน"""
+    return int(round(float(seg["start"]) * 1000)), int(round(float(seg["end"]) * 1000))
+
+
+# ---- Batched decode ---------------------------------------------------------
+def _default_batch_size() -> int:
+    try:
+        return max(1, int(os.getenv("PATHUMMA_BATCH_SIZE", "4")))
+    except ValueError:
+        return 4
+
+
+def _decode_batched(
+    decode_many: Callable[[List[np.ndarray]], List[Any]],
+    order: List[int],
+    get_arr: Callable[[int], np.ndarray],
+    batch_size: int,
+    on_batch: Optional[Callable[[int], None]] = None,
+    logprobs: Optional[Dict[int, float]] = None,
+    phase: str = "pass1",
+    beams: Optional[int] = None,
+    words: Optional[Dict[int, List[Dict]]] = None,
+) -> Dict[int, str]:
+    """
+    ถอดเป็นชุดตามลำดับ order (เรียงตามความยาวแล้ว) → {index: text}
+    - ถ้าทั้งชุดพัง ถอดทีละชิ้นใหม่ เพื่อให้ ERROR ติดเฉพาะ segment ที่มีปัญหา
+    - ส่ง logprobs มา → เก็บ avg_logprob ของผลที่มีค่านี้ (ถอดแบบ direct + greedy)
+    - ส่ง words มา → เก็บเวลาต่อคำ (เทียบกับต้น array) ของผลที่มี
+    - แต่ละ batch เป็น span "asr.batch" (phase/beams/จำนวน segment/วินาทีเสียง)
+    """
+    texts: Dict[int, str] = {}
+
+    def _keep(i: int, out: Any):
+        texts[i] = _extract_text(out)
+        if logprobs is not None and isinstance(out, dict) and out.get("avg_logprob") is not None:
+            logprobs[i] = out["avg_logprob"]
+        if words is not None and isinstance(out, dict) and out.get("words") is not None:
+            words[i] = out["words"]
+
+    for b in range(0, len(order), batch_size):
+        idxs = order[b:b + batch_size]
+        arrs = [get_arr(i) for i in idxs]
+        metrics.inc("asr_segments", len(idxs), phase=phase)
+        with metrics.span("asr.batch", audio_s=sum(len(a) for a in arrs) / SAMPLE_RATE,
+                          phase=phase, beams=beams, size=len(idxs)):
+            try:
+                outs = decode_many(arrs)
+                for i, out in zip(idxs, outs):
+                    _keep(i, out)
+            except Exception:
+                for i, arr in zip(idxs, arrs):
+                    try:
+                        _keep(i, decode_many([arr])[0])
+                    except Exception as e:
+                        texts[i] = f"[ERROR: {e}]"
+        if on_batch:
+            on_batch(len(idxs))
+    return texts
+
+
+# ---- Direct decode + ความมั่นใจ ------------------------------------------------
+def _generate_kwargs(num_beams: int) -> Dict:
+    gen = dict(GENERATE_KWARGS)
+    gen["num_beams"] = num_beams
+    return gen
+
+
+def _avg_logprobs(tokens: torch.Tensor, logits, eos_id: Optional[int]) -> List[float]:
+    """avg log-prob ของ token ที่ generate ได้ (ไม่นับหลัง EOS) — tokens: (B, T), logits: T x (B, V)"""
+    total = torch.zeros(tokens.shape[0])
+    count = torch.zeros(tokens.shape[0])
+    alive = torch.ones(tokens.shape[0], dtype=torch.bool)
+    for t, step in enumerate(logits):
+        tok = tokens[:, t]
+        lp = torch.log_softmax(step.float(), dim=-1).gather(1, tok[:, None].to(step.device))[:, 0].cpu()
+        total += torch.where(alive, lp, torch.zeros_like(lp))
+        count += alive.float()
+        if eos_id is not None:
+            alive &= tok.cpu() != eos_id
+    return (total / count.clamp(min=1)).tolist()
+
+
+def _direct_decode(pipe, arrs: List[np.ndarray], gen: Dict, words: bool = False) -> List[Dict]:
+    """
+    ช่วงสั้นกว่าหน้าต่าง Whisper (30 s) → feature extractor + model.generate ตรงๆ ทั้ง batch
+    ไม่ต้องผ่าน chunk/stride ของ pipeline; greedy จะได้ avg_logprob มาด้วย
+    words=True (และโมเดลมี alignment heads) → เวลาต่อคำจาก cross-attention ของ generate ครั้งเดียวกัน
+    """
+    words = words and can_align(pipe)
+    fe = pipe.feature_extractor(arrs, sampling_rate=SAMPLE_RATE, return_tensors="pt", return_attention_mask=words)
+    feats = fe.input_features.to(pipe.model.device, dtype=getattr(pipe.model, "dtype", torch.float32))
+    greedy = gen.get("num_beams", 1) == 1
+    extra = {"return_token_timestamps": True, "attention_mask": fe.attention_mask.to(pipe.model.device)} if words else {}
+    with torch.inference_mode():
+        out = pipe.model.generate(
+            feats, return_dict_in_generate=True, output_scores=greedy, output_logits=greedy, **gen, **extra,
+        )
+    seqs = out["sequences"]
+    texts = pipe.tokenizer.batch_decode(seqs, skip_special_tokens=True)
+    res = [{"text": t} for t in texts]
+    if words:
+        times = out["token_timestamps"].cpu().tolist()
+        for r, ids, ts, a in zip(res, seqs.cpu().tolist(), times, arrs):
+            r["words"] = _merge_pieces(_token_pieces(pipe.tokenizer, ids, ts, len(a) / SAMPLE_RATE))
+    if not greedy:
+        return res
+    logits = out.get("logits") or out["scores"]
+    steps = len(logits)
+    lps = _avg_logprobs(seqs[:, -steps:], logits, pipe.model.generation_config.eos_token_id)
+    for r, lp in zip(res, lps):
+        r["avg_logprob"] = lp
+    return res
+
+
+# ---- Word timestamps ------------------------------------------------------------
+# เวลาต่อ token จาก DTW บน cross-attention (alignment heads ของ Whisper) ระหว่าง generate ครั้งเดียวกัน
+# ภาษาไทยไม่เว้นวรรคระหว่างคำ → "คำ" = ชิ้น token ที่ต่อให้ไม่ขาดกลางพยางค์
+# (สระ/วรรณยุกต์ที่ต้องตามพยัญชนะ ติดกับชิ้นก่อนหน้า, สระหน้า เ แ โ ใ ไ ติดกับชิ้นถัดไป)
+_THAI_FOLLOW = re.compile("^[\u0e30-\u0e3a\u0e45\u0e47-\u0e4e]")
+_THAI_LEAD = re.compile("[\u0e40-\u0e44]$")
+_ALNUM_TAIL = re.compile(r"[A-Za-z0-9]$")
+_ALNUM_HEAD = re.compile(r"^[A-Za-z0-9]")
+
+
+def can_align(pipe) -> bool:
+    """โมเดล torch ที่มี alignment heads เท่านั้น (ONNX Runtime ไม่ส่ง cross-attention ออกมา)"""
+    model = getattr(pipe, "model", None)
+    return isinstance(model, torch.nn.Module) and bool(
+        getattr(getattr(model, "generation_config", None), "alignment_heads", None)
+    )
+
+
+def _token_pieces(tokenizer, ids: List[int], times: List[float], dur: float) -> List[Dict]:
+    """
+    token → ชิ้นข้อความที่ถอดเป็น unicode ได้ครบ + เวลา (token j เริ่มที่ times[j] จบที่ times[j+1])
+    ข้อความของชิ้น = ส่วนที่งอกจากการ decode ต่อท้าย (รวมช่องว่างที่ tokenizer แทรกระหว่าง token)
+    """
+    special = set(tokenizer.all_special_ids)
+    keep = [j for j, tok in enumerate(ids) if tok not in special]
+    pieces, buf, prev = [], [], ""
+    for n, j in enumerate(keep):
+        buf.append(j)
+        text = tokenizer.decode([ids[k] for k in keep[:n + 1]], skip_special_tokens=True)
+        if "\ufffd" in text[len(prev):] or not text.startswith(prev):
+            continue                # byte-level BPE ตัดกลางตัวอักษร → รอ token ถัดไป
+        piece, prev = text[len(prev):], text
+        if not piece:               # timestamp token
+            buf = []
+            continue
+        a = min(max(0.0, times[buf[0]]), dur)
+        b = min(max(a, times[buf[-1] + 1] if buf[-1] + 1 < len(times) else dur), dur)
+        pieces.append({"text": piece, "start": a, "end": b})
+        buf = []
+    return pieces
+
+
+def _merge_pieces(pieces: List[Dict]) -> List[Dict]:
+    words: List[Dict] = []
+    for p in pieces:
+        t = p["text"]
+        if not t.strip():
+            continue
+        prev = words[-1]["text"] if words else ""
+        join = prev and not t[0].isspace() and bool(
+            _THAI_FOLLOW.match(t) or _THAI_LEAD.search(prev) or (_ALNUM_TAIL.search(prev) and _ALNUM_HEAD.match(t))
+        )
+        if join:
+            words[-1]["text"] += t
+            words[-1]["end"] = max(words[-1]["end"], p["end"])
+        else:
+            words.append({"text": t, "start": p["start"], "end": p["end"]})
+    # คงช่องว่างนำหน้าไว้แบบ Whisper (" word") → "".join(text) ได้ข้อความเดิม; คำแรกไม่มีช่องว่าง
+    if words:
+        words[0]["text"] = words[0]["text"].lstrip()
+    return [{"start": round(w["start"], 3), "end": round(w["end"], 3), "text": w["text"].rstrip()} for w in words]
+
+
+def _chunk_words(out: Dict, dur: float) -> List[Dict]:
+    """ผล pipeline(return_timestamps="word") → รูปแบบเดียวกับ _direct_decode"""
+    pieces = []
+    for c in out.get("chunks") or []:
+        a, b = c.get("timestamp") or (None, None)
+        a = min(max(0.0, a or 0.0), dur)
+        pieces.append({"text": c.get("text", ""), "start": a, "end": min(max(a, b if b is not None else dur), dur)})
+    return _merge_pieces(pieces)
+
+
+def _squash_words(words: List[Dict], text: str) -> List[Dict]:
+    """
+    _squash_repeats ลบคำ/ข้อความที่วนซ้ำออกจากข้อความ → ตัดคำเดียวกันออกจาก words
+    (เทียบตัวอักษรของ words ที่ต่อกันกับข้อความหลังแก้; คำที่เหลือตัวอักษรไม่ถึงครึ่งถูกทิ้ง)
+    """
+    joined = "".join(w["text"] for w in words)
+    if joined == text:
+        return words
+    kept = bytearray(len(joined))
+    for a, _, n in difflib.SequenceMatcher(None, joined, text, autojunk=False).get_matching_blocks():
+        kept[a:a + n] = b"\x01" * n
+    out, pos = [], 0
+    for w in words:
+        span = range(pos, pos + len(w["text"]))
+        pos += len(w["text"])
+        chars = "".join(joined[k] for k in span if kept[k])
+        solid = sum(1 for k in span if not joined[k].isspace())
+        if chars.strip() and 2 * sum(1 for c in chars if not c.isspace()) >= solid:
+            out.append({**w, "text": chars if out else chars.lstrip()})
+    return out
+
+
+def _approx_words(text: str, start: float, end: float) -> List[Dict]:
+    """ไม่มีเวลาจากโมเดล → กระจายช่วง [start, end) ตามจำนวนตัวอักษรของแต่ละคำ (คั่นด้วยช่องว่าง)"""
+    parts = text.split()
+    total = sum(len(p) for p in parts)
+    if not total:
+        return []
+    out, t = [], start
+    for k, p in enumerate(parts):
+        d = (end - start) * len(p) / total
+        out.append({"start": round(t, 3), "end": round(t + d, 3), "text": p if k == 0 else " " + p})
+        t += d
+    return out
+
+
+def _compression_ratio(text: str) -> float:
+    # ภาษาไทยใน UTF-8 ใช้ 3 ไบต์ที่ขึ้นต้นเหมือนกัน บีบอัดได้เยอะเกินจริง → วัดบน TIS-620 แทน
+    b = text.encode("tis-620", errors="replace")
+    return len(b) / len(zlib.compress(b)) if b else 0.0
+
+
+def _low_confidence(text: str, avg_logprob: Optional[float]) -> bool:
+    if len(text) < CONFIDENCE["min_chars"] or text.startswith("[ERROR"):
+        return True
+    if avg_logprob is not None and avg_logprob < CONFIDENCE["min_avg_logprob"]:
+        return True
+    return _compression_ratio(text) > CONFIDENCE["max_compression_ratio"]
+
+
+# ---- Packing (ช่วงสั้นหลายช่วง → หน้าต่าง encoder เดียว) -------------------------------
+def _pack_groups(order: List[int], dur: Callable[[int], float]) -> List[List[int]]:
+    """ช่วงสั้นเรียงตามเวลา → กลุ่มละไม่เกิน max_window_s (รวมเงียบคั่น); กลุ่มที่มีช่วงเดียวไม่ต้อง pack"""
+    p = PACK_PARAMS
+    groups, cur, total = [], [], 0.0
+    for i in sorted(order):
+        d = dur(i)
+        if d > p["max_piece_s"]:
+            continue
+        if cur and total + p["gap_s"] + d > p["max_window_s"]:
+            groups.append(cur)
+            cur, total = [], 0.0
+        total += d + (p["gap_s"] if cur else 0.0)
+        cur.append(i)
+    if cur:
+        groups.append(cur)
+    return [g for g in groups if len(g) > 1]
+
+
+def _pack_audio(arrs: List[np.ndarray]) -> Tuple[np.ndarray, List[float]]:
+    """ต่อ array คั่นด้วยเงียบ → (array รวม, เวลาเริ่มของแต่ละชิ้นในหน้าต่าง)"""
+    gap = np.zeros(int(PACK_PARAMS["gap_s"] * SAMPLE_RATE), dtype=np.float32)
+    parts, offsets, pos = [], [], 0
+    for k, a in enumerate(arrs):
+        if k:
+            parts.append(gap)
+            pos += len(gap)
+        offsets.append(pos / SAMPLE_RATE)
+        parts.append(a)
+        pos += len(a)
+    return np.concatenate(parts), offsets
+
+
+def _unpack_words(words: List[Dict], offsets: List[float], durs: List[float]) -> List[List[Dict]]:
+    """เวลาต่อคำของหน้าต่างรวม → แยกคืนแต่ละชิ้นตามจุดกึ่งกลางคำ (ขอบ = กลางช่องเงียบคั่น), เวลาเทียบต้นชิ้น"""
+    edges = [o - PACK_PARAMS["gap_s"] / 2 for o in offsets[1:]]
+    out: List[List[Dict]] = [[] for _ in offsets]
+    for w in words:
+        k = bisect.bisect_right(edges, (w["start"] + w["end"]) / 2)
+        a, d = offsets[k], durs[k]
+        out[k].append({
+            "start": round(min(max(w["start"] - a, 0.0), d), 3),
+            "end": round(min(max(w["end"] - a, 0.0), d), 3),
+            "text": w["text"],
+        })
+    for ws in out:
+        if ws:
+            ws[0]["text"] = ws[0]["text"].lstrip()
+    return out
+
+
+def _decode_packed(
+    pipe, groups: List[List[int]], get_arr: Callable[[int], np.ndarray], gen: Dict, batch_size: int,
+) -> Tuple[Dict[int, str], Dict[int, List[Dict]], Dict[int, float]]:
+    """ถอดกลุ่มที่ pack แล้ว (direct + เวลาต่อคำ) → ({i: text}, {i: words เทียบต้นชิ้น}, {i: avg_logprob ของกลุ่ม})"""
+    windows: Dict[int, Tuple[List[float], List[float]]] = {}
+
+    def _window(g: int) -> np.ndarray:
+        arrs = [get_arr(i) for i in groups[g]]
+        arr, offsets = _pack_audio(arrs)
+        windows[g] = (offsets, [len(a) / SAMPLE_RATE for a in arrs])
+        return arr
+
+    g_words: Dict[int, List[Dict]] = {}
+    g_logprobs: Dict[int, float] = {}
+    g_texts = _decode_batched(
+        lambda arrs: _direct_decode(pipe, arrs, gen, words=True), list(range(len(groups))), _window, batch_size,
+        logprobs=g_logprobs, phase="packed", beams=gen.get("num_beams"), words=g_words,
+    )
+    texts, words, logprobs = {}, {}, {}
+    for g, idxs in enumerate(groups):
+        if g_texts.get(g, "").startswith("[ERROR") or g not in g_words:
+            continue                    # ผู้เรียกถอดชิ้นเหล่านี้แยกทีละช่วงแทน
+        for i, ws in zip(idxs, _unpack_words(g_words[g], *windows[g])):
+            texts[i] = "".join(w["text"] for w in ws).strip()
+            words[i] = ws
+            if g in g_logprobs:
+                logprobs[i] = g_logprobs[g]
+    return texts, words, logprobs
+
+
 # ---- Main: Transcribe by segments -------------------------------------------
 def transcribe_segments_with_pathumma(
-    wav_path: str | Path,
+    wav_path: str | Path | None,
     segments: List[Dict],
     language: Optional[str] = "th",
+    pcm: Optional[np.ndarray] = None,
+    batch_size: Optional[int] = None,
+    progress: Optional[Callable[[str, int, int], None]] = None,
+    decode: Optional[str] = None,
+    timestamps: Optional[str] = None,
+    reuse: Optional[Dict[Tuple[int, int], Dict]] = None,
 ) -> List[Dict]:
     """
-    อ่านช่วงเสียงด้วย ffmpeg (stream) → ส่งเข้า Pathumma ในหน่วยความจำ
-    - วาง -ss หลัง -i เพื่อ seek แม่น
-    - ใช้ silenceremove แบบพอดี + fallback แบบไม่ตัดเงียบ
-    - ตั้ง chunk_length/stride ให้โมเดลจัดการภายใน
+    โหลด PCM 16 kHz ของทั้งไฟล์ครั้งเดียว (memory-map) → ตัดแต่ละช่วงเป็น view → ส่งเข้า Pathumma
+    - ไม่เปิด ffmpeg ต่อ segment อีกต่อไป
+    - จัดกลุ่ม segment ตามความยาวแล้วถอดเป็น batch (PATHUMMA_BATCH_SIZE, default 4)
+    - ตัดเงียบหัว/ท้ายด้วย energy gate (-35 dB, 0.2 s) + fallback แบบไม่ตัดเงียบ (ถอดเป็น batch เช่นกัน)
+    - decode: fast | mid | max (ดู DECODE_PROFILES, default PATHUMMA_DECODE_PROFILE หรือ mid)
     - post-process กันวนคำ
+    - progress("transcribe", done, total) ถูกเรียกหลังถอดแต่ละ batch (ถ้าส่งมา)
+    - ส่ง pcm มาแล้ว wav_path เป็น None ได้ (ingest แบบ streaming ที่ไม่ได้เขียน .wav)
+    - timestamps="word" → แต่ละ segment มี words [{start, end, text}] (เวลาในไฟล์) จากการถอดรอบเดียวกัน
+      ไม่มี alignment heads / ข้อความถูกแก้วนคำ → กระจายเวลาตามตัวอักษร (words_approx: true)
+    - PATHUMMA_PACK=1 (profile แบบ direct + โมเดลที่มี alignment heads) → ช่วงสั้นหลายช่วงถอดรวมในหน้าต่างเดียว
+      แล้วแยกข้อความคืนตามเวลาต่อคำ; ชิ้นที่ได้ข้อความน้อยกว่า CONFIDENCE["min_chars"] ถอดใหม่ทีละช่วง
+    - reuse: {span_key ของช่วงที่ prepare แล้ว: ผลเดิมของช่วงนั้น} → ช่วงที่ตรงกันใช้ข้อความเดิม ไม่ถอดซ้ำ
+      (ข้อความขึ้นกับเสียงในช่วง + ค่า ASR เท่านั้น; ผู้เรียกต้องส่งผลที่ถอดด้วย asr_settings เดียวกัน)
     """
-    wav_path = Path(wav_path).resolve()
     pipe = _get_pipe()
-    enriched: List[Dict] = []
+    want_words = timestamps_mode(timestamps) == "word"
+    if pcm is None:
+        pcm = load_pcm16k(Path(wav_path).resolve())
+    bs = batch_size or _default_batch_size()
+    prof = DECODE_PROFILES[decode_profile(decode)]
+    direct_max = int(DIRECT_MAX_S * SAMPLE_RATE)
 
-    def _ffmpeg_read_chunk(start: float, dur: float, use_silence: bool) -> bytes:
-        cmd = [
-            "ffmpeg", "-hide_banner", "-loglevel", "error",
-            "-i", str(wav_path),
-            "-ss", f"{start:.3f}", "-t", f"{dur:.3f}",
-            "-ac", "1", "-ar", "16000",
-        ]
-        if use_silence:
-            cmd += [
-                "-af",
-                "silenceremove=start_periods=1:start_threshold=-35dB:start_duration=0.2:"
-                "stop_periods=1:stop_threshold=-35dB:stop_duration=0.2",
-            ]
-        cmd += ["-f", "wav", "pipe:1"]
-        p = Popen(cmd, stdout=PIPE, stderr=PIPE)
-        wav_bytes, _ = p.communicate()
-        return wav_bytes or b""
-
-    def _decode_arr(arr):
-        return pipe(
-            arr,
-            chunk_length_s=12,
-            stride_length_s=(2, 2),
-            return_timestamps=False,
-            generate_kwargs={
-                "num_beams": 5,
-                "temperature": 0.0,
-                "no_repeat_ngram_size": 3,
-                "repetition_penalty": 1.1,
-                "length_penalty": 0.1,
-            },
-        )
+    def _decoder(num_beams: int) -> Callable[[List[np.ndarray]], List[Any]]:
+        gen = _generate_kwargs(num_beams)
+
+        def _decode_many(arrs: List[np.ndarray]) -> List[Any]:
+            if prof["direct"] and all(len(a) <= direct_max for a in arrs):
+                return _direct_decode(pipe, arrs, gen, words=want_words)
+            align = want_words and can_align(pipe)
+            outs = pipe(
+                arrs,
+                batch_size=min(bs, len(arrs)),
+                return_timestamps="word" if align else False,
+                generate_kwargs=dict(gen),
+                **CHUNK_PARAMS,
+            )
+            outs = list(outs)
+            if align:
+                for a, out in zip(arrs, outs):
+                    out["words"] = _chunk_words(out, len(a) / SAMPLE_RATE)
+            return outs
+        return _decode_many
 
-    for seg in prepare_asr_segments(
-        segments,
-        pad_head=0.30, pad_tail=0.40,
-        min_len=1.5, merge_gap=0.30, max_len=18.0,
-    ):
+    segs = prepare_asr_segments(segments, **PREPARE_PARAMS)
+    spans = []
+    for seg in segs:
         start = float(seg["start"])
         end = float(seg["end"])
-        dur = max(0.02, end - start)
-
-        text = ""
-        try:
-            # pass 1: ตัดเงียบ
-            wav_bytes = _ffmpeg_read_chunk(start, dur, use_silence=True)
-            if wav_bytes:
-                data, _ = sf.read(io.BytesIO(wav_bytes), dtype="float32")
-                out = _decode_arr(data)
-                text = _extract_text(out)
-        except Exception as e:
-            text = f"[ERROR: {e}]"
-
-        # fallback: ไม่ตัดเงียบ
-        if len(text) < 3 or text.startswith("[ERROR"):
-            try:
-                wav_bytes2 = _ffmpeg_read_chunk(start, dur, use_silence=False)
-                if wav_bytes2:
-                    data2, _ = sf.read(io.BytesIO(wav_bytes2), dtype="float32")
-                    out2 = _decode_arr(data2)
-                    text2 = _extract_text(out2)
-                    if len(text2) > len(text):
-                        text = text2
-            except Exception:
-                pass
+        spans.append((start, end, max(0.02, end - start)))
+
+    def _chunk(i: int) -> np.ndarray:
+        start, _, dur = spans[i]
+        return to_float32(slice_pcm(pcm, start, dur))
+
+    reused = {i: reuse[k] for i, k in enumerate(map(span_key, segs)) if reuse and k in reuse}
+    if reuse is not None:
+        metrics.inc("asr_reused", len(reused))
+
+    # pass 1: ตัดเงียบ (เก็บแค่ขอบเขต ไม่ถือ array ทั้งไฟล์ไว้ในหน่วยความจำ); ช่วงที่ใช้ผลเดิม = ว่าง ไม่ส่งเข้าโมเดล
+    bounds = [(0, 0) if i in reused else trim_bounds(_chunk(i), **SILENCE_GATE) for i in range(len(segs))]
+
+    def _trimmed(i: int) -> np.ndarray:
+        a, b = bounds[i]
+        return _chunk(i)[a:b]
 
-        text = _squash_repeats(text, max_repeat=2)
+    # เรียงตามความยาว → padding ภายใน batch น้อยที่สุด; ช่วงที่เงียบล้วนไม่ต้องส่งเข้าโมเดล
+    by_len = sorted(range(len(segs)), key=lambda i: spans[i][2])
+    pass1 = [i for i in by_len if bounds[i][1] > bounds[i][0]]
+    done = len(segs) - len(pass1)
 
-        enriched.append({
+    def _tick(n: int):
+        nonlocal done
+        done += n
+        if progress:
+            progress("transcribe", done, len(segs))
+
+    _tick(0)
+    logprobs: Dict[int, float] = {}
+    # เวลาต่อคำของข้อความที่ใช้จริง: {i: (words, offset ของ array ในไฟล์)} — เปลี่ยนตามรอบที่ข้อความถูกแทน
+    words: Dict[int, List[Dict]] = {}
+    word_src: Dict[int, Tuple[Optional[List[Dict]], float]] = {}
+
+    def _trim_offset(i: int) -> float:
+        return spans[i][0] + bounds[i][0] / SAMPLE_RATE
+
+    groups = []
+    if pack_enabled() and prof["direct"] and can_align(pipe):
+        groups = _pack_groups(pass1, lambda i: (bounds[i][1] - bounds[i][0]) / SAMPLE_RATE)
+    texts: Dict[int, str] = {}
+    if groups:
+        packed_texts, packed_words, packed_lps = _decode_packed(
+            pipe, groups, _trimmed, _generate_kwargs(prof["num_beams"]), bs,
+        )
+        # ชิ้นที่แยกแล้วได้ข้อความน้อยเกินไป (โมเดลข้าม/รวมคำข้ามช่องเงียบ) → ถอดแยกตามปกติด้านล่าง
+        ok = {i for i, t in packed_texts.items() if len(t) >= CONFIDENCE["min_chars"]}
+        for i in ok:
+            texts[i] = packed_texts[i]
+            if i in packed_lps:
+                logprobs[i] = packed_lps[i]
+            if want_words:
+                words[i] = packed_words[i]
+        packed = sum(len(g) for g in groups)
+        metrics.inc("asr_packed", len(ok))
+        if packed > len(ok):
+            metrics.inc("asr_redecode", packed - len(ok), reason="unpacked")
+        _tick(len(ok))
+    texts.update(_decode_batched(
+        _decoder(prof["num_beams"]), [i for i in pass1 if i not in texts], _trimmed, bs,
+        on_batch=_tick, logprobs=logprobs, phase="pass1", beams=prof["num_beams"],
+        words=words if want_words else None,
+    ))
+    for i in pass1:
+        word_src[i] = (words.get(i), _trim_offset(i))
+    retry_beams = prof["escalate_beams"] or prof["num_beams"]
+
+    # fallback: ข้อความสั้น/ERROR → ถอดใหม่แบบไม่ตัดเงียบ
+    retry = []
+    if prof["retry_untrimmed"]:
+        retry = [
+            i for i in by_len
+            if i not in reused and (len(texts.get(i, "")) < 3 or texts[i].startswith("[ERROR"))
+            and len(slice_pcm(pcm, spans[i][0], spans[i][2]))
+        ]
+
+    # ความมั่นใจต่ำ (log-prob / วนคำ) → ถอดซ้ำด้วย beam เฉพาะช่วงนั้น (ช่วงใน retry ได้ beam ไปแล้ว)
+    if prof["escalate_beams"]:
+        skip = set(retry)
+        low = [i for i in pass1 if i not in skip and _low_confidence(texts.get(i, ""), logprobs.get(i))]
+        if low:
+            metrics.inc("asr_redecode", len(low), reason="low_confidence")
+            words_b: Dict[int, List[Dict]] = {}
+            texts_b = _decode_batched(
+                _decoder(prof["escalate_beams"]), low, _trimmed, bs, phase="escalate", beams=prof["escalate_beams"],
+                words=words_b if want_words else None,
+            )
+            for i in low:
+                text_b = texts_b.get(i, "")
+                if text_b and not text_b.startswith("[ERROR"):
+                    texts[i] = text_b
+                    word_src[i] = (words_b.get(i), _trim_offset(i))
+
+    if retry:
+        metrics.inc("asr_redecode", len(retry), reason="untrimmed")
+        words_2: Dict[int, List[Dict]] = {}
+        texts2 = _decode_batched(
+            _decoder(retry_beams), retry, _chunk, bs, phase="untrimmed", beams=retry_beams,
+            words=words_2 if want_words else None,
+        )
+        for i in retry:
+            text2 = texts2.get(i, "")
+            if not text2.startswith("[ERROR") and len(text2) > len(texts.get(i, "")):
+                texts[i] = text2
+                word_src[i] = (words_2.get(i), spans[i][0])
+
+    enriched: List[Dict] = []
+    for i, seg in enumerate(segs):
+        start, end, _ = spans[i]
+        if i in reused:
+            enriched.append({**reused[i], "start": float(start), "end": float(end), "speaker": str(seg.get("speaker", "-"))})
+            continue
+        raw = texts.get(i, "")
+        text = _squash_repeats(raw, max_repeat=2)
+        item = {
             "start": float(start),
             "end": float(end),
             "speaker": str(seg.get("speaker", "-")),
             "text": str(text or ""),
-        })
+        }
+        if want_words:
+            ws, offset = word_src.get(i, (None, start))
+            if ws is not None and not text.startswith("[ERROR"):
+                item["words"] = [
+                    {"start": round(min(offset + w["start"], end), 3), "end": round(min(offset + w["end"], end), 3),
+                     "text": w["text"]}
+                    for w in _squash_words(ws, text)
+                ]
+            elif not text.startswith("[ERROR"):
+                a, b = bounds[i]
+                lo = start + a / SAMPLE_RATE if b > a else start
+                hi = start + b / SAMPLE_RATE if b > a else end
+                item["words"] = _approx_words(text, lo, hi)
+                item["words_approx"] = True
+        enriched.append(item)
 
     return enriched
+
+
+# ---- Single utterance (live captions) ---------------------------------------
+def transcribe_array(arr: np.ndarray, language: Optional[str] = "th", greedy: bool = False) -> str:
+    """
+    ถอดเสียง PCM 16 kHz หนึ่งช่วง (float32 หรือ int16) ด้วย pipeline ที่แคชไว้
+    - greedy=True ใช้ num_beams=1 สำหรับ partial ระหว่างพูด (เร็วกว่า)
+    """
+    if arr.dtype != np.float32:
+        arr = to_float32(arr)
+    if len(arr) == 0:
+        return ""
+    gen = dict(GENERATE_KWARGS)
+    if greedy:
+        gen["num_beams"] = 1
+    out = _get_pipe()(arr, return_timestamps=False, generate_kwargs=gen, **CHUNK_PARAMS)
+    return _squash_repeats(_extract_text(out), max_repeat=2)
@@ -0,0 +1,231 @@
+import os
+import wave
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from .audio import SAMPLE_RATE, FRAME_S, frame_db, load_pcm16k
+from . import cache, metrics
+
+# ตัดช่วงไม่มีเสียงพูดก่อน diarize (ประชุมจริงเงียบ/พัก/รอสาย 30-40% ของไฟล์)
+# - energy gate ทีละเฟรม 10 ms, threshold อัตโนมัติจาก noise floor ของไฟล์ (หรือกำหนดเองด้วย MEDIAFLOW_VAD_THRESHOLD_DB)
+# - ต่อช่วงเสียงพูดเป็นไฟล์ .wav ใหม่ (compact) → pyannote ทำงานเฉพาะช่วงที่มีเสียง
+# - TimeMap แปลงเวลาของ compact กลับเป็นเวลาในไฟล์เดิม (segment ที่คร่อมรอยต่อถูกแยกเป็นชิ้น)
+#   ผล diarization ที่แคช/ส่งออกเป็นเวลาเดิมเสมอ → ASR ถอดเฉพาะช่วงเสียงพูดโดยอัตโนมัติ
+
+VAD_PARAMS = {
+    "margin_db": 12.0,      # threshold = noise floor + margin (ไม่เกิน ระดับเสียงพูด - 15 dB)
+    "min_db": -55.0,        # threshold ต่ำสุด (ไฟล์ที่เงียบสนิท/ถูก normalize)
+    "min_speech": 0.25,     # ช่วงเสียงสั้นกว่านี้ (วินาที) ถือเป็นเสียงรบกวน
+    "min_silence": 1.0,     # ตัดเฉพาะช่วงเงียบที่ยาวกว่านี้ (ช่วงหยุดระหว่างคำ/ประโยคคงไว้)
+    "pad": 0.25,            # เผื่อหัว/ท้ายแต่ละช่วงเสียง
+}
+MIN_SAVING = 0.05           # ตัดได้น้อยกว่า 5% → ไม่คุ้มเขียนไฟล์ใหม่ ใช้ไฟล์เดิม
+BLOCK_S = 60.0              # อ่าน memmap ทีละช่วง ไม่ต้องแปลงทั้งไฟล์เป็น float พร้อมกัน
+MIN_PIECE_S = 0.05          # ชิ้นของ segment หลังแยกที่รอยต่อ สั้นกว่านี้ทิ้ง
+
+
+def enabled() -> bool:
+    return os.getenv("MEDIAFLOW_VAD", "1") not in ("0", "false", "False", "")
+
+
+def _fixed_threshold() -> Optional[float]:
+    try:
+        return float(os.environ["MEDIAFLOW_VAD_THRESHOLD_DB"])
+    except (KeyError, ValueError):
+        return None
+
+
+def settings() -> Optional[Dict]:
+    """ค่าที่มีผลต่อ mask (ใส่ใน cache key ของ diarization); None = ปิด VAD"""
+    if not enabled():
+        return None
+    return {**VAD_PARAMS, "threshold_db": _fixed_threshold()}
+
+
+# ---- Speech mask ------------------------------------------------------------------------
+def _frame_levels(pcm: np.ndarray) -> np.ndarray:
+    hop = int(SAMPLE_RATE * FRAME_S)
+    block = int(BLOCK_S / FRAME_S) * hop
+    parts = [frame_db(np.asarray(pcm[a:a + block], dtype=np.float32) / 32768.0) for a in range(0, len(pcm), block)]
+    return np.concatenate(parts) if parts else np.zeros(0, dtype=np.float32)
+
+
+def _threshold(db: np.ndarray, p: Dict) -> float:
+    if p.get("threshold_db") is not None:
+        return float(p["threshold_db"])
+    live = db[db > -90.0]                 # ไม่นับ digital silence (padding / ช่วงที่ถูกตัด)
+    if len(live) == 0:
+        return p["min_db"]
+    floor, loud = np.percentile(live, [10, 95])
+    return float(max(p["min_db"], min(floor + p["margin_db"], loud - 15.0)))
+
+
+def _runs(mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """ช่วง True ที่ต่อเนื่อง → (start, end) เป็น index เฟรม"""
+    d = np.diff(np.concatenate([[0], mask.astype(np.int8), [0]]))
+    return np.flatnonzero(d == 1), np.flatnonzero(d == -1)
+
+
+def speech_regions(pcm: np.ndarray, params: Optional[Dict] = None) -> List[Tuple[int, int]]:
+    """ช่วงที่มีเสียงพูด [(a, b)] เป็น index sample (เรียง, ไม่ทับกัน)"""
+    p = {**VAD_PARAMS, "threshold_db": _fixed_threshold(), **(params or {})}
+    db = _frame_levels(pcm)
+    if len(db) == 0:
+        return []
+    voiced = db > _threshold(db, p)
+
+    # เติมช่วงเงียบสั้น → ตัดช่วงเสียงสั้น → เผื่อขอบ (หน่วยเฟรม)
+    gap, short, pad = (max(1, int(round(p[k] / FRAME_S))) for k in ("min_silence", "min_speech", "pad"))
+    st, en = _runs(voiced)
+    if len(st) == 0:
+        return []
+    keep = np.concatenate([[True], st[1:] - en[:-1] >= gap])
+    heads = np.flatnonzero(keep)
+    st, en = st[heads], np.concatenate([en[heads[1:] - 1], [en[-1]]])
+    ok = en - st >= short
+    st, en = st[ok], en[ok]
+    st, en = np.maximum(0, st - pad), np.minimum(len(db), en + pad)
+    # หลังเผื่อขอบ ช่วงที่ชนกันรวมเป็นช่วงเดียว
+    out: List[Tuple[int, int]] = []
+    hop = int(SAMPLE_RATE * FRAME_S)
+    for a, b in zip(st.tolist(), en.tolist()):
+        if out and a * hop <= out[-1][1]:
+            out[-1] = (out[-1][0], b * hop)
+        else:
+            out.append((a * hop, b * hop))
+    if out:
+        out[-1] = (out[-1][0], min(out[-1][1], len(pcm)))
+    return out
+
+
+# ---- Time map -----------------------------------------------------------------------
+class TimeMap:
+    """
+    ตำแหน่งของแต่ละช่วงเสียงพูดในไฟล์เดิมกับใน compact
+    region k: เดิม [orig[k], orig[k] + dur[k]) ↔ compact [comp[k], comp[k] + dur[k]) (หน่วย sample)
+    """
+
+    def __init__(self, regions: List[Tuple[int, int]], total: int):
+        self.total = int(total)
+        self.orig = np.array([a for a, _ in regions], dtype=np.int64)
+        self.dur = np.array([b - a for a, b in regions], dtype=np.int64)
+        self.comp = np.concatenate([[0], np.cumsum(self.dur)[:-1]]).astype(np.int64) if len(regions) else self.dur
+
+    @property
+    def speech_s(self) -> float:
+        return float(self.dur.sum()) / SAMPLE_RATE
+
+    @property
+    def total_s(self) -> float:
+        return self.total / SAMPLE_RATE
+
+    def saving(self) -> float:
+        return 1.0 - self.speech_s / self.total_s if self.total else 0.0
+
+    def to_original(self, t: float) -> float:
+        """เวลาใน compact → เวลาในไฟล์เดิม (จุดที่อยู่บนรอยต่อ = ท้ายช่วงก่อนหน้า)"""
+        if len(self.dur) == 0:
+            return 0.0
+        x = t * SAMPLE_RATE
+        k = max(0, int(np.searchsorted(self.comp, x, side="right")) - 1)
+        if k > 0 and x <= self.comp[k]:
+            k -= 1
+        return float(self.orig[k] + min(max(0.0, x - self.comp[k]), self.dur[k])) / SAMPLE_RATE
+
+    def _pieces(self, segs: List[Dict], base: np.ndarray) -> List[Dict]:
+        """ตัด segment ตามช่วงเสียง (เริ่มที่ base[k]) แล้วเลื่อนไปเวลาเดิม (orig[k])"""
+        out: List[Dict] = []
+        ends = base + self.dur
+        for s in segs:
+            a, b = s["start"] * SAMPLE_RATE, s["end"] * SAMPLE_RATE
+            k0 = int(np.searchsorted(ends, a, side="right"))
+            k1 = int(np.searchsorted(base, b, side="left"))
+            for k in range(k0, min(k1, len(self.dur))):
+                lo, hi = max(a, base[k]), min(b, ends[k])
+                if (hi - lo) / SAMPLE_RATE < MIN_PIECE_S:
+                    continue
+                shift = self.orig[k] - base[k]
+                out.append({**s, "start": round(float(lo + shift) / SAMPLE_RATE, 3),
+                            "end": round(float(hi + shift) / SAMPLE_RATE, 3)})
+        return out
+
+    def segments_to_original(self, segs: List[Dict]) -> List[Dict]:
+        """แปลง segment ของ compact เป็นเวลาเดิม — คร่อมรอยต่อ (ช่วงเงียบที่ถูกตัด) → แยกเป็นชิ้นตามช่วงเสียง"""
+        return self._pieces(segs, self.comp)
+
+    def clip(self, segs: List[Dict]) -> List[Dict]:
+        """
+        segment ที่เป็นเวลาเดิมอยู่แล้ว → ตัดส่วนที่อยู่ในช่วงเงียบออก
+        (clean_diar_segments รวมผู้พูดเดียวกันที่อยู่ติดกันโดยไม่ดูระยะห่าง → อาจคร่อมช่วงเงียบกลับมา)
+        """
+        return self._pieces(segs, self.orig)
+
+    def regions(self) -> List[List[int]]:
+        return [[int(a), int(a + d)] for a, d in zip(self.orig, self.dur)]
+
+
+def time_map(pcm: np.ndarray, audio_key: Optional[str] = None) -> TimeMap:
+    """mask ของไฟล์ (แคชตาม audio_key + ค่า VAD)"""
+    key = cache.cache_key("vad", audio_key, settings()) if audio_key else None
+    regions = cache.get_json("vad", key) if key else None
+    if regions is None:
+        with metrics.span("vad", audio_s=len(pcm) / SAMPLE_RATE):
+            regions = speech_regions(pcm)
+        if key:
+            cache.put_json("vad", key, regions)
+    return TimeMap([tuple(r) for r in regions], len(pcm))
+
+
+def _write_compact(path: Path, pcm: np.ndarray, tmap: TimeMap):
+    step = int(BLOCK_S * SAMPLE_RATE)
+    with wave.open(str(path), "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        for a, b in tmap.regions():
+            for c in range(a, b, step):
+                w.writeframes(np.ascontiguousarray(pcm[c:min(b, c + step)], dtype="<i2"))
+
+
+def active_map(pcm: np.ndarray, audio_key: Optional[str] = None) -> Optional[TimeMap]:
+    """TimeMap ที่ compacted() ใช้กับไฟล์นี้ — None = diarize ทั้งไฟล์ (VAD ปิด / ตัดได้ไม่คุ้ม)"""
+    if not enabled() or len(pcm) == 0:
+        return None
+    tmap = time_map(pcm, audio_key)
+    return tmap if tmap.saving() >= MIN_SAVING else None
+
+
+@contextmanager
+def compacted(wav_path: Optional[Path], pcm: np.ndarray, audio_key: Optional[str] = None) -> Iterator[Tuple]:
+    """
+    with compacted(wav, pcm, key) as (wav_c, pcm_c, tmap): ...
+    - VAD ปิด / ตัดได้ไม่ถึง MIN_SAVING → (wav, pcm, None) ใช้ไฟล์เดิม
+    - ไม่งั้น .wav ที่มีแต่ช่วงเสียงพูด (เก็บในแคช stage "vad"; ปิดแคช/ไม่มี key → ไฟล์ชั่วคราว ลบเมื่อออกจาก with)
+      pcm_c เป็น memmap ของไฟล์นั้น — model workers อ่านจาก path เดียวกันได้
+    """
+    tmap = active_map(pcm, audio_key)
+    if tmap is None:
+        yield wav_path, pcm, None
+        return
+    metrics.inc("vad_removed_seconds", tmap.total_s - tmap.speech_s)
+
+    key = cache.cache_key("vad", audio_key, settings()) if audio_key else None
+    tmp = None
+    path = cache.get_file("vad", key, ".wav") if key else None
+    if path is None and key:
+        path = cache.put_with("vad", key, ".wav", lambda p: _write_compact(p, pcm, tmap))
+    if path is None:
+        fd, tmp = tempfile.mkstemp(suffix=".wav", prefix="mediaflow-vad-")
+        os.close(fd)
+        path = Path(tmp)
+        _write_compact(path, pcm, tmap)
+    try:
+        yield path, load_pcm16k(path), tmap
+    finally:
+        if tmp:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
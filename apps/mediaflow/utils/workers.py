@@ -0,0 +1,202 @@
+import os
+import threading
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Model workers: process แยกที่โหลด pyannote + Pathumma ครั้งเดียวตอนเริ่ม แล้ว warm-up
+# - MEDIAFLOW_MODEL_WORKERS=0 (default) → รันโมเดลใน process ของ Django แบบเดิม
+# - MEDIAFLOW_MODEL_WORKERS=N → N replica, view ส่งงานผ่านคิวของ ProcessPoolExecutor
+# - MEDIAFLOW_WORKER_THREADS → torch threads ต่อ worker (default = cores // N)
+# - MEDIAFLOW_PRELOAD_MODELS=1 → กรณีไม่มี worker ให้โหลดโมเดลใน process ตั้งแต่ start
+
+_executor: Optional[ProcessPoolExecutor] = None
+_lock = threading.Lock()
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def num_workers() -> int:
+    return max(0, _env_int("MEDIAFLOW_MODEL_WORKERS", 0))
+
+
+def enabled() -> bool:
+    return num_workers() > 0
+
+
+# ---- ฝั่ง worker process -------------------------------------------------------
+def _warm_up():
+    """รันโมเดลหนึ่งรอบด้วยเสียงสั้นๆ ให้ kernel/แคชพร้อมก่อนงานจริงเข้ามา"""
+    from .audio import SAMPLE_RATE
+    from . import diarize, transcribe
+    rng = np.random.default_rng(0)
+    noise = (rng.standard_normal(SAMPLE_RATE * 5) * 0.01).astype(np.float32)
+    transcribe.transcribe_array(noise[:SAMPLE_RATE], greedy=True)
+    diarize._diarize_array(diarize._get_pipeline(), noise, 0.0)
+
+
+def _init_worker(threads: int):
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "asrpro.settings")
+    import django
+    django.setup()
+    import torch
+    if threads > 0:
+        torch.set_num_threads(threads)
+    from . import diarize, transcribe
+    diarize._get_pipeline()
+    transcribe._get_pipe()
+    try:
+        _warm_up()
+    except Exception as e:
+        print(f"[WARN] model worker warm-up failed: {e}")
+    print(f"[INFO] model worker {os.getpid()} ready (threads={threads})")
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _diarize_task(wav_path: str) -> List[Dict]:
+    from . import diarize
+    return diarize._run_pipeline_local(Path(wav_path))
+
+
+def _diarize_window_task(wav_path: str, w0: float, w1: float):
+    from . import diarize
+    from .audio import load_pcm16k
+    return diarize._diarize_window(diarize._get_pipeline(), load_pcm16k(wav_path), w0, w1)
+
+
+def _embed_task(wav_path: str, segments: List[Dict]) -> Dict[str, List[float]]:
+    from . import speakers
+    from .audio import load_pcm16k
+    return speakers.embed_speakers_local(load_pcm16k(wav_path), segments)
+
+
+def _transcribe_task(
+    wav_path: str, segments: List[Dict], language: Optional[str], decode: Optional[str] = None,
+    timestamps: Optional[str] = None, reuse: Optional[Dict] = None,
+) -> List[Dict]:
+    from . import transcribe
+    return transcribe.transcribe_segments_with_pathumma(
+        wav_path, segments, language=language, decode=decode, timestamps=timestamps, reuse=reuse,
+    )
+
+
+def _transcribe_array_task(pcm: np.ndarray, language: Optional[str], greedy: bool) -> str:
+    from . import transcribe
+    return transcribe.transcribe_array(pcm, language=language, greedy=greedy)
+
+
+# ---- ฝั่ง Django ---------------------------------------------------------------
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            n = num_workers()
+            threads = _env_int("MEDIAFLOW_WORKER_THREADS", max(1, (os.cpu_count() or 1) // n))
+            _executor = ProcessPoolExecutor(
+                max_workers=n,
+                mp_context=mp.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(threads,),
+            )
+        return _executor
+
+
+def _submit(fn, *args) -> Future:
+    global _executor
+    try:
+        return _get_executor().submit(fn, *args)
+    except BrokenProcessPool:
+        # worker ตาย (เช่น OOM) → สร้าง pool ใหม่ครั้งหนึ่ง
+        with _lock:
+            _executor = None
+        return _get_executor().submit(fn, *args)
+
+
+def start_model_workers():
+    """
+    เรียกตอน start server (wsgi/asgi): spawn worker ครบ N ตัวทันที ให้โหลดโมเดล + warm-up
+    ก่อน request แรกเข้ามา (ไม่ block การ start)
+    """
+    if enabled():
+        for _ in range(num_workers()):
+            _submit(_ping)
+    elif os.getenv("MEDIAFLOW_PRELOAD_MODELS", "0") == "1":
+        def preload():
+            from . import diarize, transcribe
+            try:
+                diarize._get_pipeline()
+                transcribe._get_pipe()
+                _warm_up()
+            except Exception as e:
+                print(f"[WARN] model preload failed: {e}")
+        threading.Thread(target=preload, name="mediaflow-preload", daemon=True).start()
+
+
+def diarize(wav_path: str | Path) -> List[Dict]:
+    return _submit(_diarize_task, str(wav_path)).result()
+
+
+def submit_diarize_window(wav_path: str | Path, w0: float, w1: float) -> Future:
+    """Future ของ (segments, embedding ต่อ label) ของหน้าต่าง [w0, w1)"""
+    return _submit(_diarize_window_task, str(wav_path), w0, w1)
+
+
+def embed_speakers(wav_path: str | Path, segments: List[Dict]) -> Dict[str, List[float]]:
+    return _submit(_embed_task, str(wav_path), segments).result()
+
+
+def transcribe_array(pcm: np.ndarray, language: Optional[str] = "th", greedy: bool = False) -> str:
+    return _submit(_transcribe_array_task, np.ascontiguousarray(pcm), language, greedy).result()
+
+
+def _split_by_speaker_turns(segments: List[Dict], parts: int) -> List[List[Dict]]:
+    """แบ่ง segments เป็นก้อนต่อเนื่องตามเวลา ตัดเฉพาะตรงที่เปลี่ยนผู้พูด (prepare_asr_segments จะได้รวมเหมือนเดิม)"""
+    segs = sorted(segments, key=lambda x: (x["start"], x["end"]))
+    if parts <= 1 or len(segs) < 2:
+        return [segs] if segs else []
+    target = max(1, len(segs) // parts)
+    groups, cur = [], []
+    for s in segs:
+        if len(cur) >= target and cur[-1].get("speaker") != s.get("speaker"):
+            groups.append(cur); cur = []
+        cur.append(s)
+    if cur:
+        groups.append(cur)
+    return groups
+
+
+def transcribe_segments(
+    wav_path: str | Path,
+    segments: List[Dict],
+    language: Optional[str] = "th",
+    progress=None,
+    decode: Optional[str] = None,
+    timestamps: Optional[str] = None,
+    reuse: Optional[Dict] = None,
+) -> List[Dict]:
+    """
+    กระจาย segments ให้ worker หลายตัวถอดพร้อมกัน (แบ่งละเอียดกว่าจำนวน worker เพื่อรายงาน progress)
+    แล้วเรียงผลกลับตามเวลา; reuse = ผลเดิมต่อช่วง (ดู transcribe_segments_with_pathumma)
+    """
+    groups = _split_by_speaker_turns(segments, num_workers() * 4)
+    futures = [_submit(_transcribe_task, str(wav_path), g, language, decode, timestamps, reuse) for g in groups]
+    out: List[Dict] = []
+    done = 0
+    for g, fut in zip(groups, futures):
+        out += fut.result()
+        done += len(g)
+        if progress:
+            progress("transcribe", done, len(segments))
+    return sorted(out, key=lambda x: (x["start"], x["end"]))
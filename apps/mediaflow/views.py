@@ -1,14 +1,36 @@
-import asyncio
+import os
+import json
+import uuid
 from pathlib import Path
-from django.http import JsonResponse, HttpRequest
+from django.http import JsonResponse, HttpRequest, HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
 from django.shortcuts import render
-from .utils.io import save_json
+from .models import TranscribeJob
+from .utils.io import export_formats, render_export
+from .utils import batch, chunked, ingest, metrics, results, search, speakers
 
-from .utils.ffmpeg_convert import convert_to_wav
-from .utils.diarize import diarize_auto
-from .utils.transcribe import transcribe_segments_with_pathumma
+from .utils.ffmpeg_convert import convert_to_wav_cached, run_sync
+from .utils.diarize import diarize_auto, convert_for_diarization
+from .utils.pipeline import transcribe_auto, retranscribe
+from .utils.transcribe import timestamps_mode
+from .utils.jobs import submit_transcribe_job
+
+def _output_options(data):
+    """timestamps (none|word) + exports ("srt,vtt,compact") จาก form/JSON → (timestamps, exports), ผิด → ValueError"""
+    exports = data.getlist("exports") if hasattr(data, "getlist") else data.get("exports")
+    if isinstance(exports, list) and len(exports) == 1:
+        exports = exports[0]
+    return timestamps_mode(data.get("timestamps")), export_formats(exports or [])
+
+def _upload_profile(request: HttpRequest, default: str) -> str:
+    """
+    ติดตั้ง ingest (ถอดเสียงระหว่างอัปโหลด) ก่อนแตะ request.POST/FILES → profile ที่ใช้ถอด
+    ffmpeg เริ่มก่อนอ่าน field อื่นได้ → profile ของ upload แบบ streaming มาจาก ?profile= ใน URL
+    """
+    profile = (request.GET.get("profile") or default).lower().strip()
+    ingest.install(request, profile=profile)
+    return profile
 
 def index(request):
     return render(request, "mediaflow/index.html")
@@ -23,50 +45,55 @@ def transcribe_auto_page(request):
     return render(request, "mediaflow/transcribe_auto_page.html")
 
 @csrf_exempt
+@metrics.traced
 def convert_one(request: HttpRequest):
     if request.method != "POST":
         return JsonResponse({"error": "POST only"}, status=405)
 
+    profile = _upload_profile(request, "fast")
     f = request.FILES.get("file")
     if not f:
         return JsonResponse({"error": "missing file"}, status=400)
 
-    profile = (request.POST.get("profile") or "fast").lower().strip()
-    up = Path(settings.MEDIA_ROOT); up.mkdir(parents=True, exist_ok=True)
-    src = up / f.name
-    with src.open("wb") as dst:
-        for ch in f.chunks():
-            dst.write(ch)
-
-    result = asyncio.run(convert_to_wav(src, out_dir=settings.CONVERTED_ROOT, profile=profile))
+    profile = (request.POST.get("profile") or profile).lower().strip()
+    try:
+        # ผลของ endpoint นี้คือไฟล์ .wav → เขียนลงดิสก์เสมอ (persist)
+        src, result, _ = ingest.take_upload(f, persist=True, profile=profile)
+    except ValueError as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=400)
+    except RuntimeError as e:
+        return JsonResponse({"ok": False, "message": "ffmpeg failed", "detail": str(e)[:2000]}, status=500)
+    if result is None:
+        result = run_sync(convert_to_wav_cached(src, out_dir=settings.CONVERTED_ROOT, profile=profile))
     if not result["ok"]:
         return JsonResponse({"ok": False, "message": "ffmpeg failed", "detail": result["stderr"][:2000]}, status=500)
     return JsonResponse({"ok": True, "input": result["input"], "output": result["output"], "profile": result["profile"]})
 
 @csrf_exempt
+@metrics.traced
 def diarize_auto_api(request: HttpRequest):
     """
     POST multipart/form-data:
       file: (required) ไฟล์เสียงใดๆ (mp3/m4a/wav/…)
-      profile: (optional) fast|max (default=fast)
+      profile: (optional) fast|max (default=fast) — ส่งเป็น ?profile= ใน URL (ถอดระหว่างอัปโหลด ต้องรู้ก่อนอ่าน form)
     """
     if request.method != "POST":
         return JsonResponse({"error": "POST only"}, status=405)
 
+    profile = _upload_profile(request, "fast")
     f = request.FILES.get("file")
     if not f:
         return JsonResponse({"error": "missing file"}, status=400)
 
-    profile = (request.POST.get("profile") or "fast").lower().strip()
+    profile = (request.POST.get("profile") or profile).lower().strip()
 
-    up = Path(settings.MEDIA_ROOT); up.mkdir(parents=True, exist_ok=True)
-    src = up / f.name
-    with src.open("wb") as dst:
-        for ch in f.chunks():
-            dst.write(ch)
+    try:
+        src, conv, pcm = ingest.take_upload(f, profile=profile)
+    except ValueError as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=400)
 
     try:
-        res = diarize_auto(src, profile=profile)
+        res = diarize_auto(src, profile=profile, conv=conv, pcm=pcm)
         return JsonResponse({"ok": True, **res}, json_dumps_params={"ensure_ascii": False})
     except Exception as e:
         import traceback
@@ -74,52 +101,441 @@ def diarize_auto_api(request: HttpRequest):
         return JsonResponse({"ok": False, "error": str(e), "trace": tb[:2000]}, status=500)
 
 @csrf_exempt
+@metrics.traced
 def transcribe_auto_api(request: HttpRequest):
     """
     POST multipart/form-data:
       file: (required) ไฟล์เสียงใดๆ
       language: (optional) 'th' (default) หรือปล่อยว่างให้ auto ของโมเดล
+      decode: (optional) fast|mid|max — ความเร็ว vs ความแม่นของ ASR (default=PATHUMMA_DECODE_PROFILE หรือ mid)
+      timestamps: (optional) none|word — word = เวลาต่อคำใน segments[].words (ไม่ต้องถอดรอบสอง)
+      exports: (optional) srt,vtt,compact — เขียนไฟล์ข้าง JSON ผล, path อยู่ใน "exports"
     """
     if request.method != "POST":
         return JsonResponse({"error": "POST only"}, status=405)
 
-    f = request.FILES.get("file")
+    # ถอดเสียงระหว่างอัปโหลด (ต้องติดตั้งก่อนแตะ request.POST/FILES)
+    ingest.install(request)
+
+    # รับ body (และถอดเสียงไปพร้อมกันถ้าเป็น streaming ingest)
+    with metrics.span("upload"):
+        f = request.FILES.get("file")
     if not f:
         return JsonResponse({"error": "missing file"}, status=400)
 
     language = (request.POST.get("language") or "th").strip() or None
-
-    # upload → data/uploads/...
-    up = Path(settings.MEDIA_ROOT); up.mkdir(parents=True, exist_ok=True)
-    src = up / f.name
-    with src.open("wb") as dst:
-        for ch in f.chunks():
-            dst.write(ch)
-
+    decode = (request.POST.get("decode") or "").lower().strip() or None
     try:
-        # 1) diarize (จะสร้าง .json ใน results/diar ให้อัตโนมัติ)
-        dia = diarize_auto(src, save=True)
+        timestamps, exports = _output_options(request.POST)
+    except ValueError as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=400)
 
-        # 2) transcribe ตามช่วง
-        enriched = transcribe_segments_with_pathumma(dia["wav"], dia["segments"], language=language)
+    try:
+        # upload → ffmpeg (streaming) หรือ data/uploads/... แบบเดิม
+        src, conv, pcm = ingest.take_upload(f)
 
-        # 3) รวมผล + เซฟเป็น JSON ใน results/transcribe/
-        result = {
-            "source": str(src),
-            "wav": dia["wav"],
-            "speakers_count": dia.get("speakers_count"),
-            "segments": enriched,
-            "diar_json": dia.get("json_path"),  # ลิงก์ไปไฟล์ diar.json ที่สร้างไว้
-        }
-        trans_json_path = save_json(result, base_name=src.name, tag="trans", subdir="transcribe")
+        # diarize → transcribe → เซฟ JSON (results/diar + results/transcribe)
+        result = transcribe_auto(
+            src, language=language, conv=conv, pcm=pcm, decode=decode, timestamps=timestamps, exports=exports,
+        )
 
-        # 4) ตอบกลับ พร้อม path ไฟล์ที่บันทึกไว้
+        # ตอบกลับ พร้อม path ไฟล์ที่บันทึกไว้
         return JsonResponse({
             "ok": True,
-            "json_path": trans_json_path,
             **result
         }, json_dumps_params={"ensure_ascii": False})
 
     except Exception as e:
         import traceback
-        return JsonResponse({"ok": False, "error": str(e), "trace": traceback.format_exc()[:2000]}, status=500)
\ No newline at end of file
+        return JsonResponse({"ok": False, "error": str(e), "trace": traceback.format_exc()[:2000]}, status=500)
+
+@csrf_exempt
+@metrics.traced
+def retranscribe_api(request: HttpRequest):
+    """
+    POST application/json — ถอดใหม่หลังแก้ช่วงผู้พูด ถอดจริงเฉพาะช่วงที่เปลี่ยน:
+      result_id: (required) id ของผลถอดเสียงเดิม (result_id จาก /tools/transcribe_auto หรือ job)
+      segments: (required) [{start, end, speaker}, ...] ช่วงผู้พูดที่แก้แล้ว — แก้จาก segments ของผล diarize
+                (GET /tools/results/<diar_result ของผลเดิม>) ไม่ใช่ของผลถอดเสียงที่เติม padding แล้ว
+      language / decode / timestamps / exports: เหมือน /tools/transcribe_auto (ควรตรงกับตอนถอดเดิม จึงใช้ผลเดิมได้)
+    ตอบผลใหม่ (result_id ใหม่, based_on = id เดิม) + incremental: {segments, reused, decoded}
+    ต้องมี .wav ของผลเดิม (results[].wav) หรือไฟล์ต้นฉบับบนดิสก์ — upload แบบ streaming ไม่เก็บต้นฉบับ
+    จึงใช้ได้ตราบที่ .wav ยังอยู่ (ไม่อย่างนั้นตอบ 404 ให้ถอดไฟล์ใหม่)
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "POST only"}, status=405)
+    try:
+        body = json.loads(request.body or b"{}")
+    except ValueError:
+        return JsonResponse({"ok": False, "error": "invalid JSON"}, status=400)
+    if not isinstance(body, dict) or not body.get("result_id"):
+        return JsonResponse({"ok": False, "error": "missing result_id"}, status=400)
+    try:
+        timestamps, exports = _output_options(body)
+        result = retranscribe(
+            str(body["result_id"]), body.get("segments"),
+            language=(body.get("language", "th") or "").strip() or None,
+            decode=(body.get("decode") or "").lower().strip() or None,
+            timestamps=timestamps, exports=exports,
+        )
+    except LookupError as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=404)
+    except ValueError as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=400)
+    except Exception as e:
+        import traceback
+        return JsonResponse({"ok": False, "error": str(e), "trace": traceback.format_exc()[:2000]}, status=500)
+    return JsonResponse({"ok": True, **result}, json_dumps_params={"ensure_ascii": False})
+
+@csrf_exempt
+def transcribe_job_submit_api(request: HttpRequest):
+    """
+    POST multipart/form-data (เหมือน /tools/transcribe_auto) แต่ตอบกลับทันทีด้วย job_id
+      file: (required) ไฟล์เสียงใดๆ
+      language: (optional) 'th' (default) หรือปล่อยว่าง
+      decode: (optional) fast|mid|max
+      timestamps, exports: (optional) เหมือน /tools/transcribe_auto
+    ติดตามผลที่ GET /tools/jobs/<job_id>
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "POST only"}, status=405)
+
+    ingest.install(request)
+
+    f = request.FILES.get("file")
+    if not f:
+        return JsonResponse({"error": "missing file"}, status=400)
+
+    language = (request.POST.get("language") or "th").strip() or None
+    decode = (request.POST.get("decode") or "").lower().strip() or None
+    try:
+        timestamps, exports = _output_options(request.POST)
+    except ValueError as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=400)
+
+    # ตั้งชื่อไม่ให้ชนกันระหว่าง job ที่อัปโหลดไฟล์ชื่อเดียวกัน
+    # job รันทีหลัง → .wav ต้องอยู่บนดิสก์เสมอ (persist)
+    try:
+        src, conv, _ = ingest.take_upload(f, persist=True, prefix=f"{uuid.uuid4().hex[:8]}_")
+    except RuntimeError as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=500)
+    job = submit_transcribe_job(
+        src, language=language, conv=conv, decode=decode, timestamps=timestamps, exports=exports,
+    )
+    return JsonResponse({"ok": True, **job.as_dict(with_result=False)}, status=202)
+
+# ---- Chunked upload (ไฟล์ใหญ่ / อัปโหลดต่อได้) ----
+@csrf_exempt
+def upload_init_api(request: HttpRequest):
+    """
+    POST application/json: {"name": "meeting.m4a", "size": <bytes>, "chunk_size": (optional), "sha256": (optional ทั้งไฟล์)}
+    ตอบ upload_id + chunk_size/total_chunks → PUT /tools/uploads/<id>/chunks/<n> ทีละชิ้น → POST .../finalize
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "POST only"}, status=405)
+    try:
+        body = json.loads(request.body or b"{}")
+        st = chunked.init_upload(body.get("name"), body.get("size"), body.get("chunk_size"), body.get("sha256"))
+    except (ValueError, TypeError) as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=getattr(e, "status", 400))
+    return JsonResponse({"ok": True, **st}, status=201)
+
+@csrf_exempt
+def upload_detail_api(request: HttpRequest, upload_id: str):
+    """GET: ชิ้นที่ได้รับแล้ว (ใช้ต่อการอัปโหลดหลังเน็ตหลุด) | DELETE: ยกเลิก"""
+    try:
+        if request.method == "GET":
+            return JsonResponse({"ok": True, **chunked.status(upload_id)})
+        if request.method == "DELETE":
+            chunked.abort(upload_id)
+            return JsonResponse({"ok": True, "upload_id": upload_id})
+    except chunked.UploadError as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=e.status)
+    return JsonResponse({"error": "GET or DELETE only"}, status=405)
+
+@csrf_exempt
+def upload_chunk_api(request: HttpRequest, upload_id: str, index: int):
+    """PUT body = ไบต์ของชิ้นที่ index (header X-Chunk-SHA256 = sha256 ของชิ้น, ไม่ตรง → 422 ส่งใหม่)"""
+    if request.method != "PUT":
+        return JsonResponse({"error": "PUT only"}, status=405)
+    try:
+        length = int(request.META.get("CONTENT_LENGTH") or 0) or None
+        # อ่านจาก stream ตรงๆ (request.body จะติด DATA_UPLOAD_MAX_MEMORY_SIZE และเก็บทั้งชิ้นในหน่วยความจำ)
+        res = chunked.put_chunk(upload_id, index, request, length, request.headers.get("X-Chunk-SHA256"))
+    except chunked.UploadError as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=e.status)
+    return JsonResponse({"ok": True, **res})
+
+@csrf_exempt
+def upload_finalize_api(request: HttpRequest, upload_id: str):
+    """
+    POST (form หรือ JSON): language, decode, timestamps, exports เหมือน /tools/jobs/transcribe_auto
+    ทุกชิ้นครบ → ส่งเข้า job queue (ใช้ .wav ที่แปลงระหว่างอัปโหลดถ้ามี) ตอบ job_id — ขาดชิ้น → 409
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "POST only"}, status=405)
+    if request.content_type == "application/json":
+        try:
+            body = json.loads(request.body or b"{}")
+        except ValueError:
+            return JsonResponse({"ok": False, "error": "invalid JSON"}, status=400)
+    else:
+        body = request.POST
+    language = (body.get("language") or "th").strip() or None
+    decode = (body.get("decode") or "").lower().strip() or None
+    try:
+        timestamps, exports = _output_options(body)
+    except ValueError as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=400)
+
+    try:
+        src, conv = chunked.finalize(upload_id, prefix=f"{uuid.uuid4().hex[:8]}_")
+    except chunked.UploadError as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=e.status)
+    job = submit_transcribe_job(
+        src, language=language, conv=conv, decode=decode, timestamps=timestamps, exports=exports,
+    )
+    return JsonResponse({"ok": True, "preconverted": conv is not None, **job.as_dict(with_result=False)}, status=202)
+
+def job_status_api(request: HttpRequest, job_id):
+    """GET: สถานะ/ขั้นตอน/ความคืบหน้า และผลลัพธ์เมื่อเสร็จ (status=done)"""
+    if request.method != "GET":
+        return JsonResponse({"error": "GET only"}, status=405)
+    try:
+        job = TranscribeJob.objects.get(pk=job_id)
+    except TranscribeJob.DoesNotExist:
+        return JsonResponse({"ok": False, "error": "job not found"}, status=404)
+    return JsonResponse({"ok": job.status != TranscribeJob.FAILED, **job.as_dict()},
+                        json_dumps_params={"ensure_ascii": False})
+
+
+@csrf_exempt
+def batch_submit_api(request: HttpRequest):
+    """
+    POST application/json (หรือ form):
+      inputs: (required) list ของโฟลเดอร์ / manifest / ไฟล์เสียงบนเครื่อง server (ต้องอยู่ใต้ MEDIAFLOW_BATCH_ROOTS)
+      name: (optional) ชื่อ batch — ใช้ชื่อเดิมเพื่อทำต่อจากรอบก่อน (default: สุ่ม)
+      language, decode, timestamps, exports, profile, force: (optional) เหมือน manage.py mediaflow_batch
+    รันในพื้นหลัง ตอบกลับทันที — ติดตามผลที่ GET /tools/batch/<name>
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "POST only"}, status=405)
+
+    if request.content_type == "application/json":
+        try:
+            body = json.loads(request.body or b"{}")
+        except ValueError:
+            return JsonResponse({"ok": False, "error": "invalid JSON"}, status=400)
+    else:
+        body = {**request.POST.dict(), "inputs": request.POST.getlist("inputs")}
+
+    inputs = body.get("inputs") or []
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    if not inputs:
+        return JsonResponse({"error": "missing inputs"}, status=400)
+    decode = (body.get("decode") or "").lower().strip() or None
+    profile = (body.get("profile") or "mid").lower().strip()
+    force = str(body.get("force", "")).lower() in ("1", "true", "yes")
+
+    try:
+        timestamps, exports = _output_options(body)
+        name = batch.safe_name(body.get("name") or uuid.uuid4().hex[:12])
+        paths = batch.check_allowed(inputs)
+    except ValueError as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=400)
+
+    started = batch.start_background(
+        paths, name, language=(body.get("language") or "th").strip() or None,
+        decode=decode, timestamps=timestamps, exports=exports, profile=profile, force=force,
+    )
+    if not started:
+        return JsonResponse({"ok": False, "error": "batch is already running", "name": name}, status=409)
+    return JsonResponse({"ok": True, "name": name, "status_url": f"/tools/batch/{name}"}, status=202)
+
+def batch_status_api(request: HttpRequest, name: str):
+    """GET: สถานะ batch (_batch.json) — total/skipped/done/failed + running"""
+    if request.method != "GET":
+        return JsonResponse({"error": "GET only"}, status=405)
+    try:
+        status = batch.read_status(name)
+        running = batch.is_running(name)
+    except ValueError as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=400)
+    if status is None:
+        return JsonResponse({"ok": False, "error": "batch not found"}, status=404)
+    return JsonResponse({"ok": True, "running": running, **status}, json_dumps_params={"ensure_ascii": False})
+
+@csrf_exempt
+def batch_stop_api(request: HttpRequest, name: str):
+    """POST: หยุดรับไฟล์ใหม่ (ไฟล์ที่กำลังถอดทำต่อจนเสร็จ) — POST /tools/batch ด้วยชื่อเดิมเพื่อทำต่อ"""
+    if request.method != "POST":
+        return JsonResponse({"error": "POST only"}, status=405)
+    try:
+        stopped = batch.stop_background(name)
+    except ValueError as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=400)
+    if not stopped:
+        return JsonResponse({"ok": False, "error": "batch is not running"}, status=409)
+    return JsonResponse({"ok": True, "name": name})
+
+# ---- Export (ผลที่เซฟไว้ → SRT / VTT / compact JSON) ----
+_EXPORT_TYPES = {
+    "srt": "application/x-subrip; charset=utf-8",
+    "vtt": "text/vtt; charset=utf-8",
+    "compact": "application/json; charset=utf-8",
+}
+
+def export_api(request: HttpRequest):
+    """
+    GET ?id=<result_id ของ /tools/transcribe_auto หรือ job>&format=srt|vtt|compact
+        (หรือ ?path=<ไฟล์ผลใต้ RESULTS_ROOT> เช่น JSON ของ batch)
+    แปลงผลที่เซฟไว้เป็นไฟล์ดาวน์โหลด (ผลที่ถอดด้วย timestamps=word → cue แบ่งตามเวลาต่อคำ)
+    """
+    if request.method != "GET":
+        return JsonResponse({"error": "GET only"}, status=405)
+    fmt = (request.GET.get("format") or "srt").lower().strip()
+    if fmt not in _EXPORT_TYPES:
+        return JsonResponse({"ok": False, "error": f"format must be one of: {', '.join(_EXPORT_TYPES)}"}, status=400)
+    try:
+        if request.GET.get("id"):
+            path = results.path_for(request.GET["id"])
+        else:
+            path = Path(request.GET.get("path") or "").resolve()
+            if not path.is_relative_to(settings.RESULTS_ROOT.resolve()) or path.suffix not in (".json", results.SUFFIX):
+                raise ValueError("path outside results")
+    except ValueError:
+        return JsonResponse({"ok": False, "error": "result not found"}, status=404)
+    if not path.is_file():
+        return JsonResponse({"ok": False, "error": "result not found"}, status=404)
+    try:
+        result = results.read_file(path)
+        text, ext = render_export(result, fmt)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        return JsonResponse({"ok": False, "error": f"invalid result file: {e}"}, status=400)
+    name = Path(results.title(result.get("source") or "")).stem or path.stem
+    resp = HttpResponse(text, content_type=_EXPORT_TYPES[fmt])
+    resp["Content-Disposition"] = f'attachment; filename="{name}{ext}"'
+    return resp
+
+# ---- Results (คลังผลที่เซฟไว้ + catalog) ----
+def results_api(request: HttpRequest):
+    """
+    GET [?kind=trans|diar] [&source=ชื่อไฟล์บางส่วน] [&since=YYYY-MM-DD] [&until=YYYY-MM-DD]
+        [&speakers=n | &min_speakers=n &max_speakers=n] [&batch=ชื่อ batch] [&limit=50] [&offset=0]
+    list ผลที่เซฟไว้ (ล่าสุดก่อน) จาก catalog — ไม่เปิดไฟล์ผล; หน้าถัดไปด้วย next_offset
+    """
+    if request.method != "GET":
+        return JsonResponse({"error": "GET only"}, status=405)
+    q = request.GET
+    try:
+        res = results.catalog(
+            kind=q.get("kind") or None, source=q.get("source") or None,
+            since=q.get("since"), until=q.get("until"),
+            speakers=q.get("speakers"), min_speakers=q.get("min_speakers"), max_speakers=q.get("max_speakers"),
+            batch=q.get("batch") or None, limit=q.get("limit") or 50, offset=q.get("offset") or 0,
+        )
+    except ValueError as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=400)
+    return JsonResponse({"ok": True, **res}, json_dumps_params={"ensure_ascii": False})
+
+@csrf_exempt
+def result_detail_api(request: HttpRequest, result_id: str):
+    """GET: ผลเต็ม (เหมือนตอนถอดเสร็จ) ของ id เดียว, DELETE: ลบผล + export ข้างไฟล์"""
+    if request.method not in ("GET", "DELETE"):
+        return JsonResponse({"error": "GET or DELETE only"}, status=405)
+    try:
+        if request.method == "DELETE":
+            if not results.delete(result_id):
+                raise LookupError(result_id)
+            return JsonResponse({"ok": True, "result_id": result_id})
+        result = results.load(result_id)
+    except (LookupError, ValueError):
+        return JsonResponse({"ok": False, "error": "result not found"}, status=404)
+    return JsonResponse({"ok": True, "result_id": result_id, **result}, json_dumps_params={"ensure_ascii": False})
+
+# ---- Search (ค้นข้อความในผลถอดเสียงที่เซฟไว้) ----
+def search_api(request: HttpRequest):
+    """
+    GET ?q=คำค้น (หลายคำ = ต้องพบทุกคำ, "..." = วลี) [&speaker=ชื่อ] [&transcript=id] [&limit=50] [&offset=0]
+        [&order=recent|rank] (recent = ล่าสุดก่อน, rank = เกี่ยวข้องที่สุดก่อน)
+    ตอบ hits: การประชุม (transcript) + ผู้พูด + เวลา start/end ของช่วงที่พบ + snippet; หน้าถัดไปด้วย next_offset
+    """
+    if request.method != "GET":
+        return JsonResponse({"error": "GET only"}, status=405)
+    try:
+        res = search.search(
+            request.GET.get("q", ""),
+            speaker=request.GET.get("speaker") or None,
+            transcript=request.GET.get("transcript") or None,
+            limit=request.GET.get("limit") or 50,
+            offset=request.GET.get("offset") or 0,
+            order=request.GET.get("order") or "recent",
+        )
+    except ValueError as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=400)
+    return JsonResponse({"ok": True, **res}, json_dumps_params={"ensure_ascii": False})
+
+# ---- Speakers (ลงทะเบียนเสียง → ระบุตัวผู้พูดข้ามไฟล์) ----
+@csrf_exempt
+def speakers_api(request: HttpRequest):
+    """
+    GET: รายชื่อผู้พูดที่ลงทะเบียนไว้
+    POST ลงทะเบียน (คนใหม่ด้วย name หรือเพิ่มเสียงให้คนเดิมด้วย speaker_id):
+      - application/json: {"name", "audio_key", "label"} — label จากผล /tools/diarize_auto ของไฟล์นั้น
+      - multipart: file = คลิปเสียงของคนเดียว + name/speaker_id
+    ผล diarize/transcribe ครั้งถัดไปจะเติม speaker = ชื่อ (และ speaker_id) ให้ label ที่ตรงกัน
+    """
+    if request.method == "GET":
+        return JsonResponse({"ok": True, "speakers": speakers.get_index().list()},
+                            json_dumps_params={"ensure_ascii": False})
+    if request.method != "POST":
+        return JsonResponse({"error": "GET or POST only"}, status=405)
+
+    try:
+        if request.content_type == "application/json":
+            try:
+                body = json.loads(request.body or b"{}")
+            except ValueError:
+                return JsonResponse({"ok": False, "error": "invalid JSON"}, status=400)
+            name, speaker_id = (body.get("name") or "").strip(), body.get("speaker_id") or None
+            if not body.get("audio_key") or not body.get("label"):
+                return JsonResponse({"error": "missing audio_key or label"}, status=400)
+            sid = speakers.enroll_from_result(name, body["audio_key"], body["label"], speaker_id=speaker_id)
+        else:
+            ingest.install(request)
+            name, speaker_id = (request.POST.get("name") or "").strip(), request.POST.get("speaker_id") or None
+            f = request.FILES.get("file")
+            if not f:
+                return JsonResponse({"error": "missing file"}, status=400)
+            # embedding อ่านจาก .wav หรือ PCM ที่ถอดระหว่างอัปโหลดก็ได้
+            src, conv, pcm = ingest.take_upload(f)
+            sid = speakers.enroll_clip(name, conv or convert_for_diarization(src), speaker_id=speaker_id, pcm=pcm)
+    except LookupError as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=404)
+    except ValueError as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=400)
+    except Exception as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=500)
+    return JsonResponse({"ok": True, "speaker_id": sid}, status=201)
+
+@csrf_exempt
+def speaker_detail_api(request: HttpRequest, speaker_id: str):
+    """DELETE: ลบผู้พูดและเสียงที่ลงทะเบียนไว้ทั้งหมด"""
+    if request.method != "DELETE":
+        return JsonResponse({"error": "DELETE only"}, status=405)
+    if not speakers.get_index().remove(speaker_id):
+        return JsonResponse({"ok": False, "error": "speaker not found"}, status=404)
+    return JsonResponse({"ok": True, "speaker_id": speaker_id})
+
+def _metrics_allowed(request: HttpRequest) -> bool:
+    allow = [a.strip() for a in os.getenv("MEDIAFLOW_METRICS_ALLOW", "127.0.0.1,::1").split(",") if a.strip()]
+    return "*" in allow or request.META.get("REMOTE_ADDR") in allow
+
+def metrics_api(request: HttpRequest):
+    """GET: counters/histograms ของ process นี้ในรูปแบบ Prometheus text (เฉพาะ IP ใน MEDIAFLOW_METRICS_ALLOW)"""
+    if request.method != "GET":
+        return JsonResponse({"error": "GET only"}, status=405)
+    if not _metrics_allowed(request):
+        return JsonResponse({"ok": False, "error": "forbidden"}, status=403)
+    return HttpResponse(metrics.render_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -2,6 +2,9 @@
 ASGI config for asrpro project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP goes to Django; the WebSocket endpoint ``/ws/transcribe`` (live captions)
+is served by ``apps.mediaflow.live``.  Run with:
+    uvicorn asrpro.asgi:application --port 8000
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +16,25 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'asrpro.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# โหลดโมเดล (model workers / preload) ตั้งแต่ start ไม่ต้องรอ request แรก
+from apps.mediaflow.utils.workers import start_model_workers  # noqa: E402
+start_model_workers()
+
+# ดึง job ที่ค้างจากรอบก่อนกลับเข้าคิว (ไม่ต้องรอให้มีคน submit job ใหม่)
+from apps.mediaflow.utils.jobs import start_job_queue  # noqa: E402
+start_job_queue()
+
+from apps.mediaflow.live import live_transcribe  # noqa: E402  (ต้องโหลดหลัง Django setup)
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "websocket":
+        if scope["path"].rstrip("/") == "/ws/transcribe":
+            await live_transcribe(scope, receive, send)
+        else:
+            await receive()
+            await send({"type": "websocket.close", "code": 4404})
+        return
+    await django_application(scope, receive, send)
@@ -83,7 +83,13 @@ CONVERTED_ROOT.mkdir(parents=True, exist_ok=True)
 RESULTS_ROOT = BASE_DIR / "data" / "results"
 RESULTS_ROOT.mkdir(parents=True, exist_ok=True)
 
-for p in (MEDIA_ROOT, CONVERTED_ROOT, RESULTS_ROOT / "diar", RESULTS_ROOT / "transcribe"):
+# แคชผล convert/diarize/transcribe ตาม hash ไฟล์ (จำกัดขนาดด้วย MEDIAFLOW_CACHE_MAX_MB)
+CACHE_ROOT = BASE_DIR / "data" / "cache"
+
+# index เสียงผู้พูดที่ลงทะเบียนไว้ (ระบุตัวผู้พูดข้ามไฟล์)
+SPEAKERS_ROOT = BASE_DIR / "data" / "speakers"
+
+for p in (MEDIA_ROOT, CONVERTED_ROOT, RESULTS_ROOT / "diar", RESULTS_ROOT / "transcribe", CACHE_ROOT):
     p.mkdir(parents=True, exist_ok=True)
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
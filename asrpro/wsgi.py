@@ -14,3 +14,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'asrpro.settings')
 
 application = get_wsgi_application()
+
+# โหลดโมเดล (model workers / preload) ตั้งแต่ start ไม่ต้องรอ request แรก
+from apps.mediaflow.utils.workers import start_model_workers  # noqa: E402
+start_model_workers()
+
+# ดึง job ที่ค้างจากรอบก่อนกลับเข้าคิว (ไม่ต้องรอให้มีคน submit job ใหม่)
+from apps.mediaflow.utils.jobs import start_job_queue  # noqa: E402
+start_job_queue()